@@ -46,6 +46,7 @@ from vcstools.bzr import BzrClient
 from vcstools.hg import HgClient
 from vcstools.git import GitClient
 from vcstools.tar import TarClient
+from vcstools.profiling import profile, add_command_hook, remove_command_hook
 
 # configure the VCSClient
 register_vcs("svn", SvnClient)
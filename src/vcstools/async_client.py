@@ -0,0 +1,568 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+asyncio support for the git, hg and svn clients.
+
+AsyncGitClient, AsyncHgClient and AsyncSvnClient offer coroutine
+versions of checkout, update, get_version, get_status, get_diff,
+get_log, export_repository and export_repository_stream. VCS commands
+run as asyncio subprocesses, command lines and output parsing are
+shared with the blocking clients. Steps that consist of many dependent decisions
+(like the branch handling of git update) run the blocking client code
+in the event loop's default executor, as do git config lookups, which
+may fall back to running git.
+
+Clients may share an asyncio.Semaphore passed as ``limit`` to bound
+the number of commands running concurrently, so that a single event
+loop can drive hundreds of repositories::
+
+    limit = asyncio.Semaphore(16)
+    clients = [AsyncGitClient(path, limit=limit) for path in paths]
+    versions = await asyncio.gather(*[c.get_version() for c in clients])
+
+This module requires python 3.5 or later and is not imported by the
+vcstools package.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import asyncio
+import functools
+import logging
+import os
+import sys
+
+from vcstools import compression, fetching, profiling, transcripts
+from vcstools.vcs_base import VcsError
+from vcstools.common import ensure_dir_notexists, normalized_rel_path, \
+    _get_command_env, _format_command, _command_failed_message, \
+    _get_process_group_flags, _terminate_process
+from vcstools.git import GitClient, GitError, _git_diff_path_submodule_change, \
+    _format_git_status, _parse_git_status, _parse_git_log
+from vcstools.hg import HgClient, _parse_hg_log, _parse_hg_changeset, \
+    _parse_hg_identify, _check_hg_status, _hg_diff_path_change, \
+    _parse_hg_status, _format_hg_status
+from vcstools.svn import SvnClient, _parse_svn_log, _parse_svn_info_revision, \
+    _tar_export, _parse_svn_status, _format_svn_status
+
+
+async def run_command_async(argv, cwd=None, us_env=True, timeout=None,
+                            no_warn=False, no_filter=False, limit=None):
+    """
+    coroutine version of vcstools.common.run_command. Output is not
+    filtered or echoed, except that with no_filter the command prints
+    directly to the terminal.
+
+    :param argv: list of program name and arguments
+    :param timeout: seconds after which the command is killed
+    :param limit: asyncio.Semaphore to acquire while the command runs, or None
+    :returns: ( returncode, stdout, stderr); stdout is '' if no_filter==True
+    :raises: VcsError on OSError
+    """
+    if limit is None:
+        return await _run_command_async(argv, cwd, us_env, timeout, no_warn, no_filter)
+    async with limit:
+        return await _run_command_async(argv, cwd, us_env, timeout, no_warn, no_filter)
+
+
+async def _run_command_async(argv, cwd, us_env, timeout, no_warn, no_filter):
+    logger = logging.getLogger('vcstools')
+    env = _get_command_env(us_env)
+    start_time = profiling.clock()
+    replayed = transcripts.replay_command(argv, cwd, env)
+    if replayed is not None:
+        returncode = replayed['returncode']
+        stdout = replayed['stdout']
+        stderr = replayed['stderr']
+    else:
+        returncode, stdout, stderr = await _run_process_async(argv, cwd, env, timeout, no_filter)
+        transcripts.record_command(argv, cwd, env, returncode, stdout, stderr,
+                                   profiling.clock() - start_time)
+    profiling.record_command(argv, cwd, start_time, returncode,
+                             len(stdout.encode('utf-8')), len(stderr.encode('utf-8')))
+    message = None
+    if returncode != 0 and stderr != '':
+        message = _command_failed_message(argv, cwd, returncode, stderr)
+        if not no_warn:
+            logger.warn(message)
+    return (returncode, stdout.rstrip(), message)
+
+
+async def _run_process_async(argv, cwd, env, timeout, no_filter):
+    """
+    :returns: (returncode, stdout, stderr) with decoded output
+    :raises: VcsError on OSError
+    """
+    target = None if no_filter else asyncio.subprocess.PIPE
+    # helper processes like ssh must not outlive a timeout either
+    crflags = {}
+    if timeout is not None:
+        crflags = _get_process_group_flags()
+    try:
+        proc = await asyncio.create_subprocess_exec(*argv,
+                                                    cwd=cwd,
+                                                    stdout=target,
+                                                    stderr=target,
+                                                    env=env,
+                                                    **crflags)
+    except OSError as ose:
+        message = "Command failed with OSError. '%s' <%s>:\n%s" % (_format_command(argv), cwd, ose)
+        logging.getLogger('vcstools').error(message)
+        raise VcsError(message)
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        _terminate_process(proc)
+        stdout, stderr = await proc.communicate()
+    stdout = '' if stdout is None else stdout.decode('utf-8')
+    stderr = '' if stderr is None else stderr.decode('utf-8')
+    return proc.returncode, stdout, stderr
+
+
+def _call_from(method, scopes, func, *args, **kwargs):
+    with profiling.called_from(method), fetching.within(scopes):
+        return func(*args, **kwargs)
+
+
+class AsyncClientBase(object):
+    """
+    parent class of the asyncio clients, wrapping a blocking client
+    available as attribute ``client``
+    """
+
+    client_class = None
+
+    def __init__(self, path, limit=None):
+        """
+        :param limit: asyncio.Semaphore bounding the number of
+          concurrently running commands, may be shared between clients
+        :raises: VcsError if the vcs is not installed
+        """
+        self.client = self.client_class(path)
+        self._limit = limit
+        self.logger = logging.getLogger('vcstools')
+
+    def get_path(self):
+        return self.client.get_path()
+
+    def detect_presence(self):
+        return self.client.detect_presence()
+
+    async def export_repository_stream(self, version, fileobj, archive_format=compression.DEFAULT_FORMAT,
+                                       compresslevel=None, prefix=''):
+        """
+        writes the archive in the default executor, as fileobj is a
+        blocking file object
+        """
+        return await self._run_blocking(self.client.export_repository_stream, version, fileobj,
+                                        archive_format, compresslevel, prefix)
+
+    def _run(self, argv, **kwargs):
+        return run_command_async(argv, limit=self._limit, **kwargs)
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        """
+        runs blocking client code in the default executor
+        """
+        loop = asyncio.get_event_loop()
+        method = profiling.get_current_method() if profiling.hooks_active() else None
+        # fetches count for the fetching scopes of the calling task
+        call = functools.partial(_call_from, method, fetching.get_open_scopes(), func, *args, **kwargs)
+        if self._limit is None:
+            return await loop.run_in_executor(None, call)
+        async with self._limit:
+            return await loop.run_in_executor(None, call)
+
+
+# report the coroutine methods in command records
+profiling._API_CLASSES.append(AsyncClientBase)
+
+
+class AsyncGitClient(AsyncClientBase):
+
+    client_class = GitClient
+
+    async def checkout(self, url, version=None, verbose=False, shallow=False, timeout=None,
+                       clone_filter=None, single_branch=False):
+        """
+        like GitClient.checkout, without git mirrors
+        """
+        client = self.client
+        if url is None or url.strip() == '':
+            raise ValueError('Invalid empty url : "%s"' % url)
+        if single_branch and version:
+            # asks the remote whether version is a branch or tag
+            cmd = await self._run_blocking(client._get_clone_command, url, version, shallow,
+                                           clone_filter, single_branch)
+        else:
+            cmd = client._get_clone_command(url, version, shallow, clone_filter)
+        value, _, msg = await self._run(cmd, no_filter=True, timeout=timeout)
+        if value != 0:
+            if msg:
+                self.logger.error('%s' % msg)
+            return False
+        if version is None:
+            return True
+        try:
+            return await self._run_blocking(client._do_update,
+                                            version,
+                                            verbose=verbose,
+                                            fast_foward=True,
+                                            timeout=timeout,
+                                            update_submodules=True)
+        except GitError:
+            return False
+
+    async def update(self, version=None, verbose=False, force_fetch=False, timeout=None):
+        client = self.client
+        if not client.detect_presence():
+            return False
+        try:
+            # the scope is that of the running task, concurrent updates
+            # may close theirs in any order
+            with fetching.scope():
+                # fetch in any case to get updated tags even if we don't need them
+                await self._do_fetch(force=force_fetch)
+                if version is not None and (await self._run_blocking(client._get_clone_options))[1]:
+                    await self._run_blocking(client._fetch_missing_version, version)
+                return await self._run_blocking(client._do_update,
+                                                refname=version,
+                                                verbose=verbose,
+                                                timeout=timeout)
+        except GitError:
+            return False
+
+    async def get_version(self, spec=None):
+        client = self.client
+        if not client.detect_presence():
+            return None
+        command = client._get_version_command(spec)
+        _, output, _ = await self._run(command, no_warn=True, cwd=client.get_path())
+        if output.strip() != '':
+            # On Windows the version can have single quotes around it
+            return output.strip().strip("'")
+        elif spec is None:
+            return None
+        # we try again after fetching if given spec had not been found
+        try:
+            await self._do_fetch()
+        except GitError:
+            return None
+        if (await self._run_blocking(client._get_clone_options))[1]:
+            await self._run_blocking(client._fetch_missing_version, spec)
+        _, output, _ = await self._run(command, no_warn=True, cwd=client.get_path())
+        if output.strip() == '':
+            return None
+        return output.strip().strip("'")
+
+    async def get_status(self, basepath=None, untracked=False, porcelain=False):
+        client = self.client
+        if basepath is None:
+            basepath = client.get_path()
+        if not client.path_exists():
+            return None
+        rel_path = normalized_rel_path(client.get_path(), basepath)
+        command = client._get_status_command(untracked)
+        quote_path = await self._run_blocking(client._get_status_quote_path)
+
+        async def get_status(subpath):
+            _, output, _ = await self._run(command, cwd=os.path.join(client.get_path(), subpath))
+            return _format_git_status(_parse_git_status(output), rel_path, quote_path, porcelain)
+        return ''.join([await get_status('')] + await self._map_submodules(get_status))
+
+    async def get_diff(self, basepath=None):
+        client = self.client
+        if basepath is None:
+            basepath = client.get_path()
+        if not client.path_exists():
+            return ''
+        rel_path = normalized_rel_path(client.get_path(), basepath)
+        _, response, _ = await self._run(client._get_diff_command(rel_path), cwd=client.get_path())
+
+        async def get_submodule_diff(subpath):
+            _, output, _ = await self._run(['git', 'diff', 'HEAD'], cwd=os.path.join(client.get_path(), subpath))
+            return _git_diff_path_submodule_change(output, os.path.join(rel_path, subpath))
+        response += ''.join(await self._map_submodules(get_submodule_diff))
+        return response
+
+    async def _map_submodules(self, function):
+        """
+        awaits function for the path of each submodule concurrently, as
+        bounded by limit
+
+        :returns: list of results, in the order of the submodules
+        """
+        paths = await self._run_blocking(self.client._get_submodule_paths)
+        return await asyncio.gather(*[function(subpath) for subpath in paths])
+
+    async def get_log(self, relpath=None, limit=None):
+        client = self.client
+        if relpath is None:
+            relpath = ''
+        if not (client.path_exists() and os.path.exists(os.path.join(client.get_path(), relpath))):
+            return []
+        command = client._get_log_command(relpath, limit)
+        return_code, response_str, _ = await self._run(command, cwd=client.get_path())
+        if return_code != 0:
+            return []
+        return _parse_git_log(response_str)
+
+    async def export_repository(self, version, basepath, archive_format=compression.DEFAULT_FORMAT,
+                                compresslevel=None):
+        return await self._run_blocking(self.client.export_repository, version, basepath,
+                                        archive_format, compresslevel)
+
+    async def _do_fetch(self, timeout=None, force=False):
+        """
+        :raises: GitError when git fetch fails
+        """
+        client = self.client
+        if not (force or client._needs_fetch()):
+            return
+        failed = False
+        for cmd in await self._run_blocking(client._get_fetch_commands):
+            value, _, _ = await self._run(cmd, cwd=client.get_path(), no_filter=True, timeout=timeout)
+            failed = failed or value != 0
+        client._fetched(success=not failed)
+        if failed:
+            raise GitError('git fetch failed')
+
+
+class AsyncHgClient(AsyncClientBase):
+
+    client_class = HgClient
+
+    async def checkout(self, url, version='', verbose=False, shallow=False, timeout=None):
+        client = self.client
+        if url is None or url.strip() == '':
+            raise ValueError('Invalid empty url : "%s"' % url)
+        # make sure that the parent directory exists for #3497
+        base_path = os.path.split(client.get_path())[0]
+        try:
+            os.makedirs(base_path)
+        except OSError:
+            # OSError thrown if directory already exists this is ok
+            pass
+        value, _, msg = await self._run(['hg', 'clone', url, client.get_path()],
+                                        no_filter=True, timeout=timeout)
+        if value != 0:
+            if msg:
+                self.logger.error('%s' % msg)
+            return False
+        if version is not None and version.strip() != '':
+            value, _, msg = await self._run(['hg', 'checkout', version],
+                                            cwd=client.get_path(),
+                                            no_filter=True,
+                                            timeout=timeout)
+            if value != 0:
+                if msg:
+                    sys.stderr.write('%s\n' % msg)
+                return False
+        return True
+
+    async def update(self, version='', verbose=False, timeout=None):
+        client = self.client
+        if not client.detect_presence():
+            sys.stderr.write("Error: cannot update non-existing directory\n")
+            return True
+        if not await self._do_pull():
+            return False
+        value, _, _ = await self._run(client._get_update_command(version, verbose),
+                                      cwd=client.get_path(),
+                                      no_filter=True,
+                                      timeout=timeout)
+        return value == 0
+
+    async def get_version(self, spec=None):
+        client = self.client
+        if spec is None:
+            _, output, _ = await self._run(['hg', 'identify', '-i', client.get_path()])
+            return _parse_hg_identify(output)
+        if not client.detect_presence():
+            return None
+        command = ['hg', 'log', '-r', spec]
+        _, output, _ = await self._run(command, cwd=client.get_path())
+        if output.strip() == '' or output.startswith("abort"):
+            # we repeat the call once after pulling
+            await self._do_pull()
+            _, output, _ = await self._run(command, cwd=client.get_path())
+            if output == '':
+                return None
+        return _parse_hg_changeset(output, spec)
+
+    async def get_branch(self):
+        client = self.client
+        if client.path_exists():
+            _, output, _ = await self._run(['hg', 'branch', '--repository', client.get_path()])
+            if output is not None:
+                return output.strip()
+        return None
+
+    async def get_status(self, basepath=None, untracked=False):
+        client = self.client
+        if basepath is None:
+            basepath = client.get_path()
+        if not client.path_exists():
+            return None
+        rel_path = normalized_rel_path(client.get_path(), basepath)
+        command = client._get_status_command(untracked)
+        _, output, _ = await self._run(command, cwd=client.get_path())
+        _check_hg_status(output, command, client.get_path())
+        return _format_hg_status(_parse_hg_status(output), rel_path)
+
+    async def get_diff(self, basepath=None):
+        client = self.client
+        if basepath is None:
+            basepath = client.get_path()
+        if not client.path_exists():
+            return None
+        rel_path = normalized_rel_path(client.get_path(), basepath)
+        _, response, _ = await self._run(client._get_diff_command(rel_path), cwd=basepath)
+        return _hg_diff_path_change(response, rel_path)
+
+    async def get_log(self, relpath=None, limit=None):
+        client = self.client
+        if relpath is None:
+            relpath = ''
+        if not (client.path_exists() and os.path.exists(os.path.join(client.get_path(), relpath))):
+            return []
+        command = client._get_log_command(relpath, limit, await self.get_branch())
+        return_code, response_str, _ = await self._run(command, cwd=client.get_path())
+        if return_code != 0:
+            return []
+        return _parse_hg_log(response_str)
+
+    async def export_repository(self, version, basepath, archive_format=compression.DEFAULT_FORMAT,
+                                compresslevel=None):
+        return await self._run_blocking(self.client.export_repository, version, basepath,
+                                        archive_format, compresslevel)
+
+    async def _do_pull(self, filter=False):
+        value, _, _ = await self._run(['hg', 'pull'],
+                                      cwd=self.client.get_path(),
+                                      no_filter=not filter)
+        return value == 0
+
+
+class AsyncSvnClient(AsyncClientBase):
+
+    client_class = SvnClient
+
+    async def checkout(self, url, version='', verbose=False, shallow=False, timeout=None):
+        if url is None or url.strip() == '':
+            raise ValueError('Invalid empty url : "%s"' % url)
+        client = self.client
+        # Need to check as SVN 1.6.17 writes into directory even if not empty
+        if not ensure_dir_notexists(client.get_path()):
+            self.logger.error("Can't remove %s" % client.get_path())
+            return False
+        value, _, msg = await self._run(client._get_checkout_command(url, version),
+                                        no_filter=True, timeout=timeout)
+        if value != 0:
+            if msg:
+                self.logger.error('%s' % msg)
+            return False
+        return True
+
+    async def update(self, version=None, verbose=False, timeout=None):
+        client = self.client
+        if not client.detect_presence():
+            sys.stderr.write("Error: cannot update non-existing directory\n")
+            return False
+        value, _, _ = await self._run(client._get_update_command(version),
+                                      no_filter=True, timeout=timeout)
+        return value == 0
+
+    async def get_version(self, spec=None):
+        return await self._get_version_from_path(spec=spec, path=self.client.get_path())
+
+    async def _get_version_from_path(self, spec=None, path=None):
+        if not self.client.path_exists():
+            return None
+        command = ['svn', 'info']
+        if spec is not None:
+            if spec.isdigit():
+                # avoid the long call to svn server if revision is known to exist
+                currentversion = await self.get_version(spec=None)
+                if currentversion is not None and \
+                   int(currentversion[2:]) > int(spec):
+                    return '-r' + spec
+            if spec.startswith("-r"):
+                command.append(spec)
+            else:
+                command.append('-r%s' % spec)
+        command.append(path)
+        _, output, _ = await self._run(command, us_env=True)
+        return _parse_svn_info_revision(output)
+
+    async def get_status(self, basepath=None, untracked=False):
+        client = self.client
+        if basepath is None:
+            basepath = client.get_path()
+        if not client.path_exists():
+            return None
+        rel_path = normalized_rel_path(client.get_path(), basepath)
+        command = client._get_status_command(untracked)
+        value, output, _ = await self._run(command, cwd=client.get_path())
+        if value != 0:
+            raise VcsError("Could not call %s, cwd=%s" % (command, client.get_path()))
+        return _format_svn_status(_parse_svn_status(output), rel_path)
+
+    async def get_diff(self, basepath=None):
+        client = self.client
+        if basepath is None:
+            basepath = client.get_path()
+        if not client.path_exists():
+            return None
+        rel_path = normalized_rel_path(client.get_path(), basepath)
+        _, response, _ = await self._run(['svn', 'diff', rel_path], cwd=basepath)
+        return response
+
+    async def get_log(self, relpath=None, limit=None):
+        client = self.client
+        if relpath is None:
+            relpath = ''
+        if not (client.path_exists() and os.path.exists(os.path.join(client.get_path(), relpath))):
+            return []
+        command = client._get_log_command(relpath, limit)
+        _, xml_response, _ = await self._run(command, cwd=client.get_path())
+        return _parse_svn_log(xml_response)
+
+    async def export_repository(self, version, basepath, archive_format=compression.DEFAULT_FORMAT,
+                                compresslevel=None):
+        compression.check_format(archive_format, compresslevel)
+        cmd = ['svn', 'export', os.path.join(self.client.get_path(), version), basepath]
+        result, _, _ = await self._run(cmd)
+        if result:
+            return False
+        await self._run_blocking(_tar_export, basepath, archive_format, compresslevel)
+        return True
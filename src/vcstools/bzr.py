@@ -50,17 +50,143 @@ except ImportError:
     from urllib2 import url2pathname
 
 from vcstools.vcs_base import VcsClientBase, VcsError
-from vcstools.common import sanitized, normalized_rel_path, \
-    run_shell_command, ensure_dir_notexists
+from vcstools.common import normalized_rel_path, \
+    run_command, ensure_dir_notexists, CommandLines
+from vcstools.tool_versions import get_tool_version
+from vcstools import compression
+from vcstools import log_cache
+from vcstools.diff_entry import DiffEntry, count_changes
+from vcstools.log_entry import LogEntry
+from vcstools.status_entry import StatusEntry
+
+
+def _iter_bzr_log_fields(text_response):
+    """
+    parses output of bzr log
+
+    :returns: iterator of lists of the revno, committer, timestamp and
+      message of each entry
+    """
+    # Compile regexes
+    id_regex = re.compile('^revno: ([0-9]+)$', flags=re.MULTILINE)
+    committer_regex = re.compile('^committer: (.+)$', flags=re.MULTILINE)
+    timestamp_regex = re.compile('^timestamp: (.+)$', flags=re.MULTILINE)
+    message_regex = re.compile('^  (.+)$', flags=re.MULTILINE)
+
+    revno_match = id_regex.findall(text_response)
+    committer_match = committer_regex.findall(text_response)
+    timestamp_match = timestamp_regex.findall(text_response)
+    message_match = message_regex.findall(text_response)
+
+    # Extract the entries
+    for revno, committer, timestamp, message in zip(revno_match,
+                                                    committer_match,
+                                                    timestamp_match,
+                                                    message_match):
+        yield [revno, committer, timestamp, message]
+
+
+def _bzr_log_entry(fields):
+    """
+    :returns: LogEntry, the date parsed on first access
+    """
+    revno, committer, timestamp, message = fields
+    author, email_address = email.utils.parseaddr(committer)
+    return LogEntry(revno, author, email_address, timestamp, message,
+                    date_parser=dateutil.parser.parse)
+
+
+def _parse_bzr_status(output):
+    """
+    parses the output of bzr status -S, which has a column for the
+    versioning state, one for the contents and one for the execute bit
+
+    :returns: list of StatusEntry with paths relative to the tree root
+    """
+    entries = []
+    for line in output.splitlines():
+        if len(line.strip()) == 0:
+            continue
+        line = line.ljust(4)
+        path, orig_path = line[4:], None
+        if ' => ' in path and line[0] == 'R':
+            orig_path, path = path.split(' => ', 1)
+        entries.append(StatusEntry(path, line[0], line[1], None, orig_path, line[2]))
+    return entries
+
+
+# status of DiffEntry for the kind of change in bzr diff headers
+BZR_DIFF_CHANGES = {'added': 'A', 'removed': 'D', 'renamed': 'R'}
+
+
+def _bzr_diff_entry(header, lines):
+    """
+    :param header: header line like === renamed file 'a' => 'b'
+    """
+    change, names = header[len('=== '):].split(' ', 1)
+    names = names.split("'", 1)[1].rstrip("'").split("' => '")
+    orig_path = names[0] if len(names) > 1 else None
+    added, deleted = count_changes(lines)
+    return DiffEntry(names[-1], BZR_DIFF_CHANGES.get(change, 'M'), orig_path, added, deleted, lines)
+
+
+def _iter_bzr_diff(lines):
+    """
+    splits bzr diff output at the === headers into the diffs of each
+    file
+
+    :returns: generator of DiffEntry
+    """
+    entry_lines = None
+    for line in lines:
+        if line.startswith('=== '):
+            if entry_lines:
+                yield _bzr_diff_entry(entry_lines[0], entry_lines)
+            entry_lines = []
+        if entry_lines is not None:
+            entry_lines.append(line)
+    if entry_lines:
+        yield _bzr_diff_entry(entry_lines[0], entry_lines)
+
+
+def _iter_bzr_diff_summary(entries):
+    """
+    :param entries: StatusEntry list of bzr status -S -V
+    :returns: generator of DiffEntry
+    """
+    for entry in entries:
+        if entry.index == 'R':
+            yield DiffEntry(entry.path, 'R', entry.orig_path)
+        else:
+            yield DiffEntry(entry.path, {'N': 'A', 'D': 'D'}.get(entry.worktree, 'M'))
+
+
+def _format_bzr_status(entries, rel_path):
+    """
+    formats StatusEntry records like bzr status -S, prepending rel_path
+    to the line, so renames show as rel_path/old => new
+    """
+    lines = []
+    for entry in entries:
+        path = entry.path
+        if entry.orig_path is not None:
+            path = '%s => %s' % (entry.orig_path, path)
+        path = '%s/%s' % (rel_path, path)
+        lines.append('%s%s%s %s\n' % (entry.index, entry.worktree, entry.flags, path))
+    return ''.join(lines)
 
 
 def _get_bzr_version():
+    """Looks up bzr version, calling bzr --version once per bzr binary.
+    :raises: VcsError if bzr is not installed"""
+    return get_tool_version('bzr', _probe_bzr_version)
+
+
+def _probe_bzr_version():
     """Looks up bzr version by calling bzr --version.
     :raises: VcsError if bzr is not installed"""
     try:
-        value, output, _ = run_shell_command('bzr --version',
-                                             shell=True,
-                                             us_env=True)
+        value, output, _ = run_command(['bzr', '--version'], us_env=True)
         if value == 0 and output is not None and len(output.splitlines()) > 0:
             version = output.splitlines()[0]
         else:
@@ -96,8 +222,7 @@ class BzrClient(VcsClientBase):
         """
         result = None
         if self.detect_presence():
-            cmd = 'bzr info %s' % self._path
-            _, output, _ = run_shell_command(cmd, shell=True, us_env=True)
+            _, output, _ = run_command(['bzr', 'info', self._path], us_env=True)
             matches = [l for l in output.splitlines() if l.startswith('  parent branch: ')]
             if matches:
                 ppath = url2pathname(matches[0][len('  parent branch: '):])
@@ -115,8 +240,7 @@ class BzrClient(VcsClientBase):
         # bzr info and return that one if result matches.
         result = False
         if url_or_shortcut is not None:
-            cmd = 'bzr info %s' % url_or_shortcut
-            value, output, _ = run_shell_command(cmd, shell=True, us_env=True)
+            value, output, _ = run_command(['bzr', 'info', url_or_shortcut], us_env=True)
             if value == 0:
                 for line in output.splitlines():
                     sline = line.strip()
@@ -141,14 +265,13 @@ class BzrClient(VcsClientBase):
         if not ensure_dir_notexists(self.get_path()):
             self.logger.error("Can't remove %s" % self.get_path())
             return False
-        cmd = 'bzr branch'
+        cmd = ['bzr', 'branch']
         if version:
-            cmd += ' -r %s' % version
-        cmd += ' %s %s' % (url, self._path)
-        value, _, msg = run_shell_command(cmd,
-                                          shell=True,
-                                          show_stdout=verbose,
-                                          verbose=verbose)
+            cmd += ['-r', version]
+        cmd += [url, self._path]
+        value, _, msg = run_command(cmd,
+                                    show_stdout=verbose,
+                                    verbose=verbose)
         if value != 0:
             if msg:
                 self.logger.error('%s' % msg)
@@ -158,23 +281,21 @@ class BzrClient(VcsClientBase):
     def update(self, version='', verbose=False, timeout=None):
         if not self.detect_presence():
             return False
-        value, _, _ = run_shell_command("bzr pull",
-                                        cwd=self._path,
-                                        shell=True,
-                                        show_stdout=True,
-                                        verbose=verbose)
+        value, _, _ = run_command(['bzr', 'pull'],
+                                  cwd=self._path,
+                                  show_stdout=True,
+                                  verbose=verbose)
         if value != 0:
             return False
         # Ignore verbose param, bzr is pretty verbose on update anyway
         if version is not None and version != '':
-            cmd = "bzr update -r %s" % (version)
+            cmd = ['bzr', 'update', '-r', version]
         else:
-            cmd = "bzr update"
-        value, _, _ = run_shell_command(cmd,
-                                        cwd=self._path,
-                                        shell=True,
-                                        show_stdout=True,
-                                        verbose=verbose)
+            cmd = ['bzr', 'update']
+        value, _, _ = run_command(cmd,
+                                  cwd=self._path,
+                                  show_stdout=True,
+                                  verbose=verbose)
         if value == 0:
             return True
         return False
@@ -190,11 +311,10 @@ class BzrClient(VcsClientBase):
         """
         if self.detect_presence():
             if spec is not None:
-                command = ['bzr log -r %s .' % sanitized(spec)]
-                _, output, _ = run_shell_command(command,
-                                                 shell=True,
-                                                 cwd=self._path,
-                                                 us_env=True)
+                command = ['bzr', 'log', '-r', spec, '.']
+                _, output, _ = run_command(command,
+                                           cwd=self._path,
+                                           us_env=True)
                 if output is None or output.strip() == '' or output.startswith("bzr:"):
                     return None
                 else:
@@ -202,10 +322,9 @@ class BzrClient(VcsClientBase):
                     if len(matches) == 1:
                         return matches[0].split()[1]
             else:
-                _, output, _ = run_shell_command('bzr revno --tree',
-                                                 shell=True,
-                                                 cwd=self._path,
-                                                 us_env=True)
+                _, output, _ = run_command(['bzr', 'revno', '--tree'],
+                                           cwd=self._path,
+                                           us_env=True)
                 return output.strip()
 
     def get_current_version_label(self):
@@ -222,17 +341,39 @@ class BzrClient(VcsClientBase):
         if basepath is None:
             basepath = self._path
         if self.path_exists():
-            rel_path = sanitized(normalized_rel_path(self._path, basepath))
-            command = "bzr diff %s" % rel_path
-            command += " -p1 --prefix %s/:%s/" % (rel_path, rel_path)
-            _, response, _ = run_shell_command(command, shell=True, cwd=basepath)
+            rel_path = normalized_rel_path(self._path, basepath)
+            command = ['bzr', 'diff', rel_path,
+                       '-p1', '--prefix', '%s/:%s/' % (rel_path, rel_path)]
+            _, response, _ = run_command(command, cwd=basepath)
         return response
 
+    def iter_diff(self, rev_a=None, rev_b=None, stat_only=False, basepath=None):
+        if not self.path_exists():
+            return
+        if basepath is None:
+            basepath = self._path
+        rel_path = normalized_rel_path(self._path, basepath)
+        revisions = []
+        if rev_b is not None:
+            revisions = ['-r', '%s..%s' % (rev_a or '-1', rev_b)]
+        elif rev_a is not None:
+            revisions = ['-r', rev_a]
+        if stat_only:
+            _, output, _ = run_command(['bzr', 'status', '-S', '-V'] + revisions, cwd=self._path)
+            for entry in _iter_bzr_diff_summary(_parse_bzr_status(output)):
+                yield entry
+        else:
+            # bzr replaces the prefixes of the header lines itself, and
+            # exits with 1 when there are differences
+            command = ['bzr', 'diff', '-p1', '--prefix', '%s/:%s/' % (rel_path, rel_path)] + revisions
+            with CommandLines(command, cwd=self._path, no_warn=True) as lines:
+                for entry in _iter_bzr_diff(lines):
+                    yield entry
+
     def get_affected_files(self, revision):
-        cmd = "bzr status -c {0} -S -V".format(
-            revision)
+        cmd = ['bzr', 'status', '-c', '{0}'.format(revision), '-S', '-V']
 
-        code, output, _ = run_shell_command(cmd, shell=True, cwd=self._path)
+        code, output, _ = run_command(cmd, cwd=self._path)
 
         affected = []
         if code == 0:
@@ -246,58 +387,77 @@ class BzrClient(VcsClientBase):
         if relpath is None:
             relpath = ''
 
-        # Compile regexes
-        id_regex = re.compile('^revno: ([0-9]+)$', flags=re.MULTILINE)
-        committer_regex = re.compile('^committer: (.+)$', flags=re.MULTILINE)
-        timestamp_regex = re.compile('^timestamp: (.+)$', flags=re.MULTILINE)
-        message_regex = re.compile('^  (.+)$', flags=re.MULTILINE)
-
         if self.path_exists() and os.path.exists(os.path.join(self._path, relpath)):
+            cached = log_cache.get_log(self, relpath, limit)
+            if cached is not None:
+                return cached
             # Get the log
-            limit_cmd = (("--limit=%d" % (int(limit))) if limit else "")
-            command = "bzr log %s %s" % (sanitized(relpath), limit_cmd)
-            return_code, text_response, stderr = run_shell_command(command, shell=True, cwd=self._path)
+            command = ['bzr', 'log']
+            if relpath:
+                command.append(relpath)
+            if limit:
+                command.append("--limit=%d" % (int(limit)))
+            return_code, text_response, stderr = run_command(command, cwd=self._path)
             if return_code == 0:
-                revno_match = id_regex.findall(text_response)
-                committer_match = committer_regex.findall(text_response)
-                timestamp_match = timestamp_regex.findall(text_response)
-                message_match = message_regex.findall(text_response)
-
-                # Extract the entries
-                for revno, committer, timestamp, message in zip(revno_match,
-                                                                committer_match,
-                                                                timestamp_match,
-                                                                message_match):
-                    author, email_address = email.utils.parseaddr(committer)
-                    date = dateutil.parser.parse(timestamp)
-                    log_data = {'id': revno,
-                                'author': author,
-                                'email': email_address,
-                                'message': message,
-                                'date': date}
-
-                    response.append(log_data)
+                response = [_bzr_log_entry(fields) for fields in _iter_bzr_log_fields(text_response)]
 
         return response
 
+    def _get_log_cache_key(self):
+        return 'bzr:%s' % os.path.realpath(self._path)
+
+    def _get_log_cache_head(self):
+        """
+        :returns: output of bzr revision-info, '<revno> <revision-id>'
+        """
+        value, output, _ = run_command(['bzr', 'revision-info'], cwd=self._path)
+        if value != 0 or len(output.split()) != 2:
+            return None
+        return output.strip()
+
+    def _get_log_cache_records(self, head, since=None):
+        """
+        :returns: log records as of head, newer than since if given.
+          None if revision number of since now has another revision id,
+          as after bzr uncommit.
+        """
+        revno = head.split()[0]
+        command = ['bzr', 'log', '-r', '..%s' % revno]
+        if since is not None:
+            since_revno = since.split()[0]
+            value, output, _ = run_command(['bzr', 'revision-info', '-r', since_revno],
+                                           cwd=self._path, no_warn=True)
+            if value != 0 or output.strip() != since:
+                return None
+            command = ['bzr', 'log', '-r', '%d..%s' % (int(since_revno) + 1, revno)]
+        value, text_response, _ = run_command(command, cwd=self._path)
+        if value != 0:
+            return None
+        # relpath queries need bzr log <relpath>
+        return [{'id': fields[0], 'fields': fields, 'merge': False, 'paths': None}
+                for fields in _iter_bzr_log_fields(text_response)]
+
+    def _log_cache_entry(self, fields):
+        return _bzr_log_entry(fields)
+
     def get_status(self, basepath=None, untracked=False):
         response = None
         if basepath is None:
             basepath = self._path
         if self.path_exists():
             rel_path = normalized_rel_path(self._path, basepath)
-            command = "bzr status %s -S" % sanitized(rel_path)
-            if not untracked:
-                command += " -V"
-            _, response, _ = run_shell_command(command, shell=True, cwd=basepath)
-            response_processed = ""
-            for line in response.split('\n'):
-                if len(line.strip()) > 0:
-                    response_processed += line[0:4] + rel_path + '/'
-                    response_processed += line[4:] + '\n'
-            response = response_processed
+            response = _format_bzr_status(self.iter_status(untracked), rel_path)
         return response
 
+    def iter_status(self, untracked=False):
+        if not self.path_exists():
+            return iter(())
+        command = ['bzr', 'status', '-S']
+        if not untracked:
+            command.append('-V')
+        _, output, _ = run_command(command, cwd=self._path)
+        return iter(_parse_bzr_status(output))
+
     def get_branches(self, local_only=False):
         # see http://doc.bazaar.canonical.com/beta/en/user-guide/shared_repository_layouts.html
         # the 'bzr branches' command exists, but is not useful here (too many assumptions)
@@ -306,13 +466,29 @@ class BzrClient(VcsClientBase):
         # the launchpadlib, but the API is probably not stable.
         raise NotImplementedError("get_branches is not implemented for bzr")
 
-    def export_repository(self, version, basepath):
-        # execute the bzr export cmd
-        cmd = 'bzr export --format=tgz {0} '.format(basepath + '.tar.gz')
-        cmd += '{0}'.format(version)
-        result, _, _ = run_shell_command(cmd, shell=True, cwd=self._path)
-        if result:
+    def export_repository(self, version, basepath, archive_format=compression.DEFAULT_FORMAT,
+                          compresslevel=None):
+        filepath = compression.get_archive_path(basepath, archive_format)
+        result = False
+        try:
+            with open(filepath, 'wb') as archive_file:
+                # bzr export names the top directory after the archive
+                result = self.export_repository_stream(version, archive_file, archive_format, compresslevel,
+                                                       prefix=os.path.basename(basepath))
+        finally:
+            if not result and os.path.exists(filepath):
+                os.remove(filepath)
+        return result
+
+    def export_repository_stream(self, version, fileobj, archive_format=compression.DEFAULT_FORMAT,
+                                 compresslevel=None, prefix=''):
+        writer = compression.CompressedWriter(fileobj, archive_format, compresslevel)
+        # nothing is written for versions that do not exist
+        if self.get_version(version) is None:
+            writer.abort()
             return False
-        return True
+        # bzr export writes to stdout for destination '-'
+        cmd = ['bzr', 'export', '--format=tar', '--root=%s' % prefix.rstrip('/'), '-r', '{0}'.format(version), '-']
+        return compression.write_command_output(cmd, self._path, writer)
 
 BZRClient = BzrClient
@@ -31,33 +31,42 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 from __future__ import absolute_import, print_function, unicode_literals
+import base64
 import errno
 import os
 import sys
-import copy
 import shlex
 import subprocess
 import logging
 import netrc
 import tempfile
 import shutil
-import threading
 import signal
+import select
+import threading
+import time
 
 try:
     # py3k
     from urllib.request import urlopen, HTTPPasswordMgrWithDefaultRealm, \
         HTTPBasicAuthHandler, build_opener
     from urllib.parse import urlparse
-    from queue import Queue
 except ImportError:
     # py2.7
     from urlparse import urlparse
     from urllib2 import urlopen, HTTPPasswordMgrWithDefaultRealm, \
         HTTPBasicAuthHandler, build_opener
-    from Queue import Queue
+
+try:
+    import selectors
+except ImportError:
+    # py2.7
+    selectors = None
 
 from vcstools.vcs_base import VcsError
+from vcstools import fetching
+from vcstools import profiling
+from vcstools import transcripts
 
 
 def ensure_dir_notexists(path):
@@ -185,6 +194,50 @@ def normalized_rel_path(path, basepath):
     return os.path.normpath(path)
 
 
+def map_parallel(function, items, jobs):
+    """
+    calls function for each item using up to jobs threads
+
+    :returns: list of the results, in the order of items
+    :raises: the exception raised for the first failing item, after
+      all calls have finished
+    """
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    indices = iter(range(len(items)))
+    lock = threading.Lock()
+    # commands of the workers are reported for the method calling
+    # map_parallel, and fetches count for its fetching scopes
+    method = profiling.get_current_method() if profiling.hooks_active() else None
+    scopes = fetching.get_open_scopes()
+
+    def work():
+        with profiling.called_from(method), fetching.within(scopes):
+            while True:
+                with lock:
+                    index = next(indices, None)
+                if index is None:
+                    return
+                try:
+                    results[index] = function(items[index])
+                except Exception as exc:
+                    errors[index] = exc
+
+    threads = [threading.Thread(target=work) for _ in range(min(jobs, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for error in errors:
+        if error is not None:
+            raise error
+    return results
+
+
 def sanitized(arg):
     """
     makes sure a composed command to be executed via shell was not injected.
@@ -227,37 +280,526 @@ def _discard_line(line):
     return False
 
 
-def _read_shell_output(proc, no_filter, verbose, show_stdout, output_queue):
-    # when we read output in while loop, it would not be returned
-    # in communicate()
+# bytes read from a command pipe at once
+_READ_CHUNK_SIZE = 65536
+
+
+def _terminate_process(proc):
+    """
+    terminates the process group of proc, created by run_shell_command
+    when a timeout is given
+    """
+    try:
+        if hasattr(os.sys, 'winver'):
+            os.kill(proc.pid, signal.CTRL_BREAK_EVENT)
+        else:
+            os.killpg(proc.pid, signal.SIGTERM)
+    except OSError:
+        # process terminated meanwhile
+        pass
+
+
+def _get_process_group_flags():
+    """
+    :returns: dict of Popen arguments starting the process in a new
+      process group, which _terminate_process terminates as a whole
+    """
+    if hasattr(os.sys, 'winver'):
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'preexec_fn': os.setsid}
+
+
+def _remaining_time(deadline):
+    if deadline is None:
+        return None
+    return max(0, deadline - profiling.clock())
+
+
+def _wait_process(proc, deadline):
+    """
+    waits for proc to terminate, terminating it at deadline
+
+    :returns: True if the deadline passed
+    """
+    if deadline is None:
+        proc.wait()
+        return False
+    delay = 0.001
+    while proc.poll() is None:
+        remaining = _remaining_time(deadline)
+        if remaining == 0:
+            _terminate_process(proc)
+            proc.wait()
+            return True
+        delay = min(delay * 2, remaining, 0.05)
+        time.sleep(delay)
+    return False
+
+
+def _communicate(proc, deadline):
+    """
+    reads the output of proc with communicate(), terminating its
+    process group at deadline
+
+    :returns: ((stdout, stderr), timed_out)
+    """
+    if deadline is None:
+        return proc.communicate(), False
+    if hasattr(subprocess, 'TimeoutExpired'):
+        try:
+            return proc.communicate(timeout=_remaining_time(deadline)), False
+        except subprocess.TimeoutExpired:
+            _terminate_process(proc)
+            return proc.communicate(), True
+    # py2.7 communicate() has no timeout, a watchdog thread terminates
+    # the process instead
+    timed_out = []
+
+    def terminate():
+        timed_out.append(True)
+        _terminate_process(proc)
+    watchdog = threading.Timer(_remaining_time(deadline), terminate)
+    watchdog.daemon = True
+    watchdog.start()
+    try:
+        output = proc.communicate()
+    finally:
+        watchdog.cancel()
+    return output, bool(timed_out)
+
+
+def _read_pipes(proc, deadline):
+    """
+    reads stdout and stderr of proc until both pipes are closed,
+    watching them with a selector, so neither reading nor enforcing
+    the deadline needs a thread. When the deadline passes, the process
+    group of proc is terminated and (None, b'') is yielded once.
+
+    :returns: iterator of (fd, data), data is b'' when fd is closed
+    """
+    pipes = [proc.stdout.fileno(), proc.stderr.fileno()]
+    if hasattr(os.sys, 'winver'):
+        # windows cannot select on pipes
+        output, timed_out = _communicate(proc, deadline)
+        if timed_out:
+            yield None, b''
+        for fd, data in zip(pipes, output):
+            yield fd, data
+            yield fd, b''
+        return
+    selector = None
+    if selectors is not None:
+        selector = selectors.DefaultSelector()
+        for fd in pipes:
+            selector.register(fd, selectors.EVENT_READ)
+    timed_out = False
+    try:
+        while pipes:
+            timeout = None if timed_out else _remaining_time(deadline)
+            if selector is not None:
+                ready = [key.fd for key, _ in selector.select(timeout)]
+            else:
+                # py2.7
+                ready = select.select(pipes, [], [], timeout)[0]
+            if not ready:
+                if timeout is not None and _remaining_time(deadline) == 0:
+                    _terminate_process(proc)
+                    timed_out = True
+                    yield None, b''
+                continue
+            for fd in ready:
+                data = os.read(fd, _READ_CHUNK_SIZE)
+                if not data:
+                    pipes.remove(fd)
+                    if selector is not None:
+                        selector.unregister(fd)
+                yield fd, data
+    finally:
+        if selector is not None:
+            selector.close()
+
+
+def _read_shell_output(proc, no_filter, verbose, show_stdout, deadline=None):
+    """
+    reads the output of proc until it terminates. In verbose or
+    show_stdout mode, lines are echoed while the process runs. When the
+    deadline (a profiling.clock() value) passes, the process group of
+    proc is terminated.
+
+    :returns: (stdout_buf, stderr_buf, timed_out), where the buffers
+      are lists of decoded strings
+    """
     stdout_buf = []
     stderr_buf = []
-    if not no_filter:
-        if (verbose or show_stdout):
-            # this loop runs until proc is done it listen to the pipe, print
-            # and stores result in buffer for returning this allows proc to run
-            # while we still can filter out output avoiding readline() because
-            # it may block forever
-            for line in iter(proc.stdout.readline, b''):
-                line = line.decode('UTF-8')
-                if line is not None and line != '':
-                    if verbose or not _discard_line(line):
-                        sys.stdout.write(line),
-                        stdout_buf.append(line)
-                if (not line or proc.returncode is not None):
-                    break
-        # stderr was swallowed in pipe, in verbose mode print lines
-        if verbose:
-            for line in iter(proc.stderr.readline, b''):
+    if no_filter:
+        return stdout_buf, stderr_buf, _wait_process(proc, deadline)
+    stdout_fd = proc.stdout.fileno()
+    stderr_fd = proc.stderr.fileno()
+    bufs = {stdout_fd: stdout_buf, stderr_fd: stderr_buf}
+    # pipes echoed line by line, stdout unless verbose only with
+    # lines not discarded by _discard_line()
+    echoed = {stdout_fd: verbose or show_stdout, stderr_fd: verbose}
+    chunks = {stdout_fd: [], stderr_fd: []}
+    partial = {stdout_fd: b'', stderr_fd: b''}
+    timed_out = False
+    for fd, data in _read_pipes(proc, deadline):
+        if fd is None:
+            timed_out = True
+        elif not echoed[fd]:
+            chunks[fd].append(data)
+        else:
+            lines = (partial[fd] + data).split(b'\n')
+            partial[fd] = lines.pop()
+            lines = [line + b'\n' for line in lines]
+            if not data and partial[fd]:
+                lines.append(partial[fd])
+            for line in lines:
                 line = line.decode('UTF-8')
-                if line != '':
-                    sys.stdout.write(line),
-                    stderr_buf.append(line)
-                if not line:
+                if verbose or not _discard_line(line):
+                    sys.stdout.write(line)
+                    bufs[fd].append(line)
+    proc.wait()
+    for fd in [stdout_fd, stderr_fd]:
+        if not echoed[fd]:
+            bufs[fd].append(b''.join(chunks[fd]).decode('utf-8'))
+    return stdout_buf, stderr_buf, timed_out
+
+
+# cache of (environment snapshot, child environment) per us_env flag
+_COMMAND_ENV_CACHE = {}
+
+
+def _get_command_env(us_env):
+    """
+    returns the environment to pass to child processes. The dict is
+    built once and reused for as long as os.environ does not change,
+    which avoids copying the whole environment for every command.
+
+    :param us_env: whether LANG is forced to en_US.UTF-8
+    :returns: dict for Popen(env=...), or None to inherit os.environ
+    """
+    if not us_env:
+        return None
+    # os.environ._data is the raw mapping backing os.environ, comparing
+    # it is much cheaper than copying os.environ
+    current = getattr(os.environ, '_data', None)
+    cached = _COMMAND_ENV_CACHE.get(us_env)
+    if cached is not None and current is not None and cached[0] == current:
+        return cached[1]
+    env = dict(os.environ)
+    env["LANG"] = "en_US.UTF-8"
+    if current is not None:
+        _COMMAND_ENV_CACHE[us_env] = (dict(current), env)
+    return env
+
+
+def run_command(argv, cwd=None, us_env=True,
+                show_stdout=False, verbose=False, timeout=None,
+                no_warn=False, no_filter=False):
+    """
+    executes a command given as list of arguments, without invoking
+    a shell. As arguments are passed verbatim to the program, they
+    do not need to be sanitized.
+
+    :param argv: list of program name and arguments
+    :returns: ( returncode, stdout, stderr); stdout is None if no_filter==True
+    :raises: VcsError on OSError
+    :raises: ValueError if argv is not a list
+    """
+    if not isinstance(argv, (list, tuple)):
+        raise ValueError("run_command requires a list of arguments, got: %s" % argv)
+    return run_shell_command(list(argv),
+                             cwd=cwd,
+                             shell=False,
+                             us_env=us_env,
+                             show_stdout=show_stdout,
+                             verbose=verbose,
+                             timeout=timeout,
+                             no_warn=no_warn,
+                             no_filter=no_filter)
+
+
+def run_command_to_file(argv, fileobj, cwd=None, us_env=True, no_warn=False):
+    """
+    executes a command given as list of arguments like run_command,
+    copying its binary output to fileobj while it runs, e.g. an
+    archive written to stdout. Nothing is buffered beyond one chunk,
+    except while recording a transcript, which stores the output
+    base64 encoded. stderr is spooled to a temporary file.
+
+    :param fileobj: binary file object to write the output to
+    :returns: (returncode, stderr)
+    :raises: VcsError on OSError
+    :raises: ValueError if argv is not a list
+    """
+    if not isinstance(argv, (list, tuple)):
+        raise ValueError("run_command_to_file requires a list of arguments, got: %s" % argv)
+    argv = list(argv)
+    env = _get_command_env(us_env)
+    start_time = profiling.clock()
+    replayed = transcripts.replay_command(argv, cwd, env)
+    if replayed is not None:
+        returncode = replayed['returncode']
+        stdout = replayed['stdout'] or ''
+        if replayed.get('stdout_encoding') == 'base64':
+            stdout_bytes = base64.b64decode(stdout.encode('ascii'))
+        else:
+            stdout_bytes = stdout.encode('utf-8')
+        if stdout_bytes:
+            fileobj.write(stdout_bytes)
+        written = len(stdout_bytes)
+        stderr = replayed['stderr'] or ''
+        stderr_size = len(stderr.encode('utf-8'))
+    else:
+        returncode, written, stderr_bytes = _copy_process_output(argv, fileobj, cwd, env)
+        stderr = stderr_bytes.decode('utf-8', 'replace')
+        stderr_size = len(stderr_bytes)
+    profiling.record_command(argv, cwd, start_time, returncode, written, stderr_size)
+    if returncode != 0 and stderr != '' and not no_warn:
+        logging.getLogger('vcstools').warn(_command_failed_message(argv, cwd, returncode, stderr))
+    return returncode, stderr
+
+
+def _copy_process_output(argv, fileobj, cwd, env):
+    """
+    spawns argv and copies its stdout to fileobj, see run_command_to_file
+
+    :returns: (returncode, bytes written, stderr bytes)
+    :raises: VcsError on OSError
+    """
+    start_time = profiling.clock()
+    recorded = [] if transcripts.is_recording() else None
+    written = 0
+    with tempfile.TemporaryFile() as stderr_file:
+        try:
+            proc = subprocess.Popen(argv, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=stderr_file)
+        except OSError as ose:
+            message = "Command failed with OSError. '%s' <%s>:\n%s" % (_format_command(argv), cwd, ose)
+            logging.getLogger('vcstools').error(message)
+            raise VcsError(message)
+        exhausted = False
+        try:
+            fd = proc.stdout.fileno()
+            while True:
+                chunk = os.read(fd, _READ_CHUNK_SIZE)
+                if not chunk:
                     break
-    output_queue.put(proc.communicate())
-    output_queue.put(stdout_buf)
-    output_queue.put(stderr_buf)
+                if recorded is not None:
+                    recorded.append(chunk)
+                fileobj.write(chunk)
+                written += len(chunk)
+            exhausted = True
+        finally:
+            if not exhausted and proc.poll() is None:
+                # writing failed, the output is of no use anymore
+                proc.kill()
+            proc.stdout.close()
+            returncode = proc.wait()
+        stderr_file.seek(0)
+        stderr_bytes = stderr_file.read()
+    if recorded is not None:
+        transcripts.record_command(argv, cwd, env, returncode,
+                                   base64.b64encode(b''.join(recorded)).decode('ascii'),
+                                   stderr_bytes.decode('utf-8', 'replace'),
+                                   profiling.clock() - start_time, stdout_encoding='base64')
+    return returncode, written, stderr_bytes
+
+
+def _format_command(cmd):
+    if isinstance(cmd, (list, tuple)):
+        return ' '.join(cmd)
+    return cmd
+
+
+def _command_failed_message(cmd, cwd, returncode, stderr):
+    message = "Command failed: '%s'" % (_format_command(cmd))
+    if cwd is not None:
+        message += "\n run at: '%s'" % (cwd)
+    message += "\n errcode: %s:\n%s" % (returncode, stderr)
+    return message
+
+
+class CommandLines(object):
+    """
+    runs a command given as list of arguments and iterates over its
+    output records while the command is running, so that large outputs
+    (logs, diffs) can be processed with bounded memory. Records are
+    decoded and do not include the separator; an empty record after
+    the final separator is not returned.
+
+    stderr is spooled to a temporary file to avoid blocking the
+    command while only stdout is consumed. After iterating, or after
+    close(), returncode and message hold the same values
+    run_command would have returned. Closing before all output was
+    consumed kills the command::
+
+        with CommandLines(['git', 'log']) as lines:
+            for line in lines:
+                ...
+    """
+
+    def __init__(self, argv, cwd=None, us_env=True, no_warn=False, separator='\n'):
+        """
+        :param argv: list of program name and arguments
+        :param separator: record separator, e.g. '\\0' for -z output
+        :raises: VcsError on OSError
+        :raises: ValueError if argv is not a list
+        """
+        if not isinstance(argv, (list, tuple)):
+            raise ValueError("CommandLines requires a list of arguments, got: %s" % argv)
+        self.returncode = None
+        self.message = None
+        self._cmd = list(argv)
+        self._cwd = cwd
+        self._no_warn = no_warn
+        self._separator = separator.encode('utf-8')
+        self._exhausted = False
+        self._stdout_bytes = 0
+        self._env = _get_command_env(us_env)
+        self._start_time = profiling.clock()
+        self._proc = None
+        self._stderr_file = None
+        # output chunks kept for the transcript while recording
+        self._recorded = [] if transcripts.is_recording() else None
+        self._replayed = transcripts.replay_command(self._cmd, cwd, self._env)
+        if self._replayed is not None:
+            return
+        self._stderr_file = tempfile.TemporaryFile()
+        try:
+            self._proc = subprocess.Popen(self._cmd,
+                                          cwd=cwd,
+                                          stdout=subprocess.PIPE,
+                                          stderr=self._stderr_file,
+                                          env=self._env)
+        except OSError as ose:
+            self._stderr_file.close()
+            self._stderr_file = None
+            logger = logging.getLogger('vcstools')
+            message = "Command failed with OSError. '%s' <%s>:\n%s" % (_format_command(argv), cwd, ose)
+            logger.error(message)
+            raise VcsError(message)
+
+    def _read_chunks(self):
+        if self._replayed is not None:
+            yield self._replayed['stdout'].encode('utf-8')
+            return
+        if self._proc is None:
+            return
+        fd = self._proc.stdout.fileno()
+        while True:
+            chunk = os.read(fd, _READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            if self._recorded is not None:
+                self._recorded.append(chunk)
+            yield chunk
+
+    def __iter__(self):
+        pending = []
+        try:
+            for chunk in self._read_chunks():
+                self._stdout_bytes += len(chunk)
+                if self._separator not in chunk:
+                    pending.append(chunk)
+                    continue
+                records = chunk.split(self._separator)
+                pending.append(records[0])
+                records[0] = b''.join(pending)
+                pending = [records.pop()]
+                for record in records:
+                    yield record.decode('utf-8')
+            self._exhausted = True
+            record = b''.join(pending)
+            if record:
+                yield record.decode('utf-8')
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        waits for the command to terminate, killing it if its output
+        was not read completely, and sets returncode and message
+        """
+        if self._replayed is not None:
+            replayed = self._replayed
+            self._replayed = None
+            self._finish(replayed['returncode'], replayed['stderr'], len(replayed['stderr'].encode('utf-8')))
+            return
+        if self._proc is None:
+            return
+        proc = self._proc
+        self._proc = None
+        if not self._exhausted and proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+        returncode = proc.wait()
+        self._stderr_file.seek(0)
+        stderr_bytes = self._stderr_file.read()
+        self._stderr_file.close()
+        stderr = stderr_bytes.decode('utf-8')
+        if self._recorded is not None:
+            transcripts.record_command(self._cmd, self._cwd, self._env, returncode,
+                                       b''.join(self._recorded).decode('utf-8'), stderr,
+                                       profiling.clock() - self._start_time)
+        self._finish(returncode, stderr, len(stderr_bytes))
+
+    def _finish(self, returncode, stderr, stderr_bytes):
+        self.returncode = returncode
+        profiling.record_command(self._cmd, self._cwd, self._start_time, returncode,
+                                 self._stdout_bytes, stderr_bytes)
+        if returncode != 0 and stderr != '':
+            self.message = _command_failed_message(self._cmd, self._cwd, returncode, stderr)
+            if not self._no_warn:
+                logging.getLogger('vcstools').warn(self.message)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def _run_process(cmd, cwd, shell, env, show_stdout, verbose, timeout, no_filter, start_time):
+    """
+    spawns cmd and collects its output, see run_shell_command
+
+    :returns: (returncode, stdout, stderr) with decoded output
+    :raises: OSError
+    """
+    if no_filter:
+        # in no_filter mode, we cannot pipe stdin, as this
+        # causes some prompts to be hidden (e.g. mercurial over
+        # http)
+        stdout_target = None
+        stderr_target = None
+    else:
+        stdout_target = subprocess.PIPE
+        stderr_target = subprocess.PIPE
+
+    # additional parameters to Popen when using a timeout
+    crflags = {}
+    if timeout is not None:
+        crflags = _get_process_group_flags()
+
+    proc = subprocess.Popen(cmd,
+                            shell=shell,
+                            cwd=cwd,
+                            stdout=stdout_target,
+                            stderr=stderr_target,
+                            env=env,
+                            **crflags)
+
+    deadline = None
+    if timeout is not None:
+        deadline = start_time + timeout
+    stdout_buf, stderr_buf, _ = _read_shell_output(proc, no_filter, verbose, show_stdout, deadline)
+    return proc.returncode, "\n".join(stdout_buf), "\n".join(stderr_buf)
 
 
 def run_shell_command(cmd, cwd=None, shell=False, us_env=True,
@@ -281,75 +823,33 @@ def run_shell_command(cmd, cwd=None, shell=False, us_env=True,
     :raises: VcsError on OSError
     """
     try:
-        env = copy.copy(os.environ)
-        if us_env:
-            env["LANG"] = "en_US.UTF-8"
-        if no_filter:
-            # in no_filter mode, we cannot pipe stdin, as this
-            # causes some prompts to be hidden (e.g. mercurial over
-            # http)
-            stdout_target = None
-            stderr_target = None
-        else:
-            stdout_target = subprocess.PIPE
-            stderr_target = subprocess.PIPE
-
-        # additional parameters to Popen when using a timeout
-        crflags = {}
-        if timeout is not None:
-            if hasattr(os.sys, 'winver'):
-                crflags['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
-            else:
-                crflags['preexec_fn'] = os.setsid
-
-        proc = subprocess.Popen(cmd,
-                                shell=shell,
-                                cwd=cwd,
-                                stdout=stdout_target,
-                                stderr=stderr_target,
-                                env=env,
-                                **crflags)
-
-        # using a queue to enable usage in a separate thread
-        q = Queue()
-        if timeout is None:
-            _read_shell_output(proc, no_filter, verbose, show_stdout, q)
+        env = _get_command_env(us_env)
+        start_time = profiling.clock()
+        replayed = transcripts.replay_command(cmd, cwd, env)
+        if replayed is not None:
+            returncode = replayed['returncode']
+            stdout = replayed['stdout']
+            stderr = replayed['stderr']
         else:
-            t = threading.Thread(target=_read_shell_output,
-                                 args=[proc, no_filter, verbose, show_stdout, q])
-            t.start()
-            t.join(timeout)
-            if t.isAlive():
-                if hasattr(os.sys, 'winver'):
-                    os.kill(proc.pid, signal.CTRL_BREAK_EVENT)
-                else:
-                    os.killpg(proc.pid, signal.SIGTERM)
-                t.join()
-        (stdout, stderr) = q.get()
-        stdout_buf = q.get()
-        stderr_buf = q.get()
-
-        if stdout is not None:
-            stdout_buf.append(stdout.decode('utf-8'))
-        stdout = "\n".join(stdout_buf)
-        if stderr is not None:
-            stderr_buf.append(stderr.decode('utf-8'))
-        stderr = "\n".join(stderr_buf)
+            returncode, stdout, stderr = _run_process(cmd, cwd, shell, env, show_stdout,
+                                                      verbose, timeout, no_filter, start_time)
+            transcripts.record_command(cmd, cwd, env, returncode, stdout, stderr,
+                                       profiling.clock() - start_time)
         message = None
-        if proc.returncode != 0 and stderr is not None and stderr != '':
+        if returncode != 0 and stderr is not None and stderr != '':
             logger = logging.getLogger('vcstools')
-            message = "Command failed: '%s'" % (cmd)
-            if cwd is not None:
-                message += "\n run at: '%s'" % (cwd)
-            message += "\n errcode: %s:\n%s" % (proc.returncode, stderr)
+            message = _command_failed_message(cmd, cwd, returncode, stderr)
             if not no_warn:
                 logger.warn(message)
+        if profiling.hooks_active():
+            profiling.record_command(cmd, cwd, start_time, returncode,
+                                     len(stdout.encode('utf-8')), len(stderr.encode('utf-8')))
         result = stdout
         if result is not None:
             result = result.rstrip()
-        return (proc.returncode, result, message)
+        return (returncode, result, message)
     except OSError as ose:
         logger = logging.getLogger('vcstools')
-        message = "Command failed with OSError. '%s' <%s, %s>:\n%s" % (cmd, shell, cwd, ose)
+        message = "Command failed with OSError. '%s' <%s, %s>:\n%s" % (_format_command(cmd), shell, cwd, ose)
         logger.error(message)
         raise VcsError(message)
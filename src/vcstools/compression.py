@@ -0,0 +1,631 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+compression of exported archives on several threads.
+
+Data is split into blocks that are compressed independently of each
+other on a pool of threads and written in order, as concatenated gzip
+members, bzip2 streams or xz streams. gzip, bzip2, xz and python's
+tarfile read such files like files compressed as one stream, zlib,
+bz2 and lzma release the GIL while compressing. Independent blocks
+compress slightly worse than a single stream.
+
+Archive formats are 'tar' (no compression), 'gz', 'bz2' and 'xz'. xz
+needs the lzma module of python 3. The number of threads defaults to
+the number of CPUs, see set_jobs().
+
+ZipWriter deflates zip entries the same way: the blocks of an entry
+are compressed on the threads and concatenated to one deflate stream
+per entry.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import bz2
+import collections
+import functools
+import multiprocessing
+import os
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from vcstools.common import run_command_to_file
+from vcstools.vcs_base import VcsError
+
+
+ARCHIVE_FORMATS = ('tar', 'gz', 'bz2', 'xz')
+DEFAULT_FORMAT = 'gz'
+
+_EXTENSIONS = {'tar': '.tar', 'gz': '.tar.gz', 'bz2': '.tar.bz2', 'xz': '.tar.xz'}
+_DEFAULT_LEVELS = {'gz': 6, 'bz2': 9, 'xz': 6}
+_MIN_LEVELS = {'gz': 0, 'bz2': 1, 'xz': 0}
+# uncompressed bytes per independently compressed block, bzip2 uses
+# blocks of 900k at level 9 anyway, xz needs larger blocks to not
+# lose much of its ratio
+_BLOCK_SIZES = {'gz': 1 << 20, 'bz2': 900 * 1000, 'xz': 1 << 23}
+
+_jobs = None
+
+
+def set_jobs(jobs):
+    """
+    :param jobs: number of threads compressing, None for the number
+      of CPUs
+    """
+    global _jobs
+    _jobs = jobs
+
+
+def get_jobs():
+    if _jobs is not None:
+        return _jobs
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def get_archive_path(basepath, archive_format=DEFAULT_FORMAT):
+    """
+    :returns: basepath with the extension of archive_format, e.g.
+      basepath.tar.gz
+    :raises: ValueError for unknown formats
+    """
+    if archive_format not in _EXTENSIONS:
+        raise ValueError("Unknown archive format '%s', expected one of %s" %
+                         (archive_format, ', '.join(ARCHIVE_FORMATS)))
+    return basepath + _EXTENSIONS[archive_format]
+
+
+def check_format(archive_format, level=None):
+    """
+    checks that archives of archive_format can be written, so that
+    exports fail before running any command
+
+    :raises: ValueError for unknown formats or levels
+    :raises: VcsError if the format is not supported by this python
+    """
+    _get_compress_function(archive_format, level)
+
+
+def _get_compress_function(archive_format, level):
+    """
+    :returns: function compressing a block of data into a complete
+      gzip member, bzip2 or xz stream, None for 'tar'
+    :raises: ValueError for unknown formats or levels
+    :raises: VcsError if the format is not supported by this python
+    """
+    get_archive_path('', archive_format)
+    if archive_format == 'tar':
+        return None
+    if level is None:
+        level = _DEFAULT_LEVELS[archive_format]
+    if not _MIN_LEVELS[archive_format] <= level <= 9:
+        raise ValueError("Invalid compression level %s for format '%s'" % (level, archive_format))
+    if archive_format == 'gz':
+        def compress(data):
+            # wbits 31 writes a gzip header and trailer
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            return compressor.compress(data) + compressor.flush()
+        return compress
+    if archive_format == 'bz2':
+        return lambda data: bz2.compress(data, level)
+    if lzma is None:
+        raise VcsError("xz compression requires the lzma module of python 3")
+    return lambda data: lzma.compress(data, preset=level)
+
+
+class _Block(object):
+
+    def __init__(self, function, data, context):
+        self.function = function
+        self.data = data
+        self.context = context
+        self.done = threading.Event()
+        self.error = None
+
+
+class _OrderedPool(object):
+    """
+    applies functions to blocks of data on up to jobs threads, handing
+    the results to a consumer in the order the blocks were submitted
+    """
+
+    def __init__(self, jobs, consume):
+        """
+        :param consume: function called with (result, context) of each
+          block, in order
+        """
+        self._jobs = jobs
+        self._consume = consume
+        # blocks being processed, in output order
+        self._pending = collections.deque()
+        self._queue = None
+        self._threads = []
+
+    def submit(self, function, data, context=None):
+        """
+        :param function: function applied to data, None to pass data
+          on as it is
+        """
+        if function is None or self._jobs <= 1:
+            if not self._pending:
+                self._consume(data if function is None else function(data), context)
+                return
+            block = _Block(None, data if function is None else function(data), context)
+            block.done.set()
+        else:
+            if self._queue is None:
+                self._queue = queue.Queue()
+            if len(self._threads) < self._jobs:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            block = _Block(function, data, context)
+            self._queue.put(block)
+        self._pending.append(block)
+        # bound the memory of blocks waiting to be consumed
+        while len(self._pending) > 2 * self._jobs:
+            self._consume_block()
+
+    def pending(self):
+        return len(self._pending)
+
+    def drain(self):
+        """
+        consumes all submitted blocks
+        """
+        while self._pending:
+            self._consume_block()
+
+    def stop(self):
+        """
+        stops the threads, dropping blocks not consumed yet
+        """
+        self._pending.clear()
+        for _ in self._threads:
+            self._queue.put(None)
+        self._threads = []
+
+    def _consume_block(self):
+        block = self._pending.popleft()
+        block.done.wait()
+        if block.error is not None:
+            raise block.error
+        self._consume(block.data, block.context)
+
+    def _work(self):
+        while True:
+            block = self._queue.get()
+            if block is None:
+                return
+            try:
+                block.data = block.function(block.data)
+            except Exception as exc:
+                block.error = exc
+            block.done.set()
+
+
+class CompressedWriter(object):
+    """
+    file-like object compressing the data written to it in blocks on
+    several threads and writing the compressed blocks to fileobj in
+    order. Never seeks, so fileobj may be a pipe or socket. close()
+    writes the remaining data but does not close fileobj::
+
+        with open('export.tar.gz', 'wb') as fhand:
+            with CompressedWriter(fhand, 'gz') as writer:
+                tar = tarfile.open(fileobj=writer, mode='w|')
+                ...
+    """
+
+    def __init__(self, fileobj, archive_format=DEFAULT_FORMAT, level=None, jobs=None):
+        """
+        :param fileobj: binary file object to write to
+        :param archive_format: one of ARCHIVE_FORMATS
+        :param level: compression level, 0 (gz, xz) or 1 (bz2) to 9,
+          None for the default of the format
+        :param jobs: number of threads, None for get_jobs()
+        :raises: ValueError for unknown formats or levels
+        :raises: VcsError if the format is not supported by this python
+        """
+        self._fileobj = fileobj
+        self._compress = _get_compress_function(archive_format, level)
+        self._block_size = _BLOCK_SIZES.get(archive_format)
+        self._pool = _OrderedPool(get_jobs() if jobs is None else jobs, self._write_block)
+        self._buffer = []
+        self._buffered = 0
+        self._written_blocks = 0
+        self._aborted = False
+        self.closed = False
+
+    def write(self, data):
+        if self._aborted:
+            # e.g. a tarfile flushing its buffer when garbage collected
+            return
+        if self.closed:
+            raise ValueError("write to closed CompressedWriter")
+        if self._compress is None:
+            self._fileobj.write(data)
+            return
+        self._buffer.append(bytes(data))
+        self._buffered += len(data)
+        if self._buffered >= self._block_size:
+            data = b''.join(self._buffer)
+            self._buffer = []
+            self._buffered = 0
+            for start in range(0, len(data) - self._block_size + 1, self._block_size):
+                self._pool.submit(self._compress, data[start:start + self._block_size])
+            remainder = len(data) % self._block_size
+            if remainder:
+                self._buffer.append(data[-remainder:])
+                self._buffered = remainder
+
+    def flush(self):
+        # incomplete blocks stay buffered, compressing them now would
+        # only produce small blocks
+        self._fileobj.flush()
+
+    def close(self):
+        """
+        compresses and writes the remaining data, waiting for all
+        threads
+        """
+        if self.closed:
+            return
+        try:
+            if self._compress is not None:
+                if self._buffered or not self._written_blocks and not self._pool.pending():
+                    # an empty file is not valid for all formats
+                    self._pool.submit(self._compress, b''.join(self._buffer))
+                    self._buffer = []
+                    self._buffered = 0
+                self._pool.drain()
+        finally:
+            self._stop()
+
+    def abort(self):
+        """
+        stops the threads without writing the remaining data, so that
+        e.g. no gzip member is written for a failed command. Data
+        written afterwards is discarded.
+        """
+        self._aborted = True
+        self._stop()
+
+    def _stop(self):
+        self.closed = True
+        self._pool.stop()
+
+    def _write_block(self, data, context):
+        self._fileobj.write(data)
+        self._written_blocks += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+# zip constants, see APPNOTE.TXT of PKWARE
+_ZIP_STORED = 0
+_ZIP_DEFLATED = 8
+_ZIP64_LIMIT = (1 << 32) - 1
+_ZIP_MAX_ENTRIES = (1 << 16) - 1
+# data descriptor follows the data, file names are utf-8
+_ZIP_FLAG_DATA_DESCRIPTOR = 0x08
+_ZIP_FLAG_UTF8 = 0x800
+_ZIP_UNIX = 3
+_ZIP_S_IFLNK = 0xA1ED0000
+_ZIP_DIRECTORY = 0x10
+
+
+class _ZipEntry(object):
+
+    def __init__(self, name, date_time, external_attr, method, zip64):
+        self.name = name
+        self.date_time = date_time
+        self.external_attr = external_attr
+        self.method = method
+        self.zip64 = zip64
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.header_offset = 0
+
+    def get_version(self):
+        return 45 if self.zip64 else 20
+
+    def get_encoded_name(self):
+        try:
+            return self.name.encode('ascii'), 0
+        except UnicodeEncodeError:
+            return self.name.encode('utf-8'), _ZIP_FLAG_UTF8
+
+    def get_dos_time(self):
+        year, month, day, hour, minute, second = self.date_time[:6]
+        if year < 1980:
+            year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+        return ((year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2)
+
+
+def _deflate_block(level, final, data):
+    """
+    :returns: raw deflate data of a block. Blocks but the final one end
+      with a sync flush instead of the final deflate block, so that the
+      blocks of an entry form one deflate stream when concatenated.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class ZipWriter(object):
+    """
+    writes a zip archive to fileobj, deflating the entries in blocks on
+    several threads. Like CompressedWriter, never seeks, entries carry
+    data descriptors after their data. ZIP64 extensions are used for
+    large entries and archives::
+
+        with open('export.zip', 'wb') as fhand:
+            with ZipWriter(fhand) as writer:
+                writer.add_file('README', 'export/README')
+    """
+
+    def __init__(self, fileobj, level=None, jobs=None):
+        """
+        :param fileobj: binary file object to write to
+        :param level: compression level from 0 to 9, 0 stores entries
+          without compression, None for the default of gz
+        :param jobs: number of threads, None for get_jobs()
+        :raises: ValueError for invalid levels
+        """
+        if level is None:
+            level = _DEFAULT_LEVELS['gz']
+        if not 0 <= level <= 9:
+            raise ValueError("Invalid compression level %s for format 'zip'" % level)
+        self._fileobj = fileobj
+        self._level = level
+        self._block_size = _BLOCK_SIZES['gz']
+        self._pool = _OrderedPool(get_jobs() if jobs is None else jobs, self._write_block)
+        self._entries = []
+        self._offset = 0
+        self.closed = False
+
+    def add_file(self, file_path, arcname):
+        """
+        adds a file, symbolic link or directory entry like ZipFile.write
+        """
+        if self.closed:
+            raise ValueError("write to closed ZipWriter")
+        stat = os.lstat(file_path)
+        date_time = time.localtime(stat.st_mtime)
+        if os.path.islink(file_path):
+            entry = _ZipEntry(arcname, date_time, _ZIP_S_IFLNK, _ZIP_STORED, False)
+            self._add_entry(entry, [os.readlink(file_path).encode('utf-8')])
+            return
+        external_attr = (stat.st_mode & 0xFFFF) << 16
+        if os.path.isdir(file_path):
+            entry = _ZipEntry(arcname.rstrip('/') + '/', date_time, external_attr | _ZIP_DIRECTORY,
+                              _ZIP_STORED, False)
+            self._add_entry(entry, [b''])
+            return
+        method = _ZIP_DEFLATED if self._level else _ZIP_STORED
+        # deflate may grow incompressible data a little
+        entry = _ZipEntry(arcname, date_time, external_attr, method, stat.st_size * 1.05 > _ZIP64_LIMIT)
+        with open(file_path, 'rb') as fhand:
+            self._add_entry(entry, iter(lambda: fhand.read(self._block_size), b''))
+
+    def _add_entry(self, entry, blocks):
+        """
+        :param blocks: iterable of the uncompressed data of entry
+        """
+        self._pool.submit(None, None, (entry, 'header'))
+        blocks = iter(blocks)
+        data = next(blocks, b'')
+        while True:
+            following = next(blocks, None)
+            entry.crc = zlib.crc32(data, entry.crc)
+            entry.file_size += len(data)
+            if entry.method == _ZIP_STORED:
+                self._pool.submit(None, data, (entry, 'data'))
+            else:
+                self._pool.submit(functools.partial(_deflate_block, self._level, following is None),
+                                  data, (entry, 'data'))
+            if following is None:
+                break
+            data = following
+        entry.crc &= 0xFFFFFFFF
+        if entry.file_size > _ZIP64_LIMIT and not entry.zip64:
+            raise VcsError("%s grew while adding it to the zip archive" % entry.name)
+        self._pool.submit(None, None, (entry, 'end'))
+
+    def _write(self, data):
+        self._fileobj.write(data)
+        self._offset += len(data)
+
+    def _write_block(self, data, context):
+        entry, part = context
+        if part == 'header':
+            entry.header_offset = self._offset
+            name, flags = entry.get_encoded_name()
+            size = 0
+            extra = b''
+            if entry.zip64:
+                size = _ZIP64_LIMIT
+                extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+            dosdate, dostime = entry.get_dos_time()
+            self._write(struct.pack('<4sHHHHHLLLHH', b'PK\x03\x04', entry.get_version(),
+                                    flags | _ZIP_FLAG_DATA_DESCRIPTOR, entry.method, dostime, dosdate,
+                                    0, size, size, len(name), len(extra)) + name + extra)
+        elif part == 'data':
+            entry.compress_size += len(data)
+            self._write(data)
+        else:
+            if entry.zip64:
+                descriptor = struct.pack('<4sLQQ', b'PK\x07\x08', entry.crc, entry.compress_size,
+                                         entry.file_size)
+            else:
+                descriptor = struct.pack('<4sLLL', b'PK\x07\x08', entry.crc, entry.compress_size,
+                                         entry.file_size)
+            self._write(descriptor)
+            self._entries.append(entry)
+
+    def close(self):
+        """
+        writes the remaining entries and the central directory, waiting
+        for all threads. Does not close fileobj.
+        """
+        if self.closed:
+            return
+        try:
+            self._pool.drain()
+            self._write_central_directory()
+        finally:
+            self._stop()
+
+    def abort(self):
+        """
+        stops the threads without writing the remaining entries or the
+        central directory, so that the archive is not mistaken as complete
+        """
+        self._stop()
+
+    def _stop(self):
+        self.closed = True
+        self._pool.stop()
+
+    def _write_central_directory(self):
+        start = self._offset
+        for entry in self._entries:
+            name, flags = entry.get_encoded_name()
+            # fields too large for the header go to the ZIP64 extra field
+            sizes = [entry.file_size, entry.compress_size, entry.header_offset]
+            large = [value for value in sizes if value > _ZIP64_LIMIT]
+            extra = b''
+            if large:
+                extra = struct.pack('<HH' + 'Q' * len(large), 1, 8 * len(large), *large)
+            file_size, compress_size, header_offset = [min(value, _ZIP64_LIMIT) for value in sizes]
+            version = 45 if large or entry.zip64 else 20
+            dosdate, dostime = entry.get_dos_time()
+            self._write(struct.pack('<4sBBHHHHHLLLHHHHHLL', b'PK\x01\x02', version, _ZIP_UNIX, version,
+                                    flags | _ZIP_FLAG_DATA_DESCRIPTOR, entry.method, dostime, dosdate,
+                                    entry.crc, compress_size, file_size, len(name), len(extra), 0, 0, 0,
+                                    entry.external_attr, header_offset) + name + extra)
+        size = self._offset - start
+        count = len(self._entries)
+        if count > _ZIP_MAX_ENTRIES or size > _ZIP64_LIMIT or start > _ZIP64_LIMIT:
+            end = self._offset
+            self._write(struct.pack('<4sQHHLLQQQQ', b'PK\x06\x06', 44, 45, 45, 0, 0, count, count, size, start))
+            self._write(struct.pack('<4sLQL', b'PK\x06\x07', 0, end, 1))
+            count = min(count, _ZIP_MAX_ENTRIES)
+            size = min(size, _ZIP64_LIMIT)
+            start = min(start, _ZIP64_LIMIT)
+        self._write(struct.pack('<4sHHHHLLH', b'PK\x05\x06', 0, 0, count, count, size, start, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_command_output(argv, cwd, writer):
+    """
+    writes the output of a command to writer and closes it, or aborts
+    it if the command fails, so that no compressed trailer follows
+    partial output
+
+    :param writer: CompressedWriter
+    :returns: True if the command succeeded
+    :raises: VcsError on OSError
+    """
+    try:
+        result, _ = run_command_to_file(argv, writer, cwd=cwd)
+    except Exception:
+        writer.abort()
+        raise
+    if result != 0:
+        writer.abort()
+        return False
+    writer.close()
+    return True
+
+
+def compress_tar_file(basepath, archive_format=DEFAULT_FORMAT, level=None, jobs=None):
+    """
+    compresses basepath.tar to the archive path of archive_format,
+    removing basepath.tar. Nothing is done for format 'tar'.
+
+    :returns: path of the archive
+    """
+    archive_path = get_archive_path(basepath, archive_format)
+    check_format(archive_format, level)
+    tar_path = basepath + '.tar'
+    if archive_path == tar_path:
+        return archive_path
+    try:
+        with open(tar_path, 'rb') as tar_file:
+            with open(archive_path, 'wb') as archive_file:
+                with CompressedWriter(archive_file, archive_format, level, jobs) as writer:
+                    while True:
+                        data = tar_file.read(1 << 20)
+                        if not data:
+                            break
+                        writer.write(data)
+    except Exception:
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+        raise
+    finally:
+        # clean up
+        os.remove(tar_path)
+    return archive_path
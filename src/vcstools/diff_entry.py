@@ -0,0 +1,213 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+per-file diffs as yielded by iter_diff(), and parsing of the git diff
+format shared by git and hg.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+from collections import namedtuple
+
+
+class DiffEntry(namedtuple('DiffEntry', ['path', 'status', 'orig_path', 'added', 'deleted', 'lines'])):
+    """
+    the diff of one changed file.
+
+    :ivar path: path of the file after the change, relative to the
+      client path, with '/' separators
+    :ivar status: 'A', 'M', 'D', 'R' (renamed) or 'C' (copied), other
+      letters as the vcs reports them
+    :ivar orig_path: the source path of renames and copies, else None
+    :ivar added: number of added lines, None for binary files or where
+      the vcs has no such summary
+    :ivar deleted: number of deleted lines, None like added
+    :ivar lines: lines of the diff of the file, without line endings,
+      empty for summaries
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, path, status, orig_path=None, added=None, deleted=None, lines=()):
+        return super(DiffEntry, cls).__new__(cls, path, status, orig_path, added, deleted, lines)
+
+    @property
+    def text(self):
+        """
+        :returns: the diff of the file, lines terminated by newlines
+        """
+        return ''.join(line + '\n' for line in self.lines)
+
+
+def count_changes(lines):
+    """
+    :param lines: lines of the diff of one file
+    :returns: (added, deleted) counting the lines of the hunks, (None,
+      None) if the diff has no hunks but a binary patch or notice
+    """
+    added = deleted = 0
+    in_hunk = False
+    for line in lines:
+        if line.startswith('@@'):
+            in_hunk = True
+        elif not in_hunk:
+            if line.startswith('Binary files ') or line == 'GIT binary patch':
+                return None, None
+        elif line.startswith('+'):
+            added += 1
+        elif line.startswith('-'):
+            deleted += 1
+    return added, deleted
+
+
+# C escapes of git quoted paths
+_UNQUOTE_ESCAPES = {'a': b'\a', 'b': b'\b', 't': b'\t', 'n': b'\n',
+                    'v': b'\v', 'f': b'\f', 'r': b'\r', '"': b'"', '\\': b'\\'}
+
+
+def unquote_path(path):
+    """
+    :returns: path unquoted if git quoted it with C escapes and octal
+      bytes, else path
+    """
+    if len(path) < 2 or path[0] != '"' or path[-1] != '"':
+        return path
+    result = bytearray()
+    chars = iter(path[1:-1])
+    for c in chars:
+        if c != '\\':
+            result.extend(c.encode('utf-8'))
+            continue
+        c = next(chars, '')
+        if c in '01234567' and c:
+            result.append(int(c + next(chars, '') + next(chars, ''), 8))
+        else:
+            result.extend(_UNQUOTE_ESCAPES.get(c, c.encode('utf-8')))
+    return result.decode('utf-8', 'replace')
+
+
+def _strip_prefix(path, prefix):
+    path = unquote_path(path.rstrip('\t'))
+    if path == '/dev/null':
+        return None
+    if path.startswith(prefix):
+        return path[len(prefix):]
+    return path
+
+
+def _replace_prefix(line, start, old, new):
+    """
+    replaces prefix old of a path following start in line by new,
+    also within quotes
+    """
+    if line.startswith(start + old):
+        return start + new + line[len(start + old):]
+    if line.startswith(start + '"' + old):
+        return start + '"' + new + line[len(start + '"' + old):]
+    return line
+
+
+def _git_format_entry(header, hunks, path_prefix, prefix):
+    status = 'M'
+    path = orig_path = old = new = None
+    for line in header[1:]:
+        if line.startswith('new file mode'):
+            status = 'A'
+        elif line.startswith('deleted file mode'):
+            status = 'D'
+        elif line.startswith('rename from ') or line.startswith('copy from '):
+            status = 'R' if line.startswith('rename') else 'C'
+            orig_path = unquote_path(line.split(' from ', 1)[1])
+        elif line.startswith('rename to ') or line.startswith('copy to '):
+            path = unquote_path(line.split(' to ', 1)[1])
+        elif line.startswith('--- '):
+            old = _strip_prefix(line[4:], 'a/')
+        elif line.startswith('+++ '):
+            new = _strip_prefix(line[4:], 'b/')
+    if path is None:
+        path = new or old
+    if path is None:
+        # no content change, both halves of the diff --git line name the path
+        names = header[0][len('diff --git '):]
+        path = _strip_prefix(names[len(names) // 2 + 1:], 'b/')
+    added, deleted = count_changes(header + hunks)
+    if prefix is not None:
+        header = [_rewrite_git_format_header(line, prefix) for line in header]
+    if orig_path is not None:
+        orig_path = path_prefix + orig_path
+    return DiffEntry(path_prefix + path, status, orig_path, added, deleted, header + hunks)
+
+
+def _rewrite_git_format_header(line, prefix):
+    if line.startswith('diff --git '):
+        # replacing b/ first in case the path starts with a/
+        names = line[len('diff --git '):]
+        for start in (' ', ' "'):
+            if start + 'b/' in names:
+                names = names.replace(start + 'b/', start + prefix, 1)
+                break
+        return 'diff --git ' + _replace_prefix(names, '', 'a/', prefix)
+    if line.startswith('--- '):
+        return _replace_prefix(line, '--- ', 'a/', prefix)
+    if line.startswith('+++ '):
+        return _replace_prefix(line, '+++ ', 'b/', prefix)
+    return line
+
+
+def iter_git_format_diff(lines, path_prefix='', prefix=None):
+    """
+    splits diff output in git format (git diff, hg diff -g) with the
+    default a/ and b/ prefixes into the diffs of each file. Only the
+    lines of one file are held in memory at a time.
+
+    :param lines: iterable of lines without line endings
+    :param path_prefix: prepended to the paths of the entries
+    :param prefix: if not None, replaces the a/ and b/ prefixes in the
+      header lines of each file, the hunks are passed on unchanged
+    :returns: generator of DiffEntry
+    """
+    header = None
+    hunks = []
+    for line in lines:
+        if line.startswith('diff --git '):
+            if header is not None:
+                yield _git_format_entry(header, hunks, path_prefix, prefix)
+            header = [line]
+            hunks = []
+        elif header is None:
+            continue
+        elif hunks or line.startswith('@@'):
+            hunks.append(line)
+        else:
+            header.append(line)
+    if header is not None:
+        yield _git_format_entry(header, hunks, path_prefix, prefix)
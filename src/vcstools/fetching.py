@@ -0,0 +1,202 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+process-wide record of fetches, to avoid fetching the same repository
+repeatedly.
+
+A single operation on a client may need to fetch several times, e.g.
+update() fetches and a following get_version() of an unknown revision
+fetches again. Each successful fetch is recorded per repository. A
+repository is not fetched again
+
+* within an operation scope (see scope()) that already fetched it.
+  Scopes belong to the thread or asyncio task that opened them, so
+  concurrent operations do not skip each other's fetches, or
+* while the last fetch is younger than the TTL, set via set_ttl() or the
+  environment variable VCSTOOLS_FETCH_TTL (seconds, default 0 meaning
+  no time-based skipping).
+
+Clients accept a force argument to fetch regardless.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import contextlib
+import logging
+import os
+import threading
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+from vcstools.profiling import clock
+
+
+# repository key -> clock() time of last successful fetch
+_LAST_FETCH = {}
+# one set of repository keys per open scope of any thread or task
+_SCOPES = []
+_LOCK = threading.Lock()
+
+# sets of _SCOPES open in the current thread or asyncio task, innermost last
+if contextvars is not None:
+    _open_scopes = contextvars.ContextVar('vcstools_fetch_scopes', default=())
+else:
+    _open_scopes = None
+    _local = threading.local()
+
+_ttl = None
+
+
+def get_ttl():
+    """
+    :returns: seconds a fetch is considered recent
+    """
+    if _ttl is not None:
+        return _ttl
+    value = os.environ.get('VCSTOOLS_FETCH_TTL')
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            logging.getLogger('vcstools').warn(
+                "Ignoring invalid VCSTOOLS_FETCH_TTL '%s'" % value)
+    return 0
+
+
+def set_ttl(seconds):
+    """
+    :param seconds: seconds a fetch is considered recent, None to use
+      VCSTOOLS_FETCH_TTL again
+    """
+    global _ttl
+    _ttl = seconds
+
+
+def get_open_scopes():
+    """
+    :returns: scopes open in the calling thread or asyncio task, to
+      pass on to worker threads with within()
+    """
+    if _open_scopes is not None:
+        return _open_scopes.get()
+    return getattr(_local, 'scopes', ())
+
+
+def _set_open_scopes(scopes):
+    if _open_scopes is not None:
+        _open_scopes.set(scopes)
+    else:
+        _local.scopes = scopes
+
+
+@contextlib.contextmanager
+def within(scopes):
+    """
+    context manager within which the current thread shares scopes,
+    for threads doing work of an operation running in another thread
+
+    :param scopes: value of get_open_scopes() in the calling thread
+    """
+    previous = get_open_scopes()
+    _set_open_scopes(scopes)
+    try:
+        yield
+    finally:
+        _set_open_scopes(previous)
+
+
+@contextlib.contextmanager
+def scope():
+    """
+    context manager within which each repository is fetched at most
+    once by the current thread or asyncio task. Scopes may be nested.
+    """
+    fetched_keys = set()
+    with _LOCK:
+        _SCOPES.append(fetched_keys)
+    try:
+        with within(get_open_scopes() + (fetched_keys,)):
+            yield
+    finally:
+        with _LOCK:
+            # by identity, scopes of other tasks may hold equal sets
+            for index, keys in enumerate(_SCOPES):
+                if keys is fetched_keys:
+                    del _SCOPES[index]
+                    break
+
+
+def needs_fetch(key):
+    """
+    :param key: identifies the repository, like its real path
+    :returns: False if the repository was fetched within a scope open
+      in the current thread or task, or within the TTL
+    """
+    scopes = get_open_scopes()
+    with _LOCK:
+        for fetched_keys in scopes:
+            if key in fetched_keys:
+                return False
+        last_fetch = _LAST_FETCH.get(key)
+    if last_fetch is None:
+        return True
+    return clock() - last_fetch >= get_ttl()
+
+
+def fetched(key):
+    """
+    records a successful fetch of the repository identified by key
+    """
+    scopes = get_open_scopes()
+    with _LOCK:
+        _LAST_FETCH[key] = clock()
+        for fetched_keys in scopes:
+            fetched_keys.add(key)
+
+
+def forget(key=None):
+    """
+    forgets recorded fetches of the repository identified by key, or
+    of all repositories if key is None
+    """
+    with _LOCK:
+        if key is None:
+            _LAST_FETCH.clear()
+        else:
+            _LAST_FETCH.pop(key, None)
+        for fetched_keys in _SCOPES:
+            if key is None:
+                fetched_keys.clear()
+            else:
+                fetched_keys.discard(key)
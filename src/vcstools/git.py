@@ -54,40 +54,114 @@ disambiguation, and in some cases warns.
 
 
 from __future__ import absolute_import, print_function, unicode_literals
+import contextlib
 import os
 import sys
 import shutil
 import tempfile
 import gzip
-import dateutil.parser  # For parsing date strings
 from distutils.version import LooseVersion
 import logging
 
 from vcstools.vcs_base import VcsClientBase, VcsError
-from vcstools.common import sanitized, normalized_rel_path, run_shell_command
+from vcstools.common import normalized_rel_path, run_command, CommandLines, map_parallel
+from vcstools import compression
+from vcstools import fetching
+from vcstools import git_export
+from vcstools import git_mirror
+from vcstools import log_cache
+from vcstools.diff_entry import DiffEntry, iter_git_format_diff
+from vcstools.log_entry import LogEntry, parse_raw_date
+from vcstools.status_entry import StatusEntry
+from vcstools.git_ancestry import GitAncestry
+from vcstools.git_cat_file import GitCatFile
+from vcstools.git_refs import GitRefsReader, UnsupportedRepository, parse_config_list
+from vcstools.git_snapshot import GitSnapshot, FOR_EACH_REF_FORMAT, \
+    get_branch_parent_candidates, parse_for_each_ref
+from vcstools.tool_versions import get_tool_version
 
 from vcstools.git_archive_all import *
 
 
+GIT_COMMIT_FIELDS = ['id', 'author', 'email', 'date', 'message']
+# to be used with --date=raw, dates are parsed lazily by LogEntry
+GIT_LOG_FORMAT = '%x1f'.join(['%H', '%an', '%ae', '%ad', '%s']) + '%x1e'
+# records for vcstools.log_cache, followed by the changed paths
+GIT_LOG_CACHE_FORMAT = '%x1e' + '%x1f'.join(['%H', '%an', '%ae', '%ad', '%s', '%P'])
+
+
 class GitError(Exception):
     pass
 
 
-def _git_diff_path_submodule_change(diff, rel_path_prefix):
+def _parse_git_log_record(record):
     """
-    Parses git diff result and changes the filename prefixes.
+    :returns: LogEntry with keys GIT_COMMIT_FIELDS for one record of
+      git log output produced with GIT_LOG_FORMAT
+    """
+    return LogEntry.from_values(record.strip().split("\x1f"), date_parser=parse_raw_date)
+
+
+def _iter_git_log(records):
+    """
+    parses git log output produced with GIT_LOG_FORMAT, split into
+    records at the \\x1e separators
+
+    :returns: iterator of LogEntry with keys GIT_COMMIT_FIELDS
+    """
+    for record in records:
+        if record.strip() != '':
+            yield _parse_git_log_record(record)
+
+
+def _parse_git_log(response_str):
+    """
+    parses git log output produced with GIT_LOG_FORMAT
+
+    :returns: list of LogEntry with keys GIT_COMMIT_FIELDS
+    """
+    return list(_iter_git_log(response_str.split("\x1e")))
+
+
+def _iter_git_log_cache_records(chunks, with_paths):
+    """
+    parses git log --name-only output produced with
+    GIT_LOG_CACHE_FORMAT, split into chunks at the \\x1e separators
+
+    :returns: iterator of vcstools.log_cache records, with the parent
+      SHAs in key 'parents'
+    """
+    for chunk in chunks:
+        if chunk.strip() == '':
+            continue
+        header, _, names = chunk.partition('\n')
+        fields = header.split('\x1f')
+        parents = fields[5].split()
+        paths = None
+        if with_paths:
+            paths = [name for name in names.split('\n') if name]
+            if any(name.startswith('"') for name in paths):
+                # quoted special characters, cannot match relpaths
+                paths = None
+        yield {'id': fields[0],
+               'fields': fields[:5],
+               'merge': len(parents) > 1,
+               'parents': parents,
+               'paths': paths}
+
+
+def _iter_git_diff_path_submodule_change(lines, rel_path_prefix):
+    """
+    Changes the filename prefixes in lines of git diff output, yields
+    the non-empty lines with line endings.
     """
-    if diff is None:
-        return None
     INIT = 0
     INDIFF = 1
     # small state machine makes sure we never touch anything inside
     # the actual diff
     state = INIT
-    result = ""
-    s_list = [line for line in diff.split(os.linesep)]
     subrel_path = rel_path_prefix
-    for line in s_list:
+    for line in lines:
         newline = line
         if line.startswith("Entering '"):
             state = INIT
@@ -109,18 +183,215 @@ def _git_diff_path_submodule_change(diff, rel_path_prefix):
                     newline = line.replace(" b/", " " + subrel_path + "/", 1)
                     newline = newline.replace(" a/", " " + subrel_path + "/", 1)
         if newline != '':
-            result += newline + '\n'
-    return result
+            yield newline + '\n'
+
+
+def _git_diff_path_submodule_change(diff, rel_path_prefix):
+    """
+    Parses git diff result and changes the filename prefixes.
+    """
+    if diff is None:
+        return None
+    return ''.join(_iter_git_diff_path_submodule_change(diff.split(os.linesep), rel_path_prefix))
+
+
+# mode of submodule entries in raw diff records
+_GITLINK_MODE = '160000'
+
+
+def _iter_git_diff_summary(records, path_prefix=''):
+    """
+    parses the records of git diff --raw --numstat -z, which lists the
+    raw records of all files before their numstat records.
+
+    :returns: generator of DiffEntry with counts and without lines
+    """
+    records = iter(records)
+    entries = []
+    counts = []
+    for record in records:
+        if record.startswith(':'):
+            fields = record.split(' ')
+            status = fields[4][0]
+            path = next(records)
+            orig_path = None
+            if status in 'RC':
+                orig_path, path = path, next(records)
+            entries.append((path, status, orig_path, fields[1] == _GITLINK_MODE))
+        elif record:
+            added, deleted, path = record.split('\t', 2)
+            if not path:
+                # source and destination of a rename follow
+                next(records)
+                next(records)
+            counts.append((None, None) if added == '-' else (int(added), int(deleted)))
+    for (path, status, orig_path, gitlink), (added, deleted) in zip(entries, counts):
+        if gitlink and status == 'M' and (added, deleted) == (0, 0):
+            # a dirty submodule at its recorded commit, the full diff
+            # replaces the "Subproject commit" line with a -dirty one
+            added, deleted = 1, 1
+        if orig_path is not None:
+            orig_path = path_prefix + orig_path
+        yield DiffEntry(path_prefix + path, status, orig_path, added, deleted)
+
+
+# C escapes git uses when quoting paths
+_GIT_QUOTE_ESCAPES = {'"': '\\"', '\\': '\\\\', '\a': '\\a', '\b': '\\b', '\t': '\\t',
+                      '\n': '\\n', '\v': '\\v', '\f': '\\f', '\r': '\\r'}
+
+
+def _quote_git_path(path, quote_path=True):
+    """
+    quotes path the way git status does in its short format.
+
+    :param quote_path: False if core.quotePath is off, keeping non-ASCII
+      characters verbatim
+    """
+    if not any(c in _GIT_QUOTE_ESCAPES or c == ' ' or c < ' ' or c == '\x7f' or
+               (quote_path and c > '\x7f') for c in path):
+        return path
+    result = []
+    for c in path:
+        if c in _GIT_QUOTE_ESCAPES:
+            result.append(_GIT_QUOTE_ESCAPES[c])
+        elif c < ' ' or c == '\x7f' or (quote_path and c > '\x7f'):
+            result.extend('\\%03o' % b for b in bytearray(c.encode('utf-8')))
+        else:
+            result.append(c)
+    return '"%s"' % ''.join(result)
+
+
+def _parse_git_status(output):
+    """
+    parses the output of git status --porcelain=v2 -z, or of
+    git status --porcelain -z for git without v2.
+
+    :returns: generator of StatusEntry with paths relative to the
+      repository root
+    """
+    fields = iter(output.split('\0'))
+    for field in fields:
+        if not field:
+            continue
+        kind = field[0]
+        if kind == '#':
+            continue
+        if kind in '?!' and field[1] == ' ':
+            yield StatusEntry(field[2:], kind, kind)
+        elif kind in '12u' and field[1] == ' ':
+            # v2: <kind> <XY> <sub> ... <path>, followed by the source for renames
+            parts = field.split(' ', {'1': 8, '2': 9, 'u': 10}[kind])
+            index, worktree = [' ' if c == '.' else c for c in parts[1]]
+            submodule = parts[2] if parts[2].startswith('S') else None
+            orig_path = next(fields) if kind == '2' else None
+            yield StatusEntry(parts[-1], index, worktree, submodule, orig_path)
+        else:
+            # v1: <XY> <path>, followed by the source for renames and copies
+            index, worktree = field[0], field[1]
+            orig_path = next(fields) if index in 'RC' else None
+            yield StatusEntry(field[3:], index, worktree, None, orig_path)
+
+
+def _format_git_status(entries, rel_path, quote_path=True, porcelain=False):
+    """
+    formats StatusEntry records like git status --short, or like
+    git status --porcelain, prepending rel_path to the paths.
+    """
+    lines = []
+    for entry in entries:
+        path = _quote_git_path(entry.path, quote_path)
+        if entry.orig_path is not None:
+            path = '%s -> %s' % (_quote_git_path(entry.orig_path, quote_path), path)
+        worktree = entry.worktree
+        if not porcelain and worktree == 'M' and entry.submodule is not None and entry.submodule[1] != 'C':
+            # --short marks submodules with only modified or untracked content
+            if entry.submodule[2] == 'M':
+                worktree = 'm'
+            elif entry.submodule[3] == 'U':
+                worktree = '?'
+        lines.append('%s%s %s/%s\n' % (entry.index, worktree, rel_path, path))
+    return ''.join(lines)
+
+
+def _is_git_config_true(value, default=True):
+    value = value.strip().lower()
+    if not value:
+        return default
+    return value not in ('false', 'no', 'off', '0')
+
+
+def _get_default_submodule_jobs():
+    try:
+        import multiprocessing
+        return min(8, multiprocessing.cpu_count())
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def _parse_gitlinks(output):
+    """
+    :param output: output of git ls-files -s -z
+    :returns: paths of the submodules (mode 160000 entries) of the
+      index, in index order
+    """
+    paths = []
+    for record in output.split('\0'):
+        if record.startswith('160000 '):
+            path = record.split('\t', 1)[1]
+            # unmerged gitlinks have an entry per stage
+            if not paths or paths[-1] != path:
+                paths.append(path)
+    return paths
 
 
 def _get_git_version():
+    """Looks up git version, calling git --version once per git binary.
+
+    :raises: VcsError if git is not installed or returns
+    something unexpected"""
+    return get_tool_version('git', _probe_git_version)
+
+
+# git features GitClient depends on, with the version check enabling them
+GIT_FEATURES = [
+    ('reset_keep', lambda version: version >= LooseVersion('1.7.1')),
+    ('submodules', lambda version: version > LooseVersion('1.7')),
+    ('no_single_branch', lambda version: version >= LooseVersion('1.7.10')),
+    # git fetch --tags also fetches the configured refspecs
+    ('fetch_tags_with_heads', lambda version: version >= LooseVersion('1.9')),
+    ('merge_base_is_ancestor', lambda version: version >= LooseVersion('1.8.0')),
+    ('for_each_ref_contains', lambda version: version >= LooseVersion('2.7.0')),
+    ('submodule_update_jobs', lambda version: version >= LooseVersion('2.9.0')),
+    ('status_porcelain_v2', lambda version: version >= LooseVersion('2.11.0')),
+    # partial clones with blob:none and tree:0 filters
+    ('clone_filter', lambda version: version >= LooseVersion('2.20.0')),
+    ('clone_dissociate', lambda version: version >= LooseVersion('2.3.0')),
+]
+
+# git version string -> dict of feature -> bool
+_GIT_CAPABILITIES = {}
+
+
+def _get_git_capabilities(gitversion):
+    """
+    :returns: dict telling for each name in GIT_FEATURES whether git
+      gitversion supports it, computed once per version
+    """
+    capabilities = _GIT_CAPABILITIES.get(gitversion)
+    if capabilities is None:
+        version = LooseVersion(gitversion)
+        capabilities = dict((name, check(version)) for name, check in GIT_FEATURES)
+        _GIT_CAPABILITIES[gitversion] = capabilities
+    return capabilities
+
+
+def _probe_git_version():
     """Looks up git version by calling git --version.
 
     :raises: VcsError if git is not installed or returns
     something unexpected"""
     try:
-        cmd = 'git --version'
-        value, version, _ = run_shell_command(cmd, shell=True)
+        value, version, _ = run_command(['git', '--version'])
         if value != 0:
             raise VcsError("git --version returned %s, maybe git is not installed" % (value))
         prefix = 'git version '
@@ -134,21 +405,39 @@ def _get_git_version():
 
 
 class GitClient(VcsClientBase):
-    def __init__(self, path):
+    def __init__(self, path, use_cat_file=False):
         """
+        :param use_cat_file: if True, revisions are resolved through a
+          git cat-file process kept running until close() is called,
+          instead of starting git for every lookup
         :raises: VcsError if git not detected
         """
         VcsClientBase.__init__(self, 'git', path)
         self.gitversion = _get_git_version()
+        self._capabilities = _get_git_capabilities(self.gitversion)
+        # answers read-only queries on refs and config without running git
+        self._refs = GitRefsReader(path)
+        self._ancestry = GitAncestry(path, self._capabilities)
+        self._cat_file = None
+        if use_cat_file:
+            self._cat_file = GitCatFile(path)
+
+    def close(self):
+        """
+        terminates helper processes kept running by this client, if
+        any. The client remains usable.
+        """
+        if self._cat_file is not None:
+            self._cat_file.close()
 
     @staticmethod
     def get_environment_metadata():
         metadict = {}
         try:
             version = _get_git_version()
-            resetkeep = LooseVersion(version) >= LooseVersion('1.7.1')
-            submodules = LooseVersion(version) > LooseVersion('1.7')
-            metadict["features"] = "'reset --keep': %s, submodules: %s" % (resetkeep, submodules)
+            capabilities = _get_git_capabilities(version)
+            metadict["features"] = "'reset --keep': %s, submodules: %s" % (
+                capabilities['reset_keep'], capabilities['submodules'])
         except VcsError:
             version = "No git installed"
         metadict["version"] = version
@@ -159,9 +448,7 @@ class GitClient(VcsClientBase):
         :returns: git URL of the directory path (output of git info command), or None if it cannot be determined
         """
         if self.detect_presence():
-            cmd = "git config --get remote.%s.url" % self._get_default_remote()
-            _, output, _ = run_shell_command(cmd, shell=True, cwd=self._path)
-            return output.rstrip()
+            return self._get_config_values(['remote.%s.url' % self._get_default_remote()])[0]
         return None
 
     def _get_default_remote(self):
@@ -179,27 +466,28 @@ class GitClient(VcsClientBase):
         # See: https://github.com/vcstools/vcstools/pull/10
         return os.path.exists(os.path.join(path, '.git'))
 
-    def checkout(self, url, version=None, verbose=False, shallow=False, timeout=None):
-        """calls git clone and then, if version was given, update(version)"""
+    def checkout(self, url, version=None, verbose=False, shallow=False, timeout=None,
+                 clone_filter=None, single_branch=False):
+        """
+        calls git clone and then, if version was given, update(version)
+
+        :param clone_filter: partial clone filter like 'blob:none' or
+          'tree:0'. git fetches the objects left out when they are
+          needed, see also export_repository.
+        :param single_branch: if True and version is a branch or tag
+          of the remote, clone only that. Other versions are fetched
+          when update or get_version ask for them.
+        """
         if url is None or url.strip() == '':
             raise ValueError('Invalid empty url : "%s"' % url)
 
-        # since we cannot know whether version names a branch, clone master initially
-        cmd = 'git clone'
-        if shallow:
-            cmd += ' --depth 1'
-            if LooseVersion(self.gitversion) >= LooseVersion('1.7.10'):
-                cmd += ' --no-single-branch'
-        if version is None:
-            # quicker than using _do_update, but undesired when switching branches next
-            cmd += ' --recursive'
-        cmd += ' %s %s' % (url, self._path)
-        value, _, msg = run_shell_command(cmd,
-                                          shell=True,
-                                          no_filter=True,
-                                          show_stdout=verbose,
-                                          timeout=timeout,
-                                          verbose=verbose)
+        with self._get_clone_reference(url, shallow, clone_filter, timeout) as reference:
+            cmd = self._get_clone_command(url, version, shallow, clone_filter, single_branch, reference)
+            value, _, msg = run_command(cmd,
+                                        no_filter=True,
+                                        show_stdout=verbose,
+                                        timeout=timeout,
+                                        verbose=verbose)
         if value != 0:
             if msg:
                 self.logger.error('%s' % msg)
@@ -219,17 +507,119 @@ class GitClient(VcsClientBase):
         except GitError:
             return False
 
+    @contextlib.contextmanager
+    def _get_clone_reference(self, url, shallow, clone_filter, timeout=None):
+        """
+        context manager yielding the path of the mirror of url to clone
+        with, or None, see vcstools.git_mirror
+        """
+        if shallow or clone_filter or not self._capabilities['clone_dissociate']:
+            # shallow and partial clones download little anyway
+            yield None
+        else:
+            with git_mirror.reference(url, timeout=timeout) as reference:
+                yield reference
+
+    def _get_clone_command(self, url, version, shallow, clone_filter=None, single_branch=False,
+                           reference=None):
+        # since we cannot know whether version names a branch, clone master initially
+        cmd = ['git', 'clone']
+        if reference is not None:
+            # dissociating copies the objects, so the mirror may be evicted later
+            cmd += ['--reference', reference, '--dissociate']
+        refname = None
+        if single_branch and version:
+            refname = self._get_remote_refname(url, version)
+        if clone_filter:
+            if self._capabilities['clone_filter']:
+                cmd.append('--filter=%s' % clone_filter)
+            else:
+                self.logger.warn("git %s cannot clone with filter %s, cloning all objects" %
+                                 (self.gitversion, clone_filter))
+        if shallow:
+            cmd += ['--depth', '1']
+            if refname is None and self._capabilities['no_single_branch']:
+                cmd.append('--no-single-branch')
+        if refname is not None:
+            cmd += ['--single-branch', '--branch', version]
+        if version is None:
+            # quicker than using _do_update, but undesired when switching branches next
+            cmd.append('--recursive')
+        cmd += [url, self._path]
+        return cmd
+
+    def _get_remote_refname(self, remote, version):
+        """
+        :param remote: url or name of a remote
+        :returns: refs/heads/version or refs/tags/version if the remote
+          has such a branch or tag, else None
+        """
+        _, output, _ = run_command(['git', 'ls-remote', '--heads', '--tags', remote, version],
+                                   cwd=self._path if self.path_exists() else None, no_warn=True)
+        refnames = [line.split('\t', 1)[1] for line in output.splitlines() if '\t' in line]
+        for refname in ['refs/heads/%s' % version, 'refs/tags/%s' % version]:
+            if refname in refnames:
+                return refname
+        return None
+
+    def _get_clone_options(self):
+        """
+        :returns: (clone_filter, single_branch) as the repository was
+          cloned, clone_filter None for complete clones, single_branch
+          True unless all branches of the default remote are fetched
+        """
+        remote = self._get_default_remote()
+        clone_filter, refspec = self._get_config_values(
+            ['remote.%s.partialclonefilter' % remote, 'remote.%s.fetch' % remote])
+        return (clone_filter.strip() or None, refspec.strip() != '' and '*' not in refspec)
+
+    def _fetch_missing_version(self, version):
+        """
+        in single-branch clones, fetches version from the default
+        remote unless it is known locally. Branches are added to the
+        branches fetched from then on.
+
+        :returns: False if version is still unknown
+        """
+        if self._has_version(version):
+            return True
+        remote = self._get_default_remote()
+        refname = self._get_remote_refname(remote, version)
+        if refname is None:
+            # a SHA-ID, which servers may refuse unless reachable from a ref
+            refspec = version
+        elif refname.startswith('refs/heads/'):
+            run_command(['git', 'remote', 'set-branches', '--add', remote, version], cwd=self._path)
+            refspec = '+%s:refs/remotes/%s/%s' % (refname, remote, version)
+        else:
+            refspec = '+%s:%s' % (refname, refname)
+        cmd = ['git', 'fetch', remote, refspec]
+        if os.path.exists(os.path.join(self._path, '.git', 'shallow')):
+            cmd[2:2] = ['--depth', '1']
+        run_command(cmd, cwd=self._path, no_warn=True)
+        self._ancestry.clear()
+        return self._has_version(version)
+
+    def _has_version(self, version):
+        snapshot = self.snapshot()
+        if snapshot is not None and (snapshot.resolve(version) or snapshot.is_remote_branch(version)):
+            return True
+        value, _, _ = run_command(['git', 'rev-parse', '--verify', '--quiet', '%s^{commit}' % version],
+                                  cwd=self._path, no_warn=True)
+        return value == 0
+
     def _update_submodules(self, verbose=False, timeout=None):
 
         # update submodules ( and init if necessary ).
-        if LooseVersion(self.gitversion) > LooseVersion('1.7'):
-            cmd = "git submodule update --init --recursive"
-            value, _, _ = run_shell_command(cmd,
-                                            shell=True,
-                                            cwd=self._path,
-                                            show_stdout=True,
-                                            timeout=timeout,
-                                            verbose=verbose)
+        if self._capabilities['submodules']:
+            cmd = ['git', 'submodule', 'update', '--init', '--recursive']
+            if self._capabilities['submodule_update_jobs']:
+                cmd.append('--jobs=%s' % self._get_submodule_jobs())
+            value, _, _ = run_command(cmd,
+                                      cwd=self._path,
+                                      show_stdout=True,
+                                      timeout=timeout,
+                                      verbose=verbose)
             if value != 0:
                 return False
         return True
@@ -246,15 +636,20 @@ class GitClient(VcsClientBase):
         branch. Else go untracked on tag or whatever version is. Does
         not leave if current commit would become dangling.
 
+        :param force_fetch: if True, fetches even when the repository
+          was fetched recently, see vcstools.fetching
         :return: True if already up-to-date with remote or after successful fast_foward
         """
         if not self.detect_presence():
             return False
 
         try:
-            # fetch in any case to get updated tags even if we don't need them
-            self._do_fetch()
-            return self._do_update(refname=version, verbose=verbose, timeout=timeout)
+            with fetching.scope():
+                # fetch in any case to get updated tags even if we don't need them
+                self._do_fetch(force=force_fetch)
+                if version is not None and self._get_clone_options()[1]:
+                    self._fetch_missing_version(version)
+                return self._do_update(refname=version, verbose=verbose, timeout=timeout)
         except GitError:
             return False
 
@@ -271,14 +666,16 @@ class GitClient(VcsClientBase):
         :param fast_foward: if false, does not perform fast-forward
         :param update_submodules: if false, does not attempt to update submodules
         '''
+        # one consistent view of the refs for all decisions before checkout
+        snapshot = self.snapshot()
         # are we on any branch?
-        current_branch = self._get_branch()
+        current_branch = snapshot.branch if snapshot else None
         branch_parent = None
         if current_branch:
             # local branch might be named differently from remote by user, we respect that
             same_branch = (refname == current_branch)
             if not same_branch:
-                (branch_parent, remote) = self._get_branch_parent(current_branch=current_branch)
+                (branch_parent, remote) = snapshot.upstream
                 if not refname:
                     # ! changing refname to cause fast-forward
                     refname = branch_parent
@@ -300,7 +697,7 @@ class GitClient(VcsClientBase):
         if same_branch:
             if fast_foward:
                 if not branch_parent and current_branch:
-                    (branch_parent, remote) = self._get_branch_parent(current_branch=current_branch)
+                    (branch_parent, remote) = snapshot.upstream
                     if remote != default_remote:
                         # if remote is not origin, must not fast-forward (because based on origin)
                         logger = logging.getLogger('vcstools')
@@ -312,32 +709,33 @@ class GitClient(VcsClientBase):
                 if branch_parent:
                     if not self._do_fast_forward(branch_parent=branch_parent,
                                                  fetch=False,
-                                                 verbose=verbose):
+                                                 verbose=verbose,
+                                                 snapshot=snapshot):
                         return False
         else:
             # refname can be a different branch or something else than a branch
 
-            refname_is_local_branch = self._is_local_branch(refname)
+            refname_is_local_branch = snapshot.is_local_branch(refname)
             if refname_is_local_branch:
                 # might also be remote branch, but we treat it as local
                 refname_is_remote_branch = False
             else:
-                refname_is_remote_branch = self._is_remote_branch(refname, fetch=False)
+                refname_is_remote_branch = snapshot.is_remote_branch(refname)
             refname_is_branch = refname_is_remote_branch or refname_is_local_branch
 
             current_version = None
             # shortcut if version is the same as requested
             if not refname_is_branch:
-                current_version = self.get_version()
+                current_version = snapshot.head
                 if current_version == refname:
                     return (not update_submodules) or self._update_submodules(verbose=verbose,
                                                                               timeout=timeout)
 
             if current_branch is None:
                 if not current_version:
-                    current_version = self.get_version()
+                    current_version = snapshot.head
                 # prevent commit from becoming dangling
-                if self._is_commit_in_orphaned_subtree(current_version, fetch=False):
+                if self._is_commit_in_orphaned_subtree(current_version, fetch=False, snapshot=snapshot):
                     # commit becomes dangling unless we move to one of its descendants
                     if not self._rev_list_contains(refname, current_version, fetch=False):
                         # TODO: should raise error instead of printing message
@@ -366,28 +764,17 @@ class GitClient(VcsClientBase):
     def get_current_version_label(self):
         """
         For git we change the label to clarify when a different remote
-        is configured.
+        is configured, see GitSnapshot.get_current_version_label.
         """
-        branch = self._get_branch()
-        if branch is None:
+        snapshot = self.snapshot()
+        if snapshot is None:
             return '<detached>'
-        result = branch
-        (remote_branch, remote) = self._get_branch_parent()
-        if remote_branch is not None:
-            default_remote = self._get_default_remote()
-            # if not following 'origin/branch', display 'branch < tracked ref'
-            if (remote_branch != branch or remote != default_remote):
-                result += ' < '
-                if remote != default_remote:
-                    result += remote + '/'
-                result += remote_branch
-        return result
+        return snapshot.get_current_version_label()
 
     def get_default_remote_version_label(self):
         if self.detect_presence():
-            _, output, _ = run_shell_command('git remote show %s' % self._get_default_remote(),
-                                             shell=True,
-                                             cwd=self._path)
+            _, output, _ = run_command(['git', 'remote', 'show', self._get_default_remote()],
+                                       cwd=self._path)
             for line in output.splitlines():
                 elems = line.split()
                 if elems[0:2] == ['HEAD', 'branch:']:
@@ -395,10 +782,16 @@ class GitClient(VcsClientBase):
         return None
 
     def get_remote_version(self, fetch=False):
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return None
+        if fetch and snapshot.branch is not None and self._get_merge_config(snapshot.branch) is not None:
+            self._do_fetch()
+            snapshot = self.snapshot()
         # try tracked branch on origin (returns None if on other remote)
-        (parent_branch, remote) = self._get_branch_parent(fetch=fetch)
+        (parent_branch, remote) = snapshot.upstream
         if parent_branch is not None:
-            return self.get_version(spec=remote+'/'+parent_branch)
+            return snapshot.resolve('refs/remotes/%s/%s' % (remote, parent_branch))
 
     def get_version(self, spec=None):
         """
@@ -410,12 +803,16 @@ class GitClient(VcsClientBase):
           provided, the SHA-ID of a commit specified by some token if found, else None
         """
         if self.detect_presence():
-            command = "git log -1"
-            if spec is not None:
-                command += " %s" % sanitized(spec)
-            command += " --format='%H'"
-            _, output, _ = run_shell_command(command, shell=True,
-                                             no_warn=True, cwd=self._path)
+            if self._cat_file is not None:
+                try:
+                    version = self._cat_file.resolve(spec or 'HEAD')
+                except VcsError:
+                    version = None
+                if version is not None:
+                    return version
+                # fall back to git log, which also fetches if necessary
+            command = self._get_version_command(spec)
+            _, output, _ = run_command(command, no_warn=True, cwd=self._path)
             if output.strip() != '':
                 # On Windows the version can have single quotes around it
                 version = output.strip().strip("'")
@@ -427,9 +824,10 @@ class GitClient(VcsClientBase):
                 self._do_fetch()
             except GitError:
                 return None
+            if self._get_clone_options()[1]:
+                self._fetch_missing_version(spec)
             # we repeat the call once again after fetching
-            _, output, _ = run_shell_command(command, shell=True,
-                                             no_warn=True, cwd=self._path)
+            _, output, _ = run_command(command, no_warn=True, cwd=self._path)
             if output.strip() == '':
                 # even if after fetching, not found specified version
                 return None
@@ -437,29 +835,124 @@ class GitClient(VcsClientBase):
             return version
         return None
 
+    def _get_version_command(self, spec):
+        command = ['git', 'log', '-1']
+        if spec:
+            command.append(spec)
+        command.append('--format=%H')
+        return command
+
     def get_diff(self, basepath=None):
         response = ''
         if basepath is None:
             basepath = self._path
         if self.path_exists():
             rel_path = normalized_rel_path(self._path, basepath)
-            # git needs special treatment as it only works from inside
-            # use HEAD to also show staged changes. Maybe should be option?
-            # injection should be impossible using relpath, but to be sure, we check
-            cmd = "git diff HEAD --src-prefix=%s/ --dst-prefix=%s/ ." % \
-                  (sanitized(rel_path), sanitized(rel_path))
-            _, response, _ = run_shell_command(cmd, shell=True, cwd=self._path)
-            if LooseVersion(self.gitversion) > LooseVersion('1.7'):
-                cmd = 'git submodule foreach --recursive git diff HEAD'
-                _, output, _ = run_shell_command(cmd, shell=True, cwd=self._path)
-                response += _git_diff_path_submodule_change(output, rel_path)
+            with CommandLines(self._get_diff_command(rel_path), cwd=self._path) as lines:
+                response = '\n'.join(lines).rstrip()
+
+            def get_submodule_diff(subpath):
+                _, output, _ = run_command(['git', 'diff', 'HEAD'], cwd=os.path.join(self._path, subpath))
+                return ''.join(_iter_git_diff_path_submodule_change(output.split('\n'),
+                                                                    os.path.join(rel_path, subpath)))
+            response += ''.join(self._map_submodules(get_submodule_diff))
         return response
 
+    def iter_diff(self, rev_a=None, rev_b=None, stat_only=False, basepath=None):
+        """
+        Without revisions, the diffs of the submodules follow those of
+        the repository. With revisions, submodules show as changed
+        commit ids of the repository only.
+        """
+        if not self.path_exists():
+            return
+        if basepath is None:
+            basepath = self._path
+        rel_path = normalized_rel_path(self._path, basepath)
+        subpaths = ['']
+        if rev_a is None and rev_b is None:
+            subpaths += self._get_submodule_paths()
+        for subpath in subpaths:
+            path_prefix = subpath.replace(os.sep, '/') + '/' if subpath else ''
+            cwd = os.path.join(self._path, subpath)
+            if stat_only:
+                command = ['git', 'diff', '--no-ext-diff', '--raw', '--numstat', '-z'] + \
+                    self._get_diff_revisions(rev_a, rev_b)
+                with CommandLines(command, cwd=cwd, separator='\0') as records:
+                    for entry in _iter_git_diff_summary(records, path_prefix):
+                        yield entry
+            else:
+                command = ['git', '-c', 'core.quotepath=off', 'diff', '--no-ext-diff',
+                           '--src-prefix=a/', '--dst-prefix=b/'] + self._get_diff_revisions(rev_a, rev_b)
+                prefix = os.path.join(rel_path, subpath) + '/' if subpath else rel_path + '/'
+                with CommandLines(command, cwd=cwd) as lines:
+                    for entry in iter_git_format_diff(lines, path_prefix, prefix):
+                        yield entry
+
+    def _get_diff_revisions(self, rev_a, rev_b):
+        revisions = [rev_a or 'HEAD']
+        if rev_b is not None:
+            revisions.append(rev_b)
+        return revisions + ['--']
+
+    def _get_diff_command(self, rel_path):
+        # git needs special treatment as it only works from inside
+        # use HEAD to also show staged changes. Maybe should be option?
+        return ['git', 'diff', 'HEAD',
+                '--src-prefix=%s/' % rel_path,
+                '--dst-prefix=%s/' % rel_path,
+                '.']
+
+    def _get_submodule_paths(self):
+        """
+        :returns: list of the paths of all checked out submodules,
+          recursively, relative to the repository, in the order git
+          submodule foreach --recursive visits them
+        """
+        if not self._capabilities['submodules']:
+            return []
+        jobs = self._get_submodule_jobs()
+
+        def list_submodules(subpath):
+            # the gitlinks of the index, one git call per repository
+            # instead of one shell per submodule as foreach runs
+            cwd = os.path.join(self._path, subpath)
+            _, output, _ = run_command(['git', 'ls-files', '-s', '-z'], cwd=cwd)
+            children = [os.path.normpath(os.path.join(subpath, path)) for path in _parse_gitlinks(output)
+                        if os.path.exists(os.path.join(cwd, path, '.git'))]
+            nested = map_parallel(list_submodules, children, jobs)
+            return [path for child, paths in zip(children, nested) for path in [child] + paths]
+        return list_submodules('')
+
+    def _get_submodule_jobs(self):
+        """
+        :returns: number of submodules to process in parallel, configured
+          by submodule.fetchJobs, else a default based on the number of CPUs
+        """
+        value = self._get_config_values(['submodule.fetchJobs'])[0]
+        try:
+            jobs = int(value)
+        except ValueError:
+            jobs = 0
+        if jobs > 0:
+            return jobs
+        return _get_default_submodule_jobs()
+
+    def _map_submodules(self, function):
+        """
+        calls function for the path of each submodule in parallel
+
+        :returns: list of results, in the order of _get_submodule_paths
+        """
+        paths = self._get_submodule_paths()
+        if not paths:
+            return []
+        return map_parallel(function, paths, self._get_submodule_jobs())
+
     def get_affected_files(self, revision):
         # Making changes for windows support
-        cmd = "git show {0} --pretty=format: --name-only".format(
-            revision)
-        code, output, _ = run_shell_command(cmd, shell=True, cwd=self._path)
+        cmd = ['git', 'show', revision, '--pretty=format:', '--name-only']
+        code, output, _ = run_command(cmd, cwd=self._path)
         affected = []
         if code == 0:
             for filename in output.splitlines():
@@ -474,66 +967,139 @@ class GitClient(VcsClientBase):
             relpath = ''
 
         if self.path_exists() and os.path.exists(os.path.join(self._path, relpath)):
+            cached = log_cache.get_log(self, relpath, limit)
+            if cached is not None:
+                return cached
             # Get the log
-            limit_cmd = (("-n %d" % (int(limit))) if limit else "")
-
-            GIT_COMMIT_FIELDS = ['id', 'author', 'email', 'date', 'message']
-            GIT_LOG_FORMAT = '%x1f'.join(['%H', '%an', '%ae', '%ad', '%s']) + '%x1e'
-
-            command = "git --work-tree=%s log --format=\"%s\" %s %s " % (self._path, GIT_LOG_FORMAT,
-                                                                         limit_cmd, sanitized(relpath))
-            return_code, response_str, stderr = run_shell_command(command, shell=True, cwd=self._path)
+            command = self._get_log_command(relpath, limit)
+            with CommandLines(command, cwd=self._path, separator='\x1e') as records:
+                response = list(_iter_git_log(records))
+            if records.returncode != 0:
+                response = []
 
-            if return_code == 0:
-                # Parse response
-                response = response_str.strip('\n\x1e').split("\x1e")
-                response = [row.strip().split("\x1f") for row in response]
-                response = [dict(zip(GIT_COMMIT_FIELDS, row)) for row in response]
+        return response
 
-                # Parse dates
-                for entry in response:
-                    entry['date'] = dateutil.parser.parse(entry['date'])
+    def _get_log_cache_key(self):
+        return 'git:%s' % os.path.realpath(self._path)
 
-        return response
+    def _get_log_cache_head(self):
+        try:
+            resolved = self._refs.resolve_ref('HEAD')
+            if resolved is not None and resolved[1] is not None:
+                return resolved[1]
+        except UnsupportedRepository:
+            pass
+        return self.get_version()
+
+    def _get_log_cache_records(self, head, since=None):
+        """
+        :returns: log records of head, down to but excluding since if
+          given. None if since is not an ancestor of head, or head was
+          not reached from since by single-parent commits only, as log
+          order is then not preserved.
+        """
+        spec = head
+        if since is not None:
+            if not self._ancestry.is_ancestor(since, head):
+                return None
+            spec = '%s..%s' % (since, head)
+        # changed paths are relative to the top level, not self._path
+        with_paths = os.path.exists(os.path.join(self._path, '.git'))
+        command = ['git', '-c', 'core.quotepath=off', 'log',
+                   '--format=%s' % GIT_LOG_CACHE_FORMAT, '--date=raw',
+                   '--name-only', '--no-renames', spec]
+        with CommandLines(command, cwd=self._path, separator='\x1e') as chunks:
+            records = list(_iter_git_log_cache_records(chunks, with_paths))
+        if chunks.returncode != 0:
+            return None
+        if since is not None:
+            expected_ids = [record['id'] for record in records[1:]] + [since]
+            for record, expected_id in zip(records, expected_ids):
+                if record['parents'] != [expected_id]:
+                    return None
+        for record in records:
+            del record['parents']
+        return records
+
+    def _log_cache_entry(self, fields):
+        return _parse_git_log_record('\x1f'.join(fields))
+
+    def iter_log(self, relpath=None, limit=None):
+        """
+        like get_log, but yields the log entries while git log is
+        still running, so very long histories need not be held in
+        memory. Yields nothing if git log fails.
+        """
+        if relpath is None:
+            relpath = ''
+        if self.path_exists() and os.path.exists(os.path.join(self._path, relpath)):
+            command = self._get_log_command(relpath, limit)
+            with CommandLines(command, cwd=self._path, separator='\x1e') as records:
+                for entry in _iter_git_log(records):
+                    yield entry
+
+    def _get_log_command(self, relpath, limit):
+        limit_cmd = (['-n', '%d' % (int(limit))] if limit else [])
+        command = ['git', '--work-tree=%s' % self._path, 'log',
+                   '--format=%s' % GIT_LOG_FORMAT, '--date=raw'] + limit_cmd
+        if relpath:
+            command.append(relpath)
+        return command
 
     def get_status(self, basepath=None, untracked=False, porcelain=False):
-        status_flag = '--porcelain' if porcelain else '-s'
+        """
+        formats the records of iter_status like git status --short,
+        or like git status --porcelain if porcelain is True. Paths of
+        submodules are printed relative to the submodule, as
+        git submodule foreach git status would.
+        """
         response = None
         if basepath is None:
             basepath = self._path
         if self.path_exists():
             rel_path = normalized_rel_path(self._path, basepath)
-            # git command only works inside repo
-            # self._path is safe against command injection, as long as we check path.exists
-            command = "git status {0} ".format(status_flag)
-            if not untracked:
-                command += " -uno"
-            _, response, _ = run_shell_command(command,
-                                               shell=True,
-                                               cwd=self._path)
-            response_processed = ""
-            for line in response.split('\n'):
-                if len(line.strip()) > 0:
-                    # prepend relative path
-                    response_processed += '%s%s/%s\n' % (line[0:3],
-                                                         rel_path,
-                                                         line[3:])
-            if LooseVersion(self.gitversion) > LooseVersion('1.7'):
-                if not untracked:
-                    status_flag += " -uno"
-                command = "git submodule foreach --recursive 'git status {0}'".format(status_flag)
-                _, response2, _ = run_shell_command(command,
-                                                    shell=True,
-                                                    cwd=self._path)
-                for line in response2.split('\n'):
-                    if line.startswith("Entering"):
-                        continue
-                    if len(line.strip()) > 0:
-                        # prepend relative path
-                        response_processed += line[0:3] + rel_path + '/' + line[3:] + '\n'
-            response = response_processed
+            quote_path = self._get_status_quote_path()
+            response = ''.join(_format_git_status(entries, rel_path, quote_path, porcelain)
+                               for _, entries in self._get_status_entries(untracked))
         return response
 
+    def iter_status(self, untracked=False):
+        if not self.path_exists():
+            return
+        for subpath, entries in self._get_status_entries(untracked):
+            prefix = subpath.replace(os.sep, '/') + '/' if subpath else ''
+            for entry in entries:
+                if prefix:
+                    entry = entry._replace(
+                        path=prefix + entry.path,
+                        orig_path=None if entry.orig_path is None else prefix + entry.orig_path)
+                yield entry
+
+    def _get_status_entries(self, untracked):
+        """
+        :returns: list of (subpath, entries) for the repository (subpath
+          '') and each of its submodules, entries being the list of
+          StatusEntry relative to that repository
+        """
+        command = self._get_status_command(untracked)
+
+        def get_entries(subpath):
+            _, output, _ = run_command(command, cwd=os.path.join(self._path, subpath))
+            return (subpath, list(_parse_git_status(output)))
+        return [get_entries('')] + self._map_submodules(get_entries)
+
+    def _get_status_command(self, untracked):
+        if self._capabilities['status_porcelain_v2']:
+            command = ['git', 'status', '--porcelain=v2', '-z']
+        else:
+            command = ['git', 'status', '--porcelain', '-z']
+        if not untracked:
+            command.append('-uno')
+        return command
+
+    def _get_status_quote_path(self):
+        return _is_git_config_true(self._get_config_values(['core.quotepath'])[0])
+
     def _is_remote_branch(self, branch_name, remote_name=None, fetch=True):
         """
         checks list of remote branches for match. Set fetch to False if you just fetched already.
@@ -547,9 +1113,11 @@ class GitClient(VcsClientBase):
         if self.path_exists():
             if fetch:
                 self._do_fetch()
-            _, output, _ = run_shell_command('git branch -r',
-                                             shell=True,
-                                             cwd=self._path)
+            try:
+                return self._refs.ref_exists('refs/remotes/%s/%s' % (remote_name, branch_name))
+            except UnsupportedRepository:
+                pass
+            _, output, _ = run_command(['git', 'branch', '-r'], cwd=self._path)
             for l in output.splitlines():
                 elem = l.split()[0]
                 rem_name = elem[:elem.find('/')]
@@ -560,9 +1128,11 @@ class GitClient(VcsClientBase):
 
     def _is_local_branch(self, branch_name):
         if self.path_exists():
-            _, output, _ = run_shell_command('git branch',
-                                             shell=True,
-                                             cwd=self._path)
+            try:
+                return self._refs.ref_exists('refs/heads/%s' % branch_name)
+            except UnsupportedRepository:
+                pass
+            _, output, _ = run_command(['git', 'branch'], cwd=self._path)
             for line in output.splitlines():
                 elems = line.split()
                 if len(elems) == 1:
@@ -575,9 +1145,11 @@ class GitClient(VcsClientBase):
 
     def _get_branch(self):
         if self.path_exists():
-            _, output, _ = run_shell_command('git branch',
-                                             shell=True,
-                                             cwd=self._path)
+            try:
+                return self._refs.get_head_branch()
+            except UnsupportedRepository:
+                pass
+            _, output, _ = run_command(['git', 'branch'], cwd=self._path)
             for line in output.splitlines():
                 elems = line.split()
                 if len(elems) == 2 and elems[0] == '*':
@@ -598,52 +1170,86 @@ class GitClient(VcsClientBase):
         if branchname is None:
             return (None, None)
 
-        cmd = 'git config --get %s' % sanitized('branch.%s.merge' % branchname)
+        merge_config = self._get_merge_config(branchname)
+        if merge_config is None:
+            return (None, None)
+        branch_reference, remote = merge_config
+        candidates = get_branch_parent_candidates(branch_reference)
+        for index, candidate in enumerate(candidates):
+            if self._is_remote_branch(candidate,
+                                      remote_name=remote,
+                                      fetch=fetch and index == 0):
+                return (candidate, remote)
+        return None, None
 
-        _, output, _ = run_shell_command(cmd,
-                                         shell=True,
-                                         cwd=self._path)
+    def _get_merge_config(self, branchname):
+        """
+        :returns: (branch_reference, remote) as configured for branchname,
+          None if the branch tracks nothing
+        """
+        output, output2 = self._get_config_values(['branch.%s.merge' % branchname,
+                                                   'branch.%s.remote' % branchname])
         if not output:
-            return (None, None)
+            return None
         lines = output.splitlines()
         if len(lines) > 1:
             sys.stderr.write("vcstools unable to handle multiple merge references for branch %s:\n%s\n"
                              % (branchname, output))
-            return (None, None)
-
-        # get name of configured remote
-        cmd = 'git config --get "branch.%s.remote"' % branchname
-        _, output2, _ = run_shell_command(cmd, shell=True, cwd=self._path)
+            return None
+        # name of configured remote
         remote = output2 or self._get_default_remote()
+        return (lines[0], remote)
 
-        branch_reference = lines[0]
-        # branch_reference is either refname, or /refs/heads/refname, or
-        # heads/refname we would like to return refname however,
-        # user could also have named any branch
-        # "/refs/heads/refname", for some unholy reason check all
-        # known branches on remote for refname, then for the odd
-        # cases, as git seems to do
-        candidate = branch_reference
-        if candidate.startswith('refs/'):
-            candidate = candidate[len('refs/'):]
-        if candidate.startswith('heads/'):
-            candidate = candidate[len('heads/'):]
-        elif candidate.startswith('tags/'):
-            candidate = candidate[len('tags/'):]
-        elif candidate.startswith('remotes/'):
-            candidate = candidate[len('remotes/'):]
-
-        result = None
-        if self._is_remote_branch(candidate, remote_name=remote, fetch=fetch):
-            result = candidate
-        elif branch_reference != candidate and self._is_remote_branch(branch_reference,
-                                                                      remote_name=remote,
-                                                                      fetch=False):
-            result = branch_reference
-
-        if result is not None:
-            return (result, remote)
-        return None, None
+    def snapshot(self):
+        """
+        reads HEAD, all refs and the upstream of the current branch
+        with one git for-each-ref and one git rev-parse call.
+
+        :returns: GitSnapshot, None if path is not a git repository
+        """
+        if not self.detect_presence():
+            return None
+        _, output, _ = run_command(['git', 'for-each-ref', '--format=%s' % FOR_EACH_REF_FORMAT],
+                                   cwd=self._path)
+        refs = parse_for_each_ref(output.splitlines())
+        head = None
+        branch = None
+        value, output, _ = run_command(['git', 'rev-parse', 'HEAD', '--symbolic-full-name', 'HEAD'],
+                                       cwd=self._path, no_warn=True)
+        lines = output.splitlines()
+        if value == 0 and len(lines) == 2:
+            head = lines[0]
+            if lines[1].startswith('refs/heads/'):
+                branch = lines[1][len('refs/heads/'):]
+        default_remote = self._get_default_remote()
+        upstream = (None, None)
+        merge_config = branch and self._get_merge_config(branch)
+        if merge_config:
+            branch_reference, remote = merge_config
+            for candidate in get_branch_parent_candidates(branch_reference):
+                if 'refs/remotes/%s/%s' % (remote, candidate) in refs:
+                    upstream = (candidate, remote)
+                    break
+        return GitSnapshot(head, branch, refs, upstream, default_remote)
+
+    def _get_config_values(self, keys):
+        """
+        reads keys from the config files without running git. Configs
+        the reader does not understand are listed with one git config
+        call, which is repeated only once the config files change.
+
+        :returns: list with the value of each key as git config --get
+          prints it, '' for missing keys
+        """
+        values = [self._refs.get_config_value(key, fallback=self._list_config) for key in keys]
+        return [(value or '').rstrip() for value in values]
+
+    def _list_config(self):
+        """
+        :returns: config as listed by git, see git_refs.parse_config_list
+        """
+        _, output, _ = run_command(['git', 'config', '--list', '-z'], cwd=self._path)
+        return parse_config_list(output)
 
     def is_tag(self, tag_name, fetch=True):
         """
@@ -658,8 +1264,14 @@ class GitClient(VcsClientBase):
         if not tag_name:
             raise ValueError('is_tag requires tag_name, got: "%s"' % tag_name)
         if self.path_exists():
-            cmd = 'git tag -l %s' % sanitized(tag_name)
-            _, output, _ = run_shell_command(cmd, shell=True, cwd=self._path)
+            if not any(char in tag_name for char in '*?['):
+                # git tag -l would treat these as pattern
+                try:
+                    return self._refs.ref_exists('refs/tags/%s' % tag_name)
+                except UnsupportedRepository:
+                    pass
+            cmd = ['git', 'tag', '-l', tag_name]
+            _, output, _ = run_command(cmd, cwd=self._path)
             lines = output.splitlines()
             if len(lines) == 1:
                 return True
@@ -667,8 +1279,8 @@ class GitClient(VcsClientBase):
 
     def _rev_list_contains(self, refname, version, fetch=True):
         """
-        calls git rev-list with refname and returns True if version
-        can be found in rev-list result
+        checks whether version is an ancestor of refname, other than
+        refname itself
 
         :param refname: a git refname
         :param version: an SHA IDs (if partial, caller is responsible
@@ -676,116 +1288,121 @@ class GitClient(VcsClientBase):
         :returns: True if version is an ancestor commit from refname
         :raises: GitError when call to git fetch fails
         """
-        # to avoid listing unnecessarily many rev-ids, we cut off all
-        # those we are definitely not interested in
-        # $ git rev-list foo bar ^baz ^bez
-        # means "list all the commits which are reachable from foo or
-        # bar, but not from baz or bez". We use --parents because
-        # ^baz also excludes baz itself. We could also use git
-        # show --format=%P to get all parents first and use that,
-        # not sure what's more performant
         if fetch:
             self._do_fetch()
         if (refname is not None and refname != '' and
                 version is not None and version != ''):
-
-            cmd = 'git rev-list %s ^%s --parents' % (sanitized(refname), sanitized(version))
-            _, output, _ = run_shell_command(cmd, shell=True, cwd=self._path)
-            for line in output.splitlines():
-                # can have 1, 2 or 3 elements (commit, parent1, parent2)
-                for hashid in line.split(" "):
-                    if hashid.startswith(version):
-                        return True
+            return self._ancestry.is_ancestor(version, refname, strict=True)
         return False
 
-    def _is_commit_in_orphaned_subtree(self, version, mask_self=False, fetch=True):
+    def _is_commit_in_orphaned_subtree(self, version, mask_self=False, fetch=True, snapshot=None):
         """
-        checks git log --all (the list of all commits reached by
-        references, meaning branches or tags) for version. If it shows
-        up, that means git garbage collection will not remove the
-        commit. Else it would eventually be deleted.
+        checks whether any reference (branch or tag, not HEAD) reaches
+        version. If one does, git garbage collection will not remove
+        the commit. Else it would eventually be deleted.
 
         :param version: SHA IDs (if partial, caller is responsible for mismatch)
         :param mask_self: whether to consider direct references to this commit
             (rather than only references on descendants) as well
         :param fetch: whether fetch should be done first for remote refs
+        :param snapshot: GitSnapshot of the current refs, allows reusing
+            earlier answers
         :returns: True if version is not recursively referenced by a branch or tag
         :raises: GitError if git fetch fails
         """
         if fetch:
             self._do_fetch()
         if version is not None and version != '':
-            cmd = 'git show-ref -s'
-            _, output, _ = run_shell_command(cmd, shell=True, cwd=self._path)
-            refs = output.splitlines()
-            # 2000 seems like a number the linux shell can cope with
-            chunksize = 2000
-            refchunks = [refs[x:x + chunksize] for x in range(0, len(refs), chunksize)]
-            for refchunk in refchunks:
-                # git log over all refs except HEAD
-                cmd = 'git log ' + " ".join(refchunk)
-                if mask_self:
-                    # %P: parent hashes
-                    cmd += " --pretty=format:%P"
-                else:
-                    # %H: commit hash
-                    cmd += " --pretty=format:%H"
-                _, output, _ = run_shell_command(cmd, shell=True, cwd=self._path)
-                for line in output.splitlines():
-                    if line.strip("'").startswith(version):
-                        return False
-            return True
+            return not self._ancestry.is_reachable(version, mask_self=mask_self, snapshot=snapshot)
         return False
 
-    def export_repository(self, version, basepath):
+    def export_repository(self, version, basepath, archive_format=compression.DEFAULT_FORMAT,
+                          compresslevel=None):
+        filepath = compression.get_archive_path(basepath, archive_format)
+
+        def write_archive(trees):
+            git_export.write_archive_file(trees, filepath, archive_format, compresslevel)
+
+        if self._export_repository(version, write_archive):
+            return filepath
+        return False
+
+    def export_repository_stream(self, version, fileobj, archive_format=compression.DEFAULT_FORMAT,
+                                 compresslevel=None, prefix=''):
+        compression.check_format(archive_format, compresslevel)
+
+        def write_archive(trees):
+            git_export.write_archive(trees, fileobj, archive_format, compresslevel)
+
+        return self._export_repository(version, write_archive, prefix)
+
+    def _export_repository(self, version, write_archive, prefix=''):
+        """
+        :param write_archive: function writing the archive of a list of
+          trees as returned by git_export.iter_archive_trees
+        :param prefix: directory of the files within the archive
+        :returns: True on success, False otherwise
+        """
         if not self.detect_presence():
             return False
-
-        # Export should work regardless of the state of the local dir (might have modified files),
-        # so we clone to a temporary folder and checkout the specified version there.
-        # If the repo has submodules with relative URLs, cloning to a temp dir doesn't work.
-        # To support this case, first check if current version is already checked out and there are no
-        # modifications and try to export from current local dir.
-        # see https://github.com/vcstools/vcstools/pull/130
-        current_sha = self.get_version()
+        if prefix:
+            prefix = prefix.rstrip('/') + '/'
+        # resolving version may already have fetched
+        with fetching.scope():
+            return self._export_trees(version, write_archive, prefix)
+
+    def _export_trees(self, version, write_archive, prefix):
+        # git archive reads the commits, so the state of the working
+        # tree does not matter and no clone is needed. get_version
+        # fetches if version relates to a remote branch / tag we do
+        # not know about yet.
         export_sha = self.get_version(version)
-        if current_sha == export_sha and self.get_diff() == '':
-            archiver = GitArchiver(main_repo_abspath=self.get_path(), force_sub=True)
-            filepath = '{0}.tar.gz'.format(basepath)
-            archiver.create(filepath)
-            return filepath
+        if export_sha is None:
+            return False
+        # resolve all submodules before writing anything, the archive
+        # may be written to a stream that cannot be undone. Partial
+        # clones fetch the missing blobs of export_sha as git archive
+        # reads them.
+        try:
+            trees = list(git_export.iter_archive_trees(self._path, export_sha, prefix))
+        except VcsError as e:
+            self.logger.info('Exporting from a temporary clone: %s' % e)
+        else:
+            return self._write_export(write_archive, trees)
 
-        # export a different version than currently checked out or there are local changes
+        # submodules may not be cloned, so we clone to a temporary
+        # folder and checkout the specified version there.
+        # If the repo has submodules with relative URLs, cloning to a temp dir doesn't work.
         try:
-            # since version may relate to remote branch / tag we do not
-            # know about yet, do fetch if not already done
-            self._do_fetch()
-            # export should work regardless of the state of the local dir (might have modified files)
-            # so we clone to a temporary folder and checkout the specified version there
             tmpd_path = tempfile.mkdtemp()
             try:
                 tmpgit = GitClient(tmpd_path)
-                if tmpgit.checkout(self._path, version=version, shallow=True):
-                    archiver = GitArchiver(main_repo_abspath=tmpgit.get_path(), force_sub=True)
-                    filepath = '{0}.tar.gz'.format(basepath)
-                    archiver.create(filepath)
-                    return filepath
-                else:
+                # the SHA-ID also covers remote branches, which are not cloned
+                if not tmpgit.checkout(self._path, version=export_sha, shallow=True):
                     return False
+                trees = list(git_export.iter_archive_trees(tmpgit.get_path(), tmpgit.get_version(), prefix))
+                return self._write_export(write_archive, trees)
             finally:
                 shutil.rmtree(tmpd_path)
 
-        except GitError:
+        except (GitError, VcsError):
+            return False
+
+    def _write_export(self, write_archive, trees):
+        try:
+            write_archive(trees)
+        except VcsError as e:
+            self.logger.error('Export failed: %s' % e)
             return False
+        return True
 
     def get_branches(self, local_only=False):
-        cmd = 'git branch --no-color'
+        cmd = ['git', 'branch', '--no-color']
         if not local_only:
-            cmd += ' -a'
-        result, out, err = run_shell_command(cmd,
-                                             cwd=self._path,
-                                             shell=True,
-                                             show_stdout=False)
+            cmd.append('-a')
+        result, out, err = run_command(cmd,
+                                       cwd=self._path,
+                                       show_stdout=False)
         branches = []
         for line in out.splitlines():
             if 'HEAD -> ' in line:
@@ -794,42 +1411,74 @@ class GitClient(VcsClientBase):
             branches.append(line)
         return branches
 
-    def _do_fetch(self, timeout=None):
+    def _do_fetch(self, timeout=None, force=False):
         """
-        calls git fetch
+        calls git fetch, unless the repository has been fetched
+        recently as decided by vcstools.fetching
+
+        :param force: if True, fetches in any case
         :raises: GitError when call fails
         """
-        cmd = "git fetch"
-        value1, _, _ = run_shell_command(cmd,
-                                         cwd=self._path,
-                                         shell=True,
-                                         no_filter=True,
-                                         timeout=timeout,
-                                         show_stdout=True)
-        # git fetch --tags ONLY fetches new tags and commits used, no other commits!
-        cmd = "git fetch --tags"
-        value2, _, _ = run_shell_command(cmd,
-                                         cwd=self._path,
-                                         shell=True,
-                                         no_filter=True,
-                                         timeout=timeout,
-                                         show_stdout=True)
-        if value1 != 0 or value2 != 0:
+        if not (force or self._needs_fetch()):
+            return
+        failed = False
+        for cmd in self._get_fetch_commands():
+            value, _, _ = run_command(cmd,
+                                      cwd=self._path,
+                                      no_filter=True,
+                                      timeout=timeout,
+                                      show_stdout=True)
+            failed = failed or value != 0
+        self._fetched(success=not failed)
+        if failed:
             raise GitError('git fetch failed')
 
-    def _do_fast_forward(self, branch_parent, fetch=True, verbose=False):
+    def _get_fetch_commands(self):
+        if self._get_clone_options()[1]:
+            # all tags would also fetch their history, which single-branch clones are meant to avoid
+            return [['git', 'fetch']]
+        if self._capabilities['fetch_tags_with_heads']:
+            return [['git', 'fetch', '--tags']]
+        # before git 1.9, git fetch --tags ONLY fetches new tags and commits used, no other commits!
+        return [['git', 'fetch'], ['git', 'fetch', '--tags']]
+
+    def _get_fetch_key(self):
+        return os.path.realpath(self._path)
+
+    def _needs_fetch(self):
+        return fetching.needs_fetch(self._get_fetch_key())
+
+    def _fetched(self, success=True):
+        """called after fetching"""
+        if self._cat_file is not None:
+            # restart cat-file to make sure it sees fetched objects
+            self._cat_file.close()
+        if success:
+            fetching.fetched(self._get_fetch_key())
+
+    def _do_fast_forward(self, branch_parent, fetch=True, verbose=False, snapshot=None):
         """Execute git fetch if necessary, and if we can fast-foward,
         do so to the last fetched version using git rebase.
 
         :param branch_parent: name of branch we track
         :param fetch: whether fetch should be done first for remote refs
+        :param snapshot: GitSnapshot of the current state, to avoid
+          resolving versions again
         :returns: True if up-to-date or after succesful fast-forward
         :raises: GitError when git fetch fails
         """
         assert branch_parent is not None
-        current_version = self.get_version()
         default_remote = self._get_default_remote()
-        parent_version = self.get_version("remotes/%s/%s" % (default_remote, branch_parent))
+        parent_spec = "remotes/%s/%s" % (default_remote, branch_parent)
+        current_version = None
+        parent_version = None
+        if snapshot is not None:
+            current_version = snapshot.head
+            parent_version = snapshot.resolve(parent_spec)
+        if current_version is None:
+            current_version = self.get_version()
+        if parent_version is None:
+            parent_version = self.get_version(parent_spec)
         if current_version == parent_version:
             return True
         # check if we are true ancestor of tracked branch
@@ -847,39 +1496,35 @@ class GitClient(VcsClientBase):
             return False
         # 'git reset --keep' doesn't refresh the index. Do it manually to avoid
         # errors as reported in: https://github.com/vcstools/wstool/issues/77
-        cmd = "git update-index -q --refresh"
-        run_shell_command(cmd,
-                          shell=True,
-                          cwd=self._path,
-                          show_stdout=False,
-                          verbose=verbose)
+        run_command(['git', 'update-index', '-q', '--refresh'],
+                    cwd=self._path,
+                    show_stdout=False,
+                    verbose=verbose)
         if verbose:
             print("Rebasing repository")
         # Rebase, do not pull, because somebody could have
         # commited in the meantime.
-        if LooseVersion(self.gitversion) >= LooseVersion('1.7.1'):
+        if self._capabilities['reset_keep']:
             # --keep allows to rebase even with local changes, as long as
             # local changes are not in files that change between versions
-            cmd = "git reset --keep remotes/%s/%s" % (default_remote, branch_parent)
-            value, _, _ = run_shell_command(cmd,
-                                            shell=True,
-                                            cwd=self._path,
-                                            show_stdout=True,
-                                            verbose=verbose)
+            cmd = ['git', 'reset', '--keep', 'remotes/%s/%s' % (default_remote, branch_parent)]
+            value, _, _ = run_command(cmd,
+                                      cwd=self._path,
+                                      show_stdout=True,
+                                      verbose=verbose)
             if value == 0:
                 return True
         else:
-            verboseflag = ''
+            cmd = ['git', 'rebase']
             if verbose:
-                verboseflag = '-v'
+                cmd.append('-v')
             # prior to version 1.7.1, git does not know --keep
             # Do not merge, rebase does nothing when there are local changes
-            cmd = "git rebase %s remotes/%s/%s" % (verboseflag, default_remote, branch_parent)
-            value, _, _ = run_shell_command(cmd,
-                                            shell=True,
-                                            cwd=self._path,
-                                            show_stdout=True,
-                                            verbose=verbose)
+            cmd.append('remotes/%s/%s' % (default_remote, branch_parent))
+            value, _, _ = run_command(cmd,
+                                      cwd=self._path,
+                                      show_stdout=True,
+                                      verbose=verbose)
             if value == 0:
                 return True
         return False
@@ -899,12 +1544,10 @@ class GitClient(VcsClientBase):
         # know about yet, do fetch if not already done
         if fetch:
             self._do_fetch()
-        cmd = "git checkout %s" % (refname)
-        value, _, _ = run_shell_command(cmd,
-                                        shell=True,
-                                        cwd=self._path,
-                                        show_stdout=verbose,
-                                        verbose=verbose)
+        value, _, _ = run_command(['git', 'checkout', refname],
+                                  cwd=self._path,
+                                  show_stdout=verbose,
+                                  verbose=verbose)
         if value != 0:
             raise GitError('Git Checkout failed')
 
@@ -0,0 +1,202 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+answers ancestry questions about commits of a git repository.
+
+Each question is answered by a single git command that stops as soon as
+the answer is known (git merge-base --is-ancestor, git for-each-ref
+--contains), rather than by listing history and searching it. Answers
+are cached: ancestry between two commits never changes, and
+reachability from refs is cached per state of the refs, as given by a
+GitSnapshot.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import re
+import threading
+
+from vcstools.common import run_command
+from vcstools.git_snapshot import FOR_EACH_REF_FORMAT, parse_for_each_ref
+
+
+_SHA_REGEX = re.compile('^([0-9a-f]{40}|[0-9a-f]{64})$')
+
+
+def _is_sha(name):
+    return _SHA_REGEX.match(name) is not None
+
+
+class GitAncestry(object):
+    """
+    ancestry queries on the repository at path. Instances may be shared
+    between threads.
+    """
+
+    def __init__(self, path, capabilities):
+        """
+        :param capabilities: dict as from git._get_git_capabilities
+        """
+        self._path = path
+        self._capabilities = capabilities
+        self._lock = threading.Lock()
+        # (ancestor SHA, descendant SHA) -> bool
+        self._ancestors = {}
+        # (SHA, mask_self, GitSnapshot.digest) -> bool
+        self._reachable = {}
+
+    def clear(self):
+        """forgets cached answers"""
+        with self._lock:
+            self._ancestors.clear()
+            self._reachable.clear()
+
+    def resolve(self, names):
+        """
+        :param names: list of revisions
+        :returns: list of full commit SHAs, None if any cannot be resolved
+        """
+        if all(_is_sha(name) for name in names):
+            return list(names)
+        if any(not name or name.startswith('-') for name in names):
+            # would be taken as an option
+            return None
+        cmd = ['git', 'rev-parse'] + ['%s^{commit}' % name for name in names]
+        value, output, _ = run_command(cmd, cwd=self._path, no_warn=True)
+        shas = output.split()
+        if value != 0 or len(shas) != len(names):
+            return None
+        return shas
+
+    def is_ancestor(self, ancestor, descendant, strict=False):
+        """
+        :param ancestor: revision, possibly an abbreviated SHA
+        :param descendant: revision, possibly an abbreviated SHA
+        :param strict: if True, a commit is not its own ancestor
+        :returns: True if ancestor can be reached from descendant
+        """
+        shas = self.resolve([ancestor, descendant])
+        if shas is None:
+            return False
+        if strict and shas[0] == shas[1]:
+            return False
+        key = tuple(shas)
+        with self._lock:
+            result = self._ancestors.get(key)
+        if result is None:
+            if self._capabilities['merge_base_is_ancestor']:
+                value, _, _ = run_command(['git', 'merge-base', '--is-ancestor'] + shas,
+                                          cwd=self._path, no_warn=True)
+                if value not in (0, 1):
+                    # unknown commit, not cached as a fetch may provide it
+                    return False
+                result = value == 0
+            else:
+                result = shas[0] == shas[1] or self._rev_list_contains(shas[1], shas[0])
+            with self._lock:
+                self._ancestors[key] = result
+        return result
+
+    def _rev_list_contains(self, refname, version):
+        # to avoid listing unnecessarily many rev-ids, we cut off all
+        # those we are definitely not interested in
+        # $ git rev-list foo bar ^baz ^bez
+        # means "list all the commits which are reachable from foo or
+        # bar, but not from baz or bez". We use --parents because
+        # ^baz also excludes baz itself.
+        cmd = ['git', 'rev-list', refname, '^%s' % version, '--parents']
+        _, output, _ = run_command(cmd, cwd=self._path)
+        for line in output.splitlines():
+            # can have 1, 2 or 3 elements (commit, parent1, parent2)
+            if version in line.split(" "):
+                return True
+        return False
+
+    def is_reachable(self, version, mask_self=False, snapshot=None):
+        """
+        :param version: revision, possibly an abbreviated SHA
+        :param mask_self: whether to ignore refs pointing to version
+          itself, rather than to its descendants
+        :param snapshot: GitSnapshot of the current state of refs.
+          Answers are only cached if given.
+        :returns: True if version can be reached from any ref (branch,
+          tag, ...), HEAD excluded
+        """
+        shas = self.resolve([version])
+        if shas is None:
+            return False
+        sha = shas[0]
+        key = None
+        if snapshot is not None:
+            if not mask_self and sha in snapshot.targets:
+                return True
+            key = (sha, mask_self, snapshot.digest)
+            with self._lock:
+                result = self._reachable.get(key)
+            if result is not None:
+                return result
+        if self._capabilities['for_each_ref_contains']:
+            cmd = ['git', 'for-each-ref', '--contains', sha,
+                   '--format=%s' % FOR_EACH_REF_FORMAT]
+            if not mask_self:
+                # any ref will do
+                cmd.append('--count=1')
+            _, output, _ = run_command(cmd, cwd=self._path)
+            targets = parse_for_each_ref(output.splitlines()).values()
+            result = any(target != sha for target in targets) if mask_self else len(targets) > 0
+        else:
+            result = self._log_refs_contain(sha, mask_self)
+        if key is not None:
+            with self._lock:
+                self._reachable[key] = result
+        return result
+
+    def _log_refs_contain(self, sha, mask_self):
+        _, output, _ = run_command(['git', 'show-ref', '-s'], cwd=self._path)
+        refs = output.splitlines()
+        # 2000 seems like a number the OS command line limits can cope with
+        chunksize = 2000
+        refchunks = [refs[x:x + chunksize] for x in range(0, len(refs), chunksize)]
+        for refchunk in refchunks:
+            # git log over all refs except HEAD
+            cmd = ['git', 'log'] + refchunk
+            if mask_self:
+                # %P: parent hashes
+                cmd.append('--pretty=format:%P')
+            else:
+                # %H: commit hash
+                cmd.append('--pretty=format:%H')
+            _, output, _ = run_command(cmd, cwd=self._path)
+            for line in output.splitlines():
+                if sha in line.strip("'").split():
+                    return True
+        return False
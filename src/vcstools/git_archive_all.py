@@ -29,16 +29,27 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import fnmatch
+import itertools
 import logging
-from os import extsep, path, readlink, curdir
-from subprocess import CalledProcessError, Popen, PIPE
+import multiprocessing
+from os import extsep, path, curdir
+from subprocess import CalledProcessError
 import sys
 import tarfile
-from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
 import re
 
+from vcstools.common import CommandLines, map_parallel, run_command
+from vcstools.compression import CompressedWriter, ZipWriter
+
 __version__ = "1.16.4"
 
+# file modes of index entries, see git ls-files --stage
+GIT_MODE_FILE = 0o100644
+GIT_MODE_EXECUTABLE = 0o100755
+GIT_MODE_SYMLINK = 0o120000
+GIT_MODE_SUBMODULE = 0o160000
+
 
 class GitArchiver(object):
     """
@@ -53,7 +64,10 @@ class GitArchiver(object):
     """
     LOG = logging.getLogger('GitArchiver')
 
-    def __init__(self, prefix='', exclude=True, force_sub=False, extra=None, main_repo_abspath=None):
+    # formats accepted by create and write_archive
+    OUTPUT_FORMATS = ('gz', 'zip', 'bz2', 'xz', 'tar', 'tgz', 'txz')
+
+    def __init__(self, prefix='', exclude=True, force_sub=False, extra=None, main_repo_abspath=None, jobs=None):
         """
         @param prefix: Prefix used to prepend all paths in the resulting archive.
             Extra file paths are only prefixed if they are not relative.
@@ -78,6 +92,10 @@ class GitArchiver(object):
             with abspath to top-level directory of the repository.
             If None, current cwd is used.
         @type main_repo_abspath: str
+
+        @param jobs: Number of submodules listed and updated concurrently.
+            If None, a default based on the number of CPUs is used.
+        @type jobs: int
         """
         if extra is None:
             extra = []
@@ -88,7 +106,7 @@ class GitArchiver(object):
             raise ValueError("main_repo_abspath must be an absolute path")
 
         try:
-            main_repo_abspath = path.abspath(self.run_git_shell('git rev-parse --show-toplevel', main_repo_abspath).rstrip())
+            main_repo_abspath = path.abspath(self.run_git_shell(['git', 'rev-parse', '--show-toplevel'], main_repo_abspath).rstrip())
         except CalledProcessError:
             raise ValueError("{0} is not part of a git repository".format(main_repo_abspath))
 
@@ -97,14 +115,18 @@ class GitArchiver(object):
         self.extra = extra
         self.force_sub = force_sub
         self.main_repo_abspath = main_repo_abspath
+        self.jobs = jobs if jobs is not None else self.get_default_jobs()
+        self._global_exclude_patterns = None
 
-    def create(self, output_path, dry_run=False, output_format=None):
+    def create(self, output_path, dry_run=False, output_format=None, compresslevel=None, jobs=None):
         """
         Create the archive at output_file_path.
 
         Type of the archive is determined either by extension of output_file_path or by output_format.
         Supported formats are: gz, zip, bz2, xz, tar, tgz, txz
 
+        Archives are compressed on several threads, see vcstools.compression.
+
         @param output_path: Output file path.
         @type output_path: str
 
@@ -114,54 +136,84 @@ class GitArchiver(object):
         @param output_format: Determines format of the output archive. If None, format is determined from extension
             of output_file_path.
         @type output_format: str
+
+        @param compresslevel: Compression level from 0 to 9, None for the default of the format.
+            0 stores zip entries without compression.
+        @type compresslevel: int
+
+        @param jobs: Number of threads compressing the archive, None for the number of CPUs.
+        @type jobs: int
         """
         if output_format is None:
             file_name, file_ext = path.splitext(output_path)
             output_format = file_ext[len(extsep):].lower()
             self.LOG.debug("Output format is not explicitly set, determined format is {0}.".format(output_format))
 
-        if not dry_run:
-            if output_format == 'zip':
-                archive = ZipFile(path.abspath(output_path), 'w')
-
-                def add_file(file_path, arcname):
-                    if not path.islink(file_path):
-                        archive.write(file_path, arcname, ZIP_DEFLATED)
-                    else:
-                        i = ZipInfo(arcname)
-                        i.create_system = 3
-                        i.external_attr = 0xA1ED0000
-                        archive.writestr(i, readlink(file_path))
-            elif output_format in ['tar', 'bz2', 'gz', 'xz', 'tgz', 'txz']:
-                if output_format == 'tar':
-                    t_mode = 'w'
-                elif output_format == 'tgz':
-                    t_mode = 'w:gz'
-                elif output_format == 'txz':
-                    t_mode = 'w:xz'
-                else:
-                    t_mode = 'w:{0}'.format(output_format)
-
-                archive = tarfile.open(path.abspath(output_path), t_mode)
-
-                def add_file(file_path, arcname):
-                    archive.add(file_path, arcname)
-            else:
-                raise RuntimeError("unknown format: {0}".format(output_format))
-
-            def archiver(file_path, arcname):
-                self.LOG.debug("Compressing {0} => {1}...".format(file_path, arcname))
-                add_file(file_path, arcname)
-        else:
-            archive = None
-
+        if dry_run:
             def archiver(file_path, arcname):
                 self.LOG.info("{0} => {1}".format(file_path, arcname))
 
-        self.archive_all_files(archiver)
+            self.archive_all_files(archiver)
+            return
+
+        if output_format not in self.OUTPUT_FORMATS:
+            raise RuntimeError("unknown format: {0}".format(output_format))
+
+        with open(path.abspath(output_path), 'wb') as output_file:
+            self.write_archive(output_file, output_format, compresslevel, jobs)
+
+    def write_archive(self, fileobj, output_format='tar', compresslevel=None, jobs=None):
+        """
+        Write the archive to a file object.
+
+        Archives are written in stream mode, so fileobj is never seeked and may be a pipe or a socket.
+        If archiving fails, the archive is left without its end, so that it does not look complete.
+
+        @param fileobj: Writable binary file object. It is not closed.
+        @type fileobj: file
+
+        @param output_format: Format of the archive, one of OUTPUT_FORMATS.
+        @type output_format: str
+
+        @param compresslevel: Compression level from 0 to 9, None for the default of the format.
+            0 stores zip entries without compression.
+        @type compresslevel: int
 
-        if archive is not None:
-            archive.close()
+        @param jobs: Number of threads compressing the archive, None for the number of CPUs.
+        @type jobs: int
+        """
+        # objects to close after archiving, innermost first
+        closing = []
+        if output_format == 'zip':
+            writer = ZipWriter(fileobj, compresslevel, jobs)
+            closing.append(writer)
+            add_file = writer.add_file
+        elif output_format in self.OUTPUT_FORMATS:
+            archive_format = {'tgz': 'gz', 'txz': 'xz'}.get(output_format, output_format)
+            writer = CompressedWriter(fileobj, archive_format, compresslevel, jobs)
+            closing.append(writer)
+            # stream mode, neither writer nor fileobj need to seek
+            archive = tarfile.open(fileobj=writer, mode='w|')
+            closing.insert(0, archive)
+
+            def add_file(file_path, arcname):
+                archive.add(file_path, arcname)
+        else:
+            raise RuntimeError("unknown format: {0}".format(output_format))
+
+        def archiver(file_path, arcname):
+            self.LOG.debug("Compressing {0} => {1}...".format(file_path, arcname))
+            add_file(file_path, arcname)
+
+        try:
+            self.archive_all_files(archiver)
+        except Exception:
+            # Neither end blocks, a compressed trailer nor a zip central directory may follow
+            # partial output, so that readers of a pipe or socket notice the failure.
+            writer.abort()
+            raise
+        for closable in closing:
+            closable.close()
 
     def get_exclude_patterns(self, repo_abspath, repo_file_paths):
         """
@@ -184,42 +236,93 @@ class GitArchiver(object):
         if not self.exclude:
             return None
 
-        def read_attributes(attributes_abspath):
-            patterns = []
-            if path.isfile(attributes_abspath):
-                attributes = open(attributes_abspath, 'r').readlines()
-                patterns = []
-                for line in attributes:
-                    tokens = line.strip().split()
-                    if "export-ignore" in tokens[1:]:
-                        patterns.append(tokens[0])
-            return patterns
-
-        exclude_patterns = {(): []}
-
-        # There may be no gitattributes.
-        try:
-            global_attributes_abspath = self.run_git_shell("git config --get core.attributesfile", repo_abspath).rstrip()
-            exclude_patterns[()] = read_attributes(global_attributes_abspath)
-        except:
-            # And it's valid to not have them.
-            pass
+        exclude_patterns = {(): self.get_global_exclude_patterns(repo_abspath)}
 
         for attributes_abspath in [path.join(repo_abspath, f) for f in repo_file_paths if f.endswith(".gitattributes")]:
             # Each .gitattributes affects only files within its directory.
             key = tuple(self.get_path_components(repo_abspath, path.dirname(attributes_abspath)))
-            exclude_patterns[key] = read_attributes(attributes_abspath)
+            exclude_patterns[key] = self.read_attributes(attributes_abspath)
 
         local_attributes_abspath = path.join(repo_abspath, ".git", "info", "attributes")
         key = tuple(self.get_path_components(repo_abspath, repo_abspath))
 
         if key in exclude_patterns:
-            exclude_patterns[key].extend(read_attributes(local_attributes_abspath))
+            exclude_patterns[key].extend(self.read_attributes(local_attributes_abspath))
         else:
-            exclude_patterns[key] = read_attributes(local_attributes_abspath)
+            exclude_patterns[key] = self.read_attributes(local_attributes_abspath)
 
         return exclude_patterns
 
+    def get_global_exclude_patterns(self, repo_abspath):
+        """
+        Returns exclude patterns of the core.attributesfile, which apply to every repository.
+        The file is read once and the patterns are reused for all submodules.
+
+        @param repo_abspath: Absolute path to the git repository used to look up core.attributesfile.
+        @type repo_abspath: str
+
+        @return: List of patterns.
+        @rtype: list
+        """
+        if self._global_exclude_patterns is None:
+            # submodules may be read concurrently, reading the file twice does not hurt
+            global_exclude_patterns = []
+            # There may be no gitattributes.
+            try:
+                global_attributes_abspath = self.run_git_shell(['git', 'config', '--get', 'core.attributesfile'], repo_abspath).rstrip()
+                global_exclude_patterns = self.read_attributes(path.expanduser(global_attributes_abspath))
+            except:
+                # And it's valid to not have them.
+                pass
+            self._global_exclude_patterns = global_exclude_patterns
+        return list(self._global_exclude_patterns)
+
+    @staticmethod
+    def read_attributes(attributes_abspath):
+        """
+        Returns the patterns of a .gitattributes file that have the export-ignore attribute set.
+
+        @param attributes_abspath: Absolute path to the attributes file, which may not exist.
+        @type attributes_abspath: str
+
+        @rtype: list
+        """
+        patterns = []
+        if path.isfile(attributes_abspath):
+            with open(attributes_abspath, 'r') as f:
+                for line in f:
+                    tokens = line.strip().split()
+                    if "export-ignore" in tokens[1:] and not tokens[0].startswith('#'):
+                        patterns.append(tokens[0])
+        return patterns
+
+    @staticmethod
+    def compile_exclude_patterns(exclude_patterns):
+        """
+        Compiles exclude patterns as returned by get_exclude_patterns for is_file_excluded.
+
+        The patterns of each directory are joined into a single regular expression,
+        directories without patterns are dropped, so that checking a file costs one
+        dictionary lookup and at most two regular expression matches per ancestor directory.
+
+        @param exclude_patterns: Exclude patterns with format specified for get_exclude_patterns.
+        @type exclude_patterns: dict or None
+
+        @return: Dictionary with the same keys and compiled regular expressions as values.
+        @rtype: dict or None
+        """
+        if exclude_patterns is None:
+            return None
+        compiled = {}
+        for key, patterns in exclude_patterns.items():
+            if hasattr(patterns, 'match'):
+                compiled[key] = patterns
+            elif patterns:
+                # fnmatch compares normcase'd names, which this keeps for the file names
+                compiled[key] = re.compile('|'.join('(?:{0})'.format(fnmatch.translate(path.normcase(p)))
+                                                    for p in patterns))
+        return compiled
+
     def is_file_excluded(self, repo_abspath, repo_file_path, exclude_patterns):
         """
         Checks whether file at a given path is excluded.
@@ -230,38 +333,37 @@ class GitArchiver(object):
         @param repo_file_path: Path to a file within repo_abspath.
         @type repo_file_path: str
 
-        @param exclude_patterns: Exclude patterns with format specified for get_exclude_patterns.
+        @param exclude_patterns: Exclude patterns with format specified for get_exclude_patterns,
+            preferably compiled once with compile_exclude_patterns.
         @type exclude_patterns: dict
 
         @return: True if file should be excluded. Otherwise False.
         @rtype: bool
         """
-        if exclude_patterns is None or not len(exclude_patterns):
+        if not exclude_patterns:
             return False
 
-        from fnmatch import fnmatch
-
-        file_name = path.basename(repo_file_path)
-        components = self.get_path_components(repo_abspath, path.join(repo_abspath, path.dirname(repo_file_path)))
+        file_path = path.normcase(path.normpath(repo_file_path))
+        dir_path, file_name = path.split(file_path)
+        components = [curdir]
+        if dir_path:
+            components.extend(dir_path.split(path.sep))
 
-        is_excluded = False
         # We should check all patterns specified in intermediate directories to the given file.
         # At the end we should also check for the global patterns (key '()' or empty tuple).
-        while not is_excluded:
-            key = tuple(components)
-            if key in exclude_patterns:
-                patterns = exclude_patterns[key]
-                for p in patterns:
-                    if fnmatch(file_name, p) or fnmatch(repo_file_path, p):
-                        self.LOG.debug("Exclude pattern matched {0}: {1}".format(p, repo_file_path))
-                        is_excluded = True
-
-            if not len(components):
-                break
-
-            components.pop()
+        for depth in range(len(components), -1, -1):
+            patterns = exclude_patterns.get(tuple(components[:depth]))
+            if patterns is None:
+                continue
+            if not hasattr(patterns, 'match'):
+                patterns = self.compile_exclude_patterns({(): patterns}).get(())
+                if patterns is None:
+                    continue
+            if patterns.match(file_name) or patterns.match(file_path):
+                self.LOG.debug("Exclude pattern matched: {0}".format(repo_file_path))
+                return True
 
-        return is_excluded
+        return False
 
     def archive_all_files(self, archiver):
         """
@@ -284,7 +386,10 @@ class GitArchiver(object):
         Skips those that match the exclusion patterns found in
         any discovered .gitattributes files along the way.
 
-        Recurs into submodules as well.
+        Files are read from the index as they are listed by git and classified by their mode,
+        so no file of the working tree is accessed. Recurs into submodules as well.
+        The submodules of a repository are listed (and updated, see force_sub) concurrently,
+        files are yielded in the same order as when walking them one by one.
 
         @param repo_path: Path to the git submodule repository relative to main_repo_abspath.
         @type repo_path: str
@@ -293,54 +398,164 @@ class GitArchiver(object):
         @rtype: Iterable
         """
         repo_abspath = path.join(self.main_repo_abspath, repo_path)
-        repo_file_paths = self.run_git_shell(
-            "git ls-files --cached --full-name --no-empty-directory",
-            repo_abspath
-        ).splitlines()
-        exclude_patterns = self.get_exclude_patterns(repo_abspath, repo_file_paths)
-
-        for repo_file_path in repo_file_paths:
-            # Git puts path in quotes if file path has unicode characters.
-            repo_file_path = repo_file_path.strip('"')  # file path relative to current repo
-            repo_file_abspath = path.join(repo_abspath, repo_file_path)  # absolute file path
-            main_repo_file_path = path.join(repo_path, repo_file_path)  # file path relative to the main repo
-
-            # Only list symlinks and files.
-            if not path.islink(repo_file_abspath) and path.isdir(repo_file_abspath):
+        exclude_patterns = self.get_repository_exclude_patterns(repo_abspath)
+
+        submodule_paths = []
+        for repo_file_path, mode in self.iter_git_index(repo_abspath):
+            if mode == GIT_MODE_SUBMODULE:
+                submodule_paths.append(repo_file_path)
                 continue
 
             if self.is_file_excluded(repo_abspath, repo_file_path, exclude_patterns):
                 continue
 
-            yield main_repo_file_path
+            yield path.join(repo_path, repo_file_path)  # file path relative to the main repo
+
+        self.update_submodules(repo_abspath)
+        for submodule_file_path in self._walk_submodules(repo_path, submodule_paths, exclude_patterns):
+            yield submodule_file_path
+
+    def _walk_submodules(self, repo_path, submodule_paths, exclude_patterns):
+        """
+        Yields the files of the submodules of the repository at repo_path, see walk_git_files.
+
+        @param submodule_paths: Paths of the gitlinks in the repository, relative to it.
+        @type submodule_paths: list
+
+        @param exclude_patterns: Compiled exclude patterns of the repository.
+        @type exclude_patterns: dict
+        """
+        repo_abspath = path.join(self.main_repo_abspath, repo_path)
+        submodule_paths = [
+            submodule_path for submodule_path in submodule_paths
+            if not self.is_file_excluded(repo_abspath, submodule_path, exclude_patterns) and
+            # submodules that were never initialized have no repository to list
+            path.exists(path.join(repo_abspath, submodule_path, '.git'))]
+
+        # listing a submodule and preparing its submodules only depends on the submodule itself
+        submodule_paths = [path.join(repo_path, submodule_path) for submodule_path in submodule_paths]
+        submodules = map_parallel(self._read_submodule, submodule_paths, self.jobs)
+
+        for submodule_path, (file_paths, gitlink_paths, submodule_exclude_patterns) in zip(submodule_paths, submodules):
+            for submodule_file_path in itertools.chain(
+                    file_paths, self._walk_submodules(submodule_path, gitlink_paths, submodule_exclude_patterns)):
+                if self.is_file_excluded(repo_abspath, submodule_file_path, exclude_patterns):
+                    continue
+
+                yield submodule_file_path
+
+    def _read_submodule(self, repo_path):
+        """
+        Lists the files of a submodule and updates its submodules, see update_submodules.
+
+        @param repo_path: Path to the git submodule repository relative to main_repo_abspath.
+        @type repo_path: str
+
+        @return: Tuple of the included file paths relative to main_repo_abspath,
+            the gitlink paths relative to the submodule and its compiled exclude patterns.
+        @rtype: tuple
+        """
+        repo_abspath = path.join(self.main_repo_abspath, repo_path)
+        exclude_patterns = self.get_repository_exclude_patterns(repo_abspath)
+        file_paths = []
+        gitlink_paths = []
+        for repo_file_path, mode in self.iter_git_index(repo_abspath):
+            if mode == GIT_MODE_SUBMODULE:
+                gitlink_paths.append(repo_file_path)
+            elif not self.is_file_excluded(repo_abspath, repo_file_path, exclude_patterns):
+                file_paths.append(path.join(repo_path, repo_file_path))
+        self.update_submodules(repo_abspath)
+        return file_paths, gitlink_paths, exclude_patterns
+
+    def update_submodules(self, repo_abspath):
+        """
+        Initializes and updates the submodules of a repository if force_sub is set.
 
+        @param repo_abspath: Absolute path to the git repository.
+        @type repo_abspath: str
+        """
         if self.force_sub:
-            self.run_git_shell("git submodule init", repo_abspath)
-            self.run_git_shell("git submodule update", repo_abspath)
+            self.run_git_shell(['git', 'submodule', 'init'], repo_abspath)
+            self.run_git_shell(['git', 'submodule', 'update'], repo_abspath)
 
-        try:
-            repo_gitmodules_abspath = path.join(repo_abspath, ".gitmodules")
+    def get_repository_exclude_patterns(self, repo_abspath):
+        """
+        Returns the compiled exclude patterns of a repository, reading only its .gitattributes files.
 
-            with open(repo_gitmodules_abspath) as f:
-                lines = f.readlines()
+        @param repo_abspath: Absolute path to the git repository.
+        @type repo_abspath: str
 
-            for l in lines:
-                m = re.match("^\s*path\s*=\s*(.*)\s*$", l)
+        @return: Exclude patterns as returned by compile_exclude_patterns, None if self.exclude is not set.
+        @rtype: dict or None
+        """
+        if not self.exclude:
+            return None
+        # .gitattributes files are needed before the first file can be checked
+        attributes_file_paths = list(self.iter_git_records(
+            ['git', 'ls-files', '-z', '--cached', '--full-name', '--', '*.gitattributes'], repo_abspath))
+        return self.compile_exclude_patterns(self.get_exclude_patterns(repo_abspath, attributes_file_paths))
 
-                if m:
-                    submodule_path = m.group(1)
-                    submodule_path = path.join(repo_path, submodule_path)
+    @classmethod
+    def iter_git_index(cls, repo_abspath):
+        """
+        Iterates over the entries of the index of a repository.
+
+        Entries of a path with merge conflicts are only returned once.
 
-                    if self.is_file_excluded(repo_abspath, submodule_path, exclude_patterns):
-                        continue
+        @param repo_abspath: Absolute path to the git repository.
+        @type repo_abspath: str
 
-                    for submodule_file_path in self.walk_git_files(submodule_path):
-                        if self.is_file_excluded(repo_abspath, submodule_file_path, exclude_patterns):
-                            continue
+        @return: Iterator of (path relative to repo_abspath, mode) tuples,
+            where mode is an int such as GIT_MODE_FILE, GIT_MODE_EXECUTABLE,
+            GIT_MODE_SYMLINK or GIT_MODE_SUBMODULE.
+        @rtype: Iterable
+
+        @raise CalledProcessError: Raises exception if git ls-files fails.
+        """
+        last_path = None
+        for record in cls.iter_git_records(['git', 'ls-files', '-s', '-z', '--cached', '--full-name'],
+                                           repo_abspath):
+            # "<mode> <object> <stage>\t<path>"
+            info, _, repo_file_path = record.partition('\t')
+            if repo_file_path == last_path:
+                continue
+            last_path = repo_file_path
+            yield repo_file_path, int(info.split(' ', 1)[0], 8)
+
+    @staticmethod
+    def iter_git_records(cmd, cwd=None):
+        """
+        Runs a git command with NUL terminated output (-z) and yields its records while it runs.
 
-                        yield submodule_file_path
-        except IOError:
-            pass
+        Unlike run_git_shell, paths are not unescaped, as git does not quote them in -z output.
+
+        @param cmd: Command to be executed, as list of program name and arguments.
+        @type cmd: list
+
+        @type cwd: str
+        @param cwd: Working directory.
+
+        @rtype: Iterable
+        @return: Iterator of records.
+
+        @raise CalledProcessError:  Raises exception if return code of the command is non-zero.
+        """
+        with CommandLines(cmd, cwd=cwd, us_env=False, no_warn=True, separator='\0') as records:
+            for record in records:
+                yield record
+        if records.returncode:
+            raise CalledProcessError(returncode=records.returncode, cmd=cmd, output=records.message)
+
+    @staticmethod
+    def get_default_jobs():
+        """
+        @return: Number of submodules to read concurrently, at most 8 as the work is mostly waiting for git.
+        @rtype: int
+        """
+        try:
+            return min(8, multiprocessing.cpu_count())
+        except NotImplementedError:
+            return 1
 
     @staticmethod
     def get_path_components(repo_abspath, abspath):
@@ -392,10 +607,10 @@ class GitArchiver(object):
     @staticmethod
     def run_git_shell(cmd, cwd=None):
         """
-        Runs git shell command, reads output and decodes it into unicode string.
+        Runs git command without a shell, reads output and decodes it into unicode string.
 
-        @param cmd: Command to be executed.
-        @type cmd: str
+        @param cmd: Command to be executed, as list of program name and arguments.
+        @type cmd: list
 
         @type cwd: str
         @param cwd: Working directory.
@@ -405,15 +620,14 @@ class GitArchiver(object):
 
         @raise CalledProcessError:  Raises exception if return code of the command is non-zero.
         """
-        p = Popen(cmd, shell=True, stdout=PIPE, cwd=cwd)
-        output, _ = p.communicate()
-        output = output.decode('unicode_escape').encode('raw_unicode_escape').decode('utf-8')
+        returncode, output, _ = run_command(cmd, cwd=cwd, us_env=False, no_warn=True)
+        output = output.encode('utf-8').decode('unicode_escape').encode('raw_unicode_escape').decode('utf-8')
 
-        if p.returncode:
+        if returncode:
             if sys.version_info > (2, 6):
-                raise CalledProcessError(returncode=p.returncode, cmd=cmd, output=output)
+                raise CalledProcessError(returncode=returncode, cmd=cmd, output=output)
             else:
-                raise CalledProcessError(returncode=p.returncode, cmd=cmd)
+                raise CalledProcessError(returncode=returncode, cmd=cmd)
 
         return output
 
@@ -0,0 +1,191 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+persistent git cat-file coprocess.
+
+Resolving a revision with git log starts a new git process for every
+lookup. GitCatFile instead keeps a ``git cat-file --batch-check``
+process (and, when object contents are needed, a ``git cat-file
+--batch`` process) running for a repository and talks to it over
+pipes, so resolving many revisions costs a single process.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import subprocess
+import threading
+
+from vcstools.vcs_base import VcsError
+from vcstools.common import _get_command_env
+
+
+class GitCatFile(object):
+    """
+    Resolves revisions and reads objects of one git repository through
+    long-lived ``git cat-file`` processes. Processes are started lazily
+    on first use and run until close() is called. Instances can be used
+    as context managers and are safe to share between threads.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        # mode ('--batch-check' or '--batch') -> Popen
+        self._procs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def _get_process(self, mode):
+        proc = self._procs.get(mode)
+        if proc is not None and proc.poll() is None:
+            return proc
+        try:
+            with open(os.devnull, 'wb') as devnull:
+                proc = subprocess.Popen(['git', 'cat-file', mode],
+                                        cwd=self._path,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=devnull,
+                                        env=_get_command_env(True))
+        except OSError as ose:
+            raise VcsError("Could not start git cat-file in %s: %s" % (self._path, ose))
+        self._procs[mode] = proc
+        return proc
+
+    def _request(self, mode, query):
+        """
+        writes one query line and returns the response header line and
+        the process, to read any object contents following the header.
+        Must be called with self._lock held.
+        """
+        if '\n' in query or '\r' in query:
+            raise VcsError("Invalid git revision: %s" % query)
+        proc = self._get_process(mode)
+        try:
+            proc.stdin.write(query.encode('utf-8') + b'\n')
+            proc.stdin.flush()
+            header = proc.stdout.readline()
+        except (IOError, OSError) as exc:
+            self._close_process(mode)
+            raise VcsError("git cat-file failed in %s: %s" % (self._path, exc))
+        if not header:
+            self._close_process(mode)
+            raise VcsError("git cat-file terminated unexpectedly in %s" % self._path)
+        return header.decode('utf-8').rstrip('\n'), proc
+
+    @staticmethod
+    def _parse_header(header):
+        """
+        :returns: (sha, type, size) or None if the object was not found
+        """
+        if header.endswith(' missing') or header.endswith(' ambiguous'):
+            return None
+        fields = header.rsplit(' ', 2)
+        if len(fields) != 3:
+            return None
+        return (fields[0], fields[1], int(fields[2]))
+
+    def resolve(self, spec, object_type='commit'):
+        """
+        :param spec: anything git rev-parse accepts, e.g. a tagname,
+          branchname or (partial) sha-id
+        :param object_type: peel spec to an object of this type (as in
+          ``spec^{commit}``), None to not peel
+        :returns: full sha-id of the object, or None if not found
+        :raises: VcsError if git cat-file cannot be run
+        """
+        if spec is None or spec.strip() == '':
+            return None
+        query = spec
+        if object_type is not None:
+            query = '%s^{%s}' % (spec, object_type)
+        with self._lock:
+            header, _ = self._request('--batch-check', query)
+        fields = self._parse_header(header)
+        if fields is None:
+            return None
+        return fields[0]
+
+    def read_object(self, spec):
+        """
+        :param spec: anything git rev-parse accepts, e.g. 'HEAD:README'
+        :returns: (sha, type, contents) with contents as bytes, or None
+          if no such object exists
+        :raises: VcsError if git cat-file cannot be run
+        """
+        if spec is None or spec.strip() == '':
+            return None
+        with self._lock:
+            header, proc = self._request('--batch', spec)
+            fields = self._parse_header(header)
+            if fields is None:
+                return None
+            sha, object_type, size = fields
+            # contents are followed by a newline
+            contents = proc.stdout.read(size + 1)
+            if len(contents) != size + 1:
+                self._close_process('--batch')
+                raise VcsError("git cat-file terminated unexpectedly in %s" % self._path)
+        return (sha, object_type, contents[:size])
+
+    def _close_process(self, mode):
+        proc = self._procs.pop(mode, None)
+        if proc is None:
+            return
+        try:
+            # cat-file terminates once its input is closed
+            proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        proc.stdout.close()
+        proc.wait()
+
+    def close(self):
+        """
+        terminates the git processes, if any. The instance remains
+        usable, processes will be started again when needed.
+        """
+        lock = getattr(self, '_lock', None)
+        if lock is None:
+            # __init__ did not complete
+            return
+        with lock:
+            for mode in list(self._procs.keys()):
+                self._close_process(mode)
@@ -0,0 +1,234 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+export of git commits with git archive, including submodules.
+
+The tar streams of git archive for the repository and for each
+submodule at the commit its gitlink records are copied into one tar
+archive, with the submodule files below the submodule path. Files are
+never checked out or read from a working tree, so neither a clone nor
+a clean working tree is needed, only the commits.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+
+from vcstools import compression
+from vcstools.common import run_command, run_command_to_file
+from vcstools.vcs_base import VcsError
+
+
+BLOCKSIZE = 512
+# tarfile pads archives to records of this size
+RECORDSIZE = BLOCKSIZE * 20
+
+
+def _get_submodule_names(repo_path, sha):
+    """
+    :returns: dict of submodule path to name as in .gitmodules of sha
+    """
+    _, output, _ = run_command(['git', 'config', '--blob', '%s:.gitmodules' % sha,
+                                '-z', '--get-regexp', r'^submodule\..*\.path$'],
+                               cwd=repo_path, no_warn=True)
+    names = {}
+    for record in output.split('\0'):
+        if '\n' in record:
+            key, path = record.split('\n', 1)
+            names[path] = key[len('submodule.'):-len('.path')]
+    return names
+
+
+def _get_submodule_repository(repo_path, subpath, name):
+    """
+    :returns: path to run git in for the submodule at subpath of the
+      repository at repo_path, None if the submodule is not cloned
+    """
+    candidate = os.path.join(repo_path, subpath)
+    if os.path.exists(os.path.join(candidate, '.git')):
+        return candidate
+    _, git_dir, _ = run_command(['git', 'rev-parse', '--git-dir'], cwd=repo_path, no_warn=True)
+    candidate = os.path.join(repo_path, git_dir.strip(), 'modules', name or subpath)
+    if os.path.isdir(candidate):
+        return candidate
+    return None
+
+
+def _has_commit(repo_path, sha):
+    value, _, _ = run_command(['git', 'cat-file', '-e', '%s^{commit}' % sha], cwd=repo_path, no_warn=True)
+    return value == 0
+
+
+def iter_archive_trees(repo_path, sha, prefix=''):
+    """
+    lists what to archive for sha of the repository at repo_path: the
+    commit itself and recursively the commits of its submodules, as
+    listed in .gitmodules. Submodules lacking the commit are fetched.
+
+    :returns: generator of (repository path, sha, prefix) in depth
+      first order, the prefix ending with '/' unless empty
+    :raises: VcsError if a submodule is not cloned or lacks the commit
+    """
+    yield repo_path, sha, prefix
+    # only the paths named in .gitmodules are looked up in the tree,
+    # listing the whole tree would cost as much as archiving it
+    names = _get_submodule_names(repo_path, sha)
+    if not names:
+        return
+    _, output, _ = run_command(['git', '--literal-pathspecs', 'ls-tree', '-z', sha, '--'] + sorted(names),
+                               cwd=repo_path, no_warn=True)
+    gitlinks = []
+    for record in output.split('\0'):
+        if '\t' in record:
+            info, path = record.split('\t', 1)
+            mode, _, object_sha = info.split(' ')
+            if mode == '160000':
+                gitlinks.append((path, object_sha))
+    for subpath, subsha in gitlinks:
+        subrepo = _get_submodule_repository(repo_path, subpath, names.get(subpath))
+        if subrepo is None:
+            raise VcsError('Submodule %s of %s is not cloned' % (subpath, repo_path))
+        if not _has_commit(subrepo, subsha):
+            run_command(['git', 'fetch'], cwd=subrepo, no_warn=True)
+            if not _has_commit(subrepo, subsha):
+                raise VcsError('Submodule %s of %s lacks commit %s' % (subpath, repo_path, subsha))
+        for tree in iter_archive_trees(subrepo, subsha, prefix + subpath + '/'):
+            yield tree
+
+
+class _TarMembersWriter(object):
+    """
+    file-like object passing the members of a tar stream written to it
+    on to fileobj, dropping the end of archive blocks and anything
+    after them
+    """
+
+    def __init__(self, fileobj):
+        self.written = 0
+        self._fileobj = fileobj
+        self._header = b''
+        # bytes of member data to pass on before the next header
+        self._remaining = 0
+        self._ended = False
+
+    def write(self, data):
+        data = bytes(data)
+        while data and not self._ended:
+            if self._remaining:
+                chunk = data[:self._remaining]
+                self._fileobj.write(chunk)
+                self._remaining -= len(chunk)
+                data = data[len(chunk):]
+                continue
+            missing = BLOCKSIZE - len(self._header)
+            self._header += data[:missing]
+            data = data[missing:]
+            if len(self._header) == BLOCKSIZE:
+                self._write_header(self._header)
+                self._header = b''
+
+    def _write_header(self, header):
+        if header.count(b'\0') == BLOCKSIZE:
+            self._ended = True
+            return
+        size_field = bytearray(header[124:136])
+        if size_field[0] & 0x80:
+            # base-256 encoding of large sizes
+            size = 0
+            for byte in size_field[1:]:
+                size = (size << 8) + byte
+        else:
+            size = int(bytes(size_field).strip(b'\0 ') or b'0', 8)
+        self._fileobj.write(header)
+        self._remaining = (size + BLOCKSIZE - 1) // BLOCKSIZE * BLOCKSIZE
+        self.written += BLOCKSIZE + self._remaining
+
+    def check_complete(self):
+        """
+        :raises: VcsError if the stream ended within a member
+        """
+        if self._remaining or self._header:
+            raise VcsError('Truncated git archive output')
+
+
+def _archive_tree(repo_path, sha, prefix, fileobj):
+    argv = ['git', 'archive', '--format=tar']
+    if prefix:
+        argv.append('--prefix=%s' % prefix)
+    argv.append(sha)
+    members = _TarMembersWriter(fileobj)
+    returncode, stderr = run_command_to_file(argv, members, cwd=repo_path, no_warn=True)
+    if returncode != 0:
+        raise VcsError('%s failed in %s: %s' % (' '.join(argv), repo_path, stderr))
+    members.check_complete()
+    return members.written
+
+
+def write_archive(trees, fileobj, archive_format='tar', level=None):
+    """
+    writes one tar archive of trees to fileobj, which does not need
+    to be seekable
+
+    :param trees: iterable of (repository path, sha, prefix) as of
+      iter_archive_trees()
+    :param archive_format: compression of the archive, see
+      vcstools.compression
+    :param level: compression level, None for the default
+    :raises: VcsError if git archive fails
+    """
+    if archive_format != 'tar':
+        with compression.CompressedWriter(fileobj, archive_format, level) as writer:
+            write_archive(trees, writer)
+        return
+    written = 0
+    for repo_path, sha, prefix in trees:
+        written += _archive_tree(repo_path, sha, prefix, fileobj)
+    # end of archive marker, padded like tarfile does
+    end = 2 * BLOCKSIZE
+    end += (RECORDSIZE - (written + end) % RECORDSIZE) % RECORDSIZE
+    fileobj.write(b'\0' * end)
+
+
+def write_archive_file(trees, filepath, archive_format=compression.DEFAULT_FORMAT, level=None):
+    """
+    writes one tar archive of trees to filepath, removing filepath
+    again if that fails
+
+    :raises: VcsError if git archive fails
+    """
+    try:
+        with open(filepath, 'wb') as fhand:
+            write_archive(trees, fhand, archive_format, level)
+    except Exception:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        raise
@@ -0,0 +1,351 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+shared cache of bare git mirrors, so that checkouts of the same url
+into several workspaces download objects once.
+
+Disabled unless the environment variable VCSTOOLS_GIT_MIRRORS names a
+directory, or set_mirror_dir() was called. The directory holds one bare
+mirror per url, named after a hash of the url. GitClient.checkout clones
+with --reference to the mirror and --dissociate, so that workspaces do
+not depend on the mirror afterwards.
+
+Mirrors are created with git clone --mirror and updated with git fetch,
+at most once per fetch TTL (see vcstools.fetching), also across
+processes. Processes coordinate with flock() on a lock file next to
+each mirror: updates hold it exclusively, clones from the mirror shared.
+Clones also hold a second, in-use lock file shared from before the
+update until they finish, which eviction needs exclusively. Where
+flock() is not available, no locking takes place.
+
+If a size limit is set via set_max_size() or VCSTOOLS_GIT_MIRRORS_SIZE
+(bytes, or with suffix K, M or G), the least recently used mirrors are
+removed after each checkout until the mirrors fit, skipping mirrors in
+use.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import contextlib
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from vcstools import fetching
+from vcstools.common import run_command
+
+
+_mirror_dir = os.environ.get('VCSTOOLS_GIT_MIRRORS') or None
+_max_size = None
+
+# touched in a mirror after each successful clone or fetch
+FETCH_STAMP = 'vcstools-fetched'
+
+
+def set_mirror_dir(directory):
+    """
+    :param directory: directory to keep mirrors in, None to disable
+    """
+    global _mirror_dir
+    _mirror_dir = directory
+
+
+def get_mirror_dir():
+    return _mirror_dir
+
+
+def set_max_size(size):
+    """
+    :param size: bytes all mirrors may take, None to use
+      VCSTOOLS_GIT_MIRRORS_SIZE again
+    """
+    global _max_size
+    _max_size = size
+
+
+def get_max_size():
+    """
+    :returns: bytes all mirrors may take, None for no limit
+    """
+    if _max_size is not None:
+        return _max_size
+    value = os.environ.get('VCSTOOLS_GIT_MIRRORS_SIZE')
+    if value:
+        try:
+            return _parse_size(value)
+        except ValueError:
+            logging.getLogger('vcstools').warn(
+                "Ignoring invalid VCSTOOLS_GIT_MIRRORS_SIZE '%s'" % value)
+    return None
+
+
+def _parse_size(value):
+    value = value.strip().upper()
+    factor = 1
+    for suffix, suffix_factor in (('K', 1 << 10), ('M', 1 << 20), ('G', 1 << 30)):
+        if value.endswith(suffix):
+            value = value[:-1]
+            factor = suffix_factor
+            break
+    return int(float(value) * factor)
+
+
+def get_mirror_path(url, directory=None):
+    """
+    :returns: path of the mirror of url in directory, or in the
+      configured mirror directory
+    """
+    name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return os.path.join(directory or _mirror_dir, name + '.git')
+
+
+def _get_lockname(path, in_use=False):
+    return path[:-len('.git')] + ('.use' if in_use else '.lock')
+
+
+def _flock(fhand, operation):
+    """
+    calls flock(), retrying when interrupted by a signal
+    """
+    while True:
+        try:
+            fcntl.flock(fhand.fileno(), operation)
+            return
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.EINTR:
+                raise
+
+
+@contextlib.contextmanager
+def _locked(path, exclusive, blocking=True, in_use=False):
+    """
+    context manager holding the flock() of the mirror at path, or of
+    its in-use lock file if in_use is True. Yields the lock file, or
+    None if blocking is False and the lock is held elsewhere, or if
+    flock() fails, e.g. with ENOLCK on NFS
+    """
+    lockname = _get_lockname(path, in_use)
+    while True:
+        fhand = open(lockname, 'a')
+        if fcntl is None:
+            break
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if not blocking:
+            operation |= fcntl.LOCK_NB
+        try:
+            _flock(fhand, operation)
+        except (IOError, OSError) as exc:
+            fhand.close()
+            if blocking:
+                logging.getLogger('vcstools').warn('Could not lock git mirror %s: %s' % (path, exc))
+            yield None
+            return
+        # evict() removes lock files, a lock on a removed file locks nothing
+        try:
+            if os.path.samestat(os.fstat(fhand.fileno()), os.stat(lockname)):
+                break
+        except OSError:
+            pass
+        fhand.close()
+    try:
+        yield fhand
+    finally:
+        fhand.close()
+
+
+def _touch(path):
+    """
+    records use of a mirror for eviction
+    """
+    try:
+        os.utime(_get_lockname(path), None)
+    except OSError:
+        pass
+
+
+def _prepare_mirror(url):
+    if _mirror_dir is None:
+        return None
+    if not os.path.isdir(_mirror_dir):
+        os.makedirs(_mirror_dir)
+    return get_mirror_path(url)
+
+
+def _update_locked(url, path, timeout):
+    """
+    creates or fetches the mirror at path while its lock is held
+    exclusively
+
+    :returns: True on success
+    """
+    stamp = os.path.join(path, FETCH_STAMP)
+    if not os.path.isdir(path):
+        if not _clone_mirror(url, path, timeout):
+            return False
+    elif fetching.needs_fetch(path) and (
+            not os.path.exists(stamp) or time.time() - os.path.getmtime(stamp) >= fetching.get_ttl()):
+        value, _, msg = run_command(['git', 'fetch', '--prune', 'origin'], cwd=path,
+                                    timeout=timeout, no_warn=True)
+        if value != 0:
+            logging.getLogger('vcstools').warn('Could not update git mirror %s: %s' % (path, msg))
+            return False
+    with open(stamp, 'w'):
+        pass
+    fetching.fetched(path)
+    _touch(path)
+    return True
+
+
+def update_mirror(url, timeout=None):
+    """
+    creates or fetches the mirror of url, unless fetched within the
+    fetch TTL
+
+    :returns: path of the mirror, None if mirrors are disabled or git failed
+    """
+    path = _prepare_mirror(url)
+    if path is None:
+        return None
+    with _locked(path, exclusive=True) as lock:
+        if lock is None or not _update_locked(url, path, timeout):
+            return None
+    return path
+
+
+def _clone_mirror(url, path, timeout):
+    # cloning next to the mirror and renaming leaves no partial mirror behind
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        tmppath = os.path.join(tmpdir, 'mirror.git')
+        value, _, msg = run_command(['git', 'clone', '--mirror', url, tmppath],
+                                    timeout=timeout, no_warn=True)
+        if value != 0:
+            logging.getLogger('vcstools').warn('Could not create git mirror of %s: %s' % (url, msg))
+            return False
+        os.rename(tmppath, path)
+        return True
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def reference(url, timeout=None):
+    """
+    context manager updating the mirror of url and keeping it from
+    eviction while a clone references it. Evicts other mirrors
+    afterwards if a size limit is set.
+
+    :returns: path of the mirror to pass to git clone --reference, None
+      if mirrors are disabled or the mirror could not be updated
+    """
+    path = _prepare_mirror(url)
+    if path is None:
+        yield None
+        return
+    try:
+        # flock() cannot turn the exclusive lock of the update into a
+        # shared one without releasing it in between, the in-use lock
+        # keeps evict() in another process from removing the mirror
+        # until the clone finishes
+        with _locked(path, exclusive=False, in_use=True) as in_use:
+            with _locked(path, exclusive=True) as lock:
+                updated = in_use is not None and lock is not None and _update_locked(url, path, timeout)
+            if not updated:
+                yield None
+                return
+            with _locked(path, exclusive=False):
+                yield path
+    finally:
+        max_size = get_max_size()
+        if max_size is not None:
+            evict(max_size, keep=[path])
+
+
+def _get_size(path):
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def evict(max_size, keep=()):
+    """
+    removes the least recently used mirrors until all mirrors take at
+    most max_size bytes. Mirrors in keep and mirrors in use by other
+    processes are not removed.
+
+    :returns: list of the removed mirror paths
+    """
+    if _mirror_dir is None or not os.path.isdir(_mirror_dir):
+        return []
+    mirrors = []
+    for name in os.listdir(_mirror_dir):
+        path = os.path.join(_mirror_dir, name)
+        if name.endswith('.git') and os.path.isdir(path):
+            lockname = _get_lockname(path)
+            last_use = os.path.getmtime(lockname) if os.path.exists(lockname) else 0
+            mirrors.append((last_use, path, _get_size(path)))
+    total = sum(size for _, _, size in mirrors)
+    removed = []
+    for _, path, size in sorted(mirrors):
+        if total <= max_size:
+            break
+        if path in keep:
+            continue
+        with _locked(path, exclusive=True, blocking=False) as locked:
+            if not locked:
+                continue
+            with _locked(path, exclusive=True, blocking=False, in_use=True) as unused:
+                if not unused:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                for in_use in (False, True):
+                    try:
+                        os.remove(_get_lockname(path, in_use))
+                    except OSError:
+                        pass
+        total -= size
+        removed.append(path)
+    return removed
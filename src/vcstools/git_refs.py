@@ -0,0 +1,609 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+reading git refs, HEAD and config without running git.
+
+Queries like the current branch or the url of a remote only need a few
+small files below .git. GitRefsReader reads HEAD, loose refs,
+packed-refs and the config from python, so such queries cost no
+process. Worktrees and submodules with a .git file pointing to the
+actual git directory are supported.
+
+Config files are read in the order git reads them: the system config
+(/etc/gitconfig, or GIT_CONFIG_SYSTEM, unless GIT_CONFIG_NOSYSTEM is
+set), the global config ($XDG_CONFIG_HOME/git/config and ~/.gitconfig,
+or GIT_CONFIG_GLOBAL), the repository config and config.worktree.
+include.path and the gitdir: and onbranch: conditions of includeIf are
+followed. git builds installed below another prefix read their system
+config from there, which the reader does not see.
+
+Layouts the reader does not understand (reftable ref storage, other
+includeIf conditions, repositories selected through GIT_DIR and
+similar variables) raise UnsupportedRepository, callers are expected
+to fall back to running git then. get_config accepts a function doing
+so, whose result is cached like parsed files.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import re
+import threading
+
+
+class UnsupportedRepository(Exception):
+    """raised when a repository cannot be read without git"""
+    pass
+
+
+# environment variables which make git look elsewhere than <path>/.git
+_GIT_ENV_VARS = ['GIT_DIR', 'GIT_COMMON_DIR', 'GIT_CONFIG', 'GIT_CONFIG_PARAMETERS',
+                 'GIT_CONFIG_COUNT', 'GIT_REF_PARANOIA']
+
+_SYSTEM_CONFIG = '/etc/gitconfig'
+
+# characters or sequences git does not allow in ref names
+_INVALID_REF = re.compile(r'(\.\.|@\{|[\x00-\x20\x7f~^:?*\[\\]|//|/\.|^\.|^/|/$|\.lock$|\.lock/|\.$)')
+
+# maximum depth of include.path files and symbolic ref chains, as git
+_MAX_DEPTH = 10
+
+_SHA_RE = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+
+
+def is_valid_ref_name(refname):
+    """
+    :returns: False for names git would not accept as ref, such as
+      names containing '..' or whitespace
+    """
+    return bool(refname) and _INVALID_REF.search(refname) is None
+
+
+def _stat_signature(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+
+def _read_file(filename):
+    """
+    :returns: decoded contents of filename, or None if it does not exist
+    """
+    try:
+        with open(filename, 'rb') as fhand:
+            return fhand.read().decode('utf-8')
+    except (IOError, OSError):
+        return None
+
+
+def _normalize_config_key(key):
+    """
+    section and variable names are case insensitive, subsections are not
+    """
+    parts = key.split('.')
+    if len(parts) < 2:
+        raise ValueError('Invalid config key: %s' % key)
+    section = parts[0].lower()
+    name = parts[-1].lower()
+    if len(parts) == 2:
+        return '%s.%s' % (section, name)
+    return '%s.%s.%s' % (section, '.'.join(parts[1:-1]), name)
+
+
+def _is_env_true(name):
+    return os.environ.get(name, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _get_global_config_files():
+    """
+    :returns: paths of the system and global config files git reads,
+      existing or not
+    :raises: UnsupportedRepository if the system config is unknown
+    """
+    files = []
+    if not _is_env_true('GIT_CONFIG_NOSYSTEM'):
+        system_config = os.environ.get('GIT_CONFIG_SYSTEM')
+        if system_config is None:
+            if os.name == 'nt':
+                # git for windows keeps it below its installation directory
+                raise UnsupportedRepository('Unknown system config')
+            system_config = _SYSTEM_CONFIG
+        files.append(system_config)
+    global_config = os.environ.get('GIT_CONFIG_GLOBAL')
+    if global_config is not None:
+        files.append(global_config)
+    else:
+        xdg_config_home = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+        files.append(os.path.join(xdg_config_home, 'git', 'config'))
+        files.append(os.path.join(os.path.expanduser('~'), '.gitconfig'))
+    return [filename for filename in files if filename]
+
+
+def _wildmatch_regex(pattern, ignore_case=False):
+    """
+    translates a wildmatch pattern as used by includeIf, where '*'
+    does not match '/' and '**/' matches any number of directories
+
+    :returns: compiled regular expression matching whole strings
+    :raises: UnsupportedRepository for character classes like [:alpha:]
+    """
+    parts = []
+    index = 0
+    length = len(pattern)
+    while index < length:
+        char = pattern[index]
+        at_slash = index == 0 or pattern[index - 1] == '/'
+        if pattern.startswith('**/', index) and at_slash:
+            parts.append('(?:.*/)?')
+            index += 3
+            continue
+        if pattern.startswith('**', index) and at_slash and index + 2 == length:
+            parts.append('.*')
+            index += 2
+            continue
+        if char == '*':
+            # other consecutive asterisks are regular asterisks
+            while index < length and pattern[index] == '*':
+                index += 1
+            parts.append('[^/]*')
+            continue
+        if char == '?':
+            parts.append('[^/]')
+        elif char == '[':
+            end = index + 1
+            if end < length and pattern[end] in '!^':
+                end += 1
+            if end < length and pattern[end] == ']':
+                end += 1
+            end = pattern.find(']', end)
+            if end < 0:
+                parts.append(re.escape(char))
+            else:
+                body = pattern[index + 1:end]
+                if '[:' in body or '\\' in body:
+                    raise UnsupportedRepository('Unsupported pattern %s' % pattern)
+                if body[:1] in ('!', '^'):
+                    body = '^/' + body[1:]
+                parts.append('[%s]' % body)
+                index = end
+        elif char == '\\' and index + 1 < length:
+            index += 1
+            parts.append(re.escape(pattern[index]))
+        else:
+            parts.append(re.escape(char))
+        index += 1
+    return re.compile('(?:%s)\\Z' % ''.join(parts), re.IGNORECASE if ignore_case else 0)
+
+
+_CONFIG_SECTION_RE = re.compile(r'^\s*([A-Za-z0-9.-]+)\s*(?:"((?:[^"\\]|\\.)*)")?\s*$')
+_CONFIG_NAME_RE = re.compile(r'[A-Za-z][A-Za-z0-9-]*')
+
+_CONFIG_ESCAPES = {'n': '\n', 't': '\t', 'b': '\b', '"': '"', '\\': '\\'}
+
+
+def parse_config(text, filename=None):
+    """
+    parses the contents of a git config file
+
+    :param filename: used in error messages
+    :returns: list of (key, value) in file order, keys normalized as
+      section[.subsection].name, value is None for keys without '='
+    :raises: ValueError on syntax errors
+    """
+    entries = []
+    section = None
+    pos = 0
+    length = len(text)
+    while pos < length:
+        char = text[pos]
+        if char in ' \t\r\n':
+            pos += 1
+        elif char in '#;':
+            pos = text.find('\n', pos)
+            if pos < 0:
+                pos = length
+        elif char == '[':
+            end = text.find(']', pos)
+            if end < 0:
+                raise ValueError('Bad section header in %s' % filename)
+            header = text[pos + 1:end]
+            pos = end + 1
+            match = _CONFIG_SECTION_RE.match(header)
+            if match is None:
+                raise ValueError('Bad section header in %s: [%s]' % (filename, header))
+            name, subsection = match.groups()
+            if subsection is not None:
+                section = '%s.%s' % (name.lower(), re.sub(r'\\(.)', r'\1', subsection))
+            else:
+                # also covers the deprecated [section.subsection] syntax,
+                # which git lowercases completely
+                section = name.lower()
+        else:
+            match = _CONFIG_NAME_RE.match(text, pos)
+            if match is None or section is None:
+                raise ValueError('Bad config line in %s at offset %d' % (filename, pos))
+            key = '%s.%s' % (section, match.group(0).lower())
+            pos = match.end()
+            while pos < length and text[pos] in ' \t':
+                pos += 1
+            if pos >= length or text[pos] in '\r\n#;':
+                entries.append((key, None))
+                continue
+            if text[pos] != '=':
+                raise ValueError('Bad config line in %s at offset %d' % (filename, pos))
+            value, pos = _parse_config_value(text, pos + 1, filename)
+            entries.append((key, value))
+    return entries
+
+
+def _parse_config_value(text, pos, filename):
+    """
+    :returns: (value, position after value)
+    """
+    value = []
+    # length of value without trailing unquoted whitespace
+    trimmed = 0
+    quoted = False
+    length = len(text)
+    while pos < length:
+        char = text[pos]
+        pos += 1
+        if char == '\n':
+            if quoted:
+                raise ValueError('Unterminated quote in %s' % filename)
+            break
+        if char == '\\':
+            if pos >= length:
+                raise ValueError('Bad escape in %s' % filename)
+            escaped = text[pos]
+            pos += 1
+            if escaped == '\n':
+                # line continuation
+                continue
+            if escaped == '\r' and pos < length and text[pos] == '\n':
+                pos += 1
+                continue
+            if escaped not in _CONFIG_ESCAPES:
+                raise ValueError('Bad escape in %s' % filename)
+            value.append(_CONFIG_ESCAPES[escaped])
+            trimmed = len(value)
+        elif char == '"':
+            quoted = not quoted
+        elif char in '#;' and not quoted:
+            newline = text.find('\n', pos)
+            pos = length if newline < 0 else newline + 1
+            break
+        elif char in ' \t\r' and not quoted:
+            if value:
+                value.append(char)
+        else:
+            value.append(char)
+            trimmed = len(value)
+    if quoted:
+        raise ValueError('Unterminated quote in %s' % filename)
+    return ''.join(value[:trimmed]), pos
+
+
+def parse_config_list(output):
+    """
+    parses the output of git config --list -z
+
+    :returns: dict mapping normalized keys to lists of values, as
+      GitRefsReader.get_config
+    """
+    config = {}
+    for entry in output.split('\0'):
+        if not entry:
+            continue
+        key, _, value = entry.partition('\n')
+        config.setdefault(_normalize_config_key(key), []).append(value)
+    return config
+
+
+class GitRefsReader(object):
+    """
+    reads HEAD, refs and config of the git repository checked out at
+    path. Parsed packed-refs and config files are cached until they
+    change on disk. Instances are safe to share between threads.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        # (gitdir, commondir) once found
+        self._dirs = None
+        # (stat signature, {refname: sha})
+        self._packed_refs = None
+        # (config files, [(filename, stat signature)] of all files read,
+        #  {key: [values]}, error message of unreadable files or None)
+        self._config = None
+
+    def _get_dirs(self):
+        """
+        :returns: (gitdir, commondir), commondir holding refs and config
+          shared between worktrees
+        :raises: UnsupportedRepository
+        """
+        if self._dirs is not None:
+            return self._dirs
+        for name in _GIT_ENV_VARS:
+            if os.environ.get(name):
+                raise UnsupportedRepository('%s is set' % name)
+        dotgit = os.path.join(self._path, '.git')
+        if os.path.isdir(dotgit):
+            gitdir = dotgit
+        elif os.path.isfile(dotgit):
+            # submodules and worktrees: "gitdir: <path>"
+            content = _read_file(dotgit) or ''
+            if not content.startswith('gitdir: '):
+                raise UnsupportedRepository('Invalid .git file in %s' % self._path)
+            gitdir = os.path.join(self._path, content[len('gitdir: '):].strip())
+        else:
+            raise UnsupportedRepository('No .git in %s' % self._path)
+        gitdir = os.path.normpath(gitdir)
+        commondir = gitdir
+        content = _read_file(os.path.join(gitdir, 'commondir'))
+        if content is not None:
+            commondir = os.path.normpath(os.path.join(gitdir, content.strip()))
+        if not os.path.isfile(os.path.join(gitdir, 'HEAD')):
+            raise UnsupportedRepository('No HEAD in %s' % gitdir)
+        if os.path.exists(os.path.join(commondir, 'reftable')):
+            raise UnsupportedRepository('reftable ref storage in %s' % commondir)
+        self._dirs = (gitdir, commondir)
+        return self._dirs
+
+    def _read_loose_ref(self, refname):
+        """
+        :returns: contents of the loose ref file, or None
+        """
+        gitdir, commondir = self._get_dirs()
+        if refname == 'HEAD' or refname.startswith('refs/bisect/') or refname.startswith('refs/worktree/'):
+            # per worktree refs
+            basedir = gitdir
+        else:
+            basedir = commondir
+        filename = os.path.join(basedir, *refname.split('/'))
+        if os.path.isdir(filename):
+            return None
+        content = _read_file(filename)
+        if content is None:
+            return None
+        return content.strip()
+
+    def get_packed_refs(self):
+        """
+        :returns: dict of refname to SHA from packed-refs
+        """
+        _, commondir = self._get_dirs()
+        filename = os.path.join(commondir, 'packed-refs')
+        signature = _stat_signature(filename)
+        with self._lock:
+            if self._packed_refs is not None and self._packed_refs[0] == signature:
+                return self._packed_refs[1]
+        refs = {}
+        if signature is not None:
+            for line in (_read_file(filename) or '').splitlines():
+                if not line or line[0] in '#^':
+                    continue
+                sha, _, refname = line.partition(' ')
+                refs[refname.strip()] = sha
+        with self._lock:
+            self._packed_refs = (signature, refs)
+        return refs
+
+    def resolve_ref(self, refname):
+        """
+        follows symbolic refs
+
+        :param refname: full refname like 'refs/heads/master', or 'HEAD'
+        :returns: (refname, SHA) of the final ref, SHA is None if the
+          final ref does not exist. None if refname is invalid
+        :raises: UnsupportedRepository
+        """
+        if refname != 'HEAD' and not is_valid_ref_name(refname):
+            return None
+        for _ in range(_MAX_DEPTH):
+            content = self._read_loose_ref(refname)
+            if content is None:
+                return (refname, self.get_packed_refs().get(refname))
+            if content.startswith('ref:'):
+                refname = content[len('ref:'):].strip()
+                if not is_valid_ref_name(refname):
+                    raise UnsupportedRepository('Invalid symbolic ref %s' % refname)
+                continue
+            if not _SHA_RE.match(content):
+                raise UnsupportedRepository('Invalid ref %s' % refname)
+            return (refname, content)
+        raise UnsupportedRepository('Symbolic ref loop at %s' % refname)
+
+    def ref_exists(self, refname):
+        """
+        :returns: True if refname (e.g. 'refs/tags/foo') exists
+        :raises: UnsupportedRepository
+        """
+        resolved = self.resolve_ref(refname)
+        return resolved is not None and resolved[1] is not None
+
+    def get_head_branch(self):
+        """
+        :returns: name of the checked out branch, or None if HEAD is
+          detached or the branch has no commit yet
+        :raises: UnsupportedRepository
+        """
+        content = self._read_loose_ref('HEAD')
+        if content is None:
+            raise UnsupportedRepository('No HEAD')
+        if not content.startswith('ref:'):
+            if not _SHA_RE.match(content):
+                raise UnsupportedRepository('Invalid HEAD: %s' % content)
+            return None
+        refname = content[len('ref:'):].strip()
+        if not refname.startswith('refs/heads/'):
+            raise UnsupportedRepository('HEAD points to %s' % refname)
+        if not self.ref_exists(refname):
+            return None
+        return refname[len('refs/heads/'):]
+
+    def _config_files(self):
+        gitdir, commondir = self._get_dirs()
+        files = _get_global_config_files()
+        files.append(os.path.join(commondir, 'config'))
+        if gitdir != commondir:
+            files.append(os.path.join(gitdir, 'config.worktree'))
+        return files
+
+    def get_config(self, fallback=None):
+        """
+        :param fallback: function returning the config in the same
+          format when it cannot be read from python, e.g. by running
+          git. Its result is cached until the config files change.
+        :returns: dict mapping normalized keys to lists of values, in
+          the order git applies them
+        :raises: UnsupportedRepository unless fallback is given
+        """
+        try:
+            files = self._config_files()
+        except UnsupportedRepository:
+            if fallback is None:
+                raise
+            return fallback()
+        with self._lock:
+            cached = self._config
+        if cached is not None and cached[0] == files and all(_stat_signature(filename) == signature
+                                                             for filename, signature in cached[1]):
+            _, read_files, config, error = cached
+        else:
+            read_files = []
+            config = {}
+            errors = []
+            for filename in files:
+                self._read_config_file(filename, config, read_files, errors, 0)
+            error = errors[0] if errors else None
+            if error is not None:
+                config = None
+        if config is None:
+            if fallback is None:
+                raise UnsupportedRepository(error)
+            config = fallback()
+        with self._lock:
+            self._config = (files, read_files, config, error)
+        return config
+
+    def _read_config_file(self, filename, config, read_files, errors, depth):
+        """
+        reads filename and its includes into config. Files that cannot
+        be read are added to errors, so that the signatures of all files
+        are known anyway.
+        """
+        if depth > _MAX_DEPTH:
+            errors.append('include.path nested too deeply in %s' % filename)
+            return
+        read_files.append((filename, _stat_signature(filename)))
+        text = _read_file(filename)
+        if text is None:
+            return
+        try:
+            entries = parse_config(text, filename)
+        except ValueError as exc:
+            errors.append(str(exc))
+            return
+        for key, value in entries:
+            if key == 'extensions.refstorage' and value != 'files':
+                errors.append('ref storage %s in %s' % (value, filename))
+            if key == 'include.path' or (key.startswith('includeif.') and key.endswith('.path')):
+                if not value:
+                    continue
+                include = os.path.expanduser(value)
+                if not os.path.isabs(include):
+                    include = os.path.join(os.path.dirname(filename), include)
+                if key != 'include.path':
+                    try:
+                        included = self._is_include_condition_true(key[len('includeif.'):-len('.path')],
+                                                                   filename, read_files)
+                    except UnsupportedRepository as exc:
+                        errors.append(str(exc))
+                        read_files.append((include, _stat_signature(include)))
+                        continue
+                    if not included:
+                        continue
+                self._read_config_file(include, config, read_files, errors, depth + 1)
+                continue
+            if value is None:
+                # "key" without value means true, but git config --get prints ''
+                value = ''
+            config.setdefault(key, []).append(value)
+
+    def _is_include_condition_true(self, condition, filename, read_files):
+        """
+        :param condition: condition of includeIf like 'gitdir:~/work/'
+        :param filename: config file containing the condition
+        :param read_files: list to add the signatures of files the
+          result depends on to
+        :raises: UnsupportedRepository for unknown conditions
+        """
+        kind, _, pattern = condition.partition(':')
+        if pattern.endswith('/'):
+            pattern += '**'
+        if kind in ('gitdir', 'gitdir/i'):
+            if pattern.startswith('~/'):
+                pattern = os.path.expanduser('~') + pattern[1:]
+            elif pattern.startswith('./'):
+                pattern = os.path.dirname(os.path.realpath(filename)) + pattern[1:]
+            elif not os.path.isabs(pattern):
+                pattern = '**/' + pattern
+            regex = _wildmatch_regex(pattern, ignore_case=kind == 'gitdir/i')
+            gitdir = os.path.abspath(self._get_dirs()[0])
+            return bool(regex.match(gitdir) or regex.match(os.path.realpath(gitdir)))
+        if kind == 'onbranch':
+            head = os.path.join(self._get_dirs()[0], 'HEAD')
+            read_files.append((head, _stat_signature(head)))
+            content = (_read_file(head) or '').strip()
+            if not content.startswith('ref: refs/heads/'):
+                return False
+            return bool(_wildmatch_regex(pattern).match(content[len('ref: refs/heads/'):].strip()))
+        raise UnsupportedRepository('Unsupported includeIf condition %s in %s' % (condition, filename))
+
+    def get_config_value(self, key, fallback=None):
+        """
+        like git config --get
+
+        :param key: like 'remote.origin.url'
+        :param fallback: see get_config
+        :returns: last value of key, or None
+        :raises: UnsupportedRepository unless fallback is given
+        """
+        values = self.get_config(fallback).get(_normalize_config_key(key))
+        if not values:
+            return None
+        return values[-1]
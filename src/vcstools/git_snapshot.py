@@ -0,0 +1,227 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+immutable snapshot of the refs of a git repository.
+
+Deciding how to update a checkout needs the current branch, its
+upstream, and whether names are branches or tags. Querying each of
+these separately runs git several times, and the answers may come from
+different repository states. GitClient.snapshot() gathers all of them
+with one ``git for-each-ref`` and one ``git rev-parse`` into a
+GitSnapshot, which answers such queries, also for many names at once,
+without running git again.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import hashlib
+
+
+# refname, SHA of the ref, SHA of the commit an annotated tag points to
+FOR_EACH_REF_FORMAT = '%(refname)%00%(objectname)%00%(*objectname)'
+
+
+def parse_for_each_ref(lines):
+    """
+    :param lines: output lines of git for-each-ref with FOR_EACH_REF_FORMAT
+    :returns: dict of refname to commit SHA (peeled for annotated tags)
+    """
+    refs = {}
+    for line in lines:
+        fields = line.split('\0')
+        if len(fields) != 3:
+            continue
+        refname, sha, peeled = fields
+        refs[refname] = peeled or sha
+    return refs
+
+
+def get_branch_parent_candidates(branch_reference):
+    """
+    :param branch_reference: value of branch.<name>.merge
+    :returns: names of remote branches the reference may denote, in
+      the order git checks them
+    """
+    # branch_reference is either refname, or /refs/heads/refname, or
+    # heads/refname we would like to return refname however,
+    # user could also have named any branch
+    # "/refs/heads/refname", for some unholy reason check all
+    # known branches on remote for refname, then for the odd
+    # cases, as git seems to do
+    candidate = branch_reference
+    if candidate.startswith('refs/'):
+        candidate = candidate[len('refs/'):]
+    if candidate.startswith('heads/'):
+        candidate = candidate[len('heads/'):]
+    elif candidate.startswith('tags/'):
+        candidate = candidate[len('tags/'):]
+    elif candidate.startswith('remotes/'):
+        candidate = candidate[len('remotes/'):]
+    if branch_reference != candidate:
+        return [candidate, branch_reference]
+    return [candidate]
+
+
+class GitSnapshot(object):
+    """
+    refs of a repository at one point in time. Instances are immutable,
+    the properties return copies.
+    """
+
+    __slots__ = ['head', 'branch', 'upstream', 'default_remote', '_refs', '_targets', '_digest', '_frozen']
+
+    def __init__(self, head, branch, refs, upstream=(None, None), default_remote='origin'):
+        """
+        :param head: SHA of HEAD, None if there is no commit yet
+        :param branch: name of the checked out branch, None if detached
+        :param refs: dict of full refname to commit SHA
+        :param upstream: (branch, remote) tracked by branch, as
+          GitClient._get_branch_parent returns it
+        """
+        self.head = head
+        self.branch = branch
+        self.upstream = tuple(upstream)
+        self.default_remote = default_remote
+        self._refs = dict(refs)
+        self._targets = frozenset(self._refs.values())
+        self._digest = hashlib.sha1('\n'.join('%s %s' % item for item in sorted(self._refs.items()))
+                                    .encode('utf-8')).hexdigest()
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('GitSnapshot is immutable')
+        object.__setattr__(self, name, value)
+
+    def _get_refs(self, prefix):
+        return dict((refname[len(prefix):], sha)
+                    for refname, sha in self._refs.items()
+                    if refname.startswith(prefix))
+
+    @property
+    def refs(self):
+        """dict of full refname to commit SHA"""
+        return dict(self._refs)
+
+    @property
+    def targets(self):
+        """frozenset of the commit SHAs refs point to"""
+        return self._targets
+
+    @property
+    def digest(self):
+        """
+        hex digest of all refs and their SHAs, equal for snapshots of
+        the same state of refs
+        """
+        return self._digest
+
+    @property
+    def branches(self):
+        """dict of local branch name to commit SHA"""
+        return self._get_refs('refs/heads/')
+
+    @property
+    def remote_branches(self):
+        """dict of remote branch name (like 'origin/master') to commit SHA"""
+        return self._get_refs('refs/remotes/')
+
+    @property
+    def tags(self):
+        """dict of tag name to commit SHA"""
+        return self._get_refs('refs/tags/')
+
+    def is_local_branch(self, name):
+        return 'refs/heads/%s' % name in self._refs
+
+    def is_remote_branch(self, name, remote_name=None):
+        """
+        :param remote_name: defaults to default_remote
+        """
+        return 'refs/remotes/%s/%s' % (remote_name or self.default_remote, name) in self._refs
+
+    def is_tag(self, name):
+        return 'refs/tags/%s' % name in self._refs
+
+    def classify(self, names, remote_name=None):
+        """
+        :param names: iterable of names
+        :returns: dict mapping each name to a tuple of the kinds of refs
+          it names, among 'branch', 'remote_branch' and 'tag'
+        """
+        result = {}
+        for name in names:
+            kinds = []
+            if self.is_local_branch(name):
+                kinds.append('branch')
+            if self.is_remote_branch(name, remote_name):
+                kinds.append('remote_branch')
+            if self.is_tag(name):
+                kinds.append('tag')
+            result[name] = tuple(kinds)
+        return result
+
+    def resolve(self, spec):
+        """
+        resolves HEAD and ref names like git does, without considering
+        other revision syntax
+
+        :returns: commit SHA, or None if spec is not HEAD or a ref
+        """
+        if spec is None or spec == 'HEAD':
+            return self.head
+        for refname in [spec,
+                        'refs/%s' % spec,
+                        'refs/tags/%s' % spec,
+                        'refs/heads/%s' % spec,
+                        'refs/remotes/%s' % spec,
+                        'refs/remotes/%s/HEAD' % spec]:
+            if refname in self._refs:
+                return self._refs[refname]
+        return None
+
+    def get_current_version_label(self):
+        """
+        :returns: label as GitClient.get_current_version_label
+        """
+        if self.branch is None:
+            return '<detached>'
+        result = self.branch
+        (remote_branch, remote) = self.upstream
+        if remote_branch is not None:
+            # if not following 'origin/branch', display 'branch < tracked ref'
+            if (remote_branch != self.branch or remote != self.default_remote):
+                result += ' < '
+                if remote != self.default_remote:
+                    result += remote + '/'
+                result += remote_branch
+        return result
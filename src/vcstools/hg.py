@@ -41,21 +41,28 @@ from __future__ import absolute_import, print_function, unicode_literals
 import os
 import sys
 
-import gzip
-
-import dateutil.parser  # For parsing date strings
 
 from vcstools.vcs_base import VcsClientBase, VcsError
-from vcstools.common import sanitized, normalized_rel_path, run_shell_command
+from vcstools.common import normalized_rel_path, run_command, CommandLines
+from vcstools.tool_versions import get_tool_version
+from vcstools import compression
+from vcstools import log_cache
+from vcstools.diff_entry import DiffEntry, iter_git_format_diff
+from vcstools.log_entry import LogEntry, parse_hgdate
+from vcstools.status_entry import StatusEntry
 
 
 def _get_hg_version():
+    """Looks up hg version, calling hg --version once per hg binary.
+    :raises: VcsError if hg is not installed"""
+    return get_tool_version('hg', _probe_hg_version)
+
+
+def _probe_hg_version():
     """Looks up hg version by calling hg --version.
     :raises: VcsError if hg is not installed"""
     try:
-        value, output, _ = run_shell_command('hg --version',
-                                             shell=True,
-                                             us_env=True)
+        value, output, _ = run_command(['hg', '--version'], us_env=True)
         if value == 0 and output is not None and len(output.splitlines()) > 0:
             version = output.splitlines()[0]
         else:
@@ -66,21 +73,18 @@ def _get_hg_version():
 
 
 # hg diff cannot seem to be persuaded to accept a different prefix for filenames
-def _hg_diff_path_change(diff, path):
+def _iter_hg_diff_path_change(lines, path):
     """
-    Parses hg diff result and changes the filename prefixes.
+    Changes the filename prefixes in lines of hg diff output, yields
+    the non-empty lines.
     """
-    if diff is None:
-        return None
     INIT = 0
     INDIFF = 1
     # small state machine makes sure we never touch anything inside
     # the actual diff
     state = INIT
 
-    s_list = [line for line in diff.split(os.linesep)]
-    lines = []
-    for line in s_list:
+    for line in lines:
         if line.startswith("diff"):
             state = INIT
         if state == INIT:
@@ -101,9 +105,136 @@ def _hg_diff_path_change(diff, path):
         else:
             newline = line
         if newline != '':
-            lines.append(newline)
-    result = "\n".join(lines)
-    return result
+            yield newline
+
+
+def _hg_diff_path_change(diff, path):
+    """
+    Parses hg diff result and changes the filename prefixes.
+    """
+    if diff is None:
+        return None
+    return "\n".join(_iter_hg_diff_path_change(diff.split(os.linesep), path))
+
+
+HG_COMMIT_FIELDS = ['id', 'author', 'email', 'date', 'message']
+HG_LOG_FORMAT = '\x1f'.join(['{node|short}', '{author|person}',
+                             '{autor|email}', '{date|hgdate}',
+                             '{desc}']) + '\x1e'
+# records for vcstools.log_cache
+HG_LOG_CACHE_FORMAT = '\x1e' + HG_LOG_FORMAT[:-1] + '\x1f{p2rev}\x1f{join(files, "\x1d")}'
+
+
+def _iter_hg_log_cache_records(chunks):
+    """
+    parses hg log output produced with HG_LOG_CACHE_FORMAT, split into
+    chunks at the \\x1e separators
+
+    :returns: iterator of vcstools.log_cache records
+    """
+    for chunk in chunks:
+        if chunk.strip() == '':
+            continue
+        fields = chunk.split('\x1f')
+        yield {'id': fields[0],
+               'fields': fields[:5],
+               'merge': fields[5] != '-1',
+               'paths': [name for name in fields[6].split('\x1d') if name]}
+
+
+def _hg_log_entry(fields):
+    return LogEntry.from_values('\x1f'.join(fields).strip().split('\x1f'), date_parser=parse_hgdate)
+
+
+def _iter_hg_log(records):
+    """
+    parses hg log output produced with HG_LOG_FORMAT, split into
+    records at the \\x1e separators
+
+    :returns: iterator of LogEntry with keys HG_COMMIT_FIELDS
+    """
+    for record in records:
+        if record.strip() != '':
+            yield _hg_log_entry([record])
+
+
+def _parse_hg_log(response_str):
+    """
+    parses hg log output produced with HG_LOG_FORMAT
+
+    :returns: list of LogEntry with keys HG_COMMIT_FIELDS
+    """
+    return list(_iter_hg_log(response_str.split("\x1e")))
+
+
+def _parse_hg_changeset(output, spec):
+    """
+    :returns: the SHA-ID of the single changeset in hg log output, or None
+    """
+    matches = [l for l in output.splitlines() if l.startswith('changeset: ')]
+    if len(matches) == 1:
+        return matches[0].split(':')[2]
+    sys.stderr.write("Warning: found several candidates for hg spec %s" % spec)
+    return None
+
+
+def _parse_hg_identify(output):
+    if output is None or output.strip() == '' or output.startswith("abort"):
+        return None
+    # hg adds a '+' to the end if there are uncommited
+    # changes, inconsistent to hg log
+    return output.strip().rstrip('+')
+
+
+def _check_hg_status(response, command, path):
+    """
+    :raises: VcsError if hg aborted
+    """
+    if response is not None and response.startswith("abort"):
+        raise VcsError("Probable Bug; Could not call %s, cwd=%s" % (command, path))
+
+
+def _parse_hg_status(output):
+    """
+    parses the output of hg status -0 -C
+
+    :returns: list of StatusEntry with paths relative to the repository root
+    """
+    entries = []
+    for field in output.split('\0'):
+        if field.startswith('  ') and entries:
+            # source of the copy or rename listed before
+            entries[-1] = entries[-1]._replace(orig_path=field[2:])
+        elif len(field) > 2:
+            entries.append(StatusEntry(field[2:], field[0]))
+    return entries
+
+
+def _iter_hg_diff_summary(entries):
+    """
+    :param entries: StatusEntry list of hg status -C -mard
+    :returns: generator of DiffEntry, renames merging the added and
+      the removed entry
+    """
+    removed = set(entry.path for entry in entries if entry.index in 'R!')
+    moved = set(entry.orig_path for entry in entries
+                if entry.index == 'A' and entry.orig_path in removed)
+    for entry in entries:
+        if entry.index == 'A' and entry.orig_path is not None:
+            yield DiffEntry(entry.path, 'R' if entry.orig_path in moved else 'C', entry.orig_path)
+        elif entry.index in 'R!':
+            if entry.path not in moved:
+                yield DiffEntry(entry.path, 'D')
+        else:
+            yield DiffEntry(entry.path, entry.index)
+
+
+def _format_hg_status(entries, rel_path):
+    """
+    formats StatusEntry records like hg status, prepending rel_path
+    """
+    return ''.join('%s %s\n' % (entry.index, os.path.normpath(os.path.join(rel_path, entry.path)))
+                   for entry in entries)
 
 
 class HgClient(VcsClientBase):
@@ -130,11 +261,9 @@ class HgClient(VcsClientBase):
         command), or None if it cannot be determined
         """
         if self.detect_presence():
-            cmd = "hg paths default"
-            _, output, _ = run_shell_command(cmd,
-                                             shell=True,
-                                             cwd=self._path,
-                                             us_env=True)
+            _, output, _ = run_command(['hg', 'paths', 'default'],
+                                       cwd=self._path,
+                                       us_env=True)
             return output.rstrip()
         return None
 
@@ -153,20 +282,16 @@ class HgClient(VcsClientBase):
         except OSError:
             # OSError thrown if directory already exists this is ok
             pass
-        cmd = "hg clone %s %s" % (sanitized(url), self._path)
-        value, _, msg = run_shell_command(cmd,
-                                          shell=True,
-                                          no_filter=True)
+        value, _, msg = run_command(['hg', 'clone', url, self._path],
+                                    no_filter=True)
         if value != 0:
             if msg:
                 sys.logger.error('%s' % msg)
             return False
         if version is not None and version.strip() != '':
-            cmd = "hg checkout %s" % sanitized(version)
-            value, _, msg = run_shell_command(cmd,
-                                              cwd=self._path,
-                                              shell=True,
-                                              no_filter=True)
+            value, _, msg = run_command(['hg', 'checkout', version],
+                                        cwd=self._path,
+                                        no_filter=True)
             if value != 0:
                 if msg:
                     sys.stderr.write('%s\n' % msg)
@@ -174,26 +299,26 @@ class HgClient(VcsClientBase):
         return True
 
     def update(self, version='', verbose=False, timeout=None):
-        verboseflag = ''
-        if verbose:
-            verboseflag = '--verbose'
         if not self.detect_presence():
             sys.stderr.write("Error: cannot update non-existing directory\n")
             return True
         if not self._do_pull():
             return False
-        if version is not None and version.strip() != '':
-            cmd = "hg checkout %s %s" % (verboseflag, sanitized(version))
-        else:
-            cmd = "hg update %s --config ui.merge=internal:fail" % verboseflag
-        value, _, _ = run_shell_command(cmd,
-                                        cwd=self._path,
-                                        shell=True,
-                                        no_filter=True)
+        value, _, _ = run_command(self._get_update_command(version, verbose),
+                                  cwd=self._path,
+                                  no_filter=True)
         if value != 0:
             return False
         return True
 
+    def _get_update_command(self, version, verbose):
+        verboseflag = []
+        if verbose:
+            verboseflag = ['--verbose']
+        if version is not None and version.strip() != '':
+            return ['hg', 'checkout'] + verboseflag + [version]
+        return ['hg', 'update'] + verboseflag + ['--config', 'ui.merge=internal:fail']
+
     def get_version(self, spec=None):
         """
         :param spec: (optional) token for identifying version. spec can be
@@ -206,36 +331,25 @@ class HgClient(VcsClientBase):
         # detect presence only if we need path for cwd in popen
         if spec is not None:
             if self.detect_presence():
-                command = 'hg log -r %s' % sanitized(spec)
+                command = ['hg', 'log', '-r', spec]
                 repeated = False
                 output = ''
                 # we repeat the call once after pullin if necessary
                 while output == '':
-                    _, output, _ = run_shell_command(command,
-                                                     shell=True,
-                                                     cwd=self._path,
-                                                     us_env=True)
+                    _, output, _ = run_command(command,
+                                               cwd=self._path,
+                                               us_env=True)
                     if (output.strip() != '' and
                             not output.startswith("abort") or
                             repeated is True):
-
-                        matches = [l for l in output.splitlines() if l.startswith('changeset: ')]
-                        if len(matches) == 1:
-                            return matches[0].split(':')[2]
-                        else:
-                            sys.stderr.write("Warning: found several candidates for hg spec %s" % spec)
-                        break
+                        return _parse_hg_changeset(output, spec)
                     self._do_pull()
                     repeated = True
             return None
         else:
-            command = 'hg identify -i %s' % self._path
-            _, output, _ = run_shell_command(command, shell=True, us_env=True)
-            if output is None or output.strip() == '' or output.startswith("abort"):
-                return None
-            # hg adds a '+' to the end if there are uncommited
-            # changes, inconsistent to hg log
-            return output.strip().rstrip('+')
+            command = ['hg', 'identify', '-i', self._path]
+            _, output, _ = run_command(command, us_env=True)
+            return _parse_hg_identify(output)
 
     def get_current_version_label(self):
         """
@@ -250,8 +364,8 @@ class HgClient(VcsClientBase):
 
     def get_branch(self):
         if self.path_exists():
-            command = "hg branch --repository %s" % self.get_path()
-            _, output, _ = run_shell_command(command, shell=True)
+            command = ['hg', 'branch', '--repository', self.get_path()]
+            _, output, _ = run_command(command)
             if output is not None:
                 return output.strip()
         return None
@@ -271,14 +385,38 @@ class HgClient(VcsClientBase):
             basepath = self._path
         if self.path_exists():
             rel_path = normalized_rel_path(self._path, basepath)
-            command = "hg diff -g %(path)s --repository %(path)s" % {'path': sanitized(rel_path)}
-            _, response, _ = run_shell_command(command, shell=True, cwd=basepath)
-            response = _hg_diff_path_change(response, rel_path)
+            command = self._get_diff_command(rel_path)
+            with CommandLines(command, cwd=basepath) as lines:
+                response = "\n".join(_iter_hg_diff_path_change(lines, rel_path)).rstrip()
         return response
 
+    def _get_diff_command(self, rel_path):
+        return ['hg', 'diff', '-g', rel_path, '--repository', rel_path]
+
+    def iter_diff(self, rev_a=None, rev_b=None, stat_only=False, basepath=None):
+        if not self.path_exists():
+            return
+        if basepath is None:
+            basepath = self._path
+        rel_path = normalized_rel_path(self._path, basepath)
+        revisions = ['--rev', rev_a or '.']
+        if rev_b is not None:
+            revisions += ['--rev', rev_b]
+        if stat_only:
+            command = ['hg', 'status', '-0', '-C', '-mard', '--repository', self._path] + revisions
+            _, output, _ = run_command(command, cwd=self._path)
+            _check_hg_status(output, command, self._path)
+            for entry in _iter_hg_diff_summary(_parse_hg_status(output)):
+                yield entry
+        else:
+            command = ['hg', 'diff', '-g', '--repository', self._path] + revisions
+            with CommandLines(command, cwd=self._path) as lines:
+                for entry in iter_git_format_diff(lines, prefix=rel_path + '/'):
+                    yield entry
+
     def get_affected_files(self, revision):
-        cmd = "hg log -r %s --template '{files}'" % revision
-        code, output, _ = run_shell_command(cmd, shell=True, cwd=self._path)
+        cmd = ['hg', 'log', '-r', revision, '--template', '{files}']
+        code, output, _ = run_command(cmd, cwd=self._path)
         affected = []
         if code == 0:
             affected = output.split(" ")
@@ -291,75 +429,132 @@ class HgClient(VcsClientBase):
             relpath = ''
 
         if self.path_exists() and os.path.exists(os.path.join(self._path, relpath)):
+            cached = log_cache.get_log(self, relpath, limit)
+            if cached is not None:
+                return cached
             # Get the log
-            limit_cmd = (("--limit %d" % (int(limit))) if limit else "")
-            HG_COMMIT_FIELDS = ['id', 'author', 'email', 'date', 'message']
-            HG_LOG_FORMAT = '\x1f'.join(['{node|short}', '{author|person}',
-                                         '{autor|email}', '{date|isodate}',
-                                         '{desc}']) + '\x1e'
-
-            command = "hg log %s -b %s --template '%s' %s" % (sanitized(relpath),
-                                                              self.get_branch(),
-                                                              HG_LOG_FORMAT,
-                                                              limit_cmd)
-            return_code, response_str, stderr = run_shell_command(command, shell=True, cwd=self._path)
-
-            if return_code == 0:
-                # Parse response
-                response = response_str.strip('\n\x1e').split("\x1e")
-                response = [row.strip().split("\x1f") for row in response]
-                response = [dict(zip(HG_COMMIT_FIELDS, row)) for row in response]
-                # Parse dates
-                for entry in response:
-                    entry['date'] = dateutil.parser.parse(entry['date'])
+            command = self._get_log_command(relpath, limit, self.get_branch())
+            with CommandLines(command, cwd=self._path, separator='\x1e') as records:
+                response = list(_iter_hg_log(records))
+            if records.returncode != 0:
+                response = []
 
         return response
 
+    def _get_log_cache_key(self):
+        # hg log lists the current branch only
+        return 'hg:%s:%s' % (os.path.realpath(self._path), self.get_branch())
+
+    def _get_log_cache_head(self):
+        value, output, _ = run_command(['hg', 'log', '-r', 'tip', '--template', '{rev}:{node}'],
+                                       cwd=self._path)
+        if value != 0 or not output:
+            return None
+        return output
+
+    def _get_log_cache_records(self, head, since=None):
+        """
+        :param head: tip as '<rev>:<node>'
+        :returns: log records of the current branch, down to but
+          excluding since if given. None if since is no longer the
+          same revision, as after hg strip.
+        """
+        head_rev = head.split(':')[0]
+        revisions = '%s:0' % head_rev
+        if since is not None:
+            since_rev = since.split(':')[0]
+            value, output, _ = run_command(['hg', 'log', '-r', since_rev, '--template', '{rev}:{node}'],
+                                           cwd=self._path, no_warn=True)
+            if value != 0 or output != since:
+                return None
+            revisions = '%s:%d' % (head_rev, int(since_rev) + 1)
+        command = ['hg', 'log', '-r', revisions, '-b', self.get_branch(),
+                   '--template', HG_LOG_CACHE_FORMAT]
+        with CommandLines(command, cwd=self._path, separator='\x1e') as chunks:
+            records = list(_iter_hg_log_cache_records(chunks))
+        if chunks.returncode != 0:
+            return None
+        return records
+
+    def _log_cache_entry(self, fields):
+        return _hg_log_entry(fields)
+
+    def iter_log(self, relpath=None, limit=None):
+        """
+        like get_log, but yields the log entries while hg log is
+        still running. Yields nothing if hg log fails.
+        """
+        if relpath is None:
+            relpath = ''
+        if self.path_exists() and os.path.exists(os.path.join(self._path, relpath)):
+            command = self._get_log_command(relpath, limit, self.get_branch())
+            with CommandLines(command, cwd=self._path, separator='\x1e') as records:
+                for entry in _iter_hg_log(records):
+                    yield entry
+
+    def _get_log_command(self, relpath, limit, branch):
+        limit_cmd = (['--limit', '%d' % (int(limit))] if limit else [])
+        command = ['hg', 'log']
+        if relpath:
+            command.append(relpath)
+        command += ['-b', branch, '--template', HG_LOG_FORMAT] + limit_cmd
+        return command
+
     def get_status(self, basepath=None, untracked=False):
         response = None
         if basepath is None:
             basepath = self._path
         if self.path_exists():
             rel_path = normalized_rel_path(self._path, basepath)
-            # protect against shell injection
-            command = "hg status %(path)s --repository %(path)s" % {'path': sanitized(rel_path)}
-            if not untracked:
-                command += " -mard"
-            _, response, _ = run_shell_command(command,
-                                               shell=True,
-                                               cwd=basepath)
-            if response is not None:
-                if response.startswith("abort"):
-                    raise VcsError("Probable Bug; Could not call %s, cwd=%s" % (command, basepath))
-                if len(response) > 0 and response[-1] != '\n':
-                    response += '\n'
+            response = _format_hg_status(self.iter_status(untracked), rel_path)
         return response
 
-    def export_repository(self, version, basepath):
-        # execute the hg archive cmd
-        cmd = 'hg archive -t tar -r {0} {1}.tar'.format(version, basepath)
-        result, _, _ = run_shell_command(cmd, shell=True, cwd=self._path)
-        if result:
-            return False
+    def iter_status(self, untracked=False):
+        if not self.path_exists():
+            return iter(())
+        command = self._get_status_command(untracked)
+        _, output, _ = run_command(command, cwd=self._path)
+        _check_hg_status(output, command, self._path)
+        return iter(_parse_hg_status(output))
+
+    def _get_status_command(self, untracked):
+        command = ['hg', 'status', '-0', '-C', '--repository', self._path]
+        if not untracked:
+            command.append('-mard')
+        return command
+
+    def export_repository(self, version, basepath, archive_format=compression.DEFAULT_FORMAT,
+                          compresslevel=None):
+        filepath = compression.get_archive_path(basepath, archive_format)
+        result = False
         try:
-            # gzip the tar file
-            with open(basepath + '.tar', 'rb') as tar_file:
-                gzip_file = gzip.open(basepath + '.tar.gz', 'wb')
-                try:
-                    gzip_file.writelines(tar_file)
-                finally:
-                    gzip_file.close()
+            with open(filepath, 'wb') as archive_file:
+                # hg archive names the top directory after the archive
+                result = self.export_repository_stream(version, archive_file, archive_format, compresslevel,
+                                                       prefix=os.path.basename(basepath))
         finally:
-            # clean up
-            os.remove(basepath + '.tar')
-        return True
+            if not result and os.path.exists(filepath):
+                os.remove(filepath)
+        return result
+
+    def export_repository_stream(self, version, fileobj, archive_format=compression.DEFAULT_FORMAT,
+                                 compresslevel=None, prefix=''):
+        writer = compression.CompressedWriter(fileobj, archive_format, compresslevel)
+        # nothing is written for versions that do not exist
+        export_sha = self.get_version(version)
+        if export_sha is None:
+            writer.abort()
+            return False
+        # '.' puts files at the top level, hg names a directory after
+        # the repository for an empty prefix
+        cmd = ['hg', 'archive', '-t', 'tar', '-r', export_sha, '-p', prefix or '.', '-']
+        return compression.write_command_output(cmd, self._path, writer)
 
     def get_branches(self, local_only=False):
         if not local_only:
             self._do_pull()
-        cmd = 'hg branches'
-        result, out, _ = run_shell_command(cmd, shell=True, cwd=self._path,
-                                           show_stdout=False)
+        result, out, _ = run_command(['hg', 'branches'], cwd=self._path,
+                                     show_stdout=False)
         if result:
             return []
         branches = []
@@ -370,10 +565,9 @@ class HgClient(VcsClientBase):
         return branches
 
     def _do_pull(self, filter=False):
-        value, _, _ = run_shell_command("hg pull",
-                                        cwd=self._path,
-                                        shell=True,
-                                        no_filter=not filter)
+        value, _, _ = run_command(['hg', 'pull'],
+                                  cwd=self._path,
+                                  no_filter=not filter)
         return value == 0
 
 # backwards compat
@@ -0,0 +1,265 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+persistent cache of the commit logs of repositories, used by get_log().
+
+Disabled unless the environment variable VCSTOOLS_LOG_CACHE names a
+directory, or set_cache_dir() was called. Each repository gets one JSON
+file in that directory holding its log records keyed by commit id, in
+log order, as of a head commit. When the head moves, only the commits
+after the cached head are read and parsed. If the cached head is no
+longer part of the history (history was rewritten, or another branch
+checked out), the cache of that repository is rebuilt. Queries for a
+relpath are answered from the cached changed paths while the history
+is linear; otherwise the client runs its log command as usual.
+
+Clients support the cache by implementing:
+
+* ``_get_log_cache_key()``: string identifying the history, or None
+* ``_get_log_cache_head()``: string identifying the head, or None
+* ``_get_log_cache_records(head, since=None)``: list of records newest
+  first, those after since only if given. None if the records after
+  since cannot be put on top of the cached ones.
+* ``_log_cache_entry(fields)``: get_log() entry of a record
+
+where records are dicts with keys 'id', 'fields' (list of strings),
+'merge' (bool) and 'paths' (list of changed paths relative to the
+repository, None if unknown).
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+
+CACHE_FORMAT_VERSION = 2
+
+_cache_dir = os.environ.get('VCSTOOLS_LOG_CACHE') or None
+# cache filename -> LogCache
+_CACHES = {}
+_LOCK = threading.Lock()
+
+
+def set_cache_dir(directory):
+    """
+    :param directory: directory to keep log caches in, None to disable
+    """
+    global _cache_dir
+    with _LOCK:
+        _cache_dir = directory
+        _CACHES.clear()
+
+
+def get_cache_dir():
+    return _cache_dir
+
+
+def _normalize_relpath(relpath):
+    """
+    :returns: relpath with '/' separators, '' for the whole
+      repository, None if relpath cannot be matched against paths
+    """
+    if not relpath:
+        return ''
+    relpath = os.path.normpath(relpath).replace(os.sep, '/')
+    if relpath == '.':
+        return ''
+    if relpath.startswith('../') or relpath == '..' or os.path.isabs(relpath) or \
+            any(char in relpath for char in '*?[:'):
+        return None
+    return relpath
+
+
+def _matches(paths, relpath):
+    prefix = relpath + '/'
+    return any(path == relpath or path.startswith(prefix) for path in paths)
+
+
+class LogCache(object):
+    """
+    log records of one repository, stored in filename
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self._mtime = None
+        self._reset()
+
+    def _reset(self):
+        self.head = None
+        self.order = []
+        self.records = {}
+        # whether relpath queries can be answered from changed paths
+        self.path_filter = True
+        # id -> parsed entry
+        self._entries = {}
+
+    def load(self):
+        """
+        reads the file if it changed since last read or written
+        """
+        try:
+            mtime = os.path.getmtime(self.filename)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        self._reset()
+        try:
+            with open(self.filename, 'r') as fhand:
+                data = json.load(fhand)
+            if data.get('version') != CACHE_FORMAT_VERSION:
+                return
+            records = data['records']
+            self.records = dict((record['id'], record) for record in records)
+            self.order = [record['id'] for record in records]
+            self.path_filter = data['path_filter']
+            self.head = data['head']
+            self._mtime = mtime
+        except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError) as exc:
+            self._reset()
+            logging.getLogger('vcstools').warn('Ignoring invalid log cache %s: %s' % (self.filename, exc))
+
+    def save(self):
+        data = {'version': CACHE_FORMAT_VERSION,
+                'head': self.head,
+                'path_filter': self.path_filter,
+                'records': [self.records[rid] for rid in self.order]}
+        try:
+            fdesc, tmpname = tempfile.mkstemp(dir=os.path.dirname(self.filename))
+            with os.fdopen(fdesc, 'w') as fhand:
+                json.dump(data, fhand)
+            # renaming is atomic, so concurrent processes never read partial files
+            getattr(os, 'replace', os.rename)(tmpname, self.filename)
+            self._mtime = os.path.getmtime(self.filename)
+        except (IOError, OSError) as exc:
+            logging.getLogger('vcstools').warn('Could not write log cache %s: %s' % (self.filename, exc))
+
+    def replace(self, head, records):
+        """
+        :param records: all records as of head, newest first
+        """
+        self._reset()
+        self.extend(head, records)
+
+    def extend(self, head, records):
+        """
+        :param records: records newer than the cached head, newest first
+        """
+        self.head = head
+        self.order = [record['id'] for record in records] + self.order
+        for record in records:
+            self.records[record['id']] = record
+            if record['merge'] or record['paths'] is None:
+                self.path_filter = False
+
+    def select(self, relpath, limit):
+        """
+        :returns: list of ids of the log for relpath, None if the cache
+          cannot tell
+        """
+        relpath = _normalize_relpath(relpath)
+        if relpath is None:
+            return None
+        if relpath == '':
+            ids = self.order
+        elif not self.path_filter:
+            return None
+        else:
+            ids = [rid for rid in self.order if _matches(self.records[rid]['paths'], relpath)]
+        if limit:
+            ids = ids[:int(limit)]
+        return ids
+
+    def get_entry(self, rid, to_entry):
+        """
+        :returns: copy of the LogEntry for id rid, created by to_entry once
+        """
+        entry = self._entries.get(rid)
+        if entry is None:
+            entry = to_entry(self.records[rid]['fields'])
+            self._entries[rid] = entry
+        return entry.copy()
+
+
+def _get_cache(key):
+    if _cache_dir is None or key is None:
+        return None
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    filename = os.path.join(_cache_dir, '%s.json' % digest)
+    with _LOCK:
+        cache = _CACHES.get(filename)
+        if cache is None:
+            if not os.path.isdir(_cache_dir):
+                os.makedirs(_cache_dir)
+            cache = LogCache(filename)
+            _CACHES[filename] = cache
+    return cache
+
+
+def get_log(client, relpath=None, limit=None):
+    """
+    :returns: get_log() result for client from the cache, after
+      reading new commits into it, None if the cache is disabled or
+      cannot answer the query
+    """
+    key = client._get_log_cache_key() if _cache_dir is not None else None
+    cache = _get_cache(key)
+    if cache is None:
+        return None
+    head = client._get_log_cache_head()
+    if head is None:
+        return None
+    with cache.lock:
+        cache.load()
+        if cache.head != head:
+            records = None
+            if cache.head is not None:
+                records = client._get_log_cache_records(head, since=cache.head)
+            if records is not None:
+                cache.extend(head, records)
+            else:
+                records = client._get_log_cache_records(head)
+                if records is None:
+                    return None
+                cache.replace(head, records)
+            cache.save()
+        ids = cache.select(relpath, limit)
+        if ids is None:
+            return None
+        return [cache.get_entry(rid, client._log_cache_entry) for rid in ids]
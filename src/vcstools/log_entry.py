@@ -0,0 +1,189 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+compact records of commits as returned by get_log().
+
+LogEntry behaves like the dicts get_log() used to return, with keys
+id, author, email, date and message, while storing them in slots. The
+date is kept as the string the vcs printed and converted to a datetime
+on first access, so listing long histories does not parse every date.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import datetime
+
+import dateutil.tz
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    # py2.7
+    from collections import MutableMapping
+
+
+LOG_ENTRY_KEYS = ['id', 'author', 'email', 'date', 'message']
+
+_MISSING = object()
+
+
+def _from_timestamp(seconds, utcoffset):
+    """
+    :param utcoffset: seconds east of UTC
+    """
+    if utcoffset == 0:
+        tzinfo = dateutil.tz.tzutc()
+    else:
+        tzinfo = dateutil.tz.tzoffset(None, utcoffset)
+    return datetime.datetime.fromtimestamp(seconds, tzinfo)
+
+
+def parse_raw_date(value):
+    """
+    :param value: date as printed by git --date=raw, like '1500000000 +0200'
+    :returns: timezone aware datetime
+    """
+    seconds, offset = value.split()
+    sign = -1 if offset.startswith('-') else 1
+    offset = offset.lstrip('+-')
+    return _from_timestamp(int(seconds), sign * (int(offset[:-2]) * 3600 + int(offset[-2:]) * 60))
+
+
+def parse_hgdate(value):
+    """
+    :param value: date as printed by hg {date|hgdate}, like '1500000000 -7200'
+    :returns: timezone aware datetime
+    """
+    seconds, offset = value.split()
+    # hg counts the offset west of UTC
+    return _from_timestamp(int(float(seconds)), -int(offset))
+
+
+class LogEntry(MutableMapping):
+    """
+    one commit of a log, usable as dict. Other keys than
+    LOG_ENTRY_KEYS may be set like in a dict.
+    """
+
+    __slots__ = ['id', 'author', 'email', 'message', '_date', '_date_parser', '_extra']
+
+    def __init__(self, id, author, email, date, message, date_parser=None):
+        """
+        :param date: datetime, or value converted by date_parser on
+          first access
+        :param date_parser: function returning a datetime for date,
+          e.g. parse_raw_date or dateutil.parser.parse
+        """
+        self.id = id
+        self.author = author
+        self.email = email
+        self.message = message
+        self._date = date
+        self._date_parser = date_parser if date not in (None, _MISSING) else None
+        self._extra = None
+
+    @classmethod
+    def from_values(cls, values, date_parser=None):
+        """
+        :param values: values of LOG_ENTRY_KEYS in that order. If fewer
+          are given, the remaining keys are missing, like in a dict
+          built by zip().
+        """
+        values = list(values[:len(LOG_ENTRY_KEYS)])
+        values += [_MISSING] * (len(LOG_ENTRY_KEYS) - len(values))
+        return cls(*values, date_parser=date_parser)
+
+    @property
+    def date(self):
+        if self._date_parser is not None:
+            self._date = self._date_parser(self._date)
+            self._date_parser = None
+        return self._date
+
+    @date.setter
+    def date(self, value):
+        self._date = value
+        self._date_parser = None
+
+    def __getitem__(self, key):
+        if key in LOG_ENTRY_KEYS:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                return value
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in LOG_ENTRY_KEYS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        # raises KeyError if missing
+        self[key]
+        if key in LOG_ENTRY_KEYS:
+            setattr(self, key, _MISSING)
+        else:
+            del self._extra[key]
+
+    def __iter__(self):
+        for key in LOG_ENTRY_KEYS:
+            if key == 'date':
+                value = self._date
+            else:
+                value = getattr(self, key)
+            if value is not _MISSING:
+                yield key
+        if self._extra is not None:
+            for key in self._extra:
+                yield key
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __repr__(self):
+        return 'LogEntry(%r)' % dict(self)
+
+    def copy(self):
+        """
+        :returns: LogEntry with the same values, the date still unparsed
+          if not accessed yet
+        """
+        entry = LogEntry(self.id, self.author, self.email, self._date, self.message,
+                         date_parser=self._date_parser)
+        if self._extra is not None:
+            entry._extra = dict(self._extra)
+        return entry
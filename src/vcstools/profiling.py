@@ -0,0 +1,254 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+instrumentation of the commands run by vcstools.
+
+Every command spawned by the clients produces a record, a dict with
+the keys:
+
+- argv: the command, as list of arguments (or string for shell commands)
+- cwd: working directory of the command, or None
+- wall_time: seconds from spawning the command until it terminated
+- returncode: exit code of the command
+- stdout_bytes, stderr_bytes: bytes of output captured, 0 when not captured
+- method: the public client method that caused the command,
+  e.g. 'GitClient.update', or None. Commands run in worker threads
+  are reported for the method that started the work, see called_from()
+
+Callables registered with add_command_hook are invoked with each
+record. profile() aggregates records into per-method statistics::
+
+    with vcstools.profile() as prof:
+        client.update('master')
+    print(prof.dump_json())
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import contextlib
+import json
+import sys
+import threading
+import time
+
+from vcstools.vcs_base import VcsClientBase
+
+
+# monotonic clock where available (python3)
+clock = getattr(time, 'monotonic', time.time)
+
+# upper bounds in seconds of the histogram buckets, the last bucket
+# collects all longer commands
+HISTOGRAM_BOUNDS = [0.01, 0.03, 0.1, 0.3, 1, 3, 10, 30, 100]
+
+_COMMAND_HOOKS = []
+_HOOKS_LOCK = threading.Lock()
+
+# classes whose public methods are reported as record 'method'
+_API_CLASSES = [VcsClientBase]
+
+# method of the thread that handed work to the current thread
+_caller = threading.local()
+
+
+def add_command_hook(hook):
+    """
+    :param hook: callable invoked with a record dict after every command
+    """
+    with _HOOKS_LOCK:
+        _COMMAND_HOOKS.append(hook)
+
+
+def remove_command_hook(hook):
+    """
+    :raises: ValueError if hook had not been added
+    """
+    with _HOOKS_LOCK:
+        _COMMAND_HOOKS.remove(hook)
+
+
+def hooks_active():
+    """
+    :returns: True if any command hook is registered
+    """
+    return len(_COMMAND_HOOKS) > 0
+
+
+def _get_api_method(frame):
+    """
+    :returns: name of the outermost public method of a client on the
+      stack of frame, like 'GitClient.update', or None
+    """
+    api_classes = tuple(_API_CLASSES)
+    method = None
+    while frame is not None:
+        name = frame.f_code.co_name
+        if not name.startswith('_'):
+            obj = frame.f_locals.get('self')
+            if isinstance(obj, api_classes):
+                method = '%s.%s' % (type(obj).__name__, name)
+        frame = frame.f_back
+    return method
+
+
+def get_current_method():
+    """
+    :returns: method to report for commands of the calling thread, to
+      pass on to worker threads with called_from(), or None
+    """
+    return getattr(_caller, 'method', None) or _get_api_method(sys._getframe(1))
+
+
+@contextlib.contextmanager
+def called_from(method):
+    """
+    context manager reporting method for the commands that the current
+    thread runs inside the with block, for threads doing work of a
+    client method called in another thread
+
+    :param method: value of get_current_method() in the calling thread
+    """
+    previous = getattr(_caller, 'method', None)
+    _caller.method = method
+    try:
+        yield
+    finally:
+        _caller.method = previous
+
+
+def record_command(argv, cwd, start_time, returncode, stdout_bytes, stderr_bytes):
+    """
+    passes a record of a terminated command to all hooks. Does nothing
+    if no hook is registered.
+
+    :param start_time: value of clock() when the command was spawned
+    """
+    if not _COMMAND_HOOKS:
+        return
+    record = {'argv': argv,
+              'cwd': cwd,
+              'wall_time': clock() - start_time,
+              'returncode': returncode,
+              'stdout_bytes': stdout_bytes,
+              'stderr_bytes': stderr_bytes,
+              'method': getattr(_caller, 'method', None) or _get_api_method(sys._getframe(1))}
+    with _HOOKS_LOCK:
+        hooks = list(_COMMAND_HOOKS)
+    for hook in hooks:
+        hook(record)
+
+
+class Profile(object):
+    """
+    collects command records while registered as hook, see profile()
+    """
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def __enter__(self):
+        add_command_hook(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        remove_command_hook(self)
+
+    def get_stats(self):
+        """
+        :returns: dict mapping method names ('unknown' for commands
+          not run by a client method) to dicts with the number of
+          commands, total, min and max wall time, output bytes, and a
+          histogram of wall times with the counts per HISTOGRAM_BOUNDS
+          bucket plus one for longer commands
+        """
+        stats = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            method = record['method'] or 'unknown'
+            entry = stats.get(method)
+            if entry is None:
+                entry = {'count': 0,
+                         'total_time': 0.0,
+                         'min_time': None,
+                         'max_time': None,
+                         'stdout_bytes': 0,
+                         'stderr_bytes': 0,
+                         'histogram': [0] * (len(HISTOGRAM_BOUNDS) + 1)}
+                stats[method] = entry
+            wall_time = record['wall_time']
+            entry['count'] += 1
+            entry['total_time'] += wall_time
+            if entry['min_time'] is None or wall_time < entry['min_time']:
+                entry['min_time'] = wall_time
+            if entry['max_time'] is None or wall_time > entry['max_time']:
+                entry['max_time'] = wall_time
+            entry['stdout_bytes'] += record['stdout_bytes']
+            entry['stderr_bytes'] += record['stderr_bytes']
+            bucket = len(HISTOGRAM_BOUNDS)
+            for index, bound in enumerate(HISTOGRAM_BOUNDS):
+                if wall_time <= bound:
+                    bucket = index
+                    break
+            entry['histogram'][bucket] += 1
+        return stats
+
+    def dump_json(self, fileobj=None, records=False):
+        """
+        :param fileobj: text file to write to, if None the JSON is returned
+        :param records: whether to include the individual records
+        :returns: JSON string if fileobj is None
+        """
+        data = {'histogram_bounds': HISTOGRAM_BOUNDS,
+                'methods': self.get_stats()}
+        if records:
+            with self._lock:
+                data['records'] = list(self.records)
+        if fileobj is None:
+            return json.dumps(data, indent=2, sort_keys=True)
+        json.dump(data, fileobj, indent=2, sort_keys=True)
+
+
+def profile():
+    """
+    context manager collecting records of all commands run by vcstools
+    inside the with block, in any thread.
+
+    :returns: Profile
+    """
+    return Profile()
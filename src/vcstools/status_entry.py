@@ -0,0 +1,60 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+records of changed paths as yielded by iter_status().
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+from collections import namedtuple
+
+
+class StatusEntry(namedtuple('StatusEntry', ['path', 'index', 'worktree', 'submodule', 'orig_path', 'flags'])):
+    """
+    one changed path of a working copy.
+
+    :ivar path: path relative to the root of the client's repository,
+      with '/' separators
+    :ivar index: state in the index (git), or of versioning (bzr), or
+      the status letter (hg, svn), as the vcs prints it, ' ' if unchanged
+    :ivar worktree: state in the working tree (git) or of the contents
+      (bzr), ' ' if unchanged or not distinguished by the vcs
+    :ivar submodule: for submodules, the submodule state as in git
+      status --porcelain=v2 (like 'SC..'), else None
+    :ivar orig_path: the source path of renames and copies, else None
+    :ivar flags: further status columns as the vcs prints them, '' if none
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, path, index, worktree=' ', submodule=None, orig_path=None, flags=''):
+        return super(StatusEntry, cls).__new__(cls, path, index, worktree, submodule, orig_path, flags)
@@ -43,14 +43,22 @@ try:
 except ImportError:
     from urllib.parse import urlsplit
 import re
+import shutil
 import tarfile
+import tempfile
 
 import dateutil.parser  # For parsing date strings
 import xml.dom.minidom  # For parsing logfiles
 
 from vcstools.vcs_base import VcsClientBase, VcsError
-from vcstools.common import sanitized, normalized_rel_path, \
-    run_shell_command, ensure_dir_notexists
+from vcstools.common import normalized_rel_path, \
+    run_command, ensure_dir_notexists, CommandLines
+from vcstools.tool_versions import get_tool_version
+from vcstools import compression
+from vcstools import log_cache
+from vcstools.diff_entry import DiffEntry, count_changes
+from vcstools.log_entry import LogEntry
+from vcstools.status_entry import StatusEntry
 
 
 def canonical_svn_url_split(url):
@@ -106,8 +114,7 @@ def canonical_svn_url_split(url):
 def get_remote_contents(url):
     contents = []
     if url:
-        cmd = 'svn ls %s' % (url)
-        result_code, output, _ = run_shell_command(cmd, shell=True)
+        result_code, output, _ = run_command(['svn', 'ls', url])
         if result_code:
             return []
         contents = [line.strip('/') for line in output.splitlines()]
@@ -115,13 +122,17 @@ def get_remote_contents(url):
 
 
 def _get_svn_version():
+    """Looks up svn version, calling svn --version once per svn binary.
+    :raises: VcsError if svn is not installed"""
+    return get_tool_version('svn', _probe_svn_version)
+
+
+def _probe_svn_version():
     """Looks up svn version by calling svn --version.
     :raises: VcsError if svn is not installed"""
     try:
         # SVN commands produce differently formatted output for french locale
-        value, output, _ = run_shell_command('svn --version',
-                                             shell=True,
-                                             us_env=True)
+        value, output, _ = run_command(['svn', '--version'], us_env=True)
         if value == 0 and output is not None and len(output.splitlines()) > 0:
             version = output.splitlines()[0]
         else:
@@ -133,6 +144,192 @@ def _get_svn_version():
     return version
 
 
+def _parse_svn_info_revision(output):
+    """
+    :returns: '-r' followed by the last changed revision in svn info output, or None
+    """
+    if output is not None:
+        matches = \
+            [l for l in output.splitlines() if l.startswith('Last Changed Rev: ')]
+        if len(matches) == 1:
+            split_str = matches[0].split()
+            if len(split_str) == 4:
+                return '-r' + split_str[3]
+    return None
+
+
+def _iter_svn_log_fields(xml_response):
+    """
+    parses output of svn log --xml
+
+    :returns: iterator of lists of the revision, author, date and
+      message of each entry, as strings
+    """
+    dom = xml.dom.minidom.parseString(xml_response)
+    log_entries = dom.getElementsByTagName("logentry")
+
+    # Extract the entries
+    for log_entry in log_entries:
+        author_tag = log_entry.getElementsByTagName("author")[0]
+        date_tag = log_entry.getElementsByTagName("date")[0]
+        msg_tags = log_entry.getElementsByTagName("msg")
+        if len(msg_tags) > 0 and msg_tags[0].firstChild:
+            message = msg_tags[0].firstChild.nodeValue
+        else:
+            message = ''
+        yield [log_entry.getAttribute("revision"),
+               author_tag.firstChild.nodeValue,
+               str(date_tag.firstChild.nodeValue),
+               message]
+
+
+def _svn_log_entry(fields):
+    """
+    :returns: LogEntry, the date parsed on first access
+    """
+    return LogEntry(fields[0], fields[1], None, fields[2], fields[3],
+                    date_parser=dateutil.parser.parse)
+
+
+def _parse_svn_log(xml_response):
+    """
+    parses output of svn log --xml
+
+    :returns: list of dicts with keys id, author, email, date, message
+    """
+    return [_svn_log_entry(fields) for fields in _iter_svn_log_fields(xml_response)]
+
+
+# first column of svn status for the item attribute of svn status --xml
+SVN_STATUS_ITEMS = {'added': 'A', 'conflicted': 'C', 'deleted': 'D', 'ignored': 'I',
+                    'modified': 'M', 'replaced': 'R', 'external': 'X', 'unversioned': '?',
+                    'missing': '!', 'incomplete': '!', 'obstructed': '~'}
+
+
+def _parse_svn_status(xml_response):
+    """
+    parses output of svn status --xml. The index of the entries is
+    the first column of svn status, the worktree the property column,
+    and the flags the remaining lock, history, switch and conflict
+    columns.
+
+    :returns: list of StatusEntry with paths as svn printed them
+    """
+    dom = xml.dom.minidom.parseString(xml_response)
+    entries = []
+    for entry in dom.getElementsByTagName("entry"):
+        status = entry.getElementsByTagName("wc-status")[0]
+
+        def flag(name, char):
+            return char if status.getAttribute(name) == 'true' else ' '
+        props = status.getAttribute("props")
+        flags = ''.join([flag('wc-locked', 'L'),
+                         flag('copied', '+'),
+                         'X' if status.getAttribute('file-external') == 'true' else flag('switched', 'S'),
+                         'K' if status.getElementsByTagName("lock") else ' ',
+                         flag('tree-conflicted', 'C')])
+        entries.append(StatusEntry(entry.getAttribute("path"),
+                                   SVN_STATUS_ITEMS.get(status.getAttribute("item"), ' '),
+                                   {'modified': 'M', 'conflicted': 'C'}.get(props, ' '),
+                                   None,
+                                   status.getAttribute("moved-from") or None,
+                                   flags))
+    return entries
+
+
+def _format_svn_status(entries, rel_path):
+    """
+    formats StatusEntry records like svn status, prepending rel_path
+    """
+    return ''.join('%s%s%s %s\n' % (entry.index, entry.worktree, entry.flags,
+                                    os.path.normpath(os.path.join(rel_path, entry.path)))
+                   for entry in entries)
+
+
+def _svn_diff_entry(path, lines):
+    status = 'M'
+    content = lines
+    for index, line in enumerate(lines):
+        if line.startswith('--- ') and line.endswith(('(nonexistent)', '(revision 0)')):
+            status = 'A'
+        elif line.startswith('+++ ') and line.endswith('(nonexistent)'):
+            status = 'D'
+        elif line.startswith('Property changes on: '):
+            content = lines[:index]
+            break
+    added, deleted = count_changes(content)
+    if any(line.startswith('Cannot display: ') for line in content):
+        added = deleted = None
+    return DiffEntry(path.replace(os.sep, '/'), status, None, added, deleted, lines)
+
+
+def _iter_svn_diff(lines, rel_path):
+    """
+    splits svn diff output at the Index: and Property changes on:
+    headers into the diffs of each file, prepending rel_path to the
+    paths in the header lines as svn diff rel_path would.
+
+    :returns: generator of DiffEntry
+    """
+    path = None
+    entry_lines = None
+    in_hunk = False
+    for line in lines:
+        header_path = None
+        if line.startswith('Index: '):
+            header_path = line[len('Index: '):]
+        elif line.startswith('Property changes on: '):
+            header_path = line[len('Property changes on: '):]
+            if header_path == path:
+                header_path = None
+                in_hunk = False
+        if header_path is not None:
+            if entry_lines is not None:
+                yield _svn_diff_entry(path, entry_lines)
+            path = header_path
+            entry_lines = []
+            in_hunk = False
+        if entry_lines is None:
+            continue
+        if line.startswith('@@'):
+            in_hunk = True
+        if not in_hunk and rel_path != '.':
+            for start in ('Index: ', 'Property changes on: ', '--- ', '+++ '):
+                if line.startswith(start):
+                    line = start + os.path.join(rel_path, line[len(start):])
+                    break
+        entry_lines.append(line)
+    if entry_lines is not None:
+        yield _svn_diff_entry(path, entry_lines)
+
+
+def _write_tar(directory, fileobj, archive_format=compression.DEFAULT_FORMAT, level=None, arcname=''):
+    """
+    writes a tar archive of directory to fileobj in stream mode
+    """
+    with compression.CompressedWriter(fileobj, archive_format, level) as writer:
+        tar_file = tarfile.open(fileobj=writer, mode='w|')
+        try:
+            tar_file.add(directory, arcname)
+        finally:
+            tar_file.close()
+
+
+def _tar_export(basepath, archive_format=compression.DEFAULT_FORMAT, level=None):
+    """
+    packs the exported directory basepath into a tar archive of
+    archive_format next to it, removing basepath
+    """
+    try:
+        # tar and compress the exported repo
+        with open(compression.get_archive_path(basepath, archive_format), 'wb') as archive_file:
+            _write_tar(basepath, archive_file, archive_format, level)
+    finally:
+        # clean up
+        from shutil import rmtree
+        rmtree(basepath)
+
+
 class SvnClient(VcsClientBase):
 
     def __init__(self, path):
@@ -159,8 +356,7 @@ class SvnClient(VcsClientBase):
         """
         if self.detect_presence():
             # 3305: parsing not robust to non-US locales
-            cmd = 'svn info %s' % self._path
-            _, output, _ = run_shell_command(cmd, shell=True)
+            _, output, _ = run_command(['svn', 'info', self._path])
             matches = [l for l in output.splitlines() if l.startswith('URL: ')]
             if matches:
                 return matches[0][5:]
@@ -177,42 +373,39 @@ class SvnClient(VcsClientBase):
         if not ensure_dir_notexists(self.get_path()):
             self.logger.error("Can't remove %s" % self.get_path())
             return False
-        if version is not None and version != '':
-            if not version.startswith("-r"):
-                version = "-r%s" % version
-        elif version is None:
-            version = ''
-        cmd = 'svn co %s %s %s' % (sanitized(version),
-                                   sanitized(url),
-                                   self._path)
-        value, _, msg = run_shell_command(cmd,
-                                          shell=True,
-                                          no_filter=True)
+        value, _, msg = run_command(self._get_checkout_command(url, version), no_filter=True)
         if value != 0:
             if msg:
                 self.logger.error('%s' % msg)
             return False
         return True
 
+    def _get_checkout_command(self, url, version):
+        cmd = ['svn', 'co']
+        if version is not None and version != '':
+            if not version.startswith("-r"):
+                version = "-r%s" % version
+            cmd.append(version)
+        cmd += [url, self._path]
+        return cmd
+
     def update(self, version=None, verbose=False, timeout=None):
         if not self.detect_presence():
             sys.stderr.write("Error: cannot update non-existing directory\n")
             return False
-        # protect against shell injection
+        value, _, _ = run_command(self._get_update_command(version), no_filter=True)
+        if value == 0:
+            return True
+        return False
 
+    def _get_update_command(self, version):
+        cmd = ['svn', 'up']
         if version is not None and version != '':
             if not version.startswith("-r"):
                 version = "-r" + version
-        elif version is None:
-            version = ''
-        cmd = 'svn up %s %s --non-interactive' % (sanitized(version),
-                                                  self._path)
-        value, _, _ = run_shell_command(cmd,
-                                        shell=True,
-                                        no_filter=True)
-        if value == 0:
-            return True
-        return False
+            cmd.append(version)
+        cmd += [self._path, '--non-interactive']
+        return cmd
 
     def get_version(self, spec=None):
         """
@@ -238,7 +431,7 @@ class SvnClient(VcsClientBase):
         """
         if not self.path_exists():
             return None
-        command = 'svn info '
+        command = ['svn', 'info']
         if spec is not None:
             if spec.isdigit():
                 # looking up svn with "-r" takes long, and if spec is
@@ -255,20 +448,13 @@ class SvnClient(VcsClientBase):
                     # number, avoid the long call to svn server
                     return '-r' + spec
             if spec.startswith("-r"):
-                command += sanitized(spec)
+                command.append(spec)
             else:
-                command += sanitized('-r%s' % spec)
-        command += " %s" % path
+                command.append('-r%s' % spec)
+        command.append(path)
         # #3305: parsing not robust to non-US locales
-        _, output, _ = run_shell_command(command, shell=True, us_env=True)
-        if output is not None:
-            matches = \
-                [l for l in output.splitlines() if l.startswith('Last Changed Rev: ')]
-            if len(matches) == 1:
-                split_str = matches[0].split()
-                if len(split_str) == 4:
-                    return '-r' + split_str[3]
-        return None
+        _, output, _ = run_command(command, us_env=True)
+        return _parse_svn_info_revision(output)
 
     def get_current_version_label(self):
         # SVN branches are part or URL
@@ -285,17 +471,36 @@ class SvnClient(VcsClientBase):
             basepath = self._path
         if self.path_exists():
             rel_path = normalized_rel_path(self._path, basepath)
-            command = 'svn diff %s' % sanitized(rel_path)
-            _, response, _ = run_shell_command(command,
-                                               shell=True,
-                                               cwd=basepath)
+            _, response, _ = run_command(['svn', 'diff', rel_path],
+                                         cwd=basepath)
         return response
 
+    def iter_diff(self, rev_a=None, rev_b=None, stat_only=False, basepath=None):
+        if not self.path_exists():
+            return
+        if basepath is None:
+            basepath = self._path
+        rel_path = normalized_rel_path(self._path, basepath)
+        revisions = []
+        if rev_b is not None:
+            revisions = ['-r', '%s:%s' % (rev_a or 'BASE', rev_b)]
+        elif rev_a is not None:
+            revisions = ['-r', rev_a]
+        if stat_only:
+            _, output, _ = run_command(['svn', 'diff', '--summarize'] + revisions, cwd=self._path)
+            for line in output.splitlines():
+                if len(line) > 8:
+                    status = line[0] if line[0] != ' ' else 'M'
+                    yield DiffEntry(line[8:].replace(os.sep, '/'), status)
+        else:
+            with CommandLines(['svn', 'diff'] + revisions, cwd=self._path) as lines:
+                for entry in _iter_svn_diff(lines, rel_path):
+                    yield entry
+
     def get_affected_files(self, revision):
-        cmd = "svn diff --summarize -c {0}".format(
-            revision)
+        cmd = ['svn', 'diff', '--summarize', '-c', '{0}'.format(revision)]
 
-        code, output, _ = run_shell_command(cmd, shell=True, cwd=self._path)
+        code, output, _ = run_command(cmd, cwd=self._path)
         affected = []
         if code == 0:
             for filename in output.splitlines():
@@ -309,73 +514,119 @@ class SvnClient(VcsClientBase):
             relpath = ''
 
         if self.path_exists() and os.path.exists(os.path.join(self._path, relpath)):
+            cached = log_cache.get_log(self, relpath, limit)
+            if cached is not None:
+                return cached
             # Get the log
-            limit_cmd = (("--limit %d" % (int(limit))) if limit else "")
-            command = "svn log %s --xml %s" % (limit_cmd, sanitized(relpath) if len(relpath) > 0 else '')
-            return_code, xml_response, stderr = run_shell_command(command, shell=True, cwd=self._path)
-
-            # Parse response
-            dom = xml.dom.minidom.parseString(xml_response)
-            log_entries = dom.getElementsByTagName("logentry")
-
-            # Extract the entries
-            for log_entry in log_entries:
-                author_tag = log_entry.getElementsByTagName("author")[0]
-                date_tag = log_entry.getElementsByTagName("date")[0]
-                msg_tags = log_entry.getElementsByTagName("msg")
-
-                log_data = dict()
-                log_data['id'] = log_entry.getAttribute("revision")
-                log_data['author'] = author_tag.firstChild.nodeValue
-                log_data['email'] = None
-                log_data['date'] = dateutil.parser.parse(str(date_tag.firstChild.nodeValue))
-                if len(msg_tags) > 0 and msg_tags[0].firstChild:
-                    log_data['message'] = msg_tags[0].firstChild.nodeValue
-                else:
-                    log_data['message'] = ''
-
-                response.append(log_data)
+            command = self._get_log_command(relpath, limit)
+            return_code, xml_response, stderr = run_command(command, cwd=self._path)
+            response = _parse_svn_log(xml_response)
 
         return response
 
+    def _get_log_cache_key(self):
+        return 'svn:%s' % os.path.realpath(self._path)
+
+    def _get_log_cache_head(self):
+        """
+        :returns: URL and revision of the working copy as '<url>@<rev>'
+        """
+        # 3305: parsing not robust to non-US locales
+        _, output, _ = run_command(['svn', 'info', self._path])
+        url = None
+        revision = None
+        for line in output.splitlines():
+            if line.startswith('URL: '):
+                url = line[5:]
+            elif line.startswith('Revision: '):
+                revision = line[10:].strip()
+        if url is None or revision is None or not revision.isdigit():
+            return None
+        return '%s@%s' % (url, revision)
+
+    def _get_log_cache_records(self, head, since=None):
+        """
+        :returns: log records as of head, newer than since if given.
+          None if since has another URL or a newer revision, as after
+          svn switch or svn update to an older revision.
+        """
+        url, revision = head.rsplit('@', 1)
+        command = ['svn', 'log', '--xml']
+        if since is not None:
+            since_url, since_revision = since.rsplit('@', 1)
+            if since_url != url or int(since_revision) > int(revision):
+                return None
+            command += ['-r', '%s:%d' % (revision, int(since_revision) + 1)]
+        else:
+            command += ['-r', '%s:1' % revision]
+        value, xml_response, _ = run_command(command, cwd=self._path)
+        if value != 0:
+            return None
+        # svn log -v lists paths relative to the repository root, not usable
+        return [{'id': fields[0], 'fields': fields, 'merge': False, 'paths': None}
+                for fields in _iter_svn_log_fields(xml_response)]
+
+    def _log_cache_entry(self, fields):
+        return _svn_log_entry(fields)
+
+    def _get_log_command(self, relpath, limit):
+        limit_cmd = (['--limit', '%d' % (int(limit))] if limit else [])
+        command = ['svn', 'log'] + limit_cmd + ['--xml']
+        if len(relpath) > 0:
+            command.append(relpath)
+        return command
+
     def get_status(self, basepath=None, untracked=False):
         response = None
         if basepath is None:
             basepath = self._path
         if self.path_exists():
             rel_path = normalized_rel_path(self._path, basepath)
-            # protect against shell injection
-            command = 'svn status %s' % sanitized(rel_path)
-            if not untracked:
-                command += " -q"
-            _, response, _ = run_shell_command(command,
-                                               shell=True,
-                                               cwd=basepath)
-            if response is not None and \
-               len(response) > 0 and \
-               response[-1] != '\n':
-                response += '\n'
+            response = _format_svn_status(self.iter_status(untracked), rel_path)
         return response
 
-    def export_repository(self, version, basepath):
+    def iter_status(self, untracked=False):
+        if not self.path_exists():
+            return iter(())
+        command = self._get_status_command(untracked)
+        value, output, _ = run_command(command, cwd=self._path)
+        if value != 0:
+            raise VcsError("Could not call %s, cwd=%s" % (command, self._path))
+        return iter(_parse_svn_status(output))
+
+    def _get_status_command(self, untracked):
+        command = ['svn', 'status', '--xml']
+        if not untracked:
+            command.append('-q')
+        return command
+
+    def export_repository(self, version, basepath, archive_format=compression.DEFAULT_FORMAT,
+                          compresslevel=None):
+        compression.check_format(archive_format, compresslevel)
         # Run the svn export cmd
-        cmd = 'svn export {0} {1}'.format(os.path.join(self._path, version),
-                                          basepath)
-        result, _, _ = run_shell_command(cmd, shell=True)
+        cmd = ['svn', 'export', os.path.join(self._path, version), basepath]
+        result, _, _ = run_command(cmd)
         if result:
             return False
+        _tar_export(basepath, archive_format, compresslevel)
+        return True
+
+    def export_repository_stream(self, version, fileobj, archive_format=compression.DEFAULT_FORMAT,
+                                 compresslevel=None, prefix=''):
+        compression.check_format(archive_format, compresslevel)
+        # svn cannot write archives, the files are exported to a
+        # temporary directory and packed from there
+        tmpd_path = tempfile.mkdtemp()
         try:
-            # tar gzip the exported repo
-            targzip_file = tarfile.open(basepath + '.tar.gz', 'w:gz')
-            try:
-                targzip_file.add(basepath, '')
-            finally:
-                targzip_file.close()
+            export_path = os.path.join(tmpd_path, 'export')
+            cmd = ['svn', 'export', os.path.join(self._path, version), export_path]
+            result, _, _ = run_command(cmd)
+            if result:
+                return False
+            _write_tar(export_path, fileobj, archive_format, compresslevel, prefix.rstrip('/'))
+            return True
         finally:
-            # clean up
-            from shutil import rmtree
-            rmtree(basepath)
-        return True
+            shutil.rmtree(tmpd_path)
 
     def get_branches(self, local_only=False):
         url = self.get_url()
@@ -181,10 +181,19 @@ class TarClient(VcsClientBase):
     def get_diff(self, basepath=None):
         return ''
 
+    def iter_diff(self, rev_a=None, rev_b=None, stat_only=False, basepath=None):
+        return iter(())
+
     def get_status(self, basepath=None, untracked=False):
         return ''
 
-    def export_repository(self, version, basepath):
+    def iter_status(self, untracked=False):
+        return iter(())
+
+    def export_repository(self, version, basepath, archive_format='gz', compresslevel=None):
+        raise VcsError('export repository not implemented for extracted tars')
+
+    def export_repository_stream(self, version, fileobj, archive_format='gz', compresslevel=None, prefix=''):
         raise VcsError('export repository not implemented for extracted tars')
 
 
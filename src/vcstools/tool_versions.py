@@ -0,0 +1,147 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+process-wide cache of the versions of the installed vcs programs.
+
+Clients check the version of their vcs program on construction.
+Versions are cached per resolved binary path, so creating many clients
+runs each program's --version only once. If the environment variable
+VCSTOOLS_VERSION_CACHE names a file, or set_cache_file() was called,
+versions are also stored in that JSON file and reused by other
+processes for as long as the modification time of the binary does not
+change.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import json
+import logging
+import os
+import tempfile
+import threading
+
+try:
+    from shutil import which
+except ImportError:
+    # py2.7
+    from distutils.spawn import find_executable as which
+
+
+# binary path -> (binary mtime, version string)
+_VERSIONS = {}
+_LOCK = threading.Lock()
+
+_cache_file = os.environ.get('VCSTOOLS_VERSION_CACHE') or None
+# whether _cache_file has been read into _VERSIONS
+_cache_file_loaded = False
+
+
+def set_cache_file(filename):
+    """
+    :param filename: JSON file to persist versions in, None to disable
+    """
+    global _cache_file, _cache_file_loaded
+    with _LOCK:
+        _cache_file = filename
+        _cache_file_loaded = False
+
+
+def clear_cache():
+    """
+    forgets all versions cached in this process, does not modify the
+    cache file
+    """
+    global _cache_file_loaded
+    with _LOCK:
+        _VERSIONS.clear()
+        _cache_file_loaded = False
+
+
+def _load_cache_file():
+    global _cache_file_loaded
+    _cache_file_loaded = True
+    if _cache_file is None or not os.path.isfile(_cache_file):
+        return
+    try:
+        with open(_cache_file, 'r') as fhand:
+            data = json.load(fhand)
+        for binary, entry in data.items():
+            _VERSIONS.setdefault(binary, (entry['mtime'], entry['version']))
+    except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError) as exc:
+        logging.getLogger('vcstools').warn('Ignoring invalid version cache %s: %s' % (_cache_file, exc))
+
+
+def _save_cache_file():
+    if _cache_file is None:
+        return
+    data = dict((binary, {'mtime': mtime, 'version': version})
+                for binary, (mtime, version) in _VERSIONS.items())
+    try:
+        dirname = os.path.dirname(os.path.abspath(_cache_file))
+        fdesc, tmpname = tempfile.mkstemp(dir=dirname)
+        with os.fdopen(fdesc, 'w') as fhand:
+            json.dump(data, fhand, indent=2, sort_keys=True)
+        # renaming is atomic, so concurrent processes never read partial files
+        getattr(os, 'replace', os.rename)(tmpname, _cache_file)
+    except (IOError, OSError) as exc:
+        logging.getLogger('vcstools').warn('Could not write version cache %s: %s' % (_cache_file, exc))
+
+
+def get_tool_version(program, probe):
+    """
+    :param program: name of the vcs program, e.g. 'git'
+    :param probe: function returning the version of program, called
+      only if no valid cached version exists
+    :returns: version string as returned by probe
+    :raises: whatever probe raises, failures are not cached
+    """
+    binary = which(program)
+    if binary is None:
+        # let probe report the missing program
+        return probe()
+    binary = os.path.realpath(binary)
+    try:
+        mtime = os.path.getmtime(binary)
+    except OSError:
+        return probe()
+    with _LOCK:
+        if not _cache_file_loaded:
+            _load_cache_file()
+        cached = _VERSIONS.get(binary)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    version = probe()
+    with _LOCK:
+        _VERSIONS[binary] = (mtime, version)
+        _save_cache_file()
+    return version
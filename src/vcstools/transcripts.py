@@ -0,0 +1,260 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2010, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+recording and replaying of the commands run by vcstools.
+
+While recording, every command run through vcstools.common is appended
+to a transcript file, one JSON object per line with the keys argv, cwd,
+env (the variables of ENV_VARS passed to the command), returncode,
+stdout, stderr and duration. Binary output, like archives, is stored
+base64 encoded with the additional key stdout_encoding. While
+replaying, commands are not spawned; their results are served from a
+transcript instead. Commands with the same argv, cwd and env are
+served in recorded order, the last result being repeated once all are
+used.
+
+This allows benchmarking and profiling the python side of the clients
+on recorded production runs, also on machines without the vcs
+programs::
+
+    with transcripts.recording('update.jsonl'):
+        client.update('master')
+    with transcripts.replaying('update.jsonl'):
+        client.update('master')
+
+The environment variables VCSTOOLS_RECORD and VCSTOOLS_REPLAY enable
+recording to or replaying from the named file for the whole process.
+Commands of the persistent git cat-file helper (GitClient with
+use_cat_file=True) are not recorded.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import json
+import os
+import threading
+from collections import deque
+
+from vcstools.vcs_base import VcsError
+
+
+# environment variables that are recorded and must match on replay
+ENV_VARS = ['LANG', 'LC_ALL', 'GIT_DIR', 'GIT_WORK_TREE']
+
+_LOCK = threading.Lock()
+# the active Recorder or Replayer, if any
+_active = None
+
+
+def _get_key(argv, cwd, env):
+    """
+    :param env: environment of the command, None for os.environ
+    :returns: (argv, cwd, env subset) as used to match commands
+    """
+    if env is None:
+        env = os.environ
+    if isinstance(argv, (list, tuple)):
+        argv = list(argv)
+    env_subset = dict((name, env[name]) for name in ENV_VARS if name in env)
+    return argv, cwd, env_subset
+
+
+def _freeze_key(argv, cwd, env_subset):
+    return json.dumps([argv, cwd, env_subset], sort_keys=True)
+
+
+class Recorder(object):
+    """
+    appends records of the commands run to a transcript file
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._fhand = None
+
+    def start(self):
+        self._fhand = open(self.filename, 'a')
+
+    def stop(self):
+        with self._lock:
+            if self._fhand is not None:
+                self._fhand.close()
+                self._fhand = None
+
+    def record(self, argv, cwd, env, returncode, stdout, stderr, duration, stdout_encoding=None):
+        argv, cwd, env_subset = _get_key(argv, cwd, env)
+        record = {'argv': argv,
+                  'cwd': cwd,
+                  'env': env_subset,
+                  'returncode': returncode,
+                  'stdout': stdout,
+                  'stderr': stderr,
+                  'duration': duration}
+        if stdout_encoding is not None:
+            record['stdout_encoding'] = stdout_encoding
+        line = json.dumps(record, sort_keys=True)
+        with self._lock:
+            if self._fhand is not None:
+                self._fhand.write(line + '\n')
+                self._fhand.flush()
+
+
+class Replayer(object):
+    """
+    serves the results of commands from a transcript file
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        # frozen key -> deque of records
+        self._records = {}
+
+    def start(self):
+        self._records = {}
+        with open(self.filename, 'r') as fhand:
+            for line in fhand:
+                if line.strip() == '':
+                    continue
+                record = json.loads(line)
+                key = _freeze_key(record['argv'], record['cwd'], record['env'])
+                self._records.setdefault(key, deque()).append(record)
+
+    def stop(self):
+        pass
+
+    def replay(self, argv, cwd, env):
+        """
+        :returns: the recorded dict for the command
+        :raises: VcsError if the command was not recorded
+        """
+        key = _freeze_key(*_get_key(argv, cwd, env))
+        with self._lock:
+            records = self._records.get(key)
+            if not records:
+                raise VcsError("Command not found in transcript %s: %s (cwd: %s)" %
+                               (self.filename, argv, cwd))
+            if len(records) > 1:
+                return records.popleft()
+            return records[0]
+
+
+def is_replaying():
+    return isinstance(_active, Replayer)
+
+
+def is_recording():
+    return isinstance(_active, Recorder)
+
+
+def record_command(argv, cwd, env, returncode, stdout, stderr, duration, stdout_encoding=None):
+    """
+    adds a command to the transcript if recording, else does nothing
+
+    :param env: environment passed to the command, None for os.environ
+    :param stdout: decoded output as returned to vcstools, or None
+    :param stdout_encoding: 'base64' if stdout holds binary output
+      encoded as base64, stored as key stdout_encoding of the record
+    """
+    active = _active
+    if isinstance(active, Recorder):
+        active.record(argv, cwd, env, returncode, stdout, stderr, duration, stdout_encoding)
+
+
+def replay_command(argv, cwd, env):
+    """
+    :param env: environment the command would be run with, None for os.environ
+    :returns: dict with returncode, stdout, stderr and duration of the
+      recorded command, or None if not replaying
+    :raises: VcsError if replaying and the command was not recorded
+    """
+    active = _active
+    if isinstance(active, Replayer):
+        return active.replay(argv, cwd, env)
+    return None
+
+
+class _TranscriptContext(object):
+
+    def __init__(self, transcript):
+        self.transcript = transcript
+
+    def __enter__(self):
+        global _active
+        with _LOCK:
+            if _active is not None:
+                raise VcsError("Already recording or replaying %s" % _active.filename)
+            self.transcript.start()
+            _active = self.transcript
+        return self.transcript
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active
+        with _LOCK:
+            _active = None
+            self.transcript.stop()
+
+
+def recording(filename):
+    """
+    context manager appending all commands run inside the with block
+    to the transcript filename
+
+    :raises: VcsError if already recording or replaying
+    """
+    return _TranscriptContext(Recorder(filename))
+
+
+def replaying(filename):
+    """
+    context manager serving all commands run inside the with block
+    from the transcript filename
+
+    :raises: VcsError if already recording or replaying
+    """
+    return _TranscriptContext(Replayer(filename))
+
+
+def _activate_from_environment():
+    global _active
+    if os.environ.get('VCSTOOLS_REPLAY'):
+        _active = Replayer(os.environ['VCSTOOLS_REPLAY'])
+    elif os.environ.get('VCSTOOLS_RECORD'):
+        _active = Recorder(os.environ['VCSTOOLS_RECORD'])
+    else:
+        return
+    _active.start()
+
+
+_activate_from_environment()
@@ -134,14 +134,23 @@ class VcsClient(object):
     def get_diff(self, basepath=None):
         return self.vcs.get_diff(basepath)
 
+    def iter_diff(self, rev_a=None, rev_b=None, stat_only=False, basepath=None):
+        return self.vcs.iter_diff(rev_a, rev_b, stat_only, basepath)
+
     def get_status(self, basepath=None, untracked=False, **kwargs):
         return self.vcs.get_status(basepath, untracked, **kwargs)
 
+    def iter_status(self, untracked=False):
+        return self.vcs.iter_status(untracked)
+
     def get_log(self, relpath=None, limit=None):
         return self.vcs.get_log(relpath, limit)
 
-    def export_repository(self, version, basepath):
-        return self.vcs.export_repository(version, basepath)
+    def export_repository(self, version, basepath, archive_format='gz', compresslevel=None):
+        return self.vcs.export_repository(version, basepath, archive_format, compresslevel)
+
+    def export_repository_stream(self, version, fileobj, archive_format='gz', compresslevel=None, prefix=''):
+        return self.vcs.export_repository_stream(version, fileobj, archive_format, compresslevel, prefix)
 
     def get_branches(self, local_only=False):
         return self.vcs.get_branches(local_only)
@@ -236,6 +236,27 @@ class VcsClientBase(object):
         raise NotImplementedError(
             "Base class get_diff method must be overridden")
 
+    def iter_diff(self, rev_a=None, rev_b=None, stat_only=False, basepath=None):
+        """
+        Yields the diff of each changed file as a
+        vcstools.diff_entry.DiffEntry while the vcs produces it, so
+        that large diffs are not held in memory.
+
+        :param rev_a: revision to compare, if None the revision the
+          working copy is based on
+        :param rev_b: revision to compare rev_a with, if None the
+          working copy
+        :param stat_only: if True, only yield the changed paths with
+          their status and, where the vcs counts them, the added and
+          deleted lines, without the lines of the diff
+        :param basepath: diff paths in the lines will be relative to
+          this, if any. The paths of the entries are relative to the
+          client path.
+        :returns: generator of DiffEntry
+        """
+        raise NotImplementedError("Base class iter_diff method must be overridden for client type %s " %
+                                  self._vcs_type_name)
+
     def get_status(self, basepath=None, untracked=False, **kwargs):
         """
         Calls scm status command. Output must be terminated by newline
@@ -257,6 +278,19 @@ class VcsClientBase(object):
         raise NotImplementedError("Base class get_status method must be overridden for client type %s " %
                                   self._vcs_type_name)
 
+    def iter_status(self, untracked=False):
+        """
+        Yields the locally changed paths of the working copy as
+        vcstools.status_entry.StatusEntry records, with paths relative
+        to the client path, including the paths within submodules where
+        the vcs has them. get_status() formats the same records.
+
+        :param untracked: whether to also yield changes that would not commit
+        :returns: generator of StatusEntry
+        """
+        raise NotImplementedError("Base class iter_status method must be overridden for client type %s " %
+                                  self._vcs_type_name)
+
     def get_affected_files(self, revision):
         """
         Get the files that were affected by a specific revision
@@ -288,11 +322,12 @@ class VcsClientBase(object):
         raise NotImplementedError(
             "Base class get_log method must be overridden")
 
-    def export_repository(self, version, basepath):
+    def export_repository(self, version, basepath, archive_format='gz', compresslevel=None):
         """
         Calls scm equivalent to `svn export`, removing scm meta
         information and tar gzip'ing the repository at a given version
-        to the given basepath.
+        to the given basepath. Compression runs on several threads, see
+        :mod:`vcstools.compression`.
 
         :param version: version of the repository to export.  This can
         be a branch, tag, or path (svn).  When specifying the version
@@ -301,11 +336,39 @@ class VcsClientBase(object):
         the root.
         :param basepath: this is the path to the tar gzip, excluding
         the extension which will be .tar.gz
+        :param archive_format: 'gz', 'bz2', 'xz' or 'tar' for no
+        compression, changing the extension to .tar.bz2, .tar.xz or .tar
+        :param compresslevel: compression level from 0 (gz and xz:
+        no compression) to 9, None for the default of the format
         :returns: True on success, False otherwise.
+        :raises: ValueError for unknown formats
         """
         raise NotImplementedError("Base class export_repository method must be overridden for client type %s " %
                                   self._vcs_type_name)
 
+    def export_repository_stream(self, version, fileobj, archive_format='gz', compresslevel=None, prefix=''):
+        """
+        Like export_repository, but writes the tar archive to a file
+        object instead of a file. The archive is written in tar stream
+        mode, fileobj is never seeked, so it may be a pipe, a socket or
+        the body of an upload. Nothing is written if version cannot be
+        resolved, but a failing export may leave a partial archive.
+
+        :param version: version of the repository to export, see
+        export_repository
+        :param fileobj: writable binary file object, not closed
+        :param archive_format: 'gz', 'bz2', 'xz' or 'tar' for no
+        compression
+        :param compresslevel: compression level from 0 (gz and xz:
+        no compression) to 9, None for the default of the format
+        :param prefix: directory the files are placed in within the
+        archive, '' for the top level
+        :returns: True on success, False otherwise.
+        :raises: ValueError for unknown formats
+        """
+        raise NotImplementedError("Base class export_repository_stream method must be overridden for client type %s " %
+                                  self._vcs_type_name)
+
     def get_branches(self, local_only=False):
         """
         Returns a list of all branches in the vcs repository.
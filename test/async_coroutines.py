@@ -0,0 +1,63 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+coroutines used by test_async_client. Their async syntax does not
+compile before python 3.5, so test_async_client imports this module
+only after its version check.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import asyncio
+
+from vcstools.async_client import AsyncGitClient, run_command_async
+
+
+async def run_many(count, jobs):
+    limit = asyncio.Semaphore(jobs)
+    return await asyncio.gather(*[run_command_async(['echo', str(i)], limit=limit)
+                                  for i in range(count)])
+
+
+async def checkout_all(paths, url, version, jobs):
+    limit = asyncio.Semaphore(jobs)
+    clients = [AsyncGitClient(path, limit=limit) for path in paths]
+    results = await asyncio.gather(*[c.checkout(url, version=version) for c in clients])
+    versions = await asyncio.gather(*[c.get_version() for c in clients])
+    return results, versions
+
+
+async def update_all(paths, version):
+    clients = [AsyncGitClient(path) for path in paths]
+    return await asyncio.gather(*[c.update(version) for c in clients])
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import sys
+import unittest
+import subprocess
+import tarfile
+import tempfile
+import shutil
+import time
+
+if sys.version_info < (3, 5):
+    raise unittest.SkipTest('asyncio clients require python 3.5')
+
+import asyncio
+from vcstools import GitClient, fetching, profile
+from vcstools.async_client import AsyncGitClient, AsyncHgClient, run_command_async
+from test.async_coroutines import checkout_all, run_many, update_all
+
+os.environ['GIT_AUTHOR_NAME'] = 'Your Name'
+os.environ['GIT_COMMITTER_NAME'] = 'Your Name'
+os.environ['GIT_AUTHOR_EMAIL'] = 'name@example.com'
+os.environ['EMAIL'] = 'Your Name <name@example.com>'
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class RunCommandAsyncTest(unittest.TestCase):
+
+    def test_run_command_async(self):
+        self.assertEqual((0, 'foo', None), run(run_command_async(['echo', 'foo'])))
+        value, _, _ = run(run_command_async(['false']))
+        self.assertEqual(1, value)
+        value, output, _ = run(run_command_async(['echo', 'foo; false']))
+        self.assertEqual(0, value)
+        self.assertEqual('foo; false', output)
+
+    def test_run_command_async_timeout(self):
+        value, _, _ = run(run_command_async(['sleep', '10'], timeout=0.5))
+        self.assertNotEqual(0, value)
+        # children of the command are terminated with it
+        start = time.time()
+        value, _, _ = run(run_command_async(['sh', '-c', 'sleep 10 & sleep 10'], timeout=0.5))
+        self.assertTrue(time.time() - start < 5)
+        self.assertNotEqual(0, value)
+
+    def test_run_command_async_limit(self):
+
+        results = run(run_many(8, 2))
+        self.assertEqual([str(i) for i in range(8)], [output for _, output, _ in results])
+
+
+class AsyncGitClientTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        self.root_directory = tempfile.mkdtemp()
+        self.remote_path = os.path.join(self.root_directory, "remote")
+        self.local_path = os.path.join(self.root_directory, "local")
+        os.makedirs(self.remote_path)
+
+        subprocess.check_call("git init", shell=True, cwd=self.remote_path)
+        subprocess.check_call("touch fixed.txt", shell=True, cwd=self.remote_path)
+        subprocess.check_call("git add *", shell=True, cwd=self.remote_path)
+        subprocess.check_call("git commit -m initial", shell=True, cwd=self.remote_path)
+        subprocess.check_call("git tag test_tag", shell=True, cwd=self.remote_path)
+        subprocess.check_call("git branch other", shell=True, cwd=self.remote_path)
+        self.version_init = GitClient(self.remote_path).get_version()
+        subprocess.check_call("touch modified.txt", shell=True, cwd=self.remote_path)
+        subprocess.check_call("git add *", shell=True, cwd=self.remote_path)
+        subprocess.check_call("git commit -m second", shell=True, cwd=self.remote_path)
+        self.version = GitClient(self.remote_path).get_version()
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.root_directory)
+
+    def tearDown(self):
+        if os.path.exists(self.local_path):
+            shutil.rmtree(self.local_path)
+
+    def test_checkout_concurrent(self):
+        paths = [os.path.join(self.local_path, str(i)) for i in range(4)]
+        results, versions = run(checkout_all(paths, self.remote_path, 'test_tag', 2))
+        self.assertEqual([True] * 4, results)
+        self.assertEqual([self.version_init] * 4, versions)
+
+    def test_update_concurrent(self):
+        paths = [os.path.join(self.local_path, str(i)) for i in range(3)]
+        results, _ = run(checkout_all(paths, self.remote_path, 'master', 3))
+        self.assertEqual([True] * 3, results)
+        # the first update fetches longest, so the fetching scopes of
+        # the updates close out of order
+        subprocess.check_call(['git', 'config', 'remote.origin.uploadpack', 'sleep 1; git-upload-pack'],
+                              cwd=paths[0])
+        self.assertEqual([True] * 3, run(update_all(paths, 'master')))
+        self.assertEqual([], fetching._SCOPES)
+        for path in paths:
+            self.assertTrue(fetching.needs_fetch(os.path.realpath(path)))
+
+    def test_get_version_update(self):
+        client = AsyncGitClient(self.local_path)
+        self.assertTrue(run(client.checkout(self.remote_path)))
+        self.assertEqual(self.version, run(client.get_version()))
+        self.assertEqual(self.version_init, run(client.get_version('test_tag')))
+        self.assertEqual(None, run(client.get_version('no_such_tag')))
+        self.assertTrue(run(client.update('test_tag')))
+        self.assertEqual(self.version_init, run(client.get_version()))
+        self.assertTrue(run(client.update('master')))
+        self.assertEqual(self.version, run(client.get_version()))
+
+    def test_single_branch_partial_clone(self):
+        client = AsyncGitClient(self.local_path)
+        self.assertTrue(run(client.checkout('file://' + self.remote_path, version='test_tag',
+                                            single_branch=True)))
+        self.assertEqual((None, True), client.client._get_clone_options())
+        self.assertEqual(self.version_init, run(client.get_version()))
+        # versions outside the cloned tag are fetched when needed
+        self.assertEqual(self.version, run(client.get_version(self.version)))
+        shutil.rmtree(self.local_path)
+        # other branches are fetched by update as well
+        self.assertTrue(run(client.checkout('file://' + self.remote_path, version='master', single_branch=True)))
+        self.assertTrue(run(client.update('other')))
+        self.assertEqual(self.version_init, run(client.get_version()))
+        shutil.rmtree(self.local_path)
+        subprocess.check_call("git config uploadpack.allowfilter true", shell=True, cwd=self.remote_path)
+        self.assertTrue(run(client.checkout('file://' + self.remote_path, clone_filter='blob:none')))
+        self.assertEqual(('blob:none', False), client.client._get_clone_options())
+        self.assertEqual(self.version, run(client.get_version()))
+
+    def test_status_diff_log(self):
+        client = AsyncGitClient(self.local_path)
+        self.assertTrue(run(client.checkout(self.remote_path)))
+        blocking = client.client
+        with open(os.path.join(self.local_path, 'modified.txt'), 'a') as f:
+            f.write('0123456789abcdef')
+        subprocess.check_call("touch added.txt", shell=True, cwd=self.local_path)
+        subprocess.check_call("git add added.txt", shell=True, cwd=self.local_path)
+        self.assertEqual(blocking.get_status(), run(client.get_status()))
+        self.assertEqual(blocking.get_status(porcelain=True, untracked=True),
+                         run(client.get_status(porcelain=True, untracked=True)))
+        basepath = os.path.dirname(self.local_path)
+        self.assertEqual(blocking.get_status(basepath=basepath),
+                         run(client.get_status(basepath=basepath)))
+        self.assertEqual(blocking.get_diff(), run(client.get_diff()))
+        self.assertTrue('0123456789abcdef' in run(client.get_diff()))
+        log = run(client.get_log())
+        self.assertEqual(blocking.get_log(), log)
+        self.assertEqual(2, len(log))
+        self.assertEqual(1, len(run(client.get_log(limit=1))))
+
+    def test_export_repository(self):
+        client = AsyncGitClient(self.local_path)
+        self.assertTrue(run(client.checkout(self.remote_path)))
+        basepath = os.path.join(self.root_directory, 'export')
+        with profile() as prof:
+            self.assertTrue(run(client.export_repository(self.version, basepath)))
+        self.assertTrue(os.path.exists(basepath + '.tar.gz'))
+        # commands run in the executor are reported for the async method
+        self.assertEqual(set(['AsyncGitClient.export_repository']), set(r['method'] for r in prof.records))
+        os.remove(basepath + '.tar.gz')
+
+
+class AsyncHgClientTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        self.root_directory = tempfile.mkdtemp()
+        self.remote_path = os.path.join(self.root_directory, "remote")
+        self.local_path = os.path.join(self.root_directory, "local")
+        os.makedirs(self.remote_path)
+
+        subprocess.check_call("hg init", shell=True, cwd=self.remote_path)
+        subprocess.check_call("touch fixed.txt", shell=True, cwd=self.remote_path)
+        subprocess.check_call("hg add fixed.txt", shell=True, cwd=self.remote_path)
+        subprocess.check_call("hg commit -m initial", shell=True, cwd=self.remote_path)
+        subprocess.check_call("hg tag test_tag", shell=True, cwd=self.remote_path)
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.root_directory)
+
+    def test_checkout_status_log(self):
+        client = AsyncHgClient(self.local_path)
+        self.assertTrue(run(client.checkout(self.remote_path)))
+        blocking = client.client
+        self.assertEqual(blocking.get_version(), run(client.get_version()))
+        self.assertEqual(blocking.get_version('test_tag'), run(client.get_version('test_tag')))
+        with open(os.path.join(self.local_path, 'fixed.txt'), 'a') as f:
+            f.write('0123456789abcdef')
+        self.assertEqual(blocking.get_status(), run(client.get_status()))
+        self.assertEqual(blocking.get_diff(), run(client.get_diff()))
+        self.assertEqual(blocking.get_log(), run(client.get_log()))
+        basepath = os.path.join(self.root_directory, 'export')
+        self.assertTrue(run(client.export_repository(blocking.get_version(), basepath, 'bz2')))
+        with tarfile.open(basepath + '.tar.bz2') as tar_file:
+            self.assertTrue('export/fixed.txt' in tar_file.getnames())
+        self.assertFalse(os.path.exists(basepath + '.tar'))
+        os.remove(basepath + '.tar.bz2')
+        self.assertTrue(run(client.update()))
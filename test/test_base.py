@@ -1,14 +1,23 @@
 from __future__ import absolute_import, print_function, unicode_literals
 import os
+import datetime
+import json
+import time
+import threading
 import unittest
 import tempfile
 import shutil
-from mock import Mock
+import subprocess
+from mock import Mock, patch
+import dateutil.tz
 
 import vcstools
 from vcstools.vcs_base import VcsClientBase, VcsError
+from vcstools import profiling, tool_versions, transcripts
+from vcstools.log_entry import LogEntry, parse_raw_date, parse_hgdate
 from vcstools.common import sanitized, normalized_rel_path, \
-    run_shell_command, urlretrieve_netrc, _netrc_open, urlopen_netrc
+    run_shell_command, run_command, urlretrieve_netrc, _netrc_open, urlopen_netrc, \
+    CommandLines, map_parallel, _communicate, _get_process_group_flags
 
 
 class BaseTest(unittest.TestCase):
@@ -77,6 +86,243 @@ class BaseTest(unittest.TestCase):
         except:
             pass
 
+    def test_run_command(self):
+        self.assertEqual((0, "", None), run_command(["true"]))
+        self.assertEqual((1, "", None), run_command(["false"]))
+        # arguments are not interpreted by a shell
+        self.assertEqual((0, "foo; echo bar", None), run_command(["echo", "foo; echo bar"]))
+        _, env_langs, _ = run_command(["/usr/bin/env"], us_env=True)
+        self.assertTrue("LANG=en_US.UTF-8" in env_langs.splitlines())
+        # environment changes are picked up after first call
+        os.environ['VCSTOOLS_TEST_VAR'] = 'foo'
+        try:
+            _, env_vars, _ = run_command(["/usr/bin/env"], us_env=True)
+            self.assertTrue("VCSTOOLS_TEST_VAR=foo" in env_vars.splitlines())
+        finally:
+            del os.environ['VCSTOOLS_TEST_VAR']
+        self.assertRaises(ValueError, run_command, "echo foo")
+
+    def test_run_command_timeout(self):
+        threads = threading.active_count()
+        for kwargs in [{}, {'no_filter': True}, {'show_stdout': True}, {'verbose': True}]:
+            start = time.time()
+            value, _, _ = run_command(["sh", "-c", "echo foo; sleep 10"], timeout=0.5, **kwargs)
+            self.assertTrue(time.time() - start < 5, kwargs)
+            self.assertNotEqual(0, value, kwargs)
+            self.assertEqual(threads, threading.active_count())
+        # output of commands finishing in time is complete
+        value, output, _ = run_command(["seq", "100000"], timeout=10)
+        self.assertEqual(0, value)
+        self.assertEqual(100000, len(output.splitlines()))
+        value, output, message = run_command(["sh", "-c", "echo foo >&2; exit 2"], timeout=10, no_warn=True)
+        self.assertEqual(2, value)
+        self.assertTrue('foo' in message)
+
+    def test_communicate_timeout(self):
+        # how filtered commands are read on windows, with and without
+        # the communicate() timeout of py3
+        for module in [subprocess, Mock(spec=[])]:
+            proc = subprocess.Popen(["sh", "-c", "echo foo; sleep 10"], stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, **_get_process_group_flags())
+            start = time.time()
+            with patch('vcstools.common.subprocess', module):
+                (output, _), timed_out = _communicate(proc, profiling.clock() + 0.5)
+            self.assertTrue(time.time() - start < 5)
+            self.assertTrue(timed_out)
+            self.assertEqual(b'foo\n', output)
+            proc = subprocess.Popen(["echo", "foo"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            with patch('vcstools.common.subprocess', module):
+                self.assertEqual(((b'foo\n', b''), False), _communicate(proc, profiling.clock() + 10))
+        proc = subprocess.Popen(["echo", "foo"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(((b'foo\n', b''), False), _communicate(proc, None))
+
+    def test_log_entry(self):
+        parsed = []
+
+        def parse(value):
+            parsed.append(value)
+            return parse_raw_date(value)
+        entry = LogEntry('abc', 'author', 'a@b.c', '1500000000 +0230', 'message', date_parser=parse)
+        self.assertEqual('abc', entry['id'])
+        self.assertEqual(['id', 'author', 'email', 'date', 'message'], list(entry))
+        copied = entry.copy()
+        self.assertEqual([], parsed)
+        self.assertEqual(datetime.datetime(2017, 7, 14, 5, 10,
+                                           tzinfo=dateutil.tz.tzoffset(None, 9000)), entry['date'])
+        self.assertEqual('2017-07-14T02:40:00+00:00',
+                         entry['date'].astimezone(dateutil.tz.tzutc()).isoformat())
+        self.assertEqual(entry['date'], copied.date)
+        self.assertEqual(2, len(parsed))
+        self.assertEqual(entry['date'], parse_hgdate('1500000000 -9000'))
+        # usable like a dict
+        self.assertEqual(dict(entry), entry)
+        self.assertEqual(entry, dict(entry))
+        entry['extra'] = 1
+        del entry['email']
+        self.assertFalse('email' in entry)
+        self.assertEqual(None, entry.get('email'))
+        self.assertEqual(['id', 'author', 'date', 'message', 'extra'], list(entry.keys()))
+        self.assertRaises(KeyError, entry.__getitem__, 'email')
+        partial = LogEntry.from_values(['abc', 'author'])
+        self.assertEqual({'id': 'abc', 'author': 'author'}, dict(partial))
+        self.assertEqual(None, LogEntry('abc', None, None, None, None)['date'])
+
+    def test_map_parallel(self):
+        threads = set()
+
+        def square(item):
+            threads.add(threading.current_thread())
+            time.sleep(0.01)
+            return item * item
+        self.assertEqual([x * x for x in range(20)], map_parallel(square, range(20), 4))
+        self.assertTrue(1 < len(threads) <= 4)
+        self.assertEqual([], map_parallel(square, [], 4))
+        self.assertEqual([4], map_parallel(square, [2], 4))
+
+        def fail(item):
+            if item % 2:
+                raise ValueError(item)
+            return item
+        try:
+            map_parallel(fail, range(10), 3)
+            self.fail('expected ValueError')
+        except ValueError as exc:
+            self.assertEqual(1, exc.args[0])
+
+    def test_command_lines(self):
+        lines = CommandLines(["printf", "foo\\nbar\\n\\nbaz"])
+        self.assertEqual(["foo", "bar", "", "baz"], list(lines))
+        self.assertEqual(0, lines.returncode)
+        with CommandLines(["printf", "foo\\0bar\\0"], separator="\0") as lines:
+            self.assertEqual(["foo", "bar"], list(lines))
+        # stderr does not block the command
+        lines = CommandLines(["sh", "-c", "seq 100000 >&2; echo done; exit 3"], no_warn=True)
+        self.assertEqual(["done"], list(lines))
+        self.assertEqual(3, lines.returncode)
+        self.assertTrue("100000" in lines.message)
+        # closing early terminates the command
+        with CommandLines(["yes"]) as lines:
+            for count, line in enumerate(lines):
+                if count == 3:
+                    break
+        self.assertNotEqual(0, lines.returncode)
+        self.assertRaises(ValueError, CommandLines, "echo foo")
+        self.assertRaises(VcsError, CommandLines, ["no_such_command_vcstools"])
+
+    def test_profile(self):
+        class ProfiledClient(VcsClientBase):
+            def get_version(self, spec=None):
+                return self._get_version()
+
+            def _get_version(self):
+                return run_command(["echo", "foo"])
+
+        records = []
+        vcstools.add_command_hook(records.append)
+        try:
+            with vcstools.profile() as prof:
+                ProfiledClient('profiled', '.').get_version()
+                run_command(["sh", "-c", "echo bar >&2; exit 2"], no_warn=True)
+                list(CommandLines(["echo", "baz"]))
+        finally:
+            vcstools.remove_command_hook(records.append)
+        run_command(["true"])
+        self.assertEqual(3, len(records))
+        self.assertEqual(records, prof.records)
+        self.assertEqual(["echo", "foo"], records[0]['argv'])
+        self.assertEqual('ProfiledClient.get_version', records[0]['method'])
+        self.assertEqual(4, records[0]['stdout_bytes'])
+        self.assertEqual(None, records[1]['method'])
+        self.assertEqual(2, records[1]['returncode'])
+        self.assertEqual(4, records[1]['stderr_bytes'])
+        self.assertEqual(4, records[2]['stdout_bytes'])
+        stats = prof.get_stats()
+        self.assertEqual(1, stats['ProfiledClient.get_version']['count'])
+        self.assertEqual(2, stats['unknown']['count'])
+        self.assertEqual(2, sum(stats['unknown']['histogram']))
+        dumped = json.loads(prof.dump_json(records=True))
+        self.assertEqual(3, len(dumped['records']))
+        self.assertEqual(['ProfiledClient.get_version', 'unknown'], sorted(dumped['methods']))
+
+    def test_profile_map_parallel(self):
+        class ProfiledClient(VcsClientBase):
+            def get_version(self, spec=None):
+                return map_parallel(lambda arg: run_command(["echo", arg]), ["foo", "bar"], 2)
+
+        with vcstools.profile() as prof:
+            ProfiledClient('profiled', '.').get_version()
+        self.assertEqual(['ProfiledClient.get_version'] * 2, [r['method'] for r in prof.records])
+
+    def test_tool_versions(self):
+        root_directory = tempfile.mkdtemp()
+        program = os.path.join(root_directory, 'vcstools_fake_vcs')
+        with open(program, 'w') as fhand:
+            fhand.write('#!/bin/sh\necho 1.0\n')
+        os.chmod(program, 0o755)
+        cache_file = os.path.join(root_directory, 'versions.json')
+        probes = []
+
+        def probe():
+            probes.append(1)
+            return run_command([program])[1]
+
+        backup_path = os.environ['PATH']
+        os.environ['PATH'] = root_directory + os.pathsep + backup_path
+        try:
+            tool_versions.set_cache_file(cache_file)
+            self.assertEqual('1.0', tool_versions.get_tool_version('vcstools_fake_vcs', probe))
+            self.assertEqual('1.0', tool_versions.get_tool_version('vcstools_fake_vcs', probe))
+            self.assertEqual(1, len(probes))
+            # other processes reuse the cache file
+            tool_versions.clear_cache()
+            self.assertEqual('1.0', tool_versions.get_tool_version('vcstools_fake_vcs', probe))
+            self.assertEqual(1, len(probes))
+            # changing the binary invalidates its version
+            with open(program, 'w') as fhand:
+                fhand.write('#!/bin/sh\necho 2.0\n')
+            os.utime(program, (0, 0))
+            self.assertEqual('2.0', tool_versions.get_tool_version('vcstools_fake_vcs', probe))
+            self.assertEqual(2, len(probes))
+            # missing programs are probed every time
+            self.assertRaises(VcsError, tool_versions.get_tool_version, 'vcstools_no_such_vcs',
+                              lambda: run_command(['vcstools_no_such_vcs']))
+        finally:
+            os.environ['PATH'] = backup_path
+            tool_versions.set_cache_file(None)
+            tool_versions.clear_cache()
+            shutil.rmtree(root_directory)
+
+    def test_transcripts(self):
+        root_directory = tempfile.mkdtemp()
+        program = os.path.join(root_directory, 'vcstools_fake_vcs')
+        with open(program, 'w') as fhand:
+            fhand.write('#!/bin/sh\necho "$1"\necho err >&2\nexit 3\n')
+        os.chmod(program, 0o755)
+        transcript = os.path.join(root_directory, 'transcript.jsonl')
+        try:
+            with transcripts.recording(transcript):
+                recorded = [run_command([program, 'foo'], no_warn=True),
+                            run_command([program, 'bar'], cwd=root_directory, no_warn=True)]
+                with CommandLines([program, 'baz\nbim'], no_warn=True) as lines:
+                    recorded_lines = list(lines)
+            os.remove(program)
+            with transcripts.replaying(transcript):
+                self.assertEqual(recorded[1], run_command([program, 'bar'], cwd=root_directory, no_warn=True))
+                self.assertEqual(recorded[0], run_command([program, 'foo'], no_warn=True))
+                # results are repeated
+                self.assertEqual(recorded[0], run_command([program, 'foo'], no_warn=True))
+                with CommandLines([program, 'baz\nbim'], no_warn=True) as lines:
+                    self.assertEqual(recorded_lines, list(lines))
+                self.assertEqual(3, lines.returncode)
+                self.assertTrue('err' in lines.message)
+                self.assertRaises(VcsError, run_command, [program, 'foo'], cwd=root_directory)
+                self.assertRaises(VcsError, transcripts.recording(transcript).__enter__)
+            self.assertEqual(3, recorded[0][0])
+            self.assertEqual('foo', recorded[0][1])
+            self.assertEqual(['baz', 'bim'], recorded_lines)
+        finally:
+            shutil.rmtree(root_directory)
+
     def test_shell_command_verbose(self):
         # just check no Exception happens due to decoding
         run_shell_command("echo %s" % (b'\xc3\xa4'.decode('UTF-8')), shell=True, verbose=True)
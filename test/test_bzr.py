@@ -39,9 +39,10 @@ import io
 import fnmatch
 import shutil
 import subprocess
+import tarfile
 import tempfile
 import unittest
-from vcstools.bzr import BzrClient, _get_bzr_version
+from vcstools.bzr import BzrClient, _get_bzr_version, _format_bzr_status, _parse_bzr_status
 
 
 os.environ['EMAIL'] = 'Your Name <name@example.com>'
@@ -373,3 +374,19 @@ class BzrDiffStatClientTest(BzrClientTestSetups):
         self.assertTrue(os.path.exists(self.basepath_export + '.tar.gz'))
         self.assertFalse(os.path.exists(self.basepath_export + '.tar'))
         self.assertFalse(os.path.exists(self.basepath_export))
+        with tarfile.open(self.basepath_export + '.tar.gz') as tar_file:
+            self.assertEqual(set(['export']), set(name.split('/')[0] for name in tar_file.getnames()))
+        os.remove(self.basepath_export + '.tar.gz')
+        self.assertFalse(client.export_repository('nonexistent_rev', self.basepath_export))
+        self.assertFalse(os.path.exists(self.basepath_export + '.tar.gz'))
+
+
+class BzrFormatStatusTest(unittest.TestCase):
+
+    def test_format_rename(self):
+        # the prefix goes in front of the line only, as get_status
+        # always printed bzr status -S output
+        entries = _parse_bzr_status('R   old.txt => new.txt\n M  modified.txt\n')
+        self.assertEqual(('new.txt', 'old.txt'), (entries[0].path, entries[0].orig_path))
+        self.assertEqual('R   local/old.txt => new.txt\n M  local/modified.txt\n',
+                         _format_bzr_status(entries, 'local'))
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import bz2
+import gzip
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+from mock import patch
+
+from vcstools import compression
+
+
+def _decompress(archive_format, data):
+    if archive_format == 'gz':
+        with gzip.GzipFile(fileobj=io.BytesIO(data)) as gzip_file:
+            return gzip_file.read()
+    if archive_format == 'bz2':
+        return bz2.decompress(data)
+    if archive_format == 'xz':
+        return lzma.decompress(data)
+    return data
+
+
+class CompressedWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = b''.join(b'%d line of data\n' % i for i in range(20000))
+
+    def _compress(self, archive_format, jobs, level=None, block_size=10000):
+        target = io.BytesIO()
+        writer = compression.CompressedWriter(target, archive_format, level=level, jobs=jobs)
+        writer._block_size = block_size
+        for start in range(0, len(self.data), 7777):
+            writer.write(self.data[start:start + 7777])
+        writer.close()
+        self.assertTrue(writer.closed)
+        return target.getvalue()
+
+    def test_formats(self):
+        formats = ['tar', 'gz', 'bz2']
+        if lzma is not None:
+            formats.append('xz')
+        for archive_format in formats:
+            for jobs in [1, 4]:
+                data = self._compress(archive_format, jobs)
+                self.assertEqual(self.data, _decompress(archive_format, data), archive_format)
+        self.assertEqual(self.data, self._compress('tar', 4))
+
+    def test_gz_members(self):
+        data = self._compress('gz', 3)
+        # one gzip member per block, each starting with the gzip magic
+        decompressor = zlib.decompressobj(31)
+        self.assertEqual(self.data[:10000], decompressor.decompress(data))
+        self.assertTrue(decompressor.unused_data.startswith(b'\x1f\x8b'))
+        # level 0 only stores
+        self.assertTrue(len(self._compress('gz', 2, level=0)) > len(self.data))
+
+    def test_empty(self):
+        target = io.BytesIO()
+        with compression.CompressedWriter(target, 'gz', jobs=2):
+            pass
+        self.assertEqual(b'', _decompress('gz', target.getvalue()))
+
+    def test_write_command_output(self):
+        target = io.BytesIO()
+        writer = compression.CompressedWriter(target, 'gz', jobs=2)
+        self.assertFalse(compression.write_command_output(['git', 'cat-file', 'blob', '0' * 40], None, writer))
+        self.assertEqual(b'', target.getvalue())
+        writer = compression.CompressedWriter(target, 'gz', jobs=2)
+        self.assertTrue(compression.write_command_output(['git', '--version'], None, writer))
+        self.assertTrue(_decompress('gz', target.getvalue()).startswith(b'git version'))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, compression.CompressedWriter, io.BytesIO(), 'rar')
+        self.assertRaises(ValueError, compression.CompressedWriter, io.BytesIO(), 'bz2', level=0)
+        self.assertRaises(ValueError, compression.CompressedWriter, io.BytesIO(), 'zip')
+        self.assertRaises(ValueError, compression.get_archive_path, 'export', 'zip')
+        self.assertEqual('export.tar.xz', compression.get_archive_path('export', 'xz'))
+        self.assertRaises(ValueError, compression.check_format, 'zip')
+        self.assertRaises(ValueError, compression.check_format, 'gz', 10)
+        compression.check_format('tar')
+
+
+class ZipWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root_directory = tempfile.mkdtemp()
+        self.files = {'empty': b'',
+                      'small.txt': b'small',
+                      'na\u00efve.txt': b'naive',
+                      'large.txt': b''.join(b'%d line of data\n' % i for i in range(20000))}
+        for name, data in self.files.items():
+            with open(os.path.join(self.root_directory, name), 'wb') as fhand:
+                fhand.write(data)
+        os.chmod(os.path.join(self.root_directory, 'small.txt'), 0o755)
+        os.symlink('small.txt', os.path.join(self.root_directory, 'link'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root_directory)
+
+    def _write(self, level, jobs):
+        target = io.BytesIO()
+        with compression.ZipWriter(target, level, jobs) as writer:
+            writer._block_size = 10000
+            for name in sorted(self.files) + ['link']:
+                writer.add_file(os.path.join(self.root_directory, name), 'prefix/' + name)
+        return target.getvalue()
+
+    def test_zip(self):
+        for level, jobs in [(None, 1), (None, 4), (1, 3), (0, 2)]:
+            with zipfile.ZipFile(io.BytesIO(self._write(level, jobs))) as zip_file:
+                self.assertEqual(None, zip_file.testzip())
+                for name, data in self.files.items():
+                    self.assertEqual(data, zip_file.read('prefix/' + name))
+                info = zip_file.getinfo('prefix/small.txt')
+                self.assertEqual(0o755, (info.external_attr >> 16) & 0o777)
+                self.assertEqual(zipfile.ZIP_STORED if level == 0 else zipfile.ZIP_DEFLATED, info.compress_type)
+                self.assertEqual(b'small.txt', zip_file.read('prefix/link'))
+                self.assertEqual(0xA1ED0000, zip_file.getinfo('prefix/link').external_attr)
+        self.assertTrue(len(self._write(None, 2)) < len(self._write(0, 2)) // 2)
+        self.assertRaises(ValueError, compression.ZipWriter, io.BytesIO(), 10)
+
+    def test_zip64(self):
+        target = io.BytesIO()
+        with patch.object(compression, '_ZIP_MAX_ENTRIES', 2):
+            with compression.ZipWriter(target, jobs=2) as writer:
+                for name in sorted(self.files):
+                    writer.add_file(os.path.join(self.root_directory, name), name)
+                entry = compression._ZipEntry('large64', (2020, 1, 1, 0, 0, 0), 0o644 << 16,
+                                              compression._ZIP_DEFLATED, True)
+                writer._add_entry(entry, iter([self.files['large.txt']]))
+        with zipfile.ZipFile(io.BytesIO(target.getvalue())) as zip_file:
+            self.assertEqual(len(self.files) + 1, len(zip_file.infolist()))
+            self.assertEqual(None, zip_file.testzip())
+            self.assertEqual(self.files['large.txt'], zip_file.read('large64'))
+
+    def test_abort(self):
+        target = io.BytesIO()
+        writer = compression.ZipWriter(target, jobs=2)
+        writer.add_file(os.path.join(self.root_directory, 'large.txt'), 'large.txt')
+        writer.abort()
+        self.assertRaises(zipfile.BadZipfile, zipfile.ZipFile, io.BytesIO(target.getvalue()))
+
+
+class CompressTarFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root_directory = tempfile.mkdtemp()
+        self.basepath = os.path.join(self.root_directory, 'export')
+        with tarfile.open(self.basepath + '.tar', 'w') as tar_file:
+            tar_file.add(__file__, 'test.py')
+
+    def tearDown(self):
+        shutil.rmtree(self.root_directory)
+
+    def test_compress_tar_file(self):
+        archive_path = compression.compress_tar_file(self.basepath, 'bz2', jobs=2)
+        self.assertEqual(self.basepath + '.tar.bz2', archive_path)
+        self.assertFalse(os.path.exists(self.basepath + '.tar'))
+        with tarfile.open(archive_path) as tar_file:
+            self.assertEqual(['test.py'], tar_file.getnames())
+
+    def test_compress_tar_file_tar(self):
+        self.assertEqual(self.basepath + '.tar', compression.compress_tar_file(self.basepath, 'tar'))
+        self.assertTrue(os.path.exists(self.basepath + '.tar'))
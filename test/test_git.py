@@ -33,10 +33,12 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+import errno
 import os
 import io
 import unittest
 import subprocess
+import tarfile
 import tempfile
 import shutil
 import types
@@ -44,8 +46,22 @@ import threading
 import time
 
 from distutils.version import LooseVersion
+from mock import patch
 from vcstools import GitClient
+from vcstools.diff_entry import DiffEntry, iter_git_format_diff
+from vcstools.git import _format_git_status, _iter_git_diff_summary, _parse_git_status, _parse_gitlinks, \
+    _quote_git_path
+from vcstools.git_ancestry import GitAncestry
+from vcstools.git_cat_file import GitCatFile
+from vcstools import fetching
+from vcstools import git_export
+from vcstools import git_mirror
+from vcstools import log_cache
+from vcstools import profile
+from vcstools import transcripts
+from vcstools.status_entry import StatusEntry
 from vcstools.vcs_base import VcsError
+from test.streams import PipeStream
 
 try:
     from socketserver import TCPServer, BaseRequestHandler
@@ -177,11 +193,11 @@ class GitClientTest(GitClientTestSetups):
         client.submodules = 0
         client.fast_forwards = 0
 
-        def ifetch(self):
+        def ifetch(self, timeout=None, force=False):
             self.fetches += 1
             return True
 
-        def iff(self, branch_parent, fetch=True, verbose=False):
+        def iff(self, branch_parent, fetch=True, verbose=False, snapshot=None):
             self.fast_forwards += 1
             return True
 
@@ -217,11 +233,11 @@ class GitClientTest(GitClientTestSetups):
         client.submodules = 0
         client.fast_forwards = 0
 
-        def ifetch(self):
+        def ifetch(self, timeout=None, force=False):
             self.fetches += 1
             return True
 
-        def iff(self, branch_parent, fetch=True, verbose=False):
+        def iff(self, branch_parent, fetch=True, verbose=False, snapshot=None):
             self.fast_forwards += 1
             return True
 
@@ -599,6 +615,74 @@ class GitClientLogTest(GitClientTestSetups):
             log = client.get_log(relpath='local_%d.txt' % count)
             self.assertEquals(1, len(log))
 
+    def test_iter_log(self):
+        client = GitClient(self.local_path)
+        self.assertEqual(client.get_log(), list(client.iter_log()))
+        log = client.iter_log()
+        self.assertEquals('local_%d' % (self.n_commits - 1), next(log)['message'])
+        log.close()
+        self.assertEqual([], list(client.iter_log(relpath='no_such_file')))
+
+
+class GitClientLogCacheTest(GitClientLogTest):
+
+    def setUp(self):
+        GitClientLogTest.setUp(self)
+        self.cache_dir = tempfile.mkdtemp()
+        log_cache.set_cache_dir(self.cache_dir)
+
+    def tearDown(self):
+        log_cache.set_cache_dir(None)
+        shutil.rmtree(self.cache_dir)
+        GitClientLogTest.tearDown(self)
+
+    def _get_uncached_log(self, client, **kwargs):
+        log_cache.set_cache_dir(None)
+        try:
+            return client.get_log(**kwargs)
+        finally:
+            log_cache.set_cache_dir(self.cache_dir)
+
+    def _count_log_commands(self, client, **kwargs):
+        with profile() as prof:
+            client.get_log(**kwargs)
+        return len([r for r in prof.records if 'log' in r['argv']])
+
+    def test_log_cache(self):
+        client = GitClient(self.local_path)
+        self.assertEqual(self._get_uncached_log(client), client.get_log())
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+        self.assertEqual(0, self._count_log_commands(client))
+        self.assertEqual(0, self._count_log_commands(client, relpath='local_3.txt', limit=1))
+        self.assertEqual(self._get_uncached_log(client, relpath='local_3.txt'),
+                         client.get_log(relpath='local_3.txt'))
+
+        # new commits are read incrementally
+        subprocess.check_call("mkdir sub && touch sub/new.txt && git add sub && git commit -q -m new",
+                              shell=True, cwd=self.local_path)
+        with profile() as prof:
+            log = client.get_log()
+        self.assertEqual(self._get_uncached_log(client), log)
+        log_commands = [r['argv'] for r in prof.records if 'log' in r['argv']]
+        self.assertEqual(1, len(log_commands))
+        self.assertTrue(log_commands[0][-1].endswith('..%s' % log[0]['id']), log_commands)
+        self.assertEqual(['new'], [entry['message'] for entry in client.get_log(relpath='sub')])
+
+        # rewritten history is read again
+        subprocess.check_call("git reset -q --hard HEAD~2 && git commit -q --allow-empty -m rewritten",
+                              shell=True, cwd=self.local_path)
+        log = client.get_log()
+        self.assertEqual('rewritten', log[0]['message'])
+        self.assertEqual(self._get_uncached_log(client), log)
+
+        # merges prevent answering relpath queries from the cache
+        subprocess.check_call("git merge -q --no-ff -m merged %s" % self.readonly_version,
+                              shell=True, cwd=self.local_path)
+        self.assertEqual(self._get_uncached_log(client), client.get_log())
+        self.assertEqual(self._get_uncached_log(client, relpath='deleted.txt'),
+                         client.get_log(relpath='deleted.txt'))
+        self.assertEqual(1, self._count_log_commands(client, relpath='deleted.txt'))
+
 
 class GitClientAffectedFiles(GitClientTestSetups):
 
@@ -680,6 +764,37 @@ class GitClientDanglingCommitsTest(GitClientTestSetups):
         self.assertFalse(client._is_commit_in_orphaned_subtree(self.no_br_tag_version))
         self.assertFalse(client._is_commit_in_orphaned_subtree(self.diverged_branch_version))
 
+    def test_ancestry(self):
+        client = GitClient(self.local_path)
+        snapshot = client.snapshot()
+        legacy = GitAncestry(self.local_path, {'merge_base_is_ancestor': False,
+                                               'for_each_ref_contains': False})
+        for ancestry in [client._ancestry, legacy]:
+            self.assertTrue(ancestry.is_ancestor(self.readonly_version_init, 'diverged_branch'))
+            self.assertTrue(ancestry.is_ancestor(self.readonly_version_init[:8], self.dangling_version))
+            self.assertTrue(ancestry.is_ancestor('test_tag', 'test_tag'))
+            self.assertFalse(ancestry.is_ancestor('test_tag', 'test_tag', strict=True))
+            self.assertFalse(ancestry.is_ancestor(self.diverged_branch_version, self.dangling_version))
+            self.assertFalse(ancestry.is_ancestor('--all', 'test_tag'))
+            self.assertFalse(ancestry.is_ancestor('not_a_version', 'test_tag'))
+            for refs_snapshot in [None, snapshot]:
+                self.assertFalse(ancestry.is_reachable(self.dangling_version, snapshot=refs_snapshot))
+                self.assertTrue(ancestry.is_reachable(self.no_br_tag_version, snapshot=refs_snapshot))
+                self.assertTrue(ancestry.is_reachable(self.readonly_version_init, snapshot=refs_snapshot))
+                # only referenced directly by tag
+                self.assertFalse(ancestry.is_reachable(self.no_br_tag_version, mask_self=True,
+                                                       snapshot=refs_snapshot))
+                self.assertTrue(ancestry.is_reachable(self.readonly_version_init, mask_self=True,
+                                                      snapshot=refs_snapshot))
+        # answers are cached per state of refs, also across snapshots
+        same_snapshot = client.snapshot()
+        self.assertEqual(snapshot.digest, same_snapshot.digest)
+        with profile() as prof:
+            self.assertFalse(client._is_commit_in_orphaned_subtree(
+                self.readonly_version_init, fetch=False, snapshot=same_snapshot))
+            self.assertTrue(client._rev_list_contains('diverged_branch', self.readonly_version_init, fetch=False))
+        self.assertEqual(1, len(prof.records))
+
     def test_protect_dangling(self):
         client = GitClient(self.local_path)
         # url = self.remote_path
@@ -784,27 +899,12 @@ class GitClientDanglingCommitsTest(GitClientTestSetups):
         self.assertFalse(client.update(tag))
 
     def test_inject_protection(self):
+        # arguments are passed to git verbatim, no shell is involved
         client = GitClient(self.local_path)
-        try:
-            client.is_tag('foo"; bar"', fetch=False)
-            self.fail("expected Exception")
-        except VcsError:
-            pass
-        try:
-            client._rev_list_contains('foo"; echo bar"', "foo", fetch=False)
-            self.fail("expected Exception")
-        except VcsError:
-            pass
-        try:
-            client._rev_list_contains('foo', 'foo"; echo bar"', fetch=False)
-            self.fail("expected Exception")
-        except VcsError:
-            pass
-        try:
-            client.get_version('foo"; echo bar"')
-            self.fail("expected Exception")
-        except VcsError:
-            pass
+        self.assertFalse(client.is_tag('foo"; bar"', fetch=False))
+        self.assertFalse(client._rev_list_contains('foo"; echo bar"', "foo", fetch=False))
+        self.assertFalse(client._rev_list_contains('foo', 'foo"; echo bar"', fetch=False))
+        self.assertEqual(None, client.get_version('foo"; echo bar"'))
 
 
 class GitClientOverflowTest(GitClientTestSetups):
@@ -975,6 +1075,108 @@ M  ./modified.txt
 ''',
             client.get_status(untracked=True, porcelain=True))
 
+    def test_status_global_config(self):
+        client = GitClient(self.local_path)
+        filename = os.path.join(self.local_path, '\u00fc.txt')
+        global_config = os.path.join(self.root_directory, 'global_config')
+        io.open(filename, 'w').close()
+        try:
+            self.assertTrue('?? ./"\\303\\274.txt"\n' in client.get_status(untracked=True))
+            # keys missing in the repository config come from the global config
+            with open(global_config, 'w') as fhand:
+                fhand.write('[core]\n\tquotepath = off\n[submodule]\n\tfetchJobs = 3\n')
+            os.environ['GIT_CONFIG_GLOBAL'] = global_config
+            with profile() as prof:
+                self.assertTrue(client._get_status_quote_path() is False)
+                self.assertEqual(3, client._get_submodule_jobs())
+                self.assertEqual((None, False), client._get_clone_options())
+            self.assertEqual([], prof.records)
+            self.assertTrue('?? ./\u00fc.txt\n' in client.get_status(untracked=True))
+        finally:
+            os.environ.pop('GIT_CONFIG_GLOBAL', None)
+            os.remove(filename)
+            if os.path.exists(global_config):
+                os.remove(global_config)
+
+    def test_iter_status(self):
+        client = GitClient(self.local_path)
+        self.assertEqual([StatusEntry('added.txt', 'A', ' '),
+                          StatusEntry('deleted-fs.txt', ' ', 'D'),
+                          StatusEntry('deleted.txt', 'D', ' '),
+                          StatusEntry('modified-fs.txt', ' ', 'M'),
+                          StatusEntry('modified.txt', 'M', ' '),
+                          StatusEntry('added-fs.txt', '?', '?')],
+                         list(client.iter_status(untracked=True)))
+
+    def test_iter_diff(self):
+        client = GitClient(self.local_path)
+        expected = [('added.txt', 'A', 1, 0), ('deleted-fs.txt', 'D', 0, 0), ('deleted.txt', 'D', 0, 0),
+                    ('modified-fs.txt', 'M', 1, 0), ('modified.txt', 'M', 1, 0)]
+        entries = list(client.iter_diff())
+        self.assertEqual(expected, [(e.path, e.status, e.added, e.deleted) for e in entries])
+        self.assertEqual(client.get_diff(), ''.join(e.text for e in entries).rstrip())
+        basepath = os.path.dirname(self.local_path)
+        self.assertEqual(client.get_diff(basepath=basepath),
+                         ''.join(e.text for e in client.iter_diff(basepath=basepath)).rstrip())
+        summary = list(client.iter_diff(stat_only=True))
+        self.assertEqual(expected, [(e.path, e.status, e.added, e.deleted) for e in summary])
+        self.assertEqual([()] * 5, [e.lines for e in summary])
+        # between commits of the history
+        self.assertEqual([], list(client.iter_diff('HEAD', 'HEAD')))
+        self.assertEqual([e.path for e in client.iter_diff('HEAD~1', 'HEAD')],
+                         [e.path for e in client.iter_diff('HEAD~1', 'HEAD', stat_only=True)])
+
+    def test_parse_diff(self):
+        lines = ['diff --git a/old b/new', 'similarity index 100%', 'rename from old', 'rename to new',
+                 'diff --git a/bin b/bin', 'index bdc955b..8835708 100644', 'Binary files a/bin and b/bin differ',
+                 'diff --git "a/\\303\\274 x" "b/\\303\\274 x"', 'new file mode 100644',
+                 'diff --git a/a/b b/a/b', 'index e69de29..454f6b3 100644', '--- a/a/b', '+++ b/a/b',
+                 '@@ -1 +1 @@', '--- a/a/b', '+++ b/a/b']
+        entries = list(iter_git_format_diff(lines, 'sub/', 'rel/'))
+        self.assertEqual([('sub/new', 'R', 'sub/old', 0, 0), ('sub/bin', 'M', None, None, None),
+                          ('sub/\u00fc x', 'A', None, 0, 0), ('sub/a/b', 'M', None, 1, 1)],
+                         [e[:5] for e in entries])
+        self.assertEqual(['diff --git rel/a/b rel/a/b', 'index e69de29..454f6b3 100644', '--- rel/a/b',
+                          '+++ rel/a/b', '@@ -1 +1 @@', '--- a/a/b', '+++ b/a/b'], list(entries[3].lines))
+        self.assertEqual('diff --git "rel/\\303\\274 x" "rel/\\303\\274 x"', entries[2].lines[0])
+        records = [':100644 100644 1 2 R100', 'old', 'new', ':100644 100644 1 2 M', 'bin',
+                   '0\t0\t', 'old', 'new', '-\t-\tbin', '']
+        self.assertEqual([DiffEntry('sub/new', 'R', 'sub/old', 0, 0), DiffEntry('sub/bin', 'M')],
+                         list(_iter_git_diff_summary(records, 'sub/')))
+
+    def test_parse_gitlinks(self):
+        # unmerged submodules are listed once
+        output = ('100644 e69de 0\tfile\x00160000 1234 0\tsub dir/sub\x00'
+                  '160000 1234 1\tunmerged\x00160000 5678 2\tunmerged\x00')
+        self.assertEqual(['sub dir/sub', 'unmerged'], _parse_gitlinks(output))
+
+    def test_parse_status(self):
+        # v2 with a rename and a modified submodule, v1 as fallback
+        output = ('# branch.oid 1234\x001 .M N... 100644 100644 100644 12 12 with space.txt\x00'
+                  '2 R. N... 100644 100644 100644 12 12 R100 new.txt\x00old.txt\x00'
+                  '1 .M SC.. 160000 160000 160000 34 34 sub\x00? new dir/\x00')
+        self.assertEqual([StatusEntry('with space.txt', ' ', 'M'),
+                          StatusEntry('new.txt', 'R', ' ', None, 'old.txt'),
+                          StatusEntry('sub', ' ', 'M', 'SC..'),
+                          StatusEntry('new dir/', '?', '?')],
+                         list(_parse_git_status(output)))
+        self.assertEqual([StatusEntry('with space.txt', ' ', 'M'),
+                          StatusEntry('new.txt', 'R', ' ', None, 'old.txt')],
+                         list(_parse_git_status(' M with space.txt\x00R  new.txt\x00old.txt\x00')))
+        self.assertEqual(' M ./"with space.txt"\nR  ./old.txt -> new.txt\n M ./sub\n?? ./"new dir/"\n',
+                         _format_git_status(_parse_git_status(output), '.'))
+        # submodules with only modified or untracked content
+        entries = [StatusEntry('sub', ' ', 'M', 'S.M.'), StatusEntry('sub2', ' ', 'M', 'S..U'),
+                   StatusEntry('sub3', ' ', 'M', 'SCMU')]
+        self.assertEqual(' m ./sub\n ? ./sub2\n M ./sub3\n', _format_git_status(entries, '.'))
+        self.assertEqual(' M ./sub\n M ./sub2\n M ./sub3\n', _format_git_status(entries, '.', porcelain=True))
+
+    def test_quote_path(self):
+        self.assertEqual('plain.txt', _quote_git_path('plain.txt'))
+        self.assertEqual('"a\\tb \\"c\\""', _quote_git_path('a\tb "c"'))
+        self.assertEqual('"\\303\\274.txt"', _quote_git_path('\u00fc.txt'))
+        self.assertEqual('\u00fc.txt', _quote_git_path('\u00fc.txt', quote_path=False))
+
 
 class GitExportClientTest(GitClientTestSetups):
 
@@ -1001,6 +1203,62 @@ class GitExportClientTest(GitClientTestSetups):
         self.assertFalse(os.path.exists(self.basepath_export + '.tar'))
         self.assertFalse(os.path.exists(self.basepath_export))
 
+    def test_export_repository_stream(self):
+        client = GitClient(self.local_path)
+        stream = PipeStream()
+        self.assertTrue(client.export_repository_stream(self.readonly_version, stream, prefix='pkg-1.0/'))
+        with tarfile.open(fileobj=io.BytesIO(stream.getvalue())) as tar:
+            self.assertIn('pkg-1.0/fixed.txt', tar.getnames())
+        stream = PipeStream()
+        self.assertTrue(client.export_repository_stream('test_tag', stream, archive_format='tar'))
+        with tarfile.open(fileobj=io.BytesIO(stream.getvalue()), mode='r:') as tar:
+            self.assertEqual(['fixed.txt'], tar.getnames())
+        stream = PipeStream()
+        self.assertFalse(client.export_repository_stream('not_a_version', stream))
+        self.assertEqual(b'', stream.getvalue())
+
+    def test_export_repository_format(self):
+        client = GitClient(self.local_path)
+        basepath = os.path.join(self.root_directory, 'export_format')
+        self.assertEqual(basepath + '.tar.bz2', client.export_repository(self.readonly_version, basepath,
+                                                                         archive_format='bz2', compresslevel=1))
+        with tarfile.open(basepath + '.tar.bz2') as tar:
+            self.assertIn('fixed.txt', tar.getnames())
+        self.assertEqual(basepath + '.tar', client.export_repository(self.readonly_version, basepath,
+                                                                     archive_format='tar'))
+        with tarfile.open(basepath + '.tar') as tar:
+            self.assertIn('fixed.txt', tar.getnames())
+        self.assertRaises(ValueError, client.export_repository, self.readonly_version, basepath, 'rar')
+
+
+    def test_write_archive(self):
+        # data ending in zero blocks must not be taken for the end of an archive
+        source = io.BytesIO()
+        with tarfile.open(fileobj=source, mode='w') as tar:
+            info = tarfile.TarInfo('zeros')
+            info.size = 3 * git_export.BLOCKSIZE
+            tar.addfile(info, io.BytesIO(b'\0' * info.size))
+        data = source.getvalue()
+        target = io.BytesIO()
+        members = git_export._TarMembersWriter(target)
+        # chunks that do not align with the tar blocks
+        for start in range(0, len(data), 700):
+            members.write(data[start:start + 700])
+        members.check_complete()
+        self.assertEqual(4 * git_export.BLOCKSIZE, members.written)
+        self.assertEqual(data[:members.written], target.getvalue())
+        truncated = git_export._TarMembersWriter(io.BytesIO())
+        truncated.write(data[:2 * git_export.BLOCKSIZE])
+        self.assertRaises(VcsError, truncated.check_complete)
+        client = GitClient(self.local_path)
+        git_export.write_archive([(self.local_path, client.get_version('test_tag'), 'tagged/')], target)
+        self.assertEqual(0, (len(target.getvalue()) - 4 * git_export.BLOCKSIZE) % git_export.RECORDSIZE)
+        target.seek(0)
+        with tarfile.open(fileobj=target) as tar:
+            self.assertEqual(b'\0' * info.size, tar.extractfile('zeros').read())
+            self.assertEqual(['zeros', 'tagged/fixed.txt'],
+                             [member.name for member in tar.getmembers() if member.isfile()])
+
 
 class GitGetBranchesClientTest(GitClientTestSetups):
 
@@ -1027,6 +1285,358 @@ class GitGetBranchesClientTest(GitClientTestSetups):
                           'remotes/origin/test_branch'])
 
 
+class GitCatFileClientTest(GitClientTestSetups):
+
+    def test_get_version_cat_file(self):
+        client = GitClient(self.local_path, use_cat_file=True)
+        self.assertTrue(client.checkout(self.remote_path))
+        try:
+            self.assertEqual(client.get_version(), self.readonly_version)
+            self.assertEqual(client.get_version("test_tag"), self.readonly_version_init)
+            self.assertEqual(client.get_version(self.readonly_version_init[0:6]), self.readonly_version_init)
+            self.assertEqual(client.get_version("remotes/origin/test_branch"), self.readonly_version_init)
+            # a single process answers all queries
+            self.assertEqual(1, len(client._cat_file._procs))
+            self.assertEqual(client.get_version("not_a_version"), None)
+        finally:
+            client.close()
+        self.assertEqual(0, len(client._cat_file._procs))
+        # processes are restarted on demand
+        self.assertEqual(client.get_version(), self.readonly_version)
+        client.close()
+
+    def test_read_object(self):
+        client = GitClient(self.local_path)
+        self.assertTrue(client.checkout(self.remote_path))
+        subprocess.check_call("git tag -a annotated -m annotated test_tag", shell=True, cwd=self.local_path)
+        with GitCatFile(self.local_path) as cat_file:
+            self.assertEqual(cat_file.resolve("annotated"), self.readonly_version_init)
+            self.assertNotEqual(cat_file.resolve("annotated", object_type=None), self.readonly_version_init)
+            (sha, object_type, contents) = cat_file.read_object("%s" % self.readonly_version_init)
+            self.assertEqual(sha, self.readonly_version_init)
+            self.assertEqual(object_type, 'commit')
+            self.assertTrue(b'initial' in contents)
+            (_, object_type, contents) = cat_file.read_object("HEAD:fixed.txt")
+            self.assertEqual(object_type, 'blob')
+            self.assertEqual(contents, b'')
+            self.assertEqual(cat_file.read_object("HEAD:no_such_file"), None)
+            self.assertRaises(VcsError, cat_file.resolve, "foo\nbar")
+
+
+class GitSnapshotTest(GitClientTestSetups):
+
+    def test_snapshot(self):
+        client = GitClient(self.local_path)
+        self.assertEqual(None, client.snapshot())
+        self.assertTrue(client.checkout(self.remote_path))
+        subprocess.check_call("git tag -a annotated -m annotated test_tag", shell=True, cwd=self.local_path)
+        snapshot = client.snapshot()
+        self.assertEqual(self.readonly_version, snapshot.head)
+        self.assertEqual('master', snapshot.branch)
+        self.assertEqual(('master', 'origin'), snapshot.upstream)
+        # the label and the remote version are read from a snapshot each
+        with profile() as prof:
+            self.assertEqual('master', client.get_current_version_label())
+            self.assertEqual(self.readonly_version, client.get_remote_version())
+        self.assertEqual([['git', 'for-each-ref'], ['git', 'rev-parse']] * 2,
+                         [r['argv'][:2] for r in prof.records])
+        self.assertEqual({'master': self.readonly_version}, snapshot.branches)
+        self.assertEqual(self.readonly_version_init, snapshot.remote_branches['origin/test_branch'])
+        # annotated tags resolve to the commit
+        self.assertEqual(self.readonly_version_init, snapshot.tags['annotated'])
+        self.assertEqual(self.readonly_version_init, snapshot.resolve('test_tag'))
+        self.assertEqual(self.readonly_version_init, snapshot.resolve('remotes/origin/test_branch'))
+        self.assertEqual(self.readonly_version, snapshot.resolve('origin'))
+        self.assertEqual(None, snapshot.resolve('not_a_version'))
+        self.assertEqual({'master': ('branch', 'remote_branch'),
+                          'test_tag': ('tag',),
+                          'test_branch': ('remote_branch',),
+                          'foo': ()},
+                         snapshot.classify(['master', 'test_tag', 'test_branch', 'foo']))
+        self.assertRaises(AttributeError, setattr, snapshot, 'head', None)
+        # later changes do not alter the snapshot
+        subprocess.check_call("git checkout -q test_tag", shell=True, cwd=self.local_path)
+        self.assertEqual('master', snapshot.branch)
+        detached = client.snapshot()
+        self.assertEqual(None, detached.branch)
+        self.assertEqual(self.readonly_version_init, detached.head)
+        self.assertEqual('<detached>', detached.get_current_version_label())
+
+    def test_snapshot_empty_repository(self):
+        os.makedirs(self.local_path)
+        subprocess.check_call("git init -q", shell=True, cwd=self.local_path)
+        snapshot = GitClient(self.local_path).snapshot()
+        self.assertEqual(None, snapshot.head)
+        self.assertEqual(None, snapshot.branch)
+        self.assertEqual({}, snapshot.refs)
+
+
+class GitFetchTest(GitClientTestSetups):
+
+    def tearDown(self):
+        GitClientTestSetups.tearDown(self)
+        fetching.set_ttl(None)
+        fetching.forget()
+
+    def _count_fetches(self, function, *args, **kwargs):
+        with profile() as prof:
+            function(*args, **kwargs)
+        return len([r for r in prof.records if r['argv'][:2] == ['git', 'fetch']])
+
+    def test_fetch_scope(self):
+        client = GitClient(self.local_path)
+        self.assertTrue(client.checkout(self.remote_path))
+        self.assertEqual(client._get_fetch_commands()[-1], ['git', 'fetch', '--tags'])
+        fetches = len(client._get_fetch_commands())
+        # without scope or TTL, every lookup of an unknown version fetches
+        self.assertEqual(fetches, self._count_fetches(client.get_version, 'not_a_version'))
+        self.assertEqual(fetches, self._count_fetches(client.update))
+        # export fetches once although both resolving and exporting need it
+        basepath = os.path.join(self.root_directory, 'export_fetch')
+        self.assertEqual(fetches, self._count_fetches(client.export_repository, 'not_a_version', basepath))
+        with fetching.scope():
+            self.assertEqual(fetches, self._count_fetches(client.update))
+            self.assertEqual(0, self._count_fetches(client.get_version, 'not_a_version'))
+            self.assertEqual(fetches, self._count_fetches(client.update, force_fetch=True))
+        self.assertEqual(fetches, self._count_fetches(client.get_version, 'not_a_version'))
+
+    def test_fetch_scope_threads(self):
+        # scopes of concurrent operations exit out of order and do not
+        # skip each other's fetches
+        opened = threading.Event()
+        closing = threading.Event()
+        results = []
+
+        def other():
+            try:
+                with fetching.scope():
+                    fetching.fetched('/repo')
+                    results.append(fetching.needs_fetch('/repo'))
+                    opened.set()
+                    closing.wait(10)
+            except Exception as exc:
+                results.append(exc)
+        thread = threading.Thread(target=other)
+        thread.start()
+        self.assertTrue(opened.wait(10))
+        with fetching.scope():
+            self.assertTrue(fetching.needs_fetch('/repo'))
+            fetching.fetched('/repo')
+            self.assertFalse(fetching.needs_fetch('/repo'))
+        closing.set()
+        thread.join()
+        self.assertEqual([False], results)
+        self.assertEqual([], fetching._SCOPES)
+        self.assertTrue(fetching.needs_fetch('/repo'))
+
+    def test_fetch_ttl(self):
+        client = GitClient(self.local_path)
+        self.assertTrue(client.checkout(self.remote_path))
+        fetches = len(client._get_fetch_commands())
+        fetching.set_ttl(3600)
+        self.assertEqual(fetches, self._count_fetches(client.update))
+        self.assertEqual(0, self._count_fetches(client.update))
+        self.assertTrue(client.is_tag('last_tag'))
+        self.assertEqual(fetches, self._count_fetches(client.update, force_fetch=True))
+        fetching.forget(os.path.realpath(self.local_path))
+        self.assertEqual(fetches, self._count_fetches(client.update))
+        # failed fetches are not recorded
+        subprocess.check_call("git remote set-url origin /not/a/repo", shell=True, cwd=self.local_path)
+        self.assertFalse(client.update(force_fetch=True))
+        fetching.set_ttl(0)
+        self.assertEqual(fetches, self._count_fetches(client.update))
+
+
+class GitPartialCloneTest(GitClientTestSetups):
+
+    @classmethod
+    def setUpClass(self):
+        GitClientTestSetups.setUpClass()
+        subprocess.check_call("git config uploadpack.allowfilter true", shell=True, cwd=self.remote_path)
+        # local paths would be cloned without filter
+        self.remote_url = 'file://' + self.remote_path
+
+    def test_clone_command(self):
+        client = GitClient(self.local_path)
+        command = client._get_clone_command(self.remote_url, 'test_branch', True, 'tree:0', True)
+        self.assertEqual(['--depth', '1', '--single-branch', '--branch', 'test_branch'],
+                         [arg for arg in command if arg in ('--depth', '1', '--single-branch', '--branch',
+                                                            'test_branch', '--no-single-branch')])
+        self.assertTrue('--filter=tree:0' in command)
+        # a SHA-ID cannot be cloned as single branch
+        command = client._get_clone_command(self.remote_url, self.readonly_version, True, None, True)
+        self.assertTrue('--no-single-branch' in command)
+        self.assertFalse('--single-branch' in command)
+
+    def test_single_branch_partial_clone(self):
+        client = GitClient(self.local_path)
+        self.assertTrue(client.checkout(self.remote_url, version='test_branch',
+                                        clone_filter='blob:none', single_branch=True))
+        self.assertEqual(('blob:none', True), client._get_clone_options())
+        self.assertEqual(self.readonly_version_init, client.get_version())
+        self.assertFalse(client.snapshot().is_tag('last_tag'))
+        self.assertEqual([['git', 'fetch']], client._get_fetch_commands())
+        # versions outside the cloned branch are fetched when needed
+        self.assertEqual(self.readonly_version, client.get_version('last_tag'))
+        self.assertTrue(client.update('master'))
+        self.assertEqual(self.readonly_version, client.get_version())
+        output = subprocess.check_output(['git', 'config', '--get-all', 'remote.origin.fetch'],
+                                         cwd=self.local_path).decode('utf-8')
+        self.assertTrue('refs/heads/master' in output, output)
+        # export fetches the missing blobs
+        basepath = os.path.join(self.root_directory, 'partial_export')
+        self.assertEqual(basepath + '.tar.gz', client.export_repository('test_tag', basepath))
+        with tarfile.open(basepath + '.tar.gz') as tar:
+            names = [os.path.basename(name) for name in tar.getnames()]
+        self.assertTrue('fixed.txt' in names, names)
+        self.assertFalse('modified.txt' in names, names)
+
+    def test_export_moved_remote(self):
+        # a remote of our own, as it gets a new commit
+        remote_path = os.path.join(self.root_directory, 'moving_remote')
+        subprocess.check_call(['git', 'clone', '-q', self.remote_path, remote_path])
+        subprocess.check_call("git config uploadpack.allowfilter true", shell=True, cwd=remote_path)
+        client = GitClient(self.local_path)
+        self.assertTrue(client.checkout('file://' + remote_path, version='master', clone_filter='blob:none'))
+        local_version = client.get_version()
+        subprocess.check_call("touch new.txt && git add new.txt && git commit -q -m new", shell=True, cwd=remote_path)
+        # a local commit the remote does not have
+        subprocess.check_call("git checkout -q -b local_branch && touch local.txt && git add local.txt && "
+                              "git commit -q -m local", shell=True, cwd=self.local_path)
+
+        basepath = os.path.join(self.root_directory, 'moved_export')
+        self.assertEqual(basepath + '.tar.gz', client.export_repository('master', basepath))
+        with tarfile.open(basepath + '.tar.gz') as tar:
+            names = tar.getnames()
+        self.assertTrue('modified.txt' in names, names)
+        self.assertFalse('new.txt' in names, names)
+        self.assertEqual(local_version, client.get_version('master'))
+
+        self.assertEqual(basepath + '.tar.gz', client.export_repository('local_branch', basepath))
+        with tarfile.open(basepath + '.tar.gz') as tar:
+            names = tar.getnames()
+        self.assertTrue('local.txt' in names, names)
+        self.assertFalse('new.txt' in names, names)
+
+
+class GitMirrorTest(GitClientTestSetups):
+
+    def setUp(self):
+        self.mirror_dir = os.path.join(self.root_directory, 'mirrors')
+        git_mirror.set_mirror_dir(self.mirror_dir)
+
+    def tearDown(self):
+        GitClientTestSetups.tearDown(self)
+        git_mirror.set_mirror_dir(None)
+        git_mirror.set_max_size(None)
+        fetching.forget()
+        shutil.rmtree(self.mirror_dir, ignore_errors=True)
+
+    def _get_clone_commands(self, prof):
+        return [r['argv'] for r in prof.records if r['argv'][:2] == ['git', 'clone']]
+
+    def test_checkout_with_mirror(self):
+        client = GitClient(self.local_path)
+        with profile() as prof:
+            self.assertTrue(client.checkout(self.remote_path, version='test_branch'))
+        mirror = git_mirror.get_mirror_path(self.remote_path)
+        self.assertEqual([mirror], [os.path.join(self.mirror_dir, name)
+                                    for name in os.listdir(self.mirror_dir) if name.endswith('.git')])
+        clones = self._get_clone_commands(prof)
+        self.assertEqual(['git', 'clone', '--mirror'], clones[0][:3])
+        self.assertTrue(['--reference', mirror, '--dissociate'] == clones[1][2:5], clones)
+        # the workspace does not depend on the mirror
+        self.assertFalse(os.path.exists(os.path.join(self.local_path, '.git', 'objects', 'info', 'alternates')))
+        self.assertEqual(self.readonly_version_init, client.get_version())
+
+        other_path = os.path.join(self.root_directory, 'other')
+        other = GitClient(other_path)
+        try:
+            with profile() as prof:
+                self.assertTrue(other.checkout(self.remote_path))
+            self.assertEqual(1, len(self._get_clone_commands(prof)))
+            self.assertEqual(1, len([r for r in prof.records if r['argv'][:2] == ['git', 'fetch']]))
+            self.assertEqual(self.readonly_version, other.get_version())
+        finally:
+            shutil.rmtree(other_path)
+        # shallow clones do not use mirrors
+        shutil.rmtree(self.local_path)
+        with profile() as prof:
+            self.assertTrue(client.checkout(self.remote_path, shallow=True))
+        self.assertFalse('--reference' in self._get_clone_commands(prof)[0])
+
+    def test_lock_failure(self):
+        mirror = git_mirror.get_mirror_path(self.remote_path)
+        # interrupted flock() calls are retried
+        with patch.object(git_mirror.fcntl, 'flock', side_effect=[IOError(errno.EINTR, 'Interrupted')] + [None] * 3):
+            with git_mirror.reference(self.remote_path) as reference:
+                self.assertEqual(mirror, reference)
+        # mirrors that cannot be locked are not used
+        with patch.object(git_mirror.fcntl, 'flock', side_effect=IOError(errno.ENOLCK, 'No locks available')):
+            with git_mirror.reference(self.remote_path) as reference:
+                self.assertEqual(None, reference)
+            self.assertEqual(None, git_mirror.update_mirror(self.remote_path))
+
+    def test_evict(self):
+        git_mirror.update_mirror(self.remote_path)
+        mirror = git_mirror.get_mirror_path(self.remote_path)
+        self.assertEqual([], git_mirror.evict(1, keep=[mirror]))
+        # mirrors in use are kept
+        with git_mirror.reference(self.remote_path) as reference:
+            self.assertEqual(mirror, reference)
+            self.assertEqual([], git_mirror.evict(1))
+        self.assertEqual([], git_mirror.evict(10 << 20))
+        self.assertEqual([mirror], git_mirror.evict(1))
+        self.assertFalse(os.path.exists(mirror))
+        self.assertFalse(os.path.exists(mirror[:-len('.git')] + '.lock'))
+        # reference() keeps the mirror locked from its update on
+        with git_mirror.reference(self.remote_path) as reference:
+            self.assertEqual(mirror, reference)
+            self.assertEqual([], git_mirror.evict(1))
+        # also after its update lock is released and before the
+        # shared lock of the clone is taken
+        with git_mirror._locked(mirror, exclusive=False, in_use=True):
+            self.assertEqual([], git_mirror.evict(1))
+        self.assertEqual([mirror], git_mirror.evict(1))
+        self.assertFalse(os.path.exists(mirror[:-len('.git')] + '.use'))
+        # checkouts evict other mirrors, never the one they used
+        git_mirror.update_mirror(self.root_directory + '/remote/.git')
+        git_mirror.set_max_size(1)
+        client = GitClient(self.local_path)
+        self.assertTrue(client.checkout(self.remote_path))
+        self.assertTrue(os.path.exists(mirror))
+        self.assertFalse(os.path.exists(git_mirror.get_mirror_path(self.root_directory + '/remote/.git')))
+        self.assertEqual(1024 * 1024 * 3 // 2, git_mirror._parse_size('1.5M'))
+
+
+class GitTranscriptTest(GitClientTestSetups):
+
+    def test_replay(self):
+        client = GitClient(self.local_path)
+        self.assertTrue(client.checkout(self.remote_path))
+        transcript = os.path.join(self.root_directory, 'transcript.jsonl')
+
+        def query():
+            return [client.get_version(),
+                    client.get_version('test_tag'),
+                    client.get_current_version_label(),
+                    client.get_branches(),
+                    client.get_status(),
+                    client.get_diff(),
+                    client.get_log()]
+        with transcripts.recording(transcript):
+            recorded = query()
+        backup_popen = subprocess.Popen
+        try:
+            subprocess.Popen = None
+            with transcripts.replaying(transcript):
+                self.assertEqual(recorded, query())
+        finally:
+            subprocess.Popen = backup_popen
+        self.assertEqual(self.readonly_version, recorded[0])
+        os.remove(transcript)
+
+
 class GitTimeoutTest(unittest.TestCase):
 
     class MuteHandler(BaseRequestHandler):
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import io
+import os
+import unittest
+import subprocess
+import tarfile
+import tempfile
+import shutil
+import zipfile
+
+from vcstools.git_archive_all import GitArchiver, GIT_MODE_EXECUTABLE, GIT_MODE_FILE, GIT_MODE_SUBMODULE, \
+    GIT_MODE_SYMLINK
+from test.streams import PipeStream
+
+os.environ['GIT_AUTHOR_NAME'] = 'Your Name'
+os.environ['GIT_COMMITTER_NAME'] = 'Your Name'
+os.environ['GIT_AUTHOR_EMAIL'] = 'name@example.com'
+os.environ['EMAIL'] = 'Your Name <name@example.com>'
+
+
+class GitArchiverTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        self.root_directory = tempfile.mkdtemp()
+        self.repo_path = os.path.join(self.root_directory, "repo")
+        os.makedirs(os.path.join(self.repo_path, "docs", "build"))
+
+        subprocess.check_call("git init", shell=True, cwd=self.repo_path)
+        with open(os.path.join(self.repo_path, ".gitattributes"), 'w') as f:
+            f.write("# comment export-ignore\n\n*.log export-ignore\nscripts/* export-ignore\n")
+        with open(os.path.join(self.repo_path, "docs", ".gitattributes"), 'w') as f:
+            f.write("*.tmp export-ignore\n*.txt text\n")
+        for name in ["main.py", "debug.log", "docs/index.txt", "docs/draft.tmp", "docs/build/old.tmp",
+                     "docs/build/out.log", "draft.tmp", "na\u00efve\\name.py"]:
+            with io.open(os.path.join(self.repo_path, name), 'w', encoding='utf-8') as f:
+                f.write(name)
+        os.chmod(os.path.join(self.repo_path, "main.py"), 0o755)
+        os.symlink("main.py", os.path.join(self.repo_path, "link.py"))
+        subprocess.check_call("git add -A", shell=True, cwd=self.repo_path)
+        # a submodule that was never initialized
+        subprocess.check_call("git update-index --add --cacheinfo 160000,%s,lib" % ('1' * 40),
+                              shell=True, cwd=self.repo_path)
+        subprocess.check_call("git commit -m initial", shell=True, cwd=self.repo_path)
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.root_directory)
+
+    def test_walk_git_files(self):
+        archiver = GitArchiver(main_repo_abspath=self.repo_path)
+        self.assertEqual(['.gitattributes', 'docs/.gitattributes', 'docs/index.txt', 'draft.tmp', 'link.py', 'main.py',
+                          'na\u00efve\\name.py'],
+                         sorted(archiver.walk_git_files()))
+        archiver = GitArchiver(exclude=False, main_repo_abspath=self.repo_path)
+        self.assertEqual(11, len(list(archiver.walk_git_files())))
+
+    def test_iter_git_index(self):
+        modes = dict(GitArchiver.iter_git_index(self.repo_path))
+        self.assertEqual(GIT_MODE_FILE, modes['docs/index.txt'])
+        self.assertEqual(GIT_MODE_EXECUTABLE, modes['main.py'])
+        self.assertEqual(GIT_MODE_SYMLINK, modes['link.py'])
+        self.assertEqual(GIT_MODE_SUBMODULE, modes['lib'])
+        self.assertEqual(GIT_MODE_FILE, modes['na\u00efve\\name.py'])
+
+    def test_is_file_excluded(self):
+        archiver = GitArchiver(main_repo_abspath=self.repo_path)
+        patterns = archiver.get_exclude_patterns(self.repo_path, ['.gitattributes', 'docs/.gitattributes'])
+        self.assertEqual(['*.log', 'scripts/*'], patterns[('.',)])
+        self.assertEqual(['*.tmp'], patterns[('.', 'docs')])
+        compiled = archiver.compile_exclude_patterns(patterns)
+        self.assertEqual(set([('.',), ('.', 'docs')]), set(compiled))
+        for exclude_patterns in [patterns, compiled]:
+            for file_path, excluded in [('main.py', False),
+                                        ('debug.log', True),
+                                        ('a/b/c.log', True),
+                                        ('scripts/run.sh', True),
+                                        ('draft.tmp', False),
+                                        ('docs/draft.tmp', True),
+                                        ('docs/build/old.tmp', True),
+                                        ('docs/index.txt', False)]:
+                self.assertEqual(excluded, archiver.is_file_excluded(self.repo_path, file_path, exclude_patterns),
+                                 file_path)
+        self.assertFalse(archiver.is_file_excluded(self.repo_path, 'debug.log', {}))
+        self.assertFalse(archiver.is_file_excluded(self.repo_path, 'debug.log', None))
+
+    def test_write_archive(self):
+        archiver = GitArchiver(main_repo_abspath=self.repo_path)
+        stream = PipeStream()
+        archiver.write_archive(stream, 'tgz', jobs=2)
+        with tarfile.open(fileobj=io.BytesIO(stream.getvalue())) as tar_file:
+            self.assertEqual(sorted(archiver.walk_git_files()), sorted(tar_file.getnames()))
+        # zip entries are deflated on several threads as well
+        stream = PipeStream()
+        archiver.write_archive(stream, 'zip', jobs=2)
+        with zipfile.ZipFile(io.BytesIO(stream.getvalue())) as zip_file:
+            self.assertEqual(sorted(archiver.walk_git_files()), sorted(zip_file.namelist()))
+            self.assertEqual(None, zip_file.testzip())
+            self.assertEqual(b'main.py', zip_file.read('main.py'))
+        self.assertRaises(RuntimeError, archiver.write_archive, stream, 'rar')
+
+    def test_write_archive_failure(self):
+        archiver = GitArchiver(main_repo_abspath=self.repo_path)
+        file_path = os.path.join(self.repo_path, 'draft.tmp')
+        os.rename(file_path, file_path + '.bak')
+        try:
+            for output_format in ['tar', 'tgz']:
+                stream = PipeStream()
+                self.assertRaises(EnvironmentError, archiver.write_archive, stream, output_format)
+                self.assertRaises(tarfile.ReadError, tarfile.open, fileobj=io.BytesIO(stream.getvalue()))
+            stream = PipeStream()
+            self.assertRaises(EnvironmentError, archiver.write_archive, stream, 'zip')
+            self.assertRaises(zipfile.BadZipfile, zipfile.ZipFile, io.BytesIO(stream.getvalue()))
+        finally:
+            os.rename(file_path + '.bak', file_path)
+
+    def test_create(self):
+        archiver = GitArchiver(prefix='repo', main_repo_abspath=self.repo_path)
+        output_path = os.path.join(self.root_directory, 'repo.tgz')
+        archiver.create(output_path, compresslevel=1, jobs=2)
+        with tarfile.open(output_path) as tar_file:
+            names = tar_file.getnames()
+            self.assertEqual('main.py', tar_file.getmember('repo/link.py').linkname)
+        self.assertEqual(sorted(os.path.join('repo', p) for p in archiver.walk_git_files()), sorted(names))
+
+        output_path = os.path.join(self.root_directory, 'repo.zip')
+        archiver.create(output_path, compresslevel=0)
+        with zipfile.ZipFile(output_path) as zip_file:
+            self.assertEqual(sorted(names), sorted(zip_file.namelist()))
+            self.assertEqual(set([zipfile.ZIP_STORED]), set(info.compress_type for info in zip_file.infolist()))
+
+
+class GitArchiverSubmoduleTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        self.root_directory = tempfile.mkdtemp()
+        self.repo_path = os.path.join(self.root_directory, "super")
+        for name in ["sub0", "sub1", "sub2", "subsub"]:
+            sub_path = os.path.join(self.root_directory, name)
+            os.makedirs(sub_path)
+            subprocess.check_call("git init", shell=True, cwd=sub_path)
+            for file_name in ["%s.txt" % name, "z.txt"]:
+                with open(os.path.join(sub_path, file_name), 'w') as f:
+                    f.write(file_name)
+            if name == "sub1":
+                with open(os.path.join(sub_path, ".gitattributes"), 'w') as f:
+                    f.write("z.txt export-ignore\n")
+            subprocess.check_call("git add -A", shell=True, cwd=sub_path)
+            subprocess.check_call("git commit -m initial", shell=True, cwd=sub_path)
+        subprocess.check_call("git submodule add ../subsub nested", shell=True,
+                              cwd=os.path.join(self.root_directory, "sub2"))
+        subprocess.check_call("git commit -m nested", shell=True, cwd=os.path.join(self.root_directory, "sub2"))
+        os.makedirs(self.repo_path)
+        subprocess.check_call("git init", shell=True, cwd=self.repo_path)
+        with open(os.path.join(self.repo_path, "top.txt"), 'w') as f:
+            f.write("top")
+        subprocess.check_call("git add top.txt", shell=True, cwd=self.repo_path)
+        for name in ["sub2", "sub0", "sub1"]:
+            subprocess.check_call("git submodule add ../%s lib/%s" % (name, name), shell=True, cwd=self.repo_path)
+        subprocess.check_call("git commit -m submodules", shell=True, cwd=self.repo_path)
+        subprocess.check_call("git submodule update --init --recursive", shell=True, cwd=self.repo_path)
+        self.clone_path = os.path.join(self.root_directory, "clone")
+        subprocess.check_call("git clone super clone", shell=True, cwd=self.root_directory)
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.root_directory)
+
+    def test_walk_git_files(self):
+        expected = ['.gitmodules', 'top.txt',
+                    'lib/sub0/sub0.txt', 'lib/sub0/z.txt',
+                    'lib/sub1/.gitattributes', 'lib/sub1/sub1.txt',
+                    'lib/sub2/.gitmodules', 'lib/sub2/sub2.txt', 'lib/sub2/z.txt',
+                    'lib/sub2/nested/subsub.txt', 'lib/sub2/nested/z.txt']
+        for jobs in [1, 4]:
+            archiver = GitArchiver(main_repo_abspath=self.repo_path, jobs=jobs)
+            self.assertEqual(expected, list(archiver.walk_git_files()))
+        # submodules of the clone are not initialized
+        archiver = GitArchiver(main_repo_abspath=self.clone_path)
+        self.assertEqual(expected[:2], list(archiver.walk_git_files()))
+
+    def test_force_sub(self):
+        clone_path = os.path.join(self.root_directory, "clone_force")
+        subprocess.check_call("git clone super clone_force", shell=True, cwd=self.root_directory)
+        archiver = GitArchiver(force_sub=True, main_repo_abspath=clone_path, jobs=4)
+        names = list(archiver.walk_git_files())
+        self.assertEqual(11, len(names))
+        self.assertEqual('lib/sub2/nested/z.txt', names[-1])
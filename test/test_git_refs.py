@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import unittest
+import subprocess
+import tempfile
+import shutil
+
+from vcstools import GitClient, profile
+from vcstools.git_refs import GitRefsReader, UnsupportedRepository, parse_config, parse_config_list, \
+    is_valid_ref_name
+
+os.environ['GIT_AUTHOR_NAME'] = 'Your Name'
+os.environ['GIT_COMMITTER_NAME'] = 'Your Name'
+os.environ['GIT_AUTHOR_EMAIL'] = 'name@example.com'
+os.environ['EMAIL'] = 'Your Name <name@example.com>'
+
+
+def git_output(cmd, cwd):
+    return subprocess.check_output(cmd, shell=True, cwd=cwd).decode('utf-8').strip()
+
+
+class GitRefsReaderTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        self.root_directory = tempfile.mkdtemp()
+        self.remote_path = os.path.join(self.root_directory, "remote")
+        self.local_path = os.path.join(self.root_directory, "local")
+        os.makedirs(self.remote_path)
+        subprocess.check_call("git init", shell=True, cwd=self.remote_path)
+        subprocess.check_call("touch fixed.txt", shell=True, cwd=self.remote_path)
+        subprocess.check_call("git add *", shell=True, cwd=self.remote_path)
+        subprocess.check_call("git commit -m initial", shell=True, cwd=self.remote_path)
+        subprocess.check_call("git tag test_tag", shell=True, cwd=self.remote_path)
+        subprocess.check_call("git branch test_branch", shell=True, cwd=self.remote_path)
+        subprocess.check_call("git branch feature/nested", shell=True, cwd=self.remote_path)
+        subprocess.check_call("git clone %s %s" % (self.remote_path, self.local_path), shell=True)
+        subprocess.check_call("git checkout -b local_branch", shell=True, cwd=self.local_path)
+        subprocess.check_call("git tag local_tag", shell=True, cwd=self.local_path)
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.root_directory)
+
+    def test_refs(self):
+        reader = GitRefsReader(self.local_path)
+        self.assertEqual('local_branch', reader.get_head_branch())
+        sha = git_output("git rev-parse HEAD", self.local_path)
+        self.assertEqual(('refs/heads/local_branch', sha), reader.resolve_ref('HEAD'))
+        self.assertTrue(reader.ref_exists('refs/tags/test_tag'))
+        self.assertTrue(reader.ref_exists('refs/tags/local_tag'))
+        self.assertTrue(reader.ref_exists('refs/remotes/origin/feature/nested'))
+        self.assertTrue(reader.ref_exists('refs/remotes/origin/HEAD'))
+        self.assertFalse(reader.ref_exists('refs/heads/test_branch'))
+        self.assertFalse(reader.ref_exists('refs/heads/../../config'))
+        self.assertEqual(self.remote_path, reader.get_config_value('remote.origin.url'))
+        self.assertEqual(self.remote_path, reader.get_config_value('Remote.origin.URL'))
+        self.assertEqual(None, reader.get_config_value('remote.Origin.url'))
+        self.assertEqual('refs/heads/master', reader.get_config_value('branch.master.merge'))
+
+    def test_packed_refs(self):
+        path = os.path.join(self.root_directory, "packed")
+        subprocess.check_call("git clone %s %s" % (self.remote_path, path), shell=True)
+        try:
+            subprocess.check_call("git pack-refs --all", shell=True, cwd=path)
+            reader = GitRefsReader(path)
+            self.assertEqual('master', reader.get_head_branch())
+            self.assertTrue(reader.ref_exists('refs/tags/test_tag'))
+            self.assertTrue(reader.ref_exists('refs/remotes/origin/test_branch'))
+            # loose refs take precedence
+            subprocess.check_call("git tag -f test_tag HEAD", shell=True, cwd=path)
+            subprocess.check_call("git checkout --detach", shell=True, cwd=path)
+            self.assertEqual(None, reader.get_head_branch())
+            # packed-refs changes are picked up
+            subprocess.check_call("git branch -D master", shell=True, cwd=path)
+            subprocess.check_call("git pack-refs --all", shell=True, cwd=path)
+            self.assertFalse(reader.ref_exists('refs/heads/master'))
+        finally:
+            shutil.rmtree(path)
+
+    def test_worktree(self):
+        path = os.path.join(self.root_directory, "worktree")
+        subprocess.check_call("git worktree add %s test_tag -b worktree_branch" % path,
+                              shell=True, cwd=self.local_path)
+        try:
+            reader = GitRefsReader(path)
+            self.assertEqual('worktree_branch', reader.get_head_branch())
+            self.assertTrue(reader.ref_exists('refs/heads/local_branch'))
+            self.assertEqual(self.remote_path, reader.get_config_value('remote.origin.url'))
+            client = GitClient(path)
+            self.assertEqual('worktree_branch', client._get_branch())
+            self.assertTrue(client._is_local_branch('local_branch'))
+            self.assertTrue(client.is_tag('local_tag', fetch=False))
+        finally:
+            subprocess.check_call("git worktree remove --force %s" % path, shell=True, cwd=self.local_path)
+
+    def test_config_include(self):
+        config_path = os.path.join(self.root_directory, "included.config")
+        with open(config_path, 'w') as fhand:
+            fhand.write('[remote "upstream"]\n\turl = included_url\n')
+        subprocess.check_call("git config include.path %s" % config_path, shell=True, cwd=self.local_path)
+        try:
+            reader = GitRefsReader(self.local_path)
+            self.assertEqual('included_url', reader.get_config_value('remote.upstream.url'))
+            subprocess.check_call("git config --remove-section include", shell=True, cwd=self.local_path)
+            self.assertEqual(None, reader.get_config_value('remote.upstream.url'))
+            for condition, included in [('onbranch:local_*', True),
+                                        ('onbranch:master', False),
+                                        ('gitdir:local/', True),
+                                        ('gitdir:%s/' % self.remote_path, False),
+                                        ('gitdir/i:LOCAL/.GIT', True)]:
+                subprocess.check_call("git config includeIf.%s.path %s" % (condition, config_path),
+                                      shell=True, cwd=self.local_path)
+                self.assertEqual('included_url' if included else None,
+                                 reader.get_config_value('remote.upstream.url'), condition)
+                subprocess.check_call("git config --remove-section includeIf.%s" % condition,
+                                      shell=True, cwd=self.local_path)
+            with open(config_path, 'w') as fhand:
+                fhand.write('[foo]\n\tbar = baz\n')
+            subprocess.check_call("git config includeIf.hasconfig:remote.*.url:%s.path %s" %
+                                  (self.remote_path, config_path), shell=True, cwd=self.local_path)
+            self.assertRaises(UnsupportedRepository, reader.get_config_value, 'remote.upstream.url')
+            # GitClient falls back to git once until the config changes
+            client = GitClient(self.local_path)
+            with profile() as prof:
+                self.assertEqual(self.remote_path, client.get_url())
+                self.assertEqual('baz', client._get_config_values(['foo.bar'])[0])
+                subprocess.check_call("git config remote.origin.pushurl foo", shell=True, cwd=self.local_path)
+                self.assertEqual('foo', client._get_config_values(['remote.origin.pushurl'])[0])
+            self.assertEqual(2, len(prof.records))
+        finally:
+            subprocess.call("git config --unset remote.origin.pushurl", shell=True, cwd=self.local_path)
+            subprocess.call("git config --remove-section includeIf.hasconfig:remote.*.url:%s" % self.remote_path,
+                            shell=True, cwd=self.local_path)
+
+    def test_global_config(self):
+        global_config = os.path.join(self.root_directory, 'global_config')
+        with open(global_config, 'w') as fhand:
+            fhand.write('[core]\n\tquotepath = off\n[remote "origin"]\n\turl = global_url\n')
+        os.environ['GIT_CONFIG_GLOBAL'] = global_config
+        try:
+            reader = GitRefsReader(self.local_path)
+            self.assertEqual('off', reader.get_config_value('core.quotepath'))
+            # the repository config takes precedence
+            self.assertEqual(self.remote_path, reader.get_config_value('remote.origin.url'))
+            os.environ['GIT_CONFIG_GLOBAL'] = os.path.join(self.root_directory, 'no_such_config')
+            self.assertEqual(None, reader.get_config_value('core.quotepath'))
+        finally:
+            del os.environ['GIT_CONFIG_GLOBAL']
+            os.remove(global_config)
+        self.assertEqual({'core.bare': ['false'], 'foo.bar': ['a\nb', '']},
+                         parse_config_list('core.bare\nfalse\0foo.bar\na\nb\0foo.bar\0'))
+
+    def test_unsupported(self):
+        self.assertRaises(UnsupportedRepository, GitRefsReader(self.root_directory).get_head_branch)
+        os.environ['GIT_DIR'] = os.path.join(self.local_path, '.git')
+        try:
+            self.assertRaises(UnsupportedRepository, GitRefsReader(self.local_path).get_head_branch)
+        finally:
+            del os.environ['GIT_DIR']
+
+    def test_parse_config(self):
+        text = ('# comment\n[core]\n\tbare = false ; comment\n[foo]\n\tflag\n'
+                '\tvalue = " a b " c\\\\d\\n # comment\n\tcont = x\\\ny\n'
+                '[Sub "Case \\"q\\""]\n\tKey=v\n[old.Style]\n\tkey = w\n')
+        self.assertEqual([('core.bare', 'false'),
+                          ('foo.flag', None),
+                          ('foo.value', ' a b  c\\d\n'),
+                          ('foo.cont', 'xy'),
+                          ('sub.Case "q".key', 'v'),
+                          ('old.style.key', 'w')],
+                         parse_config(text))
+        self.assertRaises(ValueError, parse_config, '[foo]\nbar = "unterminated\n')
+
+    def test_valid_ref_name(self):
+        for name in ['refs/heads/master', 'refs/heads/feature/foo', 'refs/tags/v1.0']:
+            self.assertTrue(is_valid_ref_name(name), name)
+        for name in ['', 'refs/heads/../x', 'refs/heads/a b', 'refs/heads/x.lock', '/refs/heads/x',
+                     'refs/heads/.x', 'refs/heads/x/', 'refs/heads/a:b', 'refs/heads/a@{1}']:
+            self.assertFalse(is_valid_ref_name(name), name)
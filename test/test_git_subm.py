@@ -42,6 +42,7 @@ import tarfile
 import filecmp
 from contextlib import closing
 
+from vcstools import profile
 from vcstools.git import GitClient
 
 
@@ -221,6 +222,28 @@ class GitClientTest(GitClientTestSetups):
         self.assertEqual(dirdiff.right_only, [])
         self.assertEqual(dirdiff.diff_files, [])
 
+    def test_export_modified(self):
+        client = GitClient(self.local_path)
+        self.assertTrue(client.checkout(self.repo_path))
+        with open(os.path.join(self.subsublocal_path, 'subsubfixed.txt'), 'a') as f:
+            f.write('012345cdef')
+        subprocess.check_call("touch subsubnew.txt", shell=True, cwd=self.subsublocal_path)
+        with profile() as prof:
+            tarpath = client.export_repository("master", self.export_path)
+        self.assertEqual(tarpath, self.export_path + '.tar.gz')
+        # git archive of each repository, no clone and no file reads
+        argvs = [r['argv'] for r in prof.records]
+        self.assertEqual([], [argv for argv in argvs if argv[:2] == ['git', 'clone']])
+        self.assertEqual(['', '--prefix=submodule/', '--prefix=submodule/subsubmodule/'],
+                         [argv[3] if len(argv) == 5 else '' for argv in argvs if argv[:2] == ['git', 'archive']])
+        # submodules are looked up by their .gitmodules paths, not in a recursive tree listing
+        self.assertEqual([], [argv for argv in argvs if 'ls-tree' in argv and '-r' in argv])
+        with closing(tarfile.open(tarpath, "r:gz")) as tarf:
+            names = [member.name for member in tarf.getmembers() if member.isfile()]
+            self.assertEqual(b'', tarf.extractfile('submodule/subsubmodule/subsubfixed.txt').read())
+        self.assertTrue('submodule/subsubmodule/subsubfixed.txt' in names, names)
+        self.assertFalse('submodule/subsubmodule/subsubnew.txt' in names, names)
+
     def test_export_relative(self):
         url = self.repo_path
         client = GitClient(self.local_path)
@@ -528,6 +551,72 @@ class GitClientTest(GitClientTestSetups):
  M local/subsubfixed.txt
 ?? local/subsubnew.txt''', output.rstrip())
 
+        # the short format marks submodules with modified content like git does
+        expected = subprocess.check_output(['git', 'status', '-s', '-uno'], cwd=self.local_path).decode('utf-8')
+        self.assertTrue(' m submodule' in expected, expected)
+        self.assertEqual([' M ./fixed.txt', ' m ./submodule'], client.get_status().splitlines()[:2])
+
+    def test_iter_status(self):
+        client = GitClient(self.local_path)
+        self.assertTrue(client.checkout(self.repo_path))
+        self.assertEqual([], list(client.iter_status()))
+        with open(os.path.join(self.subsublocal_path, 'subsubfixed.txt'), 'a') as f:
+            f.write('012345cdef')
+        subprocess.check_call("git mv subfixed.txt moved.txt", shell=True, cwd=self.sublocal_path)
+        entries = list(client.iter_status())
+        self.assertEqual(['submodule', 'submodule/moved.txt', 'submodule/subsubmodule',
+                          'submodule/subsubmodule/subsubfixed.txt'],
+                         [entry.path for entry in entries])
+        self.assertEqual(('submodule/subfixed.txt', 'R', ' '),
+                         (entries[1].orig_path, entries[1].index, entries[1].worktree))
+        self.assertEqual((' ', 'M', 'S.M.'),
+                         (entries[0].index, entries[0].worktree, entries[0].submodule))
+        self.assertEqual(None, entries[3].submodule)
+        self.assertEqual('R  ./subfixed.txt -> moved.txt\n', client.get_status().splitlines(True)[1])
+
+    def test_iter_diff(self):
+        client = GitClient(self.local_path)
+        self.assertTrue(client.checkout(self.repo_path))
+        with open(os.path.join(self.subsublocal_path, 'subsubfixed.txt'), 'a') as f:
+            f.write('012345cdef')
+        entries = list(client.iter_diff())
+        # modified submodules show as dirty commits
+        self.assertEqual(['submodule', 'submodule/subsubmodule', 'submodule/subsubmodule/subsubfixed.txt'],
+                         [e.path for e in entries])
+        self.assertEqual('diff --git ./submodule/subsubmodule/subsubfixed.txt ./submodule/subsubmodule/subsubfixed.txt',
+                         entries[2].lines[0])
+        summary = list(client.iter_diff(stat_only=True))
+        self.assertEqual([(e.path, e.status) for e in entries],
+                         [(e.path, e.status) for e in summary])
+        self.assertEqual((1, 0), (entries[2].added, entries[2].deleted))
+        # dirty submodules at their recorded commit count the same
+        # in both modes
+        self.assertEqual((1, 1), (entries[0].added, entries[0].deleted))
+        self.assertEqual([(e.added, e.deleted) for e in entries],
+                         [(e.added, e.deleted) for e in summary])
+
+    def test_submodule_jobs(self):
+        client = GitClient(self.local_path)
+        self.assertTrue(client.checkout(self.repo_path))
+        with profile() as prof:
+            self.assertEqual(['submodule', os.path.join('submodule', 'subsubmodule')],
+                             client._get_submodule_paths())
+        # one listing of the index per repository, no shell per submodule
+        self.assertEqual([['git', 'ls-files', '-s', '-z']] * 3,
+                         [r['argv'] for r in prof.records if r['argv'][:2] != ['git', 'config']])
+        with open(os.path.join(self.sublocal_path, 'subfixed.txt'), 'a') as f:
+            f.write('abcdef0123456789')
+        with open(os.path.join(self.subsublocal_path, 'subsubfixed.txt'), 'a') as f:
+            f.write('012345cdef')
+        status = client.get_status(porcelain=True)
+        diff = client.get_diff()
+        subprocess.check_call("git config submodule.fetchJobs 1", shell=True, cwd=self.local_path)
+        self.assertEqual(1, client._get_submodule_jobs())
+        self.assertEqual(status, client.get_status(porcelain=True))
+        self.assertEqual(diff, client.get_diff())
+        self.assertTrue(diff.index('./submodule/subfixed.txt') <
+                        diff.index('./submodule/subsubmodule/subsubfixed.txt'))
+
     def test_diff(self):
         url = self.repo_path
         client = GitClient(self.local_path)
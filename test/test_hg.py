@@ -37,10 +37,15 @@ import os
 import io
 import unittest
 import subprocess
+import tarfile
 import tempfile
 import shutil
 
-from vcstools.hg import HgClient
+from vcstools import log_cache
+from vcstools import transcripts
+from vcstools.diff_entry import DiffEntry
+from vcstools.hg import HgClient, _iter_hg_diff_summary, _parse_hg_status
+from vcstools.status_entry import StatusEntry
 
 
 os.environ['EMAIL'] = 'Your Name <name@example.com>'
@@ -278,6 +283,34 @@ class HGClientLogTest(HGClientTestSetups):
         log = client.get_log(relpath='fixed.txt')
         self.assertEquals('initial', log[0]['message'])
 
+    def test_iter_log(self):
+        client = HgClient(self.local_path)
+        client.checkout(self.local_url)
+        self.assertEqual(client.get_log(), list(client.iter_log()))
+        self.assertEqual(client.get_log(limit=1), list(client.iter_log(limit=1)))
+
+    def test_log_cache(self):
+        client = HgClient(self.local_path)
+        client.checkout(self.local_url)
+        log = client.get_log()
+        path_log = client.get_log(relpath='fixed.txt')
+        cache_dir = tempfile.mkdtemp()
+        log_cache.set_cache_dir(cache_dir)
+        try:
+            self.assertEqual(log, client.get_log())
+            self.assertEqual(log, client.get_log())
+            self.assertEqual(log[:2], client.get_log(limit=2))
+            self.assertEqual(path_log, client.get_log(relpath='fixed.txt'))
+            subprocess.check_call("touch cached.txt && hg add cached.txt && hg commit -m cached",
+                                  shell=True, cwd=self.local_path)
+            new_log = client.get_log()
+            self.assertEqual(['cached'] + [entry['message'] for entry in log],
+                             [entry['message'] for entry in new_log])
+            self.assertEqual(new_log[1:], log)
+        finally:
+            log_cache.set_cache_dir(None)
+            shutil.rmtree(cache_dir)
+
 
 class HGAffectedFilesTest(HGClientTestSetups):
 
@@ -363,6 +396,35 @@ class HGDiffStatClientTest(HGClientTestSetups):
         self.assertTrue(client.detect_presence())
         self.assertEquals('M modified-fs.txt\nM modified.txt\nA added.txt\nR deleted.txt\n! deleted-fs.txt\n? added-fs.txt\n', client.get_status(untracked=True))
 
+    def test_iter_diff(self):
+        client = HgClient(self.local_path)
+        entries = list(client.iter_diff(basepath=os.path.dirname(self.local_path)))
+        self.assertEqual([('added.txt', 'A', 1, 0), ('deleted.txt', 'D', 0, 0),
+                          ('modified-fs.txt', 'M', 1, 0), ('modified.txt', 'M', 1, 0)],
+                         [(e.path, e.status, e.added, e.deleted) for e in entries])
+        self.assertEqual(client.get_diff(basepath=os.path.dirname(self.local_path)),
+                         ''.join(e.text for e in entries).rstrip())
+        self.assertEqual([DiffEntry('modified-fs.txt', 'M'), DiffEntry('modified.txt', 'M'),
+                          DiffEntry('added.txt', 'A'), DiffEntry('deleted.txt', 'D'),
+                          DiffEntry('deleted-fs.txt', 'D')],
+                         list(client.iter_diff(stat_only=True)))
+        self.assertEqual([DiffEntry('new.txt', 'R', 'old.txt'), DiffEntry('copy.txt', 'C', 'modified.txt')],
+                         list(_iter_hg_diff_summary(_parse_hg_status(
+                             'A new.txt\x00  old.txt\x00A copy.txt\x00  modified.txt\x00R old.txt\x00'))))
+
+    def test_iter_status(self):
+        client = HgClient(self.local_path)
+        self.assertEqual([StatusEntry('modified-fs.txt', 'M'),
+                          StatusEntry('modified.txt', 'M'),
+                          StatusEntry('added.txt', 'A'),
+                          StatusEntry('deleted.txt', 'R'),
+                          StatusEntry('deleted-fs.txt', '!')],
+                         list(client.iter_status()))
+        self.assertEqual(StatusEntry('added-fs.txt', '?'), list(client.iter_status(untracked=True))[-1])
+        self.assertEqual([StatusEntry('copied.txt', 'A', orig_path='modified.txt'),
+                          StatusEntry('with space.txt', 'M')],
+                         _parse_hg_status('A copied.txt\x00  modified.txt\x00M with space.txt\x00'))
+
     def test_hg_diff_path_change_None(self):
         from vcstools.hg import _hg_diff_path_change
         self.assertEqual(_hg_diff_path_change(None, '/tmp/dummy'), None)
@@ -418,6 +480,48 @@ class HGExportRepositoryClientTest(HGClientTestSetups):
         self.assertFalse(os.path.exists(self.basepath_export + '.tar'))
         self.assertFalse(os.path.exists(self.basepath_export))
 
+    def test_export_repository_stream(self):
+        client = HgClient(self.local_path)
+        stream = io.BytesIO()
+        self.assertTrue(client.export_repository_stream(self.local_version, stream))
+        with tarfile.open(fileobj=io.BytesIO(stream.getvalue())) as tar:
+            self.assertIn('.hg_archival.txt', tar.getnames())
+        stream = io.BytesIO()
+        self.assertFalse(client.export_repository_stream('nonexistent_rev', stream))
+        self.assertEqual(b'', stream.getvalue())
+        # exports to files keep hg's top directory named after the file
+        basepath = self.basepath_export + '_stream'
+        self.assertTrue(client.export_repository(self.local_version, basepath))
+        with tarfile.open(basepath + '.tar.gz') as tar:
+            self.assertIn('export_stream/.hg_archival.txt', tar.getnames())
+
+    def test_export_repository_stream_replay(self):
+        client = HgClient(self.local_path)
+        transcript = os.path.join(self.root_directory, 'transcript.jsonl')
+        recorded = io.BytesIO()
+        with transcripts.recording(transcript):
+            self.assertTrue(client.export_repository_stream(self.local_version, recorded))
+        replayed = io.BytesIO()
+        backup_popen = subprocess.Popen
+        try:
+            subprocess.Popen = None
+            with transcripts.replaying(transcript):
+                self.assertTrue(client.export_repository_stream(self.local_version, replayed))
+        finally:
+            subprocess.Popen = backup_popen
+            os.remove(transcript)
+        self.assertEqual(recorded.getvalue(), replayed.getvalue())
+
+    def test_export_repository_format(self):
+        client = HgClient(self.local_path)
+        basepath = self.basepath_export + '_format'
+        self.assertTrue(
+          client.export_repository(self.local_version, basepath, archive_format='bz2')
+        )
+
+        self.assertTrue(os.path.exists(basepath + '.tar.bz2'))
+        self.assertFalse(os.path.exists(basepath + '.tar'))
+
 
 class HGGetBranchesClientTest(HGClientTestSetups):
 